@@ -170,7 +170,11 @@ class CuttingAreaContentAdmin(admin.ModelAdmin):
 class StorageLocationAdmin(admin.ModelAdmin):
     list_display = ['source_type', 'source_id', 'get_source_name']
     list_filter = ['source_type']
-    search_fields = ['source_id']
+    search_fields = ['source_id', 'source_name']
+    readonly_fields = ['source_name']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_source_names()
 
     def get_source_name(self, obj):
         return obj.get_source_name()
@@ -202,6 +206,29 @@ class MaterialBalanceAdmin(admin.ModelAdmin):
     raw_id_fields = ['storage_location', 'material']
 
 
+@admin.register(apps.get_model('inventory', 'StockThreshold'))
+class StockThresholdAdmin(admin.ModelAdmin):
+    list_display = ['material', 'storage_location', 'quantity_field', 'min_quantity', 'is_active']
+    list_filter = ['quantity_field', 'is_active', 'material__material_type']
+    search_fields = ['material__name']
+    raw_id_fields = ['material', 'storage_location']
+
+
+@admin.register(apps.get_model('inventory', 'LowStockAlert'))
+class LowStockAlertAdmin(admin.ModelAdmin):
+    list_display = ['material', 'storage_location', 'quantity_field', 'quantity', 'min_quantity', 'since']
+    list_filter = ['quantity_field', 'material__material_type']
+    search_fields = ['material__name']
+    list_select_related = ['material', 'storage_location']
+
+    def has_add_permission(self, request):
+        # Набор ведется автоматически (LowStockMonitor)
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 # ========== 5. OPERATIONS (Учет операций) ==========
 @admin.register(apps.get_model('operations', 'OperationType'))
 class OperationTypeAdmin(admin.ModelAdmin):
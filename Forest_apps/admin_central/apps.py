@@ -6,3 +6,7 @@ class AdminCentralConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Forest_apps.admin_central'
     verbose_name = 'Централизованная админка'
+
+    def ready(self):
+        from Forest_apps.admin_central.services import DashboardSnapshot
+        DashboardSnapshot.connect_signals()
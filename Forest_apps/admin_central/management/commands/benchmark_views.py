@@ -0,0 +1,282 @@
+# Forest_apps/admin_central/management/commands/benchmark_views.py
+import datetime
+import json
+import statistics
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Case, Count, When
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from Forest_apps.admin_central.services import DashboardSnapshot
+from Forest_apps.authorization.services import RoleContext
+from Forest_apps.employees.models import WorkTimeRecord
+from Forest_apps.inventory.models import MaterialBalance, MaterialMovement, Receipt, Conversion
+from Forest_apps.inventory.services import OwnedLocationResolver
+
+
+class Command(BaseCommand):
+    """
+    Замер ключевых страниц: время ответа и число SQL-запросов
+
+    Страницы запрашиваются тестовым клиентом от временного пользователя
+    с должностью в сессии. Каждый прогон выполняется в транзакции, которая
+    откатывается, поэтому POST (создание и проведение движения) не меняет данные.
+    Данные для замеров - generate_dataset.
+
+    Отчет (--output) - JSON с медианой/минимумом/максимумом времени и числом
+    запросов по каждой странице. С --baseline отчет сравнивается с прошлым:
+    рост медианы больше --tolerance или рост числа запросов - регрессия,
+    команда завершается с ошибкой.
+    """
+
+    help = 'Замер времени и числа SQL ключевых страниц (JSON-отчет, сравнение с --baseline)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Замеров на страницу')
+        parser.add_argument('--warmup', type=int, default=1, help='Прогревочных запросов на страницу')
+        parser.add_argument('--case', action='append', dest='cases', help='Только эти страницы (можно несколько)')
+        parser.add_argument('--output', help='Путь к JSON-отчету')
+        parser.add_argument('--baseline', help='JSON-отчет прошлого прогона для сравнения')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Допустимый рост медианы (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or options['warmup'] < 0:
+            raise CommandError('--repeat должен быть больше нуля, --warmup - не меньше нуля')
+
+        fixtures = self._fixtures()
+        cases = self._cases(fixtures)
+        if options['cases']:
+            unknown = set(options['cases']) - {case['name'] for case in cases}
+            if unknown:
+                raise CommandError(f'Неизвестные страницы: {", ".join(sorted(unknown))}')
+            cases = [case for case in cases if case['name'] in options['cases']]
+
+        user = User.objects.create_superuser(f'benchmark-{uuid.uuid4().hex[:8]}', password=uuid.uuid4().hex)
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                client = Client()
+                client.force_login(user)
+                results = [self._measure(client, case, options['warmup'], options['repeat']) for case in cases]
+        finally:
+            user.delete()
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'dataset': {
+                'movements': MaterialMovement.objects.count(),
+                'receipts': Receipt.objects.count(),
+                'conversions': Conversion.objects.count(),
+                'balances': MaterialBalance.objects.count(),
+                'worktime': WorkTimeRecord.objects.count(),
+            },
+            'fixtures': {key: value for key, value in fixtures.items() if isinstance(value, (bool, int, str))},
+            'cases': results,
+        }
+
+        for result in results:
+            self.stdout.write(
+                f'{result["name"]:<28} {result["status"]:>4} {result["median_ms"]:>9.1f} мс '
+                f'(мин {result["min_ms"]:.1f}, макс {result["max_ms"]:.1f}) SQL {result["queries"]}'
+            )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as report_file:
+                json.dump(report, report_file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Отчет записан в {options["output"]}')
+
+        if options['baseline']:
+            self._compare(results, options['baseline'], options['tolerance'])
+
+    # ---------- Данные для страниц ----------
+
+    def _fixtures(self):
+        """Должность, склад, сотрудник и остаток для замеров (самые "тяжелые" по данным)"""
+        # Руководителю недоступно Перемещение - он берется, только если других должностей нет
+        busiest = MaterialMovement.objects.filter(
+            created_by_position__isnull=False
+        ).values('created_by_position_id', 'created_by_position__name').annotate(
+            total=Count('id'),
+            is_supervisor=Case(When(created_by_position__name__iexact='руководитель', then=1), default=0)
+        ).order_by('is_supervisor', '-total').first()
+        if busiest is None:
+            raise CommandError('Нет движений для замеров: сначала выполните generate_dataset')
+
+        position_id = busiest['created_by_position_id']
+        own_locations = OwnedLocationResolver.get_location_ids(position_id)
+        balance = MaterialBalance.objects.filter(
+            storage_location_id__in=own_locations,
+            quantity_cubic__gt=1
+        ).order_by('-quantity_cubic').first()
+        target_location = next(
+            (location_id for location_id in own_locations if balance and location_id != balance.storage_location_id),
+            None
+        )
+
+        worktime = WorkTimeRecord.objects.values('warehouse_id').annotate(
+            total=Count('id')
+        ).order_by('-total').first()
+        employee = WorkTimeRecord.objects.values('employee_id').annotate(
+            total=Count('id')
+        ).order_by('-total').first()
+
+        return {
+            'position': busiest['created_by_position__name'],
+            'is_supervisor': bool(busiest['is_supervisor']),
+            'position_id': position_id,
+            'balance': balance,
+            'target_location_id': target_location,
+            'warehouse_id': worktime['warehouse_id'] if worktime else None,
+            'employee_id': employee['employee_id'] if employee else None,
+        }
+
+    def _cases(self, fixtures):
+        """Страницы для замера: name, position, request() -> (method, path, data)"""
+        position = fixtures['position']
+        today = timezone.localdate()
+        period = {
+            'date_from': (today - datetime.timedelta(days=30)).isoformat(),
+            'date_to': today.isoformat(),
+        }
+
+        def get(url_name, *args, data=None):
+            return lambda: ('get', reverse(url_name, args=args), data or {})
+
+        cases = [
+            {'name': 'movement_list', 'position': position, 'request': get('inventory:material_movement_list')},
+            {'name': 'movement_create_form', 'position': position, 'request': get('inventory:material_movement_create')},
+            {'name': 'balance_list', 'position': position, 'request': get('inventory:material_balance_list')},
+            {'name': 'booker_balances', 'position': 'бухгалтер', 'request': get('authorization:booker_balances')},
+            {'name': 'booker_movements', 'position': 'бухгалтер', 'request': get('authorization:booker_movements')},
+            {'name': 'booker_balances_pivot', 'position': 'бухгалтер',
+             'request': get('authorization:booker_balances_pivot')},
+            {'name': 'dashboard', 'position': 'руководитель', 'request': get('admin_central:dashboard')},
+            {'name': 'dashboard_cold', 'position': 'руководитель', 'request': self._cold_dashboard},
+        ]
+
+        if fixtures['balance'] and fixtures['target_location_id'] and not fixtures['is_supervisor']:
+            cases.append({
+                'name': 'movement_create', 'position': position,
+                'request': lambda: self._create_movement_request(fixtures),
+            })
+            cases.append({
+                'name': 'movement_execute', 'position': position,
+                'request': lambda: self._execute_movement_request(fixtures),
+            })
+
+        if fixtures['warehouse_id']:
+            cases.append({
+                'name': 'worktime_warehouse_report', 'position': position,
+                'request': get('employees:worktime_warehouse_report', fixtures['warehouse_id'], data=period),
+            })
+        if fixtures['employee_id']:
+            cases.append({
+                'name': 'worktime_employee_report', 'position': position,
+                'request': get('employees:worktime_employee_report', fixtures['employee_id'], data=period),
+            })
+
+        return cases
+
+    @staticmethod
+    def _cold_dashboard():
+        cache.delete(DashboardSnapshot.CACHE_KEY)
+        return 'get', reverse('admin_central:dashboard'), {}
+
+    @staticmethod
+    def _create_movement_request(fixtures):
+        balance = fixtures['balance']
+        return 'post', reverse('inventory:material_movement_create'), {
+            'accounting_type': 'Перемещение',
+            'from_location': balance.storage_location_id,
+            'to_location': fixtures['target_location_id'],
+            'material': balance.material_id,
+            'quantity_cubic': '0.001',
+            'date_time': timezone.localtime().strftime('%Y-%m-%dT%H:%M'),
+        }
+
+    @staticmethod
+    def _execute_movement_request(fixtures):
+        # Непроведенное движение создается в откатываемой транзакции замера
+        balance = fixtures['balance']
+        movement = MaterialMovement.objects.create(
+            accounting_type='Перемещение',
+            from_location_id=balance.storage_location_id,
+            to_location_id=fixtures['target_location_id'],
+            material_id=balance.material_id,
+            quantity_cubic=Decimal('0.001'),
+            created_by_position_id=fixtures['position_id'],
+        )
+        return 'post', reverse('inventory:material_movement_execute', args=[movement.id]), {}
+
+    # ---------- Замер ----------
+
+    def _measure(self, client, case, warmup, repeat):
+        session = client.session
+        session['position_name'] = case['position']
+        # Контекст должности - как при входе (иначе он пересобирается в каждом откатываемом прогоне)
+        session[RoleContext.SESSION_KEY] = RoleContext.build(case['position'])
+        session['employee_name'] = 'Замер производительности'
+        session.save()
+
+        timings = []
+        queries = []
+        status = None
+        path = None
+        for iteration in range(warmup + repeat):
+            with transaction.atomic():
+                method, path, data = case['request']()
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = getattr(client, method)(path, data)
+                    elapsed = (time.perf_counter() - started) * 1000
+                transaction.set_rollback(True)
+
+            status = response.status_code
+            if iteration >= warmup:
+                timings.append(elapsed)
+                queries.append(len(captured.captured_queries))
+
+        return {
+            'name': case['name'],
+            'path': path,
+            'position': case['position'],
+            'status': status,
+            'median_ms': round(statistics.median(timings), 2),
+            'min_ms': round(min(timings), 2),
+            'max_ms': round(max(timings), 2),
+            'queries': max(queries),
+        }
+
+    def _compare(self, results, baseline_path, tolerance):
+        """Сравнение с прошлым отчетом; регрессии - ошибка команды"""
+        with open(baseline_path, encoding='utf-8') as baseline_file:
+            baseline = {case['name']: case for case in json.load(baseline_file)['cases']}
+
+        regressions = []
+        for result in results:
+            previous = baseline.get(result['name'])
+            if previous is None:
+                continue
+            if result['queries'] > previous['queries']:
+                regressions.append(f'{result["name"]}: SQL {previous["queries"]} → {result["queries"]}')
+            if result['median_ms'] > previous['median_ms'] * (1 + tolerance):
+                regressions.append(
+                    f'{result["name"]}: медиана {previous["median_ms"]:.1f} → {result["median_ms"]:.1f} мс'
+                )
+
+        if regressions:
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            raise CommandError(f'Регрессии относительно {baseline_path}: {len(regressions)}')
+
+        self.stdout.write(self.style.SUCCESS(f'Регрессий относительно {baseline_path} нет'))
@@ -0,0 +1,554 @@
+# Forest_apps/admin_central/management/commands/generate_dataset.py
+import datetime
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from Forest_apps.admin_central.services import DashboardSnapshot
+from Forest_apps.core.models import Position, Warehouse, Vehicle, Brigade, Counterparty
+from Forest_apps.employees.models import Employee, WorkTimeRecord
+from Forest_apps.forestry.models import Forestry, CuttingArea, Material
+from Forest_apps.inventory.models import (
+    StorageLocation, MaterialBalance, MaterialMovement, Receipt, Conversion, ConversionOutput, StockLedgerEntry
+)
+from Forest_apps.inventory.services import OwnedLocationResolver, ReferenceDataCache, LowStockMonitor
+from Forest_apps.operations.models import OperationType, OperationRecord, OperationDailyRollup
+
+
+class Command(BaseCommand):
+    """
+    Генерация синтетических данных для замеров производительности (см. benchmark_views)
+
+    Создает справочники (должности, склады, транспорт, бригады, контрагенты,
+    материалы, лесничества, сотрудники) и историю документов за --days дней:
+    поступления, движения, конвертации, табель и операции. Документы
+    проигрываются по времени, поэтому остатки не уходят в минус, а итоговые
+    MaterialBalance и журнал StockLedgerEntry совпадают с документами
+    (rebuild_balances --verify и reconcile_balances проходят без расхождений).
+
+    Справочники принадлежат должностям через created_by_position, как при работе
+    через интерфейс. Документы пишутся bulk_create пачками по --batch-size.
+    Команда рассчитана на отдельную базу для замеров: данные не удаляются.
+    """
+
+    help = 'Генерация синтетических данных для замеров (--scale - множитель объемов)'
+
+    # Объемы при --scale 1
+    BASE_COUNTS = {
+        'warehouses': 20,
+        'vehicles': 40,
+        'brigades': 30,
+        'counterparties': 100,
+        'materials': 300,
+        'forestries': 10,
+        'cutting_areas': 200,
+        'employees': 400,
+        'operation_types': 10,
+        'receipts': 50000,
+        'movements': 200000,
+        'conversions': 20000,
+        'worktime': 100000,
+        'operations': 100000,
+    }
+
+    # Должности - владельцы мест хранения (created_by_position)
+    OWNER_POSITIONS = ('мастер леса', 'механик', 'мастер ЛПЦ', 'мастер ДОЦ', 'мастер ЖД', 'руководитель')
+    OTHER_POSITIONS = ('бухгалтер', 'водитель', 'рабочий')
+
+    MATERIAL_TYPE_WEIGHTS = (('древесина', 6), ('ГСМ', 1), ('запчасти', 3))
+    UNIT_FIELDS = {
+        'древесина': 'quantity_cubic',
+        'ГСМ': 'quantity_meters',
+        'запчасти': 'quantity_pieces',
+    }
+
+    # Доли типов движения
+    MOVEMENT_TYPE_WEIGHTS = (('Перемещение', 5), ('Отправление', 2), ('Реализация', 2), ('Списание', 1))
+    PENDING_SHARE = 0.03  # доля непроведенных движений
+
+    QUANTITY = Decimal('0.001')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0, help='Множитель объемов (1 - 200 тыс. движений)')
+        parser.add_argument('--days', type=int, default=365, help='Глубина истории, дней')
+        parser.add_argument('--seed', type=int, default=1, help='Зерно генератора случайных чисел')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Размер пачки bulk_create')
+        parser.add_argument('--prefix', help='Префикс названий (по умолчанию случайный)')
+
+    def handle(self, *args, **options):
+        if options['scale'] <= 0 or options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--scale, --days и --batch-size должны быть больше нуля')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = options['prefix'] or uuid.uuid4().hex[:5]
+        self.counts = {
+            name: max(1, int(count * options['scale'])) for name, count in self.BASE_COUNTS.items()
+        }
+        self.end = timezone.now()
+        self.start = self.end - datetime.timedelta(days=options['days'])
+
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            self._create_references()
+        self._log('Справочники', started)
+
+        stage = time.perf_counter()
+        balances = self._create_documents()
+        self._log('Документы и журнал', stage)
+
+        stage = time.perf_counter()
+        with transaction.atomic():
+            MaterialBalance.objects.bulk_create(
+                [
+                    MaterialBalance(
+                        storage_location_id=location_id,
+                        material_id=material_id,
+                        created_by_position=self.location_owner.get(location_id),
+                        **{field: quantity for field, quantity in quantities.items()}
+                    )
+                    for (location_id, material_id), quantities in balances.items()
+                    if any(quantities.values())
+                ],
+                batch_size=self.batch_size
+            )
+        self._log('Остатки', stage)
+
+        stage = time.perf_counter()
+        self._create_worktime()
+        self._create_operations()
+        self._log('Табель и операции', stage)
+
+        # Производные данные и кэши
+        OperationDailyRollup.rebuild()
+        LowStockMonitor.rebuild()
+        OwnedLocationResolver.invalidate()
+        ReferenceDataCache.invalidate_tables()
+        DashboardSnapshot.invalidate()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные "{self.prefix}" созданы за {time.perf_counter() - started:.1f} с: '
+            + ', '.join(f'{name} {count}' for name, count in self.counts.items())
+        ))
+
+    def _log(self, stage, started):
+        self.stdout.write(f'{stage}: {time.perf_counter() - started:.1f} с')
+
+    def _moment(self):
+        """Случайный момент в периоде истории"""
+        return self.start + (self.end - self.start) * self.rng.random()
+
+    def _quantity(self, low, high):
+        return Decimal(self.rng.uniform(low, high)).quantize(self.QUANTITY)
+
+    def _weighted(self, weights):
+        values, counts = zip(*weights)
+        return self.rng.choices(values, counts)[0]
+
+    # ---------- Справочники ----------
+
+    def _create_references(self):
+        self.positions = {}
+        for name in self.OWNER_POSITIONS + self.OTHER_POSITIONS:
+            position = Position.objects.filter(name__iexact=name).first()
+            self.positions[name] = position or Position.objects.create(name=name)
+        owners = [self.positions[name] for name in self.OWNER_POSITIONS]
+
+        # Места хранения создаются через save(): он заводит StorageLocation
+        sources = {'склад': [], 'автомобиль': [], 'бригады': [], 'контрагент': []}
+        for index in range(self.counts['warehouses']):
+            sources['склад'].append(Warehouse.objects.create(
+                name=f'{self.prefix} Склад {index + 1}', created_by_position=owners[index % len(owners)]
+            ))
+        for index in range(self.counts['vehicles']):
+            sources['автомобиль'].append(Vehicle.objects.create(
+                brand=self.rng.choice(['КАМАЗ', 'МАЗ', 'Урал', 'John Deere', 'Ponsse']),
+                model=f'{self.rng.randint(100, 999)}',
+                license_plate=f'{self.prefix}{index + 1}',
+                created_by_position=owners[index % len(owners)]
+            ))
+        for index in range(self.counts['brigades']):
+            sources['бригады'].append(Brigade.objects.create(
+                name=f'{self.prefix} Бригада {index + 1}', created_by_position=owners[index % len(owners)]
+            ))
+        base = self.rng.randint(10 ** 8, 9 * 10 ** 8)
+        for index in range(self.counts['counterparties']):
+            sources['контрагент'].append(Counterparty.objects.create(
+                legal_form=self.rng.choice(['ООО', 'ИП']),
+                name=f'{self.prefix} Контрагент {index + 1}',
+                inn=f'{base + index:010d}'[:10],
+                ogrn=f'{base + index:013d}',
+                created_by_position=self.positions['руководитель']
+            ))
+
+        locations = StorageLocation.objects.filter(
+            source_type__in=list(sources),
+            source_id__in={source.id for items in sources.values() for source in items}
+        )
+        owner_by_source = {
+            (source_type, source.id): source.created_by_position
+            for source_type, items in sources.items() for source in items
+        }
+        self.locations = {source_type: [] for source_type in sources}
+        self.location_owner = {}
+        self.owned = {}  # свои места хранения должностей (для типов движения, как в формах)
+        for location in locations:
+            owner = owner_by_source.get((location.source_type, location.source_id))
+            if owner is None:
+                continue
+            self.locations[location.source_type].append(location.id)
+            self.location_owner[location.id] = owner
+            self.owned.setdefault((owner.id, location.source_type), []).append(location.id)
+
+        materials = []
+        for index in range(self.counts['materials']):
+            material_type = self._weighted(self.MATERIAL_TYPE_WEIGHTS)
+            materials.append(Material(
+                material_type=material_type,
+                name=f'{self.prefix} {material_type} {index + 1}',
+                created_by_position=self.positions['руководитель']
+            ))
+        Material.objects.bulk_create(materials, batch_size=self.batch_size)
+        self.materials = {material_type: [] for material_type in self.UNIT_FIELDS}
+        for material in materials:
+            self.materials[material.material_type].append(material.id)
+        if len(self.materials['древесина']) < 2:
+            raise CommandError('Для конвертаций нужно хотя бы два материала "древесина" (увеличьте --scale)')
+        self.material_types = {material.id: material.material_type for material in materials}
+
+        forestries = Forestry.objects.bulk_create([
+            Forestry(name=f'{self.prefix} Лесничество {index + 1}', created_by_position=self.positions['мастер леса'])
+            for index in range(self.counts['forestries'])
+        ])
+        CuttingArea.objects.bulk_create([
+            CuttingArea(
+                forestry=forestries[index % len(forestries)],
+                quarter_number=str(index // len(forestries) + 1),
+                division_number=str(index % 50 + 1),
+                area_hectares=self._quantity(1, 50),
+                created_by_position=self.positions['мастер леса']
+            )
+            for index in range(self.counts['cutting_areas'])
+        ], batch_size=self.batch_size)
+
+        position_choices = list(self.positions.values())
+        warehouses = sources['склад']
+        employees = [
+            Employee(
+                position=position_choices[index % len(position_choices)],
+                warehouse=warehouses[index % len(warehouses)],
+                last_name=f'{self.prefix}Фамилия{index + 1}',
+                first_name=self.rng.choice(['Иван', 'Петр', 'Сергей', 'Алексей', 'Андрей', 'Николай']),
+                middle_name=self.rng.choice(['Иванович', 'Петрович', 'Сергеевич', 'Алексеевич']),
+                created_by_position=self.positions['руководитель']
+            )
+            for index in range(self.counts['employees'])
+        ]
+        Employee.objects.bulk_create(employees, batch_size=self.batch_size)
+        self.employees = [(employee.id, employee.warehouse_id) for employee in employees]
+        self.warehouse_ids = [warehouse.id for warehouse in warehouses]
+        self.drivers = [employee.id for employee in employees if employee.position_id == self.positions['водитель'].id]
+
+        operation_types = OperationType.objects.bulk_create([
+            OperationType(name=f'{self.prefix} Операция {index + 1}', created_by_position=self.positions['мастер ЛПЦ'])
+            for index in range(self.counts['operation_types'])
+        ])
+        self.operation_type_ids = [operation_type.id for operation_type in operation_types]
+
+    # ---------- Документы ----------
+
+    def _create_documents(self):
+        """
+        Проигрывание документов по времени с учетом остатков
+
+        Returns:
+            dict {(storage_location_id, material_id): {поле: количество}} - итоговые остатки
+        """
+        total = self.counts['receipts'] + self.counts['movements'] + self.counts['conversions']
+        moments = sorted(self._moment() for _ in range(total))
+        kinds = (
+            ['receipt'] * self.counts['receipts']
+            + ['movement'] * self.counts['movements']
+            + ['conversion'] * self.counts['conversions']
+        )
+        self.rng.shuffle(kinds)
+
+        self.balances = {}
+        self.stocked = []  # ключи остатков > 0 для случайного выбора
+        self.stocked_index = {}
+        pending = {Receipt: [], MaterialMovement: [], Conversion: []}
+
+        for moment, kind in zip(moments, kinds):
+            self.changes = []
+            document = None
+            if kind == 'movement':
+                document = self._movement(moment)
+            elif kind == 'conversion':
+                document = self._conversion(moment)
+            if document is None:
+                document = self._receipt(moment)
+
+            batch = pending[type(document)]
+            batch.append((document, self.changes))
+            if len(batch) >= self.batch_size:
+                self._flush(type(document), batch)
+
+        for model, batch in pending.items():
+            self._flush(model, batch)
+
+        return self.balances
+
+    def _flush(self, model, batch):
+        """bulk_create пачки документов и записей журнала по их изменениям остатков"""
+        if not batch:
+            return
+
+        with transaction.atomic():
+            model.objects.bulk_create([document for document, changes in batch])
+            if model is Conversion:
+                outputs = []
+                for document, changes in batch:
+                    for output in document.generated_outputs:
+                        output.conversion_id = document.pk
+                        outputs.append(output)
+                ConversionOutput.objects.bulk_create(outputs, batch_size=self.batch_size)
+            StockLedgerEntry.objects.bulk_create(
+                [
+                    StockLedgerEntry(
+                        storage_location_id=location_id,
+                        material_id=material_id,
+                        source_type=model.LEDGER_SOURCE,
+                        source_id=document.pk,
+                        document_date=getattr(document, model.LEDGER_DATE_FIELD),
+                        created_by_position=document.created_by_position,
+                        **{field: delta}
+                    )
+                    for document, changes in batch
+                    for location_id, material_id, field, delta in changes
+                ],
+                batch_size=self.batch_size
+            )
+
+        batch.clear()
+
+    def _change(self, location_id, material_id, field, delta):
+        """Изменение остатка проигрываемым документом (запоминается для журнала)"""
+        self.changes.append((location_id, material_id, field, delta))
+
+        key = (location_id, material_id)
+        quantities = self.balances.setdefault(key, dict.fromkeys(self.UNIT_FIELDS.values(), Decimal('0')))
+        quantities[field] += delta
+
+        if quantities[field] > 0 and key not in self.stocked_index:
+            self.stocked_index[key] = len(self.stocked)
+            self.stocked.append(key)
+        elif not any(quantity > 0 for quantity in quantities.values()) and key in self.stocked_index:
+            # Удаление перестановкой с последним элементом
+            index = self.stocked_index.pop(key)
+            last = self.stocked.pop()
+            if index < len(self.stocked):
+                self.stocked[index] = last
+                self.stocked_index[last] = index
+
+    def _unit(self, material_id):
+        return self.UNIT_FIELDS[self.material_types[material_id]]
+
+    def _receipt(self, moment):
+        material_type = self._weighted(self.MATERIAL_TYPE_WEIGHTS)
+        material_id = self.rng.choice(self.materials[material_type] or self.materials['древесина'])
+        location_id = self.rng.choice(self.locations['склад'])
+        field = self._unit(material_id)
+        quantity = self._quantity(10, 200)
+        price = self._quantity(100, 5000).quantize(Decimal('0.01'))
+
+        self._change(location_id, material_id, field, quantity)
+        return Receipt(
+            receipt_date=moment,
+            material_id=material_id,
+            storage_location_id=location_id,
+            price=price,
+            total_amount=(quantity * price).quantize(Decimal('0.01')),
+            created_by_position=self.location_owner[location_id],
+            **{field: quantity}
+        )
+
+    def _pick_stock(self, condition):
+        """Случайный остаток > 0, подходящий под условие (None, если не нашелся)"""
+        for _ in range(20):
+            if not self.stocked:
+                return None
+            key = self.rng.choice(self.stocked)
+            field = self._unit(key[1])
+            if self.balances[key][field] > 0 and condition(*key):
+                return key[0], key[1], field
+        return None
+
+    def _movement(self, moment):
+        accounting_type = self._weighted(self.MOVEMENT_TYPE_WEIGHTS)
+        owner = self.location_owner
+        warehouses = set(self.locations['склад'])
+
+        if accounting_type == 'Списание':
+            stock = self._pick_stock(
+                lambda location_id, material_id: location_id in warehouses
+                and self.material_types[material_id] != 'древесина'
+            )
+        elif accounting_type == 'Реализация':
+            stock = self._pick_stock(lambda location_id, material_id: location_id in warehouses)
+        else:
+            stock = self._pick_stock(lambda location_id, material_id: True)
+        if stock is None:
+            return None
+
+        from_id, material_id, field = stock
+        from_owner = owner[from_id]
+
+        if accounting_type == 'Перемещение':
+            candidates = [
+                location_id
+                for location_type in ('склад', 'бригады', 'автомобиль')
+                for location_id in self.owned.get((from_owner.id, location_type), [])
+                if location_id != from_id
+            ]
+        elif accounting_type == 'Отправление':
+            candidates = [
+                location_id
+                for location_type in ('склад', 'бригады', 'автомобиль')
+                for location_id in self.locations[location_type]
+                if owner[location_id].id != from_owner.id
+            ]
+        elif accounting_type == 'Реализация':
+            candidates = self.locations['контрагент']
+        else:
+            candidates = [
+                location_id
+                for location_type in ('бригады', 'автомобиль')
+                for location_id in self.owned.get((from_owner.id, location_type), [])
+            ]
+        if not candidates:
+            return None
+        to_id = self.rng.choice(candidates)
+
+        available = self.balances[(from_id, material_id)][field]
+        quantity = max(
+            (available * Decimal(self.rng.uniform(0.05, 0.5))).quantize(self.QUANTITY), self.QUANTITY
+        )
+        quantity = min(quantity, available)
+
+        completed = self.rng.random() >= self.PENDING_SHARE
+        if completed:
+            self._change(from_id, material_id, field, -quantity)
+            if accounting_type in ('Перемещение', 'Отправление'):
+                self._change(to_id, material_id, field, quantity)
+
+        price = None
+        total_amount = None
+        if accounting_type == 'Реализация':
+            price = self._quantity(100, 5000).quantize(Decimal('0.01'))
+            total_amount = (quantity * price).quantize(Decimal('0.01'))
+
+        return MaterialMovement(
+            date_time=moment,
+            accounting_type=accounting_type,
+            employee_id=self.rng.choice(self.drivers) if self.drivers and accounting_type == 'Отправление' else None,
+            from_location_id=from_id,
+            to_location_id=to_id,
+            material_id=material_id,
+            price=price,
+            total_amount=total_amount,
+            created_by_position=self.positions['руководитель'] if accounting_type == 'Реализация' else from_owner,
+            is_completed=completed,
+            completed_at=moment if completed else None,
+            **{field: quantity}
+        )
+
+    def _conversion(self, moment):
+        warehouses = set(self.locations['склад'])
+        stock = self._pick_stock(
+            lambda location_id, material_id: location_id in warehouses
+            and self.material_types[material_id] == 'древесина'
+        )
+        if stock is None:
+            return None
+
+        location_id, source_id, field = stock
+        candidates = [material_id for material_id in self.materials['древесина'] if material_id != source_id]
+        target_ids = self.rng.sample(candidates, min(len(candidates), self.rng.randint(1, 4)))
+        available = self.balances[(location_id, source_id)][field]
+        source_quantity = min(
+            max((available * Decimal(self.rng.uniform(0.1, 0.6))).quantize(self.QUANTITY), self.QUANTITY),
+            available
+        )
+
+        conversion = Conversion(
+            conversion_date=moment,
+            storage_location_id=location_id,
+            source_material_id=source_id,
+            created_by_position=self.location_owner[location_id],
+            is_completed=True,
+            completed_at=moment,
+            **{f'source_{field}': source_quantity}
+        )
+        self._change(location_id, source_id, field, -source_quantity)
+
+        # Общий выход 55-85% делится между выходами (распиловка: доски, брус, горбыль...)
+        shares = [self.rng.uniform(1, 3) for _ in target_ids]
+        total_yield = Decimal(self.rng.uniform(0.55, 0.85))
+        conversion.generated_outputs = []
+        for target_id, share in zip(target_ids, shares):
+            output = ConversionOutput(
+                material_id=target_id,
+                **{field: max(
+                    (source_quantity * total_yield * Decimal(share / sum(shares))).quantize(self.QUANTITY),
+                    self.QUANTITY
+                )}
+            )
+            output.yield_ratio = conversion.calculate_yield(output)
+            conversion.generated_outputs.append(output)
+            self._change(location_id, target_id, field, getattr(output, field))
+
+        return conversion
+
+    # ---------- Табель и операции ----------
+
+    def _create_worktime(self):
+        records = []
+        for _ in range(self.counts['worktime']):
+            employee_id, warehouse_id = self.rng.choice(self.employees)
+            moment = self._moment().replace(hour=8, minute=0, second=0, microsecond=0)
+            records.append(WorkTimeRecord(
+                date_time=moment,
+                warehouse_id=warehouse_id or self.rng.choice(self.warehouse_ids),
+                employee_id=employee_id,
+                hours=self._quantity(2, 12).quantize(Decimal('0.1')),
+                created_by_position=self.positions['мастер ЛПЦ']
+            ))
+            if len(records) >= self.batch_size:
+                WorkTimeRecord.objects.bulk_create(records)
+                records = []
+        WorkTimeRecord.objects.bulk_create(records)
+
+    def _create_operations(self):
+        wood = self.materials['древесина']
+        records = []
+        for _ in range(self.counts['operations']):
+            records.append(OperationRecord(
+                operation_type_id=self.rng.choice(self.operation_type_ids),
+                date_time=self._moment(),
+                warehouse_id=self.rng.choice(self.warehouse_ids),
+                material_id=self.rng.choice(wood),
+                quantity=self._quantity(1, 500),
+                square_meters=self._quantity(0, 100),
+                cubic_meters=self._quantity(0, 20),
+                created_by_position=self.positions['мастер ЛПЦ']
+            ))
+            if len(records) >= self.batch_size:
+                OperationRecord.objects.bulk_create(records)
+                records = []
+        OperationRecord.objects.bulk_create(records)
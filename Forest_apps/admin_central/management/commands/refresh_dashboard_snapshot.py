@@ -0,0 +1,21 @@
+# Forest_apps/admin_central/management/commands/refresh_dashboard_snapshot.py
+from django.core.management.base import BaseCommand
+
+from Forest_apps.admin_central.services import DashboardSnapshot
+
+
+class Command(BaseCommand):
+    """
+    Пересчет снимка показателей дашборда admin_central
+
+    Запускается по cron (например, раз в минуту), чтобы страница дашборда
+    всегда открывалась из готового снимка. Работает, если кэш общий для процессов.
+    """
+
+    help = 'Пересчет снимка показателей дашборда'
+
+    def handle(self, *args, **options):
+        snapshot = DashboardSnapshot.refresh()
+        self.stdout.write(self.style.SUCCESS(
+            f'Снимок дашборда обновлен: {snapshot["built_at"]:%d.%m.%Y %H:%M:%S}'
+        ))
@@ -0,0 +1,93 @@
+# Forest_apps/admin_central/middleware.py
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from Forest_apps.admin_central.models import RequestProfile
+
+
+class QueryProfilerMiddleware:
+    """
+    Профилирование SQL по запросам (включается настройкой QUERY_PROFILING)
+
+    Для каждого запроса считает время ответа, число и время SQL и ищет повторы:
+    одинаковый текст SQL (параметры не учитываются) DUPLICATE_THRESHOLD и более раз -
+    признак N+1. Итоги копятся в RequestProfile по имени представления
+    (страница admin_central:query_profile). SQL пишется через execute_wrapper,
+    поэтому DEBUG не нужен; запись итогов в сводку в замер не попадает.
+    """
+
+    DUPLICATE_THRESHOLD = 3
+    SQL_PREVIEW_LENGTH = 2000
+
+    # Страница сводки сама себя не профилирует
+    IGNORED_VIEWS = ('admin_central:query_profile',)
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = Counter()
+        sql_time = [0.0]
+
+        def record(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                sql_time[0] += time.perf_counter() - started
+                queries[sql] += 1
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(record):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.view_name and match.view_name not in self.IGNORED_VIEWS:
+            self._save(match.view_name, request.path, duration, queries, sql_time[0])
+
+        return response
+
+    @classmethod
+    def _save(cls, view_name, path, duration, queries, sql_time):
+        """Добавление запроса в сводку (атомарные UPDATE, без чтения строки)"""
+        duration_ms = duration * 1000
+        count = sum(queries.values())
+        duplicate_sql, duplicate_count = queries.most_common(1)[0] if queries else ('', 0)
+        flagged = duplicate_count >= cls.DUPLICATE_THRESHOLD
+
+        profiles = RequestProfile.objects.filter(view_name=view_name)
+        updates = dict(
+            last_path=path[:500],
+            last_seen=timezone.now(),
+            requests_count=F('requests_count') + 1,
+            total_duration_ms=F('total_duration_ms') + duration_ms,
+            max_duration_ms=Greatest('max_duration_ms', duration_ms),
+            total_queries=F('total_queries') + count,
+            max_queries=Greatest('max_queries', count),
+            total_sql_ms=F('total_sql_ms') + sql_time * 1000,
+            flagged_count=F('flagged_count') + int(flagged),
+        )
+
+        if not profiles.update(**updates):
+            try:
+                with transaction.atomic():
+                    RequestProfile.objects.create(view_name=view_name)
+            except IntegrityError:
+                pass  # строку уже создал параллельный запрос
+            profiles.update(**updates)
+
+        if flagged:
+            profiles.filter(duplicate_max__lt=duplicate_count).update(
+                duplicate_max=duplicate_count,
+                duplicate_sql=duplicate_sql[:cls.SQL_PREVIEW_LENGTH]
+            )
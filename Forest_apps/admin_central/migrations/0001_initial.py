@@ -0,0 +1,37 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view_name', models.CharField(max_length=200, unique=True, verbose_name='Представление')),
+                ('last_path', models.CharField(blank=True, default='', max_length=500, verbose_name='Последний URL')),
+                ('requests_count', models.PositiveIntegerField(default=0, verbose_name='Запросов')),
+                ('total_duration_ms', models.FloatField(default=0, verbose_name='Общее время, мс')),
+                ('max_duration_ms', models.FloatField(default=0, verbose_name='Макс. время, мс')),
+                ('total_queries', models.PositiveIntegerField(default=0, verbose_name='SQL всего')),
+                ('max_queries', models.PositiveIntegerField(default=0, verbose_name='Макс. SQL за запрос')),
+                ('total_sql_ms', models.FloatField(default=0, verbose_name='Время SQL, мс')),
+                ('flagged_count', models.PositiveIntegerField(default=0, verbose_name='Запросов с повторами')),
+                ('duplicate_max', models.PositiveIntegerField(default=0, verbose_name='Макс. повторов одного SQL')),
+                ('duplicate_sql', models.TextField(blank=True, default='', verbose_name='Самый частый повтор')),
+                ('last_seen', models.DateTimeField(auto_now=True, verbose_name='Последний запрос')),
+            ],
+            options={
+                'verbose_name': 'Профиль запросов',
+                'verbose_name_plural': 'Профили запросов',
+                'ordering': ['view_name'],
+            },
+        ),
+    ]
@@ -1,3 +1,44 @@
+# Forest_apps/admin_central/models.py
 from django.db import models
 
-# Create your models here.
+
+class RequestProfile(models.Model):
+    """
+    Сводка профилирования запросов по представлению (см. QueryProfilerMiddleware)
+
+    Одна строка на представление, счетчики накапливаются с последнего сброса.
+    Повтор - один и тот же SQL (с разными параметрами) в одном запросе
+    не меньше QueryProfilerMiddleware.DUPLICATE_THRESHOLD раз: обычно это N+1.
+    """
+
+    view_name = models.CharField('Представление', max_length=200, unique=True)
+    last_path = models.CharField('Последний URL', max_length=500, blank=True, default='')
+
+    requests_count = models.PositiveIntegerField('Запросов', default=0)
+    total_duration_ms = models.FloatField('Общее время, мс', default=0)
+    max_duration_ms = models.FloatField('Макс. время, мс', default=0)
+    total_queries = models.PositiveIntegerField('SQL всего', default=0)
+    max_queries = models.PositiveIntegerField('Макс. SQL за запрос', default=0)
+    total_sql_ms = models.FloatField('Время SQL, мс', default=0)
+
+    flagged_count = models.PositiveIntegerField('Запросов с повторами', default=0)
+    duplicate_max = models.PositiveIntegerField('Макс. повторов одного SQL', default=0)
+    duplicate_sql = models.TextField('Самый частый повтор', blank=True, default='')
+
+    last_seen = models.DateTimeField('Последний запрос', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Профиль запросов'
+        verbose_name_plural = 'Профили запросов'
+        ordering = ['view_name']
+
+    def __str__(self):
+        return self.view_name
+
+    @property
+    def avg_duration_ms(self):
+        return self.total_duration_ms / self.requests_count if self.requests_count else 0
+
+    @property
+    def avg_queries(self):
+        return self.total_queries / self.requests_count if self.requests_count else 0
@@ -0,0 +1,154 @@
+# Forest_apps/admin_central/services.py
+import threading
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count, F
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+
+from Forest_apps.core.models import Warehouse, Vehicle
+from Forest_apps.employees.models import Employee
+from Forest_apps.forestry.models import Material, Forestry, CuttingArea
+from Forest_apps.inventory.models import StorageLocation, MaterialMovement, MaterialBalance, StockThreshold, LowStockAlert
+from Forest_apps.inventory.services import LowStockMonitor
+from Forest_apps.operations.models import OperationRecord
+
+
+class DashboardSnapshot:
+    """
+    Снимок показателей дашборда admin_central
+
+    Все показатели собираются в один словарь из простых значений и кладутся
+    в кэш целиком - страница строится по одному чтению кэша (get_many снимка
+    и флага устаревания).
+
+    Снимок считается устаревшим по TTL или после изменения моделей, из которых
+    он собран (флаг выставляется сигналами, см. connect_signals). Устаревший снимок
+    отдается сразу, а пересчитывается в фоновом потоке (один поток на процесс
+    благодаря блокировке в кэше). Без снимка в кэше он строится синхронно.
+    Для cron есть команда refresh_dashboard_snapshot.
+    """
+
+    CACHE_KEY = 'admin_central:dashboard'
+    STALE_KEY = 'admin_central:dashboard:stale'
+    LOCK_KEY = 'admin_central:dashboard:lock'
+
+    TTL = 60  # секунд до фонового обновления
+    CACHE_TIMEOUT = 60 * 60  # сколько хранить снимок, пока его некому обновить
+    LOCK_TIMEOUT = 60
+
+    WATCHED_MODELS = (
+        Employee, Material, Forestry, CuttingArea, Vehicle, Warehouse,
+        MaterialMovement, MaterialBalance, StockThreshold, OperationRecord,
+    )
+
+    @classmethod
+    def build(cls):
+        """Сбор показателей дашборда из базы"""
+        today = timezone.localdate()
+
+        # Остатки ниже порогов материалов - из набора LowStockAlert
+        low_stock = list(LowStockMonitor.alerts()[:10])
+        StorageLocation.resolve_source_names([alert.storage_location for alert in low_stock])
+
+        return {
+            'built_at': timezone.now(),
+            'total_employees': Employee.objects.filter(is_active=True).count(),
+            'total_materials': Material.objects.count(),
+            'total_cutting_areas': CuttingArea.objects.filter(is_active=True).count(),
+            'total_vehicles': Vehicle.objects.filter(is_active=True).count(),
+            'pending_movements': MaterialMovement.objects.filter(is_completed=False).count(),
+            'low_stock_count': LowStockAlert.objects.count(),
+            'today_operations': OperationRecord.objects.filter(date_time__date=today).count(),
+            'forestries_summary': list(Forestry.objects.filter(is_active=True).annotate(
+                cutting_area_count=Count('cuttingarea')
+            ).order_by('-cutting_area_count').values('id', 'name', 'cutting_area_count')[:5]),
+            'recent_movements': list(MaterialMovement.objects.order_by('-date_time').values(
+                'accounting_type', 'quantity_pieces', material_name=F('material__name')
+            )[:5]),
+            'warehouses': list(Warehouse.objects.filter(is_active=True).annotate(
+                employee_count=Count('employee')
+            ).order_by('-employee_count').values('id', 'name', 'is_active', 'employee_count')),
+            'recent_operations': list(OperationRecord.objects.order_by('-date_time').values(
+                'quantity',
+                operation_type_name=F('operation_type__name'),
+                material_name=F('material__name')
+            )[:5]),
+            'low_stock_items': [
+                {
+                    'material_name': alert.material.name,
+                    'quantity': alert.quantity,
+                    'min_quantity': alert.min_quantity,
+                    'unit': alert.get_quantity_field_display(),
+                    'location_name': alert.storage_location.get_source_name(),
+                }
+                for alert in low_stock
+            ],
+        }
+
+    @classmethod
+    def refresh(cls):
+        """Пересчет снимка и запись в кэш"""
+        # Флаг снимается до сбора: изменения во время сбора снова пометят снимок устаревшим
+        cache.delete(cls.STALE_KEY)
+        snapshot = cls.build()
+        cache.set(cls.CACHE_KEY, snapshot, cls.CACHE_TIMEOUT)
+        return snapshot
+
+    @classmethod
+    def get(cls):
+        """
+        Снимок для страницы дашборда
+
+        Returns:
+            dict: показатели и built_at (время сбора)
+        """
+        cached = cache.get_many([cls.CACHE_KEY, cls.STALE_KEY])
+        snapshot = cached.get(cls.CACHE_KEY)
+
+        if snapshot is None:
+            return cls.refresh()
+
+        age = (timezone.now() - snapshot['built_at']).total_seconds()
+        if cached.get(cls.STALE_KEY) or age > cls.TTL:
+            cls.refresh_in_background()
+
+        return snapshot
+
+    @classmethod
+    def invalidate(cls):
+        """Пометить снимок устаревшим (пересчитается при следующем открытии)"""
+        cache.set(cls.STALE_KEY, True, cls.CACHE_TIMEOUT)
+
+    @classmethod
+    def refresh_in_background(cls):
+        """Запуск пересчета в фоновом потоке, если он еще не идет"""
+        if not cache.add(cls.LOCK_KEY, True, cls.LOCK_TIMEOUT):
+            return
+
+        thread = threading.Thread(target=cls._background_refresh, daemon=True)
+        thread.start()
+
+    @classmethod
+    def _background_refresh(cls):
+        try:
+            cls.refresh()
+        finally:
+            cache.delete(cls.LOCK_KEY)
+            connections.close_all()
+
+    @classmethod
+    def connect_signals(cls):
+        """Подписка на изменения моделей, из которых собран снимок"""
+        for model in cls.WATCHED_MODELS:
+            for signal in (post_save, post_delete):
+                signal.connect(
+                    cls._on_model_change,
+                    sender=model,
+                    dispatch_uid=f'dashboard_snapshot_{model._meta.label_lower}'
+                )
+
+    @classmethod
+    def _on_model_change(cls, sender, **kwargs):
+        cls.invalidate()
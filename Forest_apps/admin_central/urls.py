@@ -7,4 +7,7 @@ app_name = 'admin_central'
 urlpatterns = [
     # === ДАШБОРД С АНАЛИТИКОЙ ===
     path('dashboard/', views.dashboard_view, name='dashboard'),
+
+    # === ПРОФИЛИРОВАНИЕ SQL ===
+    path('queries/', views.query_profile_view, name='query_profile'),
 ]
\ No newline at end of file
@@ -1,73 +1,67 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.contrib import messages
+from django.shortcuts import render, redirect
 from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import ExpressionWrapper, F, FloatField
+from django.db.models.functions import Cast
 from django.utils import timezone
-from django.db.models import Count, Sum, Q
-from datetime import timedelta
 
-# Импортируем с префиксом Forest_apps
-from Forest_apps.core.models import Position, Warehouse, Vehicle, Counterparty, Brigade
-from Forest_apps.employees.models import Employee, WorkTimeRecord
-from Forest_apps.forestry.models import Material, Forestry, CuttingArea, CuttingAreaContent
-from Forest_apps.inventory.models import StorageLocation, MaterialMovement, MaterialBalance
-from Forest_apps.operations.models import OperationType, OperationRecord
+from Forest_apps.admin_central.middleware import QueryProfilerMiddleware
+from Forest_apps.admin_central.models import RequestProfile
+from Forest_apps.admin_central.services import DashboardSnapshot
 
 
 @staff_member_required
 def dashboard_view(request):
     """Детальный дашборд с аналитикой"""
 
-    # Общая статистика
-    total_employees = Employee.objects.filter(is_active=True).count()
-    total_materials = Material.objects.count()
-    total_cutting_areas = CuttingArea.objects.filter(is_active=True).count()
-    total_vehicles = Vehicle.objects.filter(is_active=True).count()
+    # Показатели берутся из снимка в кэше (обновляется в фоне, см. DashboardSnapshot)
+    snapshot = DashboardSnapshot.get()
 
-    # Лесничества с количеством лесосек
-    forestries_summary = Forestry.objects.filter(is_active=True).annotate(
-        cutting_area_count=Count('cuttingarea')
-    ).order_by('-cutting_area_count')[:5]
+    context = dict(
+        snapshot,
+        snapshot_age=int((timezone.now() - snapshot['built_at']).total_seconds()),
+        django_version='3.2+',
+        user=request.user,
+    )
 
-    # Последние движения
-    recent_movements = MaterialMovement.objects.select_related('material').order_by('-date_time')[:5]
+    return render(request, 'admin_central/dashboard.html', context)
 
-    # Склады с количеством сотрудников
-    warehouses = Warehouse.objects.filter(is_active=True).annotate(
-        employee_count=Count('employee')
-    ).order_by('-employee_count')
 
-    # Последние операции
-    recent_operations = OperationRecord.objects.select_related(
-        'operation_type', 'material'
-    ).order_by('-date_time')[:5]
+# Сортировки страницы профилирования: ключ -> (выражение, подпись)
+QUERY_PROFILE_SORTS = {
+    'avg_queries': (Cast('total_queries', FloatField()) / F('requests_count'), 'SQL на запрос'),
+    'max_queries': (F('max_queries'), 'Макс. SQL'),
+    'duplicates': (F('duplicate_max'), 'Повторы'),
+    'sql_time': (F('total_sql_ms'), 'Время SQL'),
+    'avg_duration': (ExpressionWrapper(F('total_duration_ms') / F('requests_count'), output_field=FloatField()), 'Среднее время'),
+    'requests': (F('requests_count'), 'Запросов'),
+}
 
-    # Материалы с низким запасом
-    low_stock_items = MaterialBalance.objects.filter(
-        quantity_pieces__lt=10
-    ).select_related('material', 'storage_location')[:10]
 
-    # Ожидающие движения
-    pending_movements = MaterialMovement.objects.filter(is_completed=False).count()
+@staff_member_required
+def query_profile_view(request):
+    """Сводка профилирования SQL по представлениям (худшие первыми)"""
+
+    if request.method == 'POST':
+        RequestProfile.objects.all().delete()
+        messages.success(request, 'Сводка профилирования очищена')
+        return redirect('admin_central:query_profile')
+
+    sort = request.GET.get('sort')
+    if sort not in QUERY_PROFILE_SORTS:
+        sort = 'avg_queries'
 
-    # Статистика за сегодня
-    today = timezone.now().date()
-    today_operations = OperationRecord.objects.filter(
-        date_time__date=today
-    ).count()
+    profiles = RequestProfile.objects.filter(requests_count__gt=0).annotate(
+        sort_value=QUERY_PROFILE_SORTS[sort][0]
+    ).order_by(F('sort_value').desc(), 'view_name')
 
     context = {
-        'total_employees': total_employees,
-        'total_materials': total_materials,
-        'total_cutting_areas': total_cutting_areas,
-        'total_vehicles': total_vehicles,
-        'forestries_summary': forestries_summary,
-        'recent_movements': recent_movements,
-        'warehouses': warehouses,
-        'recent_operations': recent_operations,
-        'low_stock_items': low_stock_items,
-        'pending_movements': pending_movements,
-        'today_operations': today_operations,
-        'django_version': '3.2+',
-        'user': request.user,
+        'profiles': profiles[:200],
+        'sort': sort,
+        'sorts': [(key, label) for key, (expression, label) in QUERY_PROFILE_SORTS.items()],
+        'enabled': getattr(settings, 'QUERY_PROFILING', False),
+        'duplicate_threshold': QueryProfilerMiddleware.DUPLICATE_THRESHOLD,
     }
 
-    return render(request, 'admin_central/dashboard.html', context)
\ No newline at end of file
+    return render(request, 'admin_central/query_profile.html', context)
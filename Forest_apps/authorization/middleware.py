@@ -0,0 +1,26 @@
+# Forest_apps/authorization/middleware.py
+from django.utils.functional import SimpleLazyObject
+
+from Forest_apps.authorization.services import Role, RoleContext
+
+
+class RoleMiddleware:
+    """
+    request.role - контекст должности из сессии (см. RoleContext)
+
+    Контекст вычисляется при первом обращении: запросы, которым должность
+    не нужна, сессию не читают. Для анонимных пользователей - пустой контекст.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.role = SimpleLazyObject(lambda: self._resolve(request))
+        return self.get_response(request)
+
+    @staticmethod
+    def _resolve(request):
+        if not request.user.is_authenticated:
+            return Role({})
+        return RoleContext.for_request(request)
@@ -0,0 +1,97 @@
+# Forest_apps/authorization/services.py
+from Forest_apps.inventory.services import OwnedLocationResolver
+
+
+class Role:
+    """
+    Контекст должности текущего пользователя (request.role)
+
+    Атрибуты:
+        position_id, position_name - должность из сессии
+        is_manager - руководитель, is_booker - бухгалтер
+        locations - {source_type: [location_id, ...]} места хранения должности
+        version - версия OwnedLocationResolver, на которой собран контекст
+    """
+
+    def __init__(self, data):
+        self.position_id = data.get('position_id')
+        self.position_name = data.get('position_name')
+        self.is_manager = data.get('is_manager', False)
+        self.is_booker = data.get('is_booker', False)
+        self.locations = data.get('locations', {})
+        self.version = data.get('version')
+
+    @property
+    def sees_all_locations(self):
+        """Руководитель и бухгалтер видят остатки и движения всех мест хранения"""
+        return self.is_manager or self.is_booker
+
+    def location_ids(self, source_types=None):
+        """
+        ID мест хранения должности
+
+        Args:
+            source_types: тип или список типов (по умолчанию склады, бригады и транспорт)
+        """
+        return OwnedLocationResolver.select(self.locations, source_types)
+
+    def __repr__(self):
+        return f'<Role {self.position_name!r} id={self.position_id}>'
+
+
+class RoleContext:
+    """
+    Контекст должности в сессии
+
+    Должность, признаки руководителя/бухгалтера и ID мест хранения определяются
+    при входе и при переключении должности (store) и хранятся в сессии
+    под SESSION_KEY вместе с версией кэша владельцев. В следующих запросах
+    контекст берется из сессии; пересобирается он только при смене версии
+    (изменились склады, бригады, транспорт, контрагенты или места хранения)
+    или при смене session['position_name'] в обход store.
+
+    Версия - OwnedLocationResolver.get_version(): она хранится в БД
+    (CacheVersions) и одинакова во всех воркерах, поэтому запрос, попавший
+    на другой воркер, не пересобирает контекст и не пересохраняет сессию.
+    Проверка версии - один запрос на HTTP-запрос (вместе с версиями справочников).
+    """
+
+    SESSION_KEY = 'role'
+
+    MANAGER_POSITION = 'руководитель'
+    BOOKER_POSITION = 'бухгалтер'
+
+    @classmethod
+    def build(cls, position_name):
+        """Контекст должности (dict для сессии)"""
+        version = OwnedLocationResolver.get_version()
+        position_id = OwnedLocationResolver.get_position_id(position_name)
+        normalized = (position_name or '').strip().lower()
+
+        return {
+            'position_id': position_id,
+            'position_name': position_name,
+            'is_manager': normalized == cls.MANAGER_POSITION,
+            'is_booker': normalized == cls.BOOKER_POSITION,
+            'locations': OwnedLocationResolver.get_locations(position_id) if position_id else {},
+            'version': version,
+        }
+
+    @classmethod
+    def store(cls, request):
+        """Пересобирает контекст по session['position_name'] (вход, переключение должности)"""
+        data = cls.build(request.session.get('position_name'))
+        request.session[cls.SESSION_KEY] = data
+        return Role(data)
+
+    @classmethod
+    def for_request(cls, request):
+        """Контекст из сессии (пересобирается, если устарел)"""
+        data = request.session.get(cls.SESSION_KEY)
+        if (
+            data is None
+            or data.get('position_name') != request.session.get('position_name')
+            or data.get('version') != OwnedLocationResolver.get_version()
+        ):
+            return cls.store(request)
+        return Role(data)
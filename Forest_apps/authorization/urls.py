@@ -1,7 +1,10 @@
 # Forest_apps.authorization.urls
 from django.urls import path
 
-from Forest_apps.authorization.views.booker_views import booker_balances_view, booker_movements_view
+from Forest_apps.authorization.views.booker_views import (
+    booker_balances_view, booker_movements_view, booker_balances_export_view, booker_movements_export_view,
+    booker_balances_pivot_view, booker_balances_pivot_api_view
+)
 from Forest_apps.authorization.views.login import login_view, logout_view
 from Forest_apps.authorization.views.management_dashboards import (
     supervisor_dashboard, booker_dashboard, mechanic_dashboard,
@@ -34,4 +37,8 @@ urlpatterns = [
     # === БУХГАЛТЕР ===
     path('booker/balances/', booker_balances_view, name='booker_balances'),
     path('booker/movements/', booker_movements_view, name='booker_movements'),
+    path('booker/balances/export/', booker_balances_export_view, name='booker_balances_export'),
+    path('booker/movements/export/', booker_movements_export_view, name='booker_movements_export'),
+    path('booker/balances/pivot/', booker_balances_pivot_view, name='booker_balances_pivot'),
+    path('booker/api/balances-pivot/', booker_balances_pivot_api_view, name='booker_balances_pivot_api'),
 ]
\ No newline at end of file
@@ -1,12 +1,21 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render
-from django.db.models import Q, Sum
+from django.http import JsonResponse
+from django.db.models import Q
+from datetime import timedelta
 from Forest_apps.inventory.models import MaterialBalance, StorageLocation, MaterialMovement
 from Forest_apps.forestry.models import Material
-from Forest_apps.core.models import Position, Warehouse, Brigade, Vehicle
+from Forest_apps.core.models import Position
 from Forest_apps.employees.models import Employee
-from Forest_apps.inventory.forms.material_balance import MaterialBalanceFilterForm
+from Forest_apps.inventory.forms.material_balance import BookerBalanceFilterForm
 from Forest_apps.inventory.forms.material_movement import MaterialMovementFilterForm
+from Forest_apps.inventory.services import OwnedLocationResolver, BalanceHistory, BalancePivot, KeysetPaginator
+from Forest_apps.inventory.exports import (
+    BALANCE_COLUMNS,
+    MOVEMENT_COLUMNS,
+    export_response,
+    iter_chunks
+)
 
 
 @login_required
@@ -20,25 +29,8 @@ def booker_dashboard(request):
     return render(request, 'Management/booker.html', context)
 
 
-@login_required
-def booker_balances_view(request):
-    """Страница остатков материалов для бухгалтера (доступ ко всем остаткам)"""
-
-    # Проверяем, что пользователь - бухгалтер (или руководитель в режиме подмены)
-    current_position = request.session.get('position_name', '').lower()
-    if current_position not in ['бухгалтер', 'руководитель'] and not request.session.get('is_switched', False):
-        from django.contrib import messages
-        from django.shortcuts import redirect
-        messages.error(request, 'У вас нет доступа к этой странице')
-        return redirect('authorization:login')
-
-    # Получаем все руководящие должности (кроме руководителя)
-    руководящие_должности = [
-        'бухгалтер', 'механик', 'мастер леса', 'мастер ЛПЦ', 'мастер ДОЦ', 'мастер ЖД'
-    ]
-
-    # Получаем все должности для фильтра
-    positions = Position.objects.filter(name__in=руководящие_должности, is_active=True)
+def _filter_booker_balances(request):
+    """Остатки с фильтрами страницы бухгалтера (общие для страницы и выгрузки)"""
 
     # Получаем все остатки с связанными данными
     balances = MaterialBalance.objects.select_related(
@@ -46,9 +38,11 @@ def booker_balances_view(request):
     ).order_by('storage_location__source_type', 'material__material_type', 'material__name')
 
     # Фильтрация
-    filter_form = MaterialBalanceFilterForm(request.GET or None)
+    filter_form = BookerBalanceFilterForm(request.GET or None)
+    as_of = None
 
     if filter_form.is_valid():
+        as_of = filter_form.cleaned_data.get('as_of')
         storage_location = filter_form.cleaned_data.get('storage_location')
         material_type = filter_form.cleaned_data.get('material_type')
         material = filter_form.cleaned_data.get('material')
@@ -70,98 +64,29 @@ def booker_balances_view(request):
                 Q(storage_location__source_id__icontains=search)
             )
 
+        if as_of:
+            # До начальных остатков журнала историю восстановить нельзя
+            try:
+                BalanceHistory.check_moment(BalanceHistory.cutoff_for(as_of) - timedelta(microseconds=1))
+            except ValueError as e:
+                filter_form.add_error('as_of', str(e))
+                as_of = None
+
     # Фильтр по должности создателя места хранения
     position_id = request.GET.get('position')
     if position_id:
         position = Position.objects.filter(id=position_id).first()
         if position:
-            # Находим все места хранения, созданные этой должностью
-            from Forest_apps.inventory.models import StorageLocation
-
-            # Склады, созданные этой должностью
-            warehouses = Warehouse.objects.filter(created_by_position_id=position_id)
-            warehouse_locations = []
-            for wh in warehouses:
-                try:
-                    location = StorageLocation.objects.get(source_type='склад', source_id=wh.id)
-                    warehouse_locations.append(location.id)
-                except StorageLocation.DoesNotExist:
-                    pass
-
-            # Бригады, созданные этой должностью
-            brigades = Brigade.objects.filter(created_by_position_id=position_id)
-            brigade_locations = []
-            for br in brigades:
-                try:
-                    location = StorageLocation.objects.get(source_type='бригады', source_id=br.id)
-                    brigade_locations.append(location.id)
-                except StorageLocation.DoesNotExist:
-                    pass
-
-            # Транспорт, созданный этой должностью
-            vehicles = Vehicle.objects.filter(created_by_position_id=position_id)
-            vehicle_locations = []
-            for vh in vehicles:
-                try:
-                    location = StorageLocation.objects.get(source_type='автомобиль', source_id=vh.id)
-                    vehicle_locations.append(location.id)
-                except StorageLocation.DoesNotExist:
-                    pass
-
-            # Объединяем все ID мест хранения
-            location_ids = warehouse_locations + brigade_locations + vehicle_locations
+            # Все места хранения (склады, бригады, транспорт), созданные этой должностью
+            location_ids = OwnedLocationResolver.get_location_ids(position)
             if location_ids:
                 balances = balances.filter(storage_location_id__in=location_ids)
 
-    # Подсчет итогов
-    total_pieces = balances.aggregate(total=Sum('quantity_pieces'))['total'] or 0
-    total_meters = balances.aggregate(total=Sum('quantity_meters'))['total'] or 0
-    total_cubic = balances.aggregate(total=Sum('quantity_cubic'))['total'] or 0
-
-    # Статистика по типам мест хранения
-    stats_by_type = {
-        'склад': balances.filter(storage_location__source_type='склад').count(),
-        'автомобиль': balances.filter(storage_location__source_type='автомобиль').count(),
-        'контрагент': balances.filter(storage_location__source_type='контрагент').count(),
-        'бригады': balances.filter(storage_location__source_type='бригады').count(),
-    }
-
-    context = {
-        'title': 'Остатки материалов',
-        'employee_name': request.session.get('employee_name'),
-        'position_name': request.session.get('position_name'),
-        'balances': balances,
-        'filter_form': filter_form,
-        'positions': positions,
-        'total_pieces': total_pieces,
-        'total_meters': total_meters,
-        'total_cubic': total_cubic,
-        'stats_by_type': stats_by_type,
-        'selected_position': position_id,
-    }
-
-    return render(request, 'Management/booker_menu/balances.html', context)
-
-
-@login_required
-def booker_movements_view(request):
-    """Страница движений материалов для бухгалтера (доступ ко всем движениям)"""
-
-    # Проверяем, что пользователь - бухгалтер (или руководитель в режиме подмены)
-    current_position = request.session.get('position_name', '').lower()
-    if current_position not in ['бухгалтер', 'руководитель'] and not request.session.get('is_switched', False):
-        from django.contrib import messages
-        from django.shortcuts import redirect
-        messages.error(request, 'У вас нет доступа к этой странице')
-        return redirect('authorization:login')
+    return balances, filter_form, as_of, position_id
 
-    # Получаем все руководящие должности (кроме руководителя)
-    руководящие_должности = [
-        'бухгалтер', 'механик', 'мастер леса', 'мастер ЛПЦ', 'мастер ДОЦ', 'мастер ЖД'
-    ]
 
-    # Получаем все должности для фильтра
-    positions = Position.objects.filter(name__in=руководящие_должности, is_active=True)
+def _filter_booker_movements(request):
+    """Движения с фильтрами страницы бухгалтера (общие для страницы и выгрузки)"""
 
     # Получаем все движения
     movements = MaterialMovement.objects.select_related(
@@ -219,24 +144,213 @@ def booker_movements_view(request):
     if creator_position_id:
         movements = movements.filter(created_by_position_id=creator_position_id)
 
-    # Подсчет статистики
-    total_count = movements.count()
-    total_amount = movements.filter(accounting_type='Реализация').aggregate(
-        total=Sum('total_amount')
-    )['total'] or 0
-    pending_count = movements.filter(is_completed=False).count()
+    return movements, filter_form, creator_position_id
+
+
+@login_required
+def booker_balances_view(request):
+    """Страница остатков материалов для бухгалтера (доступ ко всем остаткам)"""
+
+    # Проверяем, что пользователь - бухгалтер (или руководитель в режиме подмены)
+    if not request.role.sees_all_locations and not request.session.get('is_switched', False):
+        from django.contrib import messages
+        from django.shortcuts import redirect
+        messages.error(request, 'У вас нет доступа к этой странице')
+        return redirect('authorization:login')
+
+    # Получаем все руководящие должности (кроме руководителя)
+    руководящие_должности = [
+        'бухгалтер', 'механик', 'мастер леса', 'мастер ЛПЦ', 'мастер ДОЦ', 'мастер ЖД'
+    ]
+
+    # Получаем все должности для фильтра
+    positions = Position.objects.filter(name__in=руководящие_должности, is_active=True)
+
+    balances, filter_form, as_of, position_id = _filter_booker_balances(request)
+
+    if as_of:
+        # Остатки на конец выбранного дня: снимок + журнал после него
+        balances = BalanceHistory.apply_to(
+            balances,
+            BalanceHistory.cutoff_for(as_of) - timedelta(microseconds=1)
+        )
+        pivot = BalancePivot.for_balances(balances)
+    else:
+        # Итоги и статистика по типам мест хранения - один сгруппированный запрос
+        pivot = BalancePivot.for_queryset(balances)
+
+    total_pieces = pivot.totals['pieces']
+    total_meters = pivot.totals['meters']
+    total_cubic = pivot.totals['cubic']
+    stats_by_type = {source_type: totals['count'] for source_type, totals in pivot.totals_by_type.items()}
+
+    context = {
+        'title': 'Остатки материалов',
+        'employee_name': request.session.get('employee_name'),
+        'position_name': request.session.get('position_name'),
+        'balances': balances,
+        'filter_form': filter_form,
+        'positions': positions,
+        'total_pieces': total_pieces,
+        'total_meters': total_meters,
+        'total_cubic': total_cubic,
+        'stats_by_type': stats_by_type,
+        'pivot': pivot,
+        'selected_position': position_id,
+        'as_of': as_of,
+    }
+
+    return render(request, 'Management/booker_menu/balances.html', context)
+
+
+def _booker_balances_pivot(request):
+    """Свод остатков с фильтрами страницы бухгалтера (общий для страницы и API)"""
+
+    balances, filter_form, as_of, position_id = _filter_booker_balances(request)
+    by_position = request.GET.get('by_position') == '1'
+
+    if as_of:
+        pivot = BalancePivot.for_balances(
+            BalanceHistory.apply_to(balances, BalanceHistory.cutoff_for(as_of) - timedelta(microseconds=1)),
+            by_position
+        )
+    else:
+        pivot = BalancePivot.for_queryset(balances, by_position)
+
+    return pivot, filter_form, as_of, position_id
+
+
+@login_required
+def booker_balances_pivot_view(request):
+    """Свод остатков: материалы × типы мест хранения (и должности создателя)"""
+
+    if not request.role.sees_all_locations and not request.session.get('is_switched', False):
+        from django.contrib import messages
+        from django.shortcuts import redirect
+        messages.error(request, 'У вас нет доступа к этой странице')
+        return redirect('authorization:login')
+
+    руководящие_должности = [
+        'бухгалтер', 'механик', 'мастер леса', 'мастер ЛПЦ', 'мастер ДОЦ', 'мастер ЖД'
+    ]
+    positions = Position.objects.filter(name__in=руководящие_должности, is_active=True)
+
+    pivot, filter_form, as_of, position_id = _booker_balances_pivot(request)
+
+    context = {
+        'title': 'Свод остатков',
+        'employee_name': request.session.get('employee_name'),
+        'position_name': request.session.get('position_name'),
+        'pivot': pivot,
+        'filter_form': filter_form,
+        'positions': positions,
+        'selected_position': position_id,
+        'as_of': as_of,
+    }
+
+    return render(request, 'Management/booker_menu/balances_pivot.html', context)
+
+
+@login_required
+def booker_balances_pivot_api_view(request):
+    """API: свод остатков в JSON (те же фильтры, что и на странице остатков)"""
+
+    if not request.role.sees_all_locations and not request.session.get('is_switched', False):
+        return JsonResponse({'error': 'Нет доступа'}, status=403)
+
+    pivot, filter_form, as_of, position_id = _booker_balances_pivot(request)
+    if 'as_of' in filter_form.errors:
+        return JsonResponse({'error': filter_form.errors['as_of'][0]}, status=400)
+
+    data = pivot.as_dict()
+    data['as_of'] = as_of.isoformat() if as_of else None
+    return JsonResponse(data)
+
+
+@login_required
+def booker_movements_view(request):
+    """Страница движений материалов для бухгалтера (доступ ко всем движениям)"""
+
+    # Проверяем, что пользователь - бухгалтер (или руководитель в режиме подмены)
+    if not request.role.sees_all_locations and not request.session.get('is_switched', False):
+        from django.contrib import messages
+        from django.shortcuts import redirect
+        messages.error(request, 'У вас нет доступа к этой странице')
+        return redirect('authorization:login')
+
+    # Получаем все руководящие должности (кроме руководителя)
+    руководящие_должности = [
+        'бухгалтер', 'механик', 'мастер леса', 'мастер ЛПЦ', 'мастер ДОЦ', 'мастер ЖД'
+    ]
+
+    # Получаем все должности для фильтра
+    positions = Position.objects.filter(name__in=руководящие_должности, is_active=True)
+
+    movements, filter_form, creator_position_id = _filter_booker_movements(request)
+
+    # Сводная статистика по всей выборке - один запрос
+    summary = movements.summary()
+
+    # Текущая страница (keyset-пагинация по дате и id)
+    page = KeysetPaginator().for_request(request, movements)
 
     context = {
         'title': 'Движения материалов',
         'employee_name': request.session.get('employee_name'),
         'position_name': request.session.get('position_name'),
-        'movements': movements,
+        'movements': page,
+        'page': page,
+        'page_querystring': KeysetPaginator.querystring(request),
         'filter_form': filter_form,
         'positions': positions,
-        'total_count': total_count,
-        'total_amount': total_amount,
-        'pending_count': pending_count,
+        **summary,
         'selected_creator_position': creator_position_id,
     }
 
-    return render(request, 'Management/booker_menu/movements.html', context)
\ No newline at end of file
+    return render(request, 'Management/booker_menu/movements.html', context)
+
+
+@login_required
+def booker_balances_export_view(request):
+    """Выгрузка остатков (CSV/XLSX) с фильтрами страницы бухгалтера"""
+
+    if not request.role.sees_all_locations and not request.session.get('is_switched', False):
+        from django.contrib import messages
+        from django.shortcuts import redirect
+        messages.error(request, 'У вас нет доступа к этой странице')
+        return redirect('authorization:login')
+
+    balances, filter_form, as_of, position_id = _filter_booker_balances(request)
+
+    prepare = None
+    if as_of:
+        # Остатки на конец выбранного дня - пересчет по каждой порции
+        moment = BalanceHistory.cutoff_for(as_of) - timedelta(microseconds=1)
+        prepare = lambda chunk: BalanceHistory.apply_to(chunk, moment)
+
+    return export_response(
+        iter_chunks(balances, location_fields=('storage_location',), prepare=prepare),
+        BALANCE_COLUMNS,
+        f'balances_{as_of:%Y%m%d}' if as_of else 'balances',
+        request.GET.get('format')
+    )
+
+
+@login_required
+def booker_movements_export_view(request):
+    """Выгрузка движений (CSV/XLSX) с фильтрами страницы бухгалтера"""
+
+    if not request.role.sees_all_locations and not request.session.get('is_switched', False):
+        from django.contrib import messages
+        from django.shortcuts import redirect
+        messages.error(request, 'У вас нет доступа к этой странице')
+        return redirect('authorization:login')
+
+    movements, filter_form, creator_position_id = _filter_booker_movements(request)
+
+    return export_response(
+        iter_chunks(movements.order_by('-date_time', '-id'), location_fields=('from_location', 'to_location')),
+        MOVEMENT_COLUMNS,
+        'movements',
+        request.GET.get('format')
+    )
@@ -2,6 +2,7 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout
 from django.contrib import messages
 from Forest_apps.authorization.forms import CustomLoginForm
+from Forest_apps.authorization.services import RoleContext
 
 
 def login_view(request):
@@ -38,6 +39,7 @@ def login_view(request):
             request.session['employee_id'] = employee.id
             request.session['employee_name'] = employee.full_name
             request.session['position_name'] = employee.position.name
+            RoleContext.store(request)
             request.session.save()  # Принудительно сохраняем сессию
 
             messages.success(request, f'Добро пожаловать, {employee.full_name}!')
@@ -3,6 +3,15 @@ from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 
+from Forest_apps.authorization.services import RoleContext
+from Forest_apps.inventory.services import LowStockMonitor
+
+
+def _low_stock_count(request):
+    """Количество остатков ниже порогов в местах хранения текущей должности"""
+    return LowStockMonitor.alerts(LowStockMonitor.location_ids_for_request(request)).count()
+
+
 #%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%% РУКОВОДИТЕЛЬ %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 @login_required
 def supervisor_dashboard(request):
@@ -12,6 +21,7 @@ def supervisor_dashboard(request):
         'title': 'Панель руководителя',
         'employee_name': request.session.get('employee_name'),
         'position': request.session.get('position_name'),
+        'low_stock_count': _low_stock_count(request),
         'user': request.user,  # Явно передаем user в контекст
     }
     return render(request, 'Management/supervisor.html', context)
@@ -35,8 +45,7 @@ def switch_to_position_view(request, position_name):
     Сохраняем оригинальную должность в сессии и подменяем текущую.
     """
     # Проверяем, что текущий пользователь - руководитель
-    current_position = request.session.get('position_name', '').lower()
-    if current_position != 'руководитель':
+    if not request.role.is_manager:
         messages.error(request, 'У вас нет прав для доступа к этому разделу')
         return redirect('authorization:supervisor_dashboard')
 
@@ -44,7 +53,7 @@ def switch_to_position_view(request, position_name):
     if 'original_position' not in request.session:
         request.session['original_position'] = {
             'name': request.session.get('position_name'),
-            'id': request.session.get('position_id'),  # если есть
+            'id': request.role.position_id,
         }
 
     # Словарь соответствия названий должностей и URL-имен
@@ -66,6 +75,7 @@ def switch_to_position_view(request, position_name):
     # Обновляем должность в сессии
     request.session['position_name'] = position_name  # Сохраняем как есть (с сохранением регистра)
     request.session['is_switched'] = True  # Флаг, что мы в режиме подмены
+    RoleContext.store(request)
 
     messages.success(
         request,
@@ -87,6 +97,7 @@ def return_to_original_position_view(request):
         # Очищаем временные данные
         del request.session['original_position']
         request.session.pop('is_switched', None)
+        RoleContext.store(request)
 
         messages.success(request, 'Вы вернулись в свой интерфейс руководителя.')
     else:
@@ -103,6 +114,7 @@ def booker_dashboard(request):
         'title': 'Панель бухгалтера',
         'employee_name': request.session.get('employee_name'),
         'position': request.session.get('position_name'),
+        'low_stock_count': _low_stock_count(request),
     }
     return render(request, 'Management/booker.html', context)
 
@@ -113,6 +125,7 @@ def master_forest_dashboard(request):
         'title': 'Панель мастера леса',
         'employee_name': request.session.get('employee_name'),
         'position': request.session.get('position_name'),
+        'low_stock_count': _low_stock_count(request),
     }
     return render(request, 'Management/master_Forest.html', context)
 
@@ -123,6 +136,7 @@ def mechanic_dashboard(request):
         'title': 'Панель механика',
         'employee_name': request.session.get('employee_name'),
         'position': request.session.get('position_name'),
+        'low_stock_count': _low_stock_count(request),
     }
     return render(request, 'Management/mechanic.html', context)
 
@@ -133,6 +147,7 @@ def master_lpc_dashboard(request):
         'title': 'Панель мастера ЛПЦ',
         'employee_name': request.session.get('employee_name'),
         'position': request.session.get('position_name'),
+        'low_stock_count': _low_stock_count(request),
     }
     return render(request, 'Management/master_LPC.html', context)
 
@@ -143,6 +158,7 @@ def master_doc_dashboard(request):
         'title': 'Панель мастера ДОЦ',
         'employee_name': request.session.get('employee_name'),
         'position': request.session.get('position_name'),
+        'low_stock_count': _low_stock_count(request),
     }
     return render(request, 'Management/master_DOC.html', context)
 
@@ -153,5 +169,6 @@ def master_railways_dashboard(request):
         'title': 'Панель мастера ЖД',
         'employee_name': request.session.get('employee_name'),
         'position': request.session.get('position_name'),
+        'low_stock_count': _low_stock_count(request),
     }
     return render(request, 'Management/master_Railways.html', context)
\ No newline at end of file
@@ -6,4 +6,10 @@ class CoreConfig(AppConfig):
     name = 'Forest_apps.core'
     verbose_name = 'Справочники'
 
+    def ready(self):
+        from django.core.signals import request_finished, request_started
+        from Forest_apps.core.services import CacheVersions
 
+        # Версии кэша запоминаются на время HTTP-запроса (один запрос к БД)
+        request_started.connect(CacheVersions.start_request, dispatch_uid='cache_versions_start')
+        request_finished.connect(CacheVersions.finish_request, dispatch_uid='cache_versions_finish')
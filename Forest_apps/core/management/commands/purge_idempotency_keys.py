@@ -0,0 +1,28 @@
+# Forest_apps/core/management/commands/purge_idempotency_keys.py
+from django.core.management.base import BaseCommand, CommandError
+
+from Forest_apps.core.services import IdempotentSubmission
+
+
+class Command(BaseCommand):
+    """
+    Удаление старых ключей повторной отправки форм (IdempotencyKey)
+
+    Повтор отправки возможен в пределах минут, поэтому ключи старше
+    --days (по умолчанию IdempotentSubmission.TTL_DAYS) больше не нужны.
+    """
+
+    help = 'Удаление старых ключей повторной отправки форм'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=IdempotentSubmission.TTL_DAYS,
+            help='Удалять ключи старше указанного числа дней'
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError('--days не может быть отрицательным')
+
+        deleted = IdempotentSubmission.purge(options['days'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено ключей: {deleted}'))
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_brigade_created_by_position_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, verbose_name='Ключ')),
+                ('scope', models.CharField(max_length=64, verbose_name='Форма')),
+                ('object_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='ID созданного объекта')),
+                ('redirect_url', models.CharField(blank=True, max_length=255, verbose_name='Адрес перехода')),
+                ('message', models.TextField(blank=True, verbose_name='Сообщение')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Создан')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ключ повторной отправки',
+                'verbose_name_plural': 'Ключи повторной отправки',
+                'constraints': [models.UniqueConstraint(fields=('user', 'key'), name='unique_idempotency_key_per_user')],
+            },
+        ),
+    ]
@@ -104,7 +104,12 @@ class Warehouse(models.Model):
         StorageLocation.objects.update_or_create(
             source_type='склад',
             source_id=self.id,
-            defaults={'source_type': 'склад', 'source_id': self.id}
+            defaults={
+                'source_type': 'склад',
+                'source_id': self.id,
+                'source_name': StorageLocation.format_source_name('склад', self),
+                'search_text': StorageLocation.format_search_text('склад', self),
+            }
         )
 
     @classmethod
@@ -188,7 +193,12 @@ class Vehicle(models.Model):
         StorageLocation.objects.update_or_create(
             source_type='автомобиль',
             source_id=self.id,
-            defaults={'source_type': 'автомобиль', 'source_id': self.id}
+            defaults={
+                'source_type': 'автомобиль',
+                'source_id': self.id,
+                'source_name': StorageLocation.format_source_name('автомобиль', self),
+                'search_text': StorageLocation.format_search_text('автомобиль', self),
+            }
         )
 
     @classmethod
@@ -282,7 +292,12 @@ class Counterparty(models.Model):
         StorageLocation.objects.update_or_create(
             source_type='контрагент',
             source_id=self.id,
-            defaults={'source_type': 'контрагент', 'source_id': self.id}
+            defaults={
+                'source_type': 'контрагент',
+                'source_id': self.id,
+                'source_name': StorageLocation.format_source_name('контрагент', self),
+                'search_text': StorageLocation.format_search_text('контрагент', self),
+            }
         )
 
     @classmethod
@@ -365,7 +380,12 @@ class Brigade(models.Model):
         StorageLocation.objects.update_or_create(
             source_type='бригады',
             source_id=self.id,
-            defaults={'source_type': 'бригады', 'source_id': self.id}
+            defaults={
+                'source_type': 'бригады',
+                'source_id': self.id,
+                'source_name': StorageLocation.format_source_name('бригады', self),
+                'search_text': StorageLocation.format_search_text('бригады', self),
+            }
         )
 
     @classmethod
@@ -400,3 +420,55 @@ class Brigade(models.Model):
         Получение всех активных бригад
         """
         return cls.objects.filter(is_active=True).order_by('name')
+
+
+# ИДЕМПОТЕНТНОСТЬ ФОРМ СОЗДАНИЯ
+class IdempotencyKey(models.Model):
+    """
+    Ключ повторной отправки формы создания (см. IdempotentSubmission)
+
+    Ключ уникален для пользователя: первая отправка записывает его в одной
+    транзакции с документом, повтор с тем же ключом получает сохраненный
+    результат (куда перейти и сообщение) без повторного создания.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='idempotency_keys'
+    )
+    key = models.CharField('Ключ', max_length=64)
+    scope = models.CharField('Форма', max_length=64)
+    object_id = models.PositiveIntegerField('ID созданного объекта', null=True, blank=True)
+    redirect_url = models.CharField('Адрес перехода', max_length=255, blank=True)
+    message = models.TextField('Сообщение', blank=True)
+    created_at = models.DateTimeField('Создан', auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Ключ повторной отправки'
+        verbose_name_plural = 'Ключи повторной отправки'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+
+    def __str__(self):
+        return f'{self.scope}: {self.key}'
+
+
+class CacheVersion(models.Model):
+    """
+    Версия кэшируемых данных, общая для всех воркеров и серверов (см. CacheVersions)
+
+    Данные в кэше хранятся под ключом из версий: после изменения источника
+    версия увеличивается, и все процессы перестают читать прежние данные.
+    """
+    name = models.CharField('Имя', max_length=100, unique=True)
+    version = models.BigIntegerField('Версия', default=0)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Версия кэша'
+        verbose_name_plural = 'Версии кэша'
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
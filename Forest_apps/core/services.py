@@ -0,0 +1,206 @@
+# Forest_apps/core/services.py
+import datetime
+import re
+import threading
+import time
+import uuid
+
+from django.contrib import messages
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.shortcuts import redirect, resolve_url
+from django.utils import timezone
+
+from Forest_apps.core.models import CacheVersion, IdempotencyKey
+
+
+class DuplicateSubmission(Exception):
+    """Ключ уже записан параллельной отправкой"""
+
+
+class IdempotentSubmission:
+    """
+    Защита форм создания от повторной отправки
+
+    Форма получает скрытое поле idempotency_key (form_key), клиенты API могут
+    передать заголовок Idempotency-Key. Первая отправка выполняет создание
+    в одной транзакции с записью ключа (run) и сохраняет результат - адрес
+    перехода и сообщение. Повторная отправка с тем же ключом (нажали еще раз
+    после таймаута) получает сохраненный результат (replay) одним запросом
+    по уникальному индексу, без проверки формы и без записи.
+
+    Ключ записывается первым в транзакции: параллельный дубль ждет на уникальном
+    индексе, получает IntegrityError и отдает результат первой отправки.
+    При ошибке создания транзакция откатывается вместе с ключом - исправленную
+    форму можно отправить с тем же ключом.
+    """
+
+    FIELD_NAME = 'idempotency_key'
+    HEADER_NAME = 'Idempotency-Key'
+    KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+    TTL_DAYS = 7  # сколько хранить ключи (purge_idempotency_keys)
+
+    @classmethod
+    def get_key(cls, request):
+        """Ключ из заголовка или поля формы (None, если не передан или некорректен)"""
+        key = request.headers.get(cls.HEADER_NAME) or request.POST.get(cls.FIELD_NAME)
+        if key and cls.KEY_PATTERN.match(key):
+            return key
+        return None
+
+    @classmethod
+    def form_key(cls, request):
+        """Ключ для скрытого поля формы (при повторном показе формы с ошибками - прежний)"""
+        return cls.get_key(request) or uuid.uuid4().hex
+
+    @classmethod
+    def replay(cls, request):
+        """
+        Ответ на повторную отправку
+
+        Returns:
+            HttpResponseRedirect с сообщением первой отправки или None, если ключ новый
+        """
+        if request.method != 'POST':
+            return None
+
+        key = cls.get_key(request)
+        if key is None:
+            return None
+
+        record = IdempotencyKey.objects.filter(
+            user=request.user, key=key
+        ).only('redirect_url', 'message').first()
+        if record is None:
+            return None
+
+        if record.message:
+            messages.success(request, record.message)
+        return redirect(record.redirect_url)
+
+    @classmethod
+    def run(cls, request, scope, action):
+        """
+        Создание с записью ключа в одной транзакции
+
+        Args:
+            scope: имя формы (для разбора ключей)
+            action: функция без аргументов, создает объект и возвращает
+                (объект, куда перейти - имя URL или адрес, сообщение об успехе)
+
+        Returns:
+            HttpResponseRedirect
+
+        Raises:
+            ValueError: из action (транзакция и ключ откатываются)
+        """
+        key = cls.get_key(request)
+
+        try:
+            with transaction.atomic():
+                record = cls.claim(request.user, key, scope) if key else None
+                obj, redirect_to, message = action()
+                redirect_url = resolve_url(redirect_to)
+
+                if record is not None:
+                    record.object_id = obj.pk
+                    record.redirect_url = redirect_url
+                    record.message = message
+                    record.save(update_fields=['object_id', 'redirect_url', 'message'])
+        except DuplicateSubmission:
+            return cls.replay(request)
+
+        messages.success(request, message)
+        return redirect(redirect_url)
+
+    @classmethod
+    def claim(cls, user, key, scope):
+        """
+        Запись ключа (во вложенной транзакции, чтобы дубль не ломал внешнюю)
+
+        Raises:
+            DuplicateSubmission: ключ уже записан
+        """
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(user=user, key=key, scope=scope)
+        except IntegrityError:
+            raise DuplicateSubmission(key)
+
+    @classmethod
+    def purge(cls, days=None):
+        """Удаление ключей старше days (по умолчанию TTL_DAYS); возвращает количество"""
+        cutoff = timezone.now() - datetime.timedelta(days=cls.TTL_DAYS if days is None else days)
+        deleted, _ = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+        return deleted
+
+
+class CacheVersions:
+    """
+    Версии кэшируемых данных в БД (CacheVersion), общие для всех воркеров
+
+    Кэш в памяти процесса (LocMemCache) у каждого воркера свой, поэтому
+    версии хранятся в таблице: изменение, сделанное одним воркером, сразу
+    видят все воркеры и серверы. Значение версии - время изменения
+    в миллисекундах, но не меньше предыдущего значения + 1.
+
+    Все версии читаются одним запросом к маленькой таблице и запоминаются
+    до конца HTTP-запроса (request_started/request_finished, см. CoreConfig.ready);
+    вне запросов (команды, shell) читаются каждый раз. bump вызывается
+    после фиксации транзакции (transaction.on_commit), чтобы параллельный
+    запрос не закэшировал незафиксированные данные под новой версией.
+    """
+
+    _request = threading.local()
+
+    @classmethod
+    def start_request(cls, **kwargs):
+        cls._request.active = True
+        cls._request.versions = None
+
+    @classmethod
+    def finish_request(cls, **kwargs):
+        cls._request.active = False
+        cls._request.versions = None
+
+    @classmethod
+    def get_many(cls, names):
+        """
+        Версии по именам (0 - версия еще не заводилась)
+
+        Returns:
+            dict {name: version}
+        """
+        versions = getattr(cls._request, 'versions', None)
+        if versions is None:
+            versions = dict(CacheVersion.objects.values_list('name', 'version'))
+            if getattr(cls._request, 'active', False):
+                cls._request.versions = versions
+        return {name: versions.get(name, 0) for name in names}
+
+    @classmethod
+    def get(cls, name):
+        return cls.get_many([name])[name]
+
+    @classmethod
+    def bump(cls, *names):
+        """Увеличивает версии: данные под прежними версиями больше не читаются ни одним процессом"""
+        now_ms = int(time.time() * 1000)
+
+        def increment():
+            return CacheVersion.objects.filter(name__in=names).update(
+                version=Greatest(F('version') + 1, Value(now_ms)),
+                updated_at=timezone.now()
+            )
+
+        if increment() < len(set(names)):
+            # Первое изменение - заводим строки (параллельная вставка не приведет к дублю)
+            # и увеличиваем еще раз, чтобы версия точно отличалась от прочитанной до вставки
+            CacheVersion.objects.bulk_create(
+                [CacheVersion(name=name, version=now_ms) for name in set(names)],
+                ignore_conflicts=True
+            )
+            increment()
+
+        cls._request.versions = None
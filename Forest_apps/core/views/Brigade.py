@@ -3,6 +3,7 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from Forest_apps.core.models import Brigade
 from Forest_apps.core.forms.brigade import BrigadeCreateForm, BrigadeEditForm
+from Forest_apps.inventory.services import ReferenceDataCache
 
 
 @login_required
@@ -16,7 +17,7 @@ def brigade_list_view(request):
     # Находим ID должности по названию
     from Forest_apps.core.models import Position
     try:
-        position = Position.objects.get(name__iexact=user_position_name)
+        position = ReferenceDataCache.get_position(user_position_name)
         user_position_id = position.id
     except Position.DoesNotExist:
         # Если должность не найдена, показываем пустой список
@@ -53,7 +54,7 @@ def brigade_create_view(request):
             from Forest_apps.core.models import Position
             position_name = request.session.get('position_name')
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 brigade.created_by_position = position
             except Position.DoesNotExist:
                 # Если должность не найдена, создаем или используем существующую
@@ -91,7 +92,7 @@ def brigade_edit_view(request, brigade_id):
     from Forest_apps.core.models import Position
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('core:brigade_list')
@@ -133,7 +134,7 @@ def brigade_deactivate_view(request, brigade_id):
     from Forest_apps.core.models import Position
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('core:brigade_list')
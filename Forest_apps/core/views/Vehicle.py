@@ -3,6 +3,7 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from Forest_apps.core.models import Vehicle, Position
 from Forest_apps.core.forms.vehicle import VehicleCreateForm, VehicleEditForm
+from Forest_apps.inventory.services import ReferenceDataCache
 
 
 @login_required
@@ -15,7 +16,7 @@ def vehicle_list_view(request):
 
     # Находим ID должности по названию
     try:
-        position = Position.objects.get(name__iexact=user_position_name)
+        position = ReferenceDataCache.get_position(user_position_name)
         user_position_id = position.id
     except Position.DoesNotExist:
         # Если должность не найдена, показываем пустой список
@@ -51,7 +52,7 @@ def vehicle_create_view(request):
             # Добавляем должность создателя
             position_name = request.session.get('position_name')
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 vehicle.created_by_position = position
             except Position.DoesNotExist:
                 # Если должность не найдена, создаем
@@ -88,7 +89,7 @@ def vehicle_edit_view(request, vehicle_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('core:vehicle_list')
@@ -129,7 +130,7 @@ def vehicle_deactivate_view(request, vehicle_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('core:vehicle_list')
@@ -4,6 +4,7 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from Forest_apps.core.models import Warehouse, Position
 from Forest_apps.core.forms.warehouse import WarehouseCreateForm, WarehouseEditForm
+from Forest_apps.inventory.services import ReferenceDataCache
 
 
 # ----------------------ДЛЯ КОНКРЕТНОЙ ДОЛЖНОСТИ -------------------
@@ -17,7 +18,7 @@ def warehouse_list_view(request):
 
     # Находим ID должности по названию
     try:
-        position = Position.objects.get(name__iexact=user_position_name)
+        position = ReferenceDataCache.get_position(user_position_name)
         user_position_id = position.id
     except Position.DoesNotExist:
         user_position_id = -1
@@ -52,7 +53,7 @@ def warehouse_create_view(request):
             # Добавляем должность создателя
             position_name = request.session.get('position_name')
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 warehouse.created_by_position = position
             except Position.DoesNotExist:
                 # Если должность не найдена, создаем
@@ -89,7 +90,7 @@ def warehouse_edit_view(request, warehouse_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('core:warehouse_list')
@@ -130,7 +131,7 @@ def warehouse_deactivate_view(request, warehouse_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('core:warehouse_list')
@@ -161,7 +162,7 @@ def warehouse_activate_view(request, warehouse_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('core:warehouse_list')
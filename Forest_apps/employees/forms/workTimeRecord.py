@@ -1,7 +1,14 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
 from django import forms
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from Forest_apps.employees.models import WorkTimeRecord, Employee
 from Forest_apps.core.models import Warehouse, Position
+from Forest_apps.inventory.services import ReferenceDataCache
 
 
 class WorkTimeRecordCreateForm(forms.ModelForm):
@@ -66,7 +73,7 @@ class WorkTimeRecordCreateForm(forms.ModelForm):
 
         try:
             # Находим должность по названию
-            position = Position.objects.get(name__iexact=self.user_position)
+            position = ReferenceDataCache.get_position(self.user_position)
 
             # Находим все склады, созданные этой должностью
             warehouses = Warehouse.objects.filter(
@@ -191,7 +198,7 @@ class WorkTimeRecordEditForm(forms.ModelForm):
             return []
 
         try:
-            position = Position.objects.get(name__iexact=position_name)
+            position = ReferenceDataCache.get_position(position_name)
         except Position.DoesNotExist:
             return []
 
@@ -293,4 +300,202 @@ class WorkTimeRecordFilterForm(forms.Form):
             'class': 'form-control',
             'placeholder': 'Поиск по сотруднику или складу...'
         })
-    )
\ No newline at end of file
+    )
+
+
+class WorkTimeGridPeriodForm(forms.Form):
+    """Выбор склада и периода для табеля ввода часов"""
+
+    MAX_DAYS = 31
+
+    warehouse = forms.ModelChoiceField(
+        label='Склад',
+        queryset=Warehouse.objects.none(),
+        widget=forms.Select(attrs={
+            'class': 'form-control auto-submit'
+        })
+    )
+    date_from = forms.DateField(
+        label='С даты',
+        widget=forms.DateInput(attrs={
+            'class': 'form-control auto-submit',
+            'type': 'date'
+        })
+    )
+    days = forms.IntegerField(
+        label='Дней',
+        min_value=1,
+        max_value=MAX_DAYS,
+        widget=forms.NumberInput(attrs={
+            'class': 'form-control auto-submit'
+        })
+    )
+
+    def __init__(self, *args, position=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Только склады, созданные должностью пользователя
+        self.fields['warehouse'].queryset = Warehouse.objects.filter(
+            created_by_position=position,
+            is_active=True
+        ).order_by('name')
+
+    def get_days(self):
+        """Дни выбранного периода"""
+        date_from = self.cleaned_data['date_from']
+        return [date_from + datetime.timedelta(days=offset) for offset in range(self.cleaned_data['days'])]
+
+
+class WorkTimeGridForm(forms.Form):
+    """
+    Табель ввода часов: сотрудники × дни по одному складу
+
+    На каждую ячейку - поле hours_<ID сотрудника>_<ГГГГММДД>. Ячейка соответствует
+    одной записи рабочего времени (одна запись на сотрудника в день). Все ячейки
+    проверяются за один проход, включая лимит часов в день на сотрудника с учетом
+    его записей на других складах. Сохранение - bulk_create/bulk_update и удаление
+    очищенных ячеек в одной транзакции.
+
+    Ячейка недоступна для ввода, если день в будущем, или на этот день уже есть
+    запись другой должности на этом складе, или записей несколько.
+    """
+
+    MAX_HOURS_PER_DAY = Decimal('24')
+    RECORD_TIME = datetime.time(8, 0)
+
+    def __init__(self, *args, warehouse, position, days, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.warehouse = warehouse
+        self.position = position
+        self.days = days
+        self.user = user
+
+        # Сотрудники склада и те, у кого уже есть записи этой должности на складе за период
+        employees = list(Employee.objects.filter(
+            Q(warehouse=warehouse, is_active=True) |
+            Q(
+                worktimerecord__warehouse=warehouse,
+                worktimerecord__created_by_position=position,
+                worktimerecord__date_time__date__gte=days[0],
+                worktimerecord__date_time__date__lte=days[-1]
+            )
+        ).distinct().select_related('position').order_by('last_name', 'first_name'))
+
+        # Все записи этих сотрудников за период (на любых складах) - для лимита часов
+        own_records = defaultdict(list)
+        other_hours = defaultdict(Decimal)
+        locked = set()
+        records = WorkTimeRecord.objects.filter(
+            employee__in=employees,
+            date_time__date__gte=days[0],
+            date_time__date__lte=days[-1]
+        )
+        for record in records:
+            key = (record.employee_id, timezone.localtime(record.date_time).date())
+            if record.warehouse_id == warehouse.id and record.created_by_position_id == position.id:
+                own_records[key].append(record)
+            else:
+                other_hours[key] += record.hours
+                if record.warehouse_id == warehouse.id:
+                    locked.add(key)
+
+        today = timezone.localdate()
+        self.rows = []
+        self._cells = []
+        for employee in employees:
+            cells = []
+            for day in days:
+                key = (employee.id, day)
+                name = f'hours_{employee.id}_{day:%Y%m%d}'
+                records_for_day = own_records.get(key, [])
+                record = records_for_day[0] if len(records_for_day) == 1 else None
+                is_locked = day > today or key in locked or len(records_for_day) > 1
+
+                self.fields[name] = forms.DecimalField(
+                    required=False,
+                    min_value=0,
+                    max_value=self.MAX_HOURS_PER_DAY,
+                    max_digits=5,
+                    decimal_places=2,
+                    disabled=is_locked,
+                    initial=sum((r.hours for r in records_for_day), Decimal('0')) or None,
+                    widget=forms.NumberInput(attrs={
+                        'class': 'grid-input',
+                        'step': '0.25',
+                        'min': '0'
+                    })
+                )
+                cells.append({
+                    'name': name,
+                    'day': day,
+                    'other_hours': other_hours.get(key, Decimal('0')),
+                    'locked': is_locked,
+                })
+                if not is_locked:
+                    self._cells.append((employee, day, name, record, other_hours.get(key, Decimal('0'))))
+            self.rows.append({'employee': employee, 'cells': cells})
+
+    def get_rows(self):
+        """Строки табеля с привязанными полями (для шаблона)"""
+        return [
+            {
+                'employee': row['employee'],
+                'cells': [dict(cell, field=self[cell['name']]) for cell in row['cells']],
+            }
+            for row in self.rows
+        ]
+
+    def clean(self):
+        """Проверка лимита часов в день по всем ячейкам"""
+        cleaned_data = super().clean()
+
+        for employee, day, name, record, other in self._cells:
+            hours = cleaned_data.get(name)
+            if not hours:
+                continue
+            if hours + other > self.MAX_HOURS_PER_DAY:
+                self.add_error(
+                    name,
+                    f'{employee.short_name}, {day:%d.%m.%Y}: всего {hours + other} ч за день '
+                    f'(с учетом других складов), максимум {self.MAX_HOURS_PER_DAY}'
+                )
+
+        return cleaned_data
+
+    def save(self):
+        """
+        Сохранение табеля
+
+        Returns:
+            tuple: (создано, обновлено, удалено)
+        """
+        to_create = []
+        to_update = []
+        to_delete = []
+
+        for employee, day, name, record, other in self._cells:
+            hours = self.cleaned_data.get(name) or Decimal('0')
+
+            if record is None:
+                if hours:
+                    to_create.append(WorkTimeRecord(
+                        date_time=timezone.make_aware(datetime.datetime.combine(day, self.RECORD_TIME)),
+                        warehouse=self.warehouse,
+                        employee=employee,
+                        hours=hours,
+                        created_by=self.user,
+                        created_by_position=self.position
+                    ))
+            elif not hours:
+                to_delete.append(record.id)
+            elif hours != record.hours:
+                record.hours = hours
+                to_update.append(record)
+
+        with transaction.atomic():
+            WorkTimeRecord.objects.bulk_create(to_create)
+            WorkTimeRecord.objects.bulk_update(to_update, ['hours'])
+            if to_delete:
+                WorkTimeRecord.objects.filter(id__in=to_delete).delete()
+
+        return len(to_create), len(to_update), len(to_delete)
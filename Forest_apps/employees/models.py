@@ -27,6 +27,7 @@ class Employee(models.Model):
     middle_name = models.CharField('Отчество', max_length=100, blank=True)
     is_active = models.BooleanField('Активность', default=True)
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True, db_index=True)
     created_by = models.ForeignKey(
         User,
         on_delete=models.SET_NULL,
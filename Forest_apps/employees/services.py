@@ -0,0 +1,104 @@
+# Forest_apps/employees/services.py
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+from Forest_apps.employees.models import Employee
+
+
+class Timesheet:
+    """
+    Табель учета рабочего времени: сотрудники × дни периода
+
+    Часы собираются одним запросом GROUP BY сотрудник, день и разворачиваются
+    в матрицу в памяти. Сотрудники подгружаются вторым запросом (in_bulk),
+    поэтому стоимость отчета не зависит от длины периода и числа сотрудников.
+
+    rows - строки табеля по сотрудникам (по алфавиту):
+        employee, cells (часы по дням периода, None - нет записей),
+        total_hours, days_worked, records_count
+    day_totals - итоги по дням периода
+    """
+
+    def __init__(self, date_from, date_to, rows):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.days = [
+            date_from + datetime.timedelta(days=offset)
+            for offset in range((date_to - date_from).days + 1)
+        ]
+        self.rows = rows
+        self.day_totals = [
+            sum((row['cells'][index] or 0 for row in rows), Decimal('0'))
+            for index in range(len(self.days))
+        ]
+        self.total_hours = sum((row['total_hours'] for row in rows), Decimal('0'))
+        self.records_count = sum(row['records_count'] for row in rows)
+
+    @property
+    def days_count(self):
+        return len(self.days)
+
+    def get_row(self, employee_id):
+        """Строка табеля сотрудника (None, если записей за период нет)"""
+        for row in self.rows:
+            if row['employee'].id == employee_id:
+                return row
+        return None
+
+    @classmethod
+    def build(cls, records, date_from, date_to):
+        """
+        Построение табеля по записям рабочего времени
+
+        Args:
+            records: QuerySet WorkTimeRecord (уже отфильтрованный по складу/сотруднику/должности)
+            date_from: Первый день периода (date)
+            date_to: Последний день периода (date)
+
+        Returns:
+            Timesheet
+        """
+        if date_to < date_from:
+            return cls(date_from, date_from - datetime.timedelta(days=1), [])
+
+        grouped = records.filter(
+            date_time__date__gte=date_from,
+            date_time__date__lte=date_to
+        ).annotate(
+            day=TruncDate('date_time')
+        ).values('employee_id', 'day').annotate(
+            hours=Sum('hours'),
+            records_count=Count('id')
+        ).order_by()
+
+        day_index = {
+            date_from + datetime.timedelta(days=offset): offset
+            for offset in range((date_to - date_from).days + 1)
+        }
+        cells = defaultdict(lambda: [None] * len(day_index))
+        counts = defaultdict(int)
+
+        for row in grouped:
+            index = day_index.get(row['day'])
+            if index is None:
+                continue
+            cells[row['employee_id']][index] = row['hours'] or Decimal('0')
+            counts[row['employee_id']] += row['records_count']
+
+        employees = Employee.objects.select_related('position').in_bulk(list(cells))
+        rows = []
+        for employee in sorted(employees.values(), key=lambda e: (e.last_name, e.first_name, e.middle_name)):
+            employee_cells = cells[employee.id]
+            rows.append({
+                'employee': employee,
+                'cells': employee_cells,
+                'total_hours': sum((hours for hours in employee_cells if hours is not None), Decimal('0')),
+                'days_worked': sum(1 for hours in employee_cells if hours is not None),
+                'records_count': counts[employee.id],
+            })
+
+        return cls(date_from, date_to, rows)
@@ -10,6 +10,7 @@ from Forest_apps.employees.views.employee import (
 from Forest_apps.employees.views.workTimeRecord import (
     worktime_list_view,
     worktime_create_view,
+    worktime_grid_view,
     worktime_edit_view,
     worktime_delete_view,
     worktime_employee_report_view,
@@ -30,6 +31,7 @@ urlpatterns = [
     # Учет рабочего времени
     path('worktime/', worktime_list_view, name='worktime_list'),
     path('worktime/create/', worktime_create_view, name='worktime_create'),
+    path('worktime/grid/', worktime_grid_view, name='worktime_grid'),
     path('worktime/<int:record_id>/edit/', worktime_edit_view, name='worktime_edit'),
     path('worktime/<int:record_id>/delete/', worktime_delete_view, name='worktime_delete'),
     path('worktime/employee/<int:employee_id>/', worktime_employee_report_view, name='worktime_employee_report'),
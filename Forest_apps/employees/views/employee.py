@@ -5,6 +5,7 @@ from django.db.models import Q
 from Forest_apps.employees.models import Employee
 from Forest_apps.core.models import Position
 from Forest_apps.employees.forms.employee import EmployeeCreateForm, EmployeeEditForm
+from Forest_apps.inventory.services import ReferenceDataCache
 
 
 @login_required
@@ -17,7 +18,7 @@ def employee_list_view(request):
 
     # Находим ID должности по названию
     try:
-        position = Position.objects.get(name__iexact=user_position_name)
+        position = ReferenceDataCache.get_position(user_position_name)
         user_position_id = position.id
     except Position.DoesNotExist:
         # Если должность не найдена, показываем пустой список
@@ -81,7 +82,7 @@ def employee_create_view(request):
             # Добавляем должность создателя
             position_name = request.session.get('position_name')
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 employee.created_by_position = position
             except Position.DoesNotExist:
                 # Если должность не найдена, создаем
@@ -118,7 +119,7 @@ def employee_edit_view(request, employee_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('employees:employee_list')
@@ -159,7 +160,7 @@ def employee_deactivate_view(request, employee_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('employees:employee_list')
@@ -189,7 +190,7 @@ def employee_activate_view(request, employee_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('employees:employee_list')
@@ -3,13 +3,19 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.db.models import Sum, Q
 from django.utils import timezone
+from collections import defaultdict
 from datetime import timedelta
 from Forest_apps.employees.models import WorkTimeRecord, Employee
+from Forest_apps.employees.services import Timesheet
 from Forest_apps.core.models import Warehouse, Position
+from Forest_apps.core.services import IdempotentSubmission
+from Forest_apps.inventory.services import ReferenceDataCache
 from Forest_apps.employees.forms.workTimeRecord import (
     WorkTimeRecordCreateForm,
     WorkTimeRecordEditForm,
-    WorkTimeRecordFilterForm
+    WorkTimeRecordFilterForm,
+    WorkTimeGridPeriodForm,
+    WorkTimeGridForm
 )
 
 
@@ -23,7 +29,7 @@ def worktime_list_view(request):
 
     # Находим ID должности по названию
     try:
-        position = Position.objects.get(name__iexact=user_position_name)
+        position = ReferenceDataCache.get_position(user_position_name)
         user_position_id = position.id
     except Position.DoesNotExist:
         user_position_id = -1
@@ -94,6 +100,11 @@ def worktime_create_view(request):
     user_position = request.session.get('position_name')
 
     if request.method == 'POST':
+        # Повторная отправка (нажали еще раз после таймаута) - результат первой
+        replayed = IdempotentSubmission.replay(request)
+        if replayed:
+            return replayed
+
         form = WorkTimeRecordCreateForm(
             request.POST,
             user=request.user,
@@ -109,7 +120,7 @@ def worktime_create_view(request):
             # Добавляем должность создателя
             position_name = request.session.get('position_name')
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 record.created_by_position = position
             except Position.DoesNotExist:
                 # Если должность не найдена, создаем
@@ -119,14 +130,13 @@ def worktime_create_view(request):
                 )
                 record.created_by_position = position
 
-            record.save()
-
-            messages.success(
-                request,
-                f'Запись для {record.employee.short_name} на {record.date_time.date()} успешно создана!'
-            )
+            def submit():
+                record.save()
+                return record, 'employees:worktime_list', (
+                    f'Запись для {record.employee.short_name} на {record.date_time.date()} успешно создана!'
+                )
 
-            return redirect('employees:worktime_list')
+            return IdempotentSubmission.run(request, 'employees:worktime_create', submit)
     else:
         form = WorkTimeRecordCreateForm(
             user=request.user,
@@ -137,11 +147,78 @@ def worktime_create_view(request):
         'title': 'Добавление записи',
         'form': form,
         'employee_name': request.session.get('employee_name'),
+        'idempotency_key': IdempotentSubmission.form_key(request),
     }
 
     return render(request, 'WorkTimeRecord/worktime_create.html', context)
 
 
+@login_required
+def worktime_grid_view(request):
+    """Табель ввода часов: сотрудники × дни по складу (только склады своей должности)"""
+
+    # Получаем должность текущего пользователя
+    position_name = request.session.get('position_name')
+    try:
+        position = ReferenceDataCache.get_position(position_name)
+    except Position.DoesNotExist:
+        messages.error(request, 'Ошибка определения должности')
+        return redirect('employees:worktime_list')
+
+    # Период по умолчанию: текущая неделя
+    today = timezone.localdate()
+    period_data = {
+        'date_from': (today - timedelta(days=today.weekday())).strftime('%Y-%m-%d'),
+        'days': 7,
+    }
+    period_data.update(request.GET.dict())
+    period_form = WorkTimeGridPeriodForm(period_data, position=position)
+
+    if 'warehouse' not in request.GET:
+        first_warehouse = period_form.fields['warehouse'].queryset.first()
+        if first_warehouse is None:
+            messages.error(request, 'У вашей должности нет складов')
+            return redirect('employees:worktime_list')
+        period_form = WorkTimeGridPeriodForm(
+            dict(period_data, warehouse=first_warehouse.id), position=position
+        )
+
+    grid_form = None
+    if period_form.is_valid():
+        grid_kwargs = {
+            'warehouse': period_form.cleaned_data['warehouse'],
+            'position': position,
+            'days': period_form.get_days(),
+            'user': request.user,
+        }
+
+        if request.method == 'POST':
+            grid_form = WorkTimeGridForm(request.POST, **grid_kwargs)
+            if grid_form.is_valid():
+                created, updated, deleted = grid_form.save()
+                messages.success(
+                    request,
+                    f'Табель сохранен: добавлено {created}, изменено {updated}, удалено {deleted}'
+                )
+                return redirect(request.get_full_path())
+            messages.error(request, 'Табель не сохранен: исправьте ошибки в отмеченных ячейках')
+        else:
+            grid_form = WorkTimeGridForm(**grid_kwargs)
+
+    context = {
+        'title': 'Табель: ввод часов',
+        'employee_name': request.session.get('employee_name'),
+        'position_name': position_name,
+        'period_form': period_form,
+        'grid_form': grid_form,
+        'rows': grid_form.get_rows() if grid_form else [],
+        'days': grid_form.days if grid_form else [],
+        'max_hours': WorkTimeGridForm.MAX_HOURS_PER_DAY,
+    }
+
+    return render(request, 'WorkTimeRecord/worktime_grid.html', context)
+
+
 @login_required
 def worktime_edit_view(request, record_id):
     """Редактирование записи рабочего времени (только для своей должности)"""
@@ -149,7 +226,7 @@ def worktime_edit_view(request, record_id):
     # Получаем должность текущего пользователя
     user_position = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=user_position)
+        position = ReferenceDataCache.get_position(user_position)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('employees:worktime_list')
@@ -199,7 +276,7 @@ def worktime_delete_view(request, record_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('employees:worktime_list')
@@ -231,7 +308,7 @@ def worktime_employee_report_view(request, employee_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('employees:worktime_list')
@@ -256,32 +333,36 @@ def worktime_employee_report_view(request, employee_id):
     except:
         date_to = timezone.now().date()
 
-    # Получаем записи за период (только созданные текущей должностью)
-    records = WorkTimeRecord.objects.filter(
+    # Записи за период (только созданные текущей должностью)
+    records_qs = WorkTimeRecord.objects.filter(
         employee=employee,
-        created_by_position=position,
+        created_by_position=position
+    )
+    records = list(records_qs.filter(
         date_time__date__gte=date_from,
         date_time__date__lte=date_to
-    ).select_related('warehouse', 'created_by', 'created_by_position').order_by('date_time')
+    ).select_related('warehouse', 'created_by', 'created_by_position').order_by('date_time'))
 
-    # Группировка по дням
-    daily_stats = []
-    current_date = date_from
-    while current_date <= date_to:
-        day_records = records.filter(date_time__date=current_date)
-        day_hours = day_records.aggregate(total=Sum('hours'))['total'] or 0
+    # Часы по дням - строка табеля сотрудника (один сгруппированный запрос)
+    timesheet = Timesheet.build(records_qs, date_from, date_to)
+    row = timesheet.get_row(employee.id)
 
-        daily_stats.append({
-            'date': current_date,
-            'hours': day_hours,
-            'records': day_records
-        })
+    records_by_day = defaultdict(list)
+    for record in records:
+        records_by_day[timezone.localtime(record.date_time).date()].append(record)
 
-        current_date += timedelta(days=1)
+    daily_stats = [
+        {
+            'date': day,
+            'hours': (row['cells'][index] if row else None) or 0,
+            'records': records_by_day.get(day, [])
+        }
+        for index, day in enumerate(timesheet.days)
+    ]
 
     # Итоги
-    total_hours = records.aggregate(total=Sum('hours'))['total'] or 0
-    avg_hours = total_hours / ((date_to - date_from).days + 1) if (date_to - date_from).days >= 0 else 0
+    total_hours = timesheet.total_hours
+    avg_hours = total_hours / timesheet.days_count if timesheet.days_count else 0
 
     context = {
         'title': f'Отчет: {employee.short_name}',
@@ -294,7 +375,7 @@ def worktime_employee_report_view(request, employee_id):
         'date_to': date_to,
         'total_hours': total_hours,
         'avg_hours': avg_hours,
-        'days_count': (date_to - date_from).days + 1,
+        'days_count': timesheet.days_count,
     }
 
     return render(request, 'WorkTimeRecord/worktime_employee_report.html', context)
@@ -307,7 +388,7 @@ def worktime_warehouse_report_view(request, warehouse_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('employees:worktime_list')
@@ -333,50 +414,40 @@ def worktime_warehouse_report_view(request, warehouse_id):
     except:
         date_to = today
 
-    # Получаем записи за период (только созданные текущей должностью)
-    records = WorkTimeRecord.objects.filter(
-        warehouse=warehouse,
-        created_by_position=position,
-        date_time__date__gte=date_from,
-        date_time__date__lte=date_to
-    ).select_related('employee', 'employee__position', 'created_by', 'created_by_position').order_by('date_time',
-                                                                                                     'employee__last_name')
-
-    # Группировка по сотрудникам
-    employee_stats = []
-    employees = records.values('employee').distinct()
-
-    for emp_data in employees:
-        emp_id = emp_data['employee']
-        if emp_id:
-            emp_records = records.filter(employee_id=emp_id)
-            emp = emp_records.first().employee if emp_records.exists() else None
-
-            if emp:
-                emp_hours = emp_records.aggregate(total=Sum('hours'))['total'] or 0
-                employee_stats.append({
-                    'employee': emp,
-                    'hours': emp_hours,
-                    'records_count': emp_records.count(),
-                    'records': emp_records
-                })
+    # Табель сотрудники × дни по записям склада (только созданным текущей должностью)
+    timesheet = Timesheet.build(
+        WorkTimeRecord.objects.filter(warehouse=warehouse, created_by_position=position),
+        date_from,
+        date_to
+    )
+
+    # Итоги по сотрудникам
+    employee_stats = [
+        {
+            'employee': row['employee'],
+            'hours': row['total_hours'],
+            'records_count': row['records_count'],
+            'days_worked': row['days_worked'],
+        }
+        for row in timesheet.rows
+    ]
 
     # Итоги
-    total_hours = records.aggregate(total=Sum('hours'))['total'] or 0
-    avg_daily_hours = total_hours / ((date_to - date_from).days + 1) if (date_to - date_from).days >= 0 else 0
+    total_hours = timesheet.total_hours
+    avg_daily_hours = total_hours / timesheet.days_count if timesheet.days_count else 0
 
     context = {
         'title': f'Отчет по складу: {warehouse.name}',
         'employee_name': request.session.get('employee_name'),
         'position_name': position_name,
         'warehouse': warehouse,
-        'records': records,
+        'timesheet': timesheet,
         'employee_stats': employee_stats,
         'date_from': date_from,
         'date_to': date_to,
         'total_hours': total_hours,
         'avg_daily_hours': avg_daily_hours,
-        'days_count': (date_to - date_from).days + 1,
+        'days_count': timesheet.days_count,
     }
 
     return render(request, 'WorkTimeRecord/worktime_warehouse_report.html', context)
\ No newline at end of file
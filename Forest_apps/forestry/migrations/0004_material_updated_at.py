@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forestry', '0003_cuttingarea_created_by_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения'),
+        ),
+    ]
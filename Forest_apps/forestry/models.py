@@ -23,6 +23,7 @@ class Material(models.Model):
     )
     name = models.CharField('Номенклатура', max_length=200)
     is_active = models.BooleanField('Активен', default=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True, db_index=True)
     created_by = models.ForeignKey(
         User,
         on_delete=models.SET_NULL,
@@ -5,6 +5,7 @@ from Forest_apps.forestry.models import Forestry
 from Forest_apps.core.models import Position
 from Forest_apps.forestry.forms.create_forestry import ForestryCreateForm  # 👈 ИСПРАВЛЕНО
 from Forest_apps.forestry.forms.edit_forestry import ForestryEditForm  # 👈 ИСПРАВЛЕНО
+from Forest_apps.inventory.services import ReferenceDataCache
 
 
 @login_required
@@ -17,7 +18,7 @@ def forestry_view(request):
 
     # Находим ID должности по названию
     try:
-        position = Position.objects.get(name__iexact=user_position_name)
+        position = ReferenceDataCache.get_position(user_position_name)
         user_position_id = position.id
     except Position.DoesNotExist:
         user_position_id = -1
@@ -67,7 +68,7 @@ def create_forestry_view(request):
             # Добавляем должность создателя
             position_name = request.session.get('position_name')
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 forestry.created_by_position = position
             except Position.DoesNotExist:
                 # Если должность не найдена, создаем
@@ -104,7 +105,7 @@ def edit_forestry_view(request, forestry_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('forestry:forestry')
@@ -145,7 +146,7 @@ def activate_forestry_view(request, forestry_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('forestry:forestry')
@@ -179,7 +180,7 @@ def deactivate_forestry_view(request, forestry_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('forestry:forestry')
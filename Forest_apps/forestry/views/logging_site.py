@@ -6,6 +6,7 @@ from django.db.models import Q
 from Forest_apps.forestry.forms.logging_site_forms import CuttingAreaCreateForm, CuttingAreaEditForm
 from Forest_apps.forestry.models import CuttingArea, Forestry, Material
 from Forest_apps.core.models import Position
+from Forest_apps.inventory.services import ReferenceDataCache
 
 
 @login_required
@@ -18,7 +19,7 @@ def logging_site_view(request):
 
     # Находим ID должности по названию
     try:
-        position = Position.objects.get(name__iexact=user_position_name)
+        position = ReferenceDataCache.get_position(user_position_name)
         user_position_id = position.id
     except Position.DoesNotExist:
         user_position_id = -1
@@ -82,7 +83,7 @@ def create_cutting_area_view(request):
             # Добавляем должность создателя
             position_name = request.session.get('position_name')
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 cutting_area.created_by_position = position
             except Position.DoesNotExist:
                 # Если должность не найдена, создаем
@@ -119,7 +120,7 @@ def edit_cutting_area_view(request, area_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('forestry:logging_site')
@@ -160,7 +161,7 @@ def deactivate_cutting_area_view(request, area_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('forestry:logging_site')
@@ -303,7 +304,7 @@ def remove_material_view(request, area_id, material_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('forestry:logging_site')
@@ -331,7 +332,7 @@ def activate_cutting_area_view(request, area_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('forestry:logging_site')
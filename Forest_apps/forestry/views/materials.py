@@ -6,6 +6,7 @@ from django.db.models import Q
 from Forest_apps.forestry.forms.material_forms import MaterialCreateForm, MaterialEditForm
 from Forest_apps.forestry.models import Material
 from Forest_apps.core.models import Position
+from Forest_apps.inventory.services import ReferenceDataCache
 # from Forest_apps.forestry.forms.material import MaterialCreateForm, MaterialEditForm
 
 
@@ -19,7 +20,7 @@ def materials_view(request):
 
     # Находим ID должности по названию
     try:
-        position = Position.objects.get(name__iexact=user_position_name)
+        position = ReferenceDataCache.get_position(user_position_name)
         user_position_id = position.id
     except Position.DoesNotExist:
         user_position_id = -1
@@ -77,7 +78,7 @@ def material_create_view(request):
             # Добавляем должность создателя
             position_name = request.session.get('position_name')
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 material.created_by_position = position
             except Position.DoesNotExist:
                 position, _ = Position.objects.get_or_create(
@@ -113,7 +114,7 @@ def material_edit_view(request, material_id):
 
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('forestry:materials')
@@ -153,7 +154,7 @@ def material_delete_view(request, material_id):
 
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('forestry:materials')
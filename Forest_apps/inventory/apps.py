@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class InventoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Forest_apps.inventory'
-    verbose_name = 'Складской учет'
\ No newline at end of file
+    verbose_name = 'Складской учет'
+
+    def ready(self):
+        from Forest_apps.inventory import signals  # noqa: F401
@@ -0,0 +1,333 @@
+# Forest_apps/inventory/exports.py
+"""
+Потоковая выгрузка движений, остатков и поступлений в CSV и XLSX
+
+Строки читаются из БД через .iterator(chunk_size=...) и сразу отдаются
+клиенту через StreamingHttpResponse, поэтому расход памяти не зависит
+от количества строк. XLSX собирается на лету: лист пишется в zip-поток
+(zipfile поддерживает запись в поток без seek), готовые байты отдаются
+после каждой порции строк.
+"""
+import csv
+import datetime
+import re
+import zipfile
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from Forest_apps.inventory.models import StorageLocation
+
+# Размер порции строк, читаемых из БД за один раз
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+
+# ========== КОЛОНКИ ВЫГРУЗОК ==========
+
+def _location_name(location):
+    return location.get_source_name() if location else ''
+
+
+def _vehicle_name(vehicle):
+    return f'{vehicle.brand} {vehicle.model} ({vehicle.license_plate})' if vehicle else ''
+
+
+MOVEMENT_COLUMNS = [
+    ('№', lambda m: m.id),
+    ('Дата/время', lambda m: m.date_time),
+    ('Тип учета', lambda m: m.accounting_type),
+    ('Документ', lambda m: m.document_id),
+    ('Откуда', lambda m: _location_name(m.from_location)),
+    ('Куда', lambda m: _location_name(m.to_location)),
+    ('Тип материала', lambda m: m.material.material_type),
+    ('Материал', lambda m: m.material.name),
+    ('Штуки', lambda m: m.quantity_pieces),
+    ('П.м.', lambda m: m.quantity_meters),
+    ('м³', lambda m: m.quantity_cubic),
+    ('Цена', lambda m: m.price),
+    ('Сумма', lambda m: m.total_amount),
+    ('Выполнено', lambda m: 'Да' if m.is_completed else 'Нет'),
+    ('Водитель', lambda m: str(m.employee) if m.employee else ''),
+    ('Транспорт', lambda m: _vehicle_name(m.vehicle)),
+    ('№ вагона', lambda m: m.wagon_number),
+    ('Должность автора', lambda m: m.created_by_position.name if m.created_by_position else ''),
+]
+
+BALANCE_COLUMNS = [
+    ('Тип места хранения', lambda b: b.storage_location.get_source_type_display()),
+    ('Место хранения', lambda b: _location_name(b.storage_location)),
+    ('Тип материала', lambda b: b.material.material_type),
+    ('Материал', lambda b: b.material.name),
+    ('Штуки', lambda b: b.quantity_pieces),
+    ('П.м.', lambda b: b.quantity_meters),
+    ('м³', lambda b: b.quantity_cubic),
+    ('Обновлено', lambda b: b.last_updated),
+]
+
+RECEIPT_COLUMNS = [
+    ('№', lambda r: r.id),
+    ('Дата поступления', lambda r: r.receipt_date),
+    ('Место хранения', lambda r: _location_name(r.storage_location)),
+    ('Источник поступления', lambda r: _location_name(r.source_location)),
+    ('Тип материала', lambda r: r.material.material_type),
+    ('Материал', lambda r: r.material.name),
+    ('Штуки', lambda r: r.quantity_pieces),
+    ('П.м.', lambda r: r.quantity_meters),
+    ('м³', lambda r: r.quantity_cubic),
+    ('Цена', lambda r: r.price),
+    ('Сумма', lambda r: r.total_amount),
+    ('Должность автора', lambda r: r.created_by_position.name if r.created_by_position else ''),
+]
+
+
+# ========== ЧТЕНИЕ ПОРЦИЯМИ ==========
+
+def iter_chunks(queryset, location_fields=(), prepare=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Читает queryset порциями, не загружая всю выборку в память
+
+    Args:
+        queryset: QuerySet выгрузки
+        location_fields: поля StorageLocation, названия которых подгружаются пачкой на порцию
+        prepare: функция обработки порции (например, остатки на дату), возвращает список
+        chunk_size: размер порции
+
+    Yields:
+        list объектов порции
+    """
+    chunk = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            yield _prepare_chunk(chunk, location_fields, prepare)
+            chunk = []
+    if chunk:
+        yield _prepare_chunk(chunk, location_fields, prepare)
+
+
+def _prepare_chunk(chunk, location_fields, prepare):
+    if location_fields:
+        StorageLocation.attach_source_names(chunk, *location_fields)
+    return prepare(chunk) if prepare else chunk
+
+
+# ========== CSV ==========
+
+class _Echo:
+    """Псевдо-файл для csv.writer: возвращает записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.strftime('%d.%m.%Y %H:%M')
+    if isinstance(value, datetime.date):
+        return value.strftime('%d.%m.%Y')
+    return value
+
+
+def stream_csv(header, rows):
+    """CSV (разделитель ';', UTF-8 с BOM - корректно открывается в Excel)"""
+    writer = csv.writer(_Echo(), delimiter=';')
+    yield '\ufeff' + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([_csv_value(value) for value in row])
+
+
+# ========== XLSX ==========
+
+class _ZipStream:
+    """Накопитель байтов zip-архива: zipfile пишет сюда, генератор забирает"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer.extend(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class XlsxStreamWriter:
+    """
+    Потоковая запись книги XLSX с одним листом
+
+    Поддерживаются строки, числа, Decimal, дата/время (как даты Excel) и None.
+    Первая строка - заголовок (жирный шрифт).
+    """
+
+    EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+
+    # Символы, недопустимые в XML 1.0
+    ILLEGAL_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+    CONTENT_TYPES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    )
+
+    ROOT_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    )
+
+    WORKBOOK_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    )
+
+    # Стили: 0 - обычный, 1 - дата/время, 2 - жирный (заголовок)
+    STYLES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd.mm.yyyy hh:mm"/></numFmts>'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+        '</cellXfs>'
+        '</styleSheet>'
+    )
+
+    def __init__(self, sheet_name='Лист1'):
+        self.sheet_name = sheet_name
+
+    def _workbook(self):
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(self.sheet_name[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>'
+        )
+
+    @classmethod
+    def _cell(cls, value, style=0):
+        if value is None or value == '':
+            return '<c/>'
+        if isinstance(value, bool):
+            value = 'Да' if value else 'Нет'
+        if isinstance(value, datetime.datetime):
+            if timezone.is_aware(value):
+                value = timezone.make_naive(value)
+            serial = (value - cls.EXCEL_EPOCH) / datetime.timedelta(days=1)
+            return f'<c s="1"><v>{serial:.10f}</v></c>'
+        if isinstance(value, datetime.date):
+            serial = (value - cls.EXCEL_EPOCH.date()).days
+            return f'<c s="1"><v>{serial}</v></c>'
+        if isinstance(value, (int, float, Decimal)):
+            return f'<c><v>{value}</v></c>'
+
+        text = escape(cls.ILLEGAL_CHARS.sub('', str(value)))
+        style_attr = f' s="{style}"' if style else ''
+        return f'<c t="inlineStr"{style_attr}><is><t xml:space="preserve">{text}</t></is></c>'
+
+    @classmethod
+    def _row(cls, values, style=0):
+        return '<row>' + ''.join(cls._cell(value, style) for value in values) + '</row>'
+
+    def stream(self, header, rows, flush_every=500):
+        """
+        Генератор байтов XLSX
+
+        Args:
+            header: названия колонок
+            rows: итерируемый источник строк (списков значений)
+            flush_every: через сколько строк отдавать накопленные байты
+        """
+        output = _ZipStream()
+        with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('[Content_Types].xml', self.CONTENT_TYPES)
+            archive.writestr('_rels/.rels', self.ROOT_RELS)
+            archive.writestr('xl/workbook.xml', self._workbook())
+            archive.writestr('xl/_rels/workbook.xml.rels', self.WORKBOOK_RELS)
+            archive.writestr('xl/styles.xml', self.STYLES)
+
+            with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+                sheet.write((
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                    '<sheetData>' + self._row(header, style=2)
+                ).encode('utf-8'))
+
+                for index, row in enumerate(rows, start=1):
+                    sheet.write(self._row(row).encode('utf-8'))
+                    if index % flush_every == 0:
+                        yield output.pop()
+
+                sheet.write(b'</sheetData></worksheet>')
+
+        yield output.pop()
+
+
+# ========== ОТВЕТ ==========
+
+def export_response(chunks, columns, filename, export_format='csv'):
+    """
+    StreamingHttpResponse с выгрузкой в CSV или XLSX
+
+    Args:
+        chunks: итерируемый источник порций объектов (см. iter_chunks)
+        columns: список (заголовок, функция значения)
+        filename: имя файла без расширения
+        export_format: 'csv' или 'xlsx'
+    """
+    header = [title for title, _ in columns]
+    getters = [getter for _, getter in columns]
+    rows = ([getter(obj) for getter in getters] for chunk in chunks for obj in chunk)
+
+    if export_format == 'xlsx':
+        response = StreamingHttpResponse(
+            XlsxStreamWriter().stream(header, rows),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+    else:
+        export_format = 'csv'
+        response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv; charset=utf-8')
+
+    stamp = timezone.localtime().strftime('%Y%m%d_%H%M')
+    response['Content-Disposition'] = f'attachment; filename="{filename}_{stamp}.{export_format}"'
+    return response
@@ -1,10 +1,11 @@
 # ФОРМЫ КОНВЕРТАЦИЯ
 import datetime
 from django import forms
+from django.forms import formset_factory
 from django.utils import timezone
-from Forest_apps.inventory.models import Conversion #, StorageLocation
+from Forest_apps.inventory.models import Conversion, ConversionOutput #, StorageLocation
 from Forest_apps.forestry.models import Material
-from Forest_apps.inventory.services import StorageLocationService
+from Forest_apps.inventory.services import ReferenceDataCache, StorageLocationService
 
 
 class ConversionCreateForm(forms.ModelForm):
@@ -24,7 +25,6 @@ class ConversionCreateForm(forms.ModelForm):
         fields = [
             'storage_location', 'conversion_date',
             'source_material', 'source_quantity_pieces', 'source_quantity_meters', 'source_quantity_cubic',
-            'target_material', 'target_quantity_pieces', 'target_quantity_meters', 'target_quantity_cubic'
         ]
         widgets = {
             'storage_location': forms.Select(attrs={
@@ -52,27 +52,6 @@ class ConversionCreateForm(forms.ModelForm):
                 'step': '0.001',
                 'min': '0'
             }),
-            'target_material': forms.Select(attrs={
-                'class': 'form-control'
-            }),
-            'target_quantity_pieces': forms.NumberInput(attrs={
-                'class': 'form-control',
-                'placeholder': 'Количество в штуках',
-                'step': '0.001',
-                'min': '0'
-            }),
-            'target_quantity_meters': forms.NumberInput(attrs={
-                'class': 'form-control',
-                'placeholder': 'Количество в погонных метрах',
-                'step': '0.001',
-                'min': '0'
-            }),
-            'target_quantity_cubic': forms.NumberInput(attrs={
-                'class': 'form-control',
-                'placeholder': 'Количество в кубических метрах',
-                'step': '0.001',
-                'min': '0'
-            }),
         }
         labels = {
             'storage_location': 'Склад',
@@ -81,10 +60,6 @@ class ConversionCreateForm(forms.ModelForm):
             'source_quantity_pieces': 'Штуки',
             'source_quantity_meters': 'Погонные метры',
             'source_quantity_cubic': 'Кубические метры',
-            'target_material': 'Целевой материал (что создаем)',
-            'target_quantity_pieces': 'Штуки',
-            'target_quantity_meters': 'Погонные метры',
-            'target_quantity_cubic': 'Кубические метры',
         }
 
     def __init__(self, *args, **kwargs):
@@ -115,10 +90,6 @@ class ConversionCreateForm(forms.ModelForm):
             material_type='древесина'
         ).order_by('name')
 
-        self.fields['target_material'].queryset = Material.objects.filter(
-            material_type='древесина'
-        ).order_by('name')
-
     def clean(self):
         """Валидация формы"""
         cleaned_data = super().clean()
@@ -127,25 +98,11 @@ class ConversionCreateForm(forms.ModelForm):
         source_meters = cleaned_data.get('source_quantity_meters')
         source_cubic = cleaned_data.get('source_quantity_cubic')
 
-        target_pieces = cleaned_data.get('target_quantity_pieces')
-        target_meters = cleaned_data.get('target_quantity_meters')
-        target_cubic = cleaned_data.get('target_quantity_cubic')
-
-        source_material = cleaned_data.get('source_material')
-        target_material = cleaned_data.get('target_material')
 
         # Проверка, что указано хотя бы одно количество для исходного материала
         if not source_pieces and not source_meters and not source_cubic:
             raise forms.ValidationError('Необходимо указать хотя бы одно количество для списания')
 
-        # Проверка, что указано хотя бы одно количество для целевого материала
-        if not target_pieces and not target_meters and not target_cubic:
-            raise forms.ValidationError('Необходимо указать хотя бы одно количество для создания')
-
-        # Проверка, что исходный и целевой материалы разные
-        if source_material and target_material and source_material == target_material:
-            raise forms.ValidationError('Исходный и целевой материалы должны быть разными')
-
         return cleaned_data
 
     def save(self, commit=True, position=None, user=None):
@@ -174,4 +131,125 @@ class ConversionCreateForm(forms.ModelForm):
         if commit:
             conversion.save()
 
-        return conversion
\ No newline at end of file
+        return conversion
+
+
+class ConversionOutputForm(forms.Form):
+    """Выход конвертации: создаваемый материал и количество"""
+
+    material = forms.ModelChoiceField(
+        queryset=Material.objects.filter(material_type='древесина').order_by('name'),
+        label='Материал',
+        widget=forms.Select(attrs={'class': 'form-control output-material'})
+    )
+
+    quantity_pieces = forms.DecimalField(
+        label='Штуки',
+        required=False,
+        min_value=0,
+        max_digits=12,
+        decimal_places=3,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.001', 'min': '0'})
+    )
+
+    quantity_meters = forms.DecimalField(
+        label='Погонные метры',
+        required=False,
+        min_value=0,
+        max_digits=12,
+        decimal_places=3,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.001', 'min': '0'})
+    )
+
+    quantity_cubic = forms.DecimalField(
+        label='Кубические метры',
+        required=False,
+        min_value=0,
+        max_digits=12,
+        decimal_places=3,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.001', 'min': '0'})
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Список древесины из кэша: без запроса на каждую строку выходов
+        ReferenceDataCache.apply_choices(
+            self.fields['material'],
+            [(m['id'], m['name']) for m in ReferenceDataCache.materials() if m['type'] == 'древесина']
+        )
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        if cleaned_data.get('material') and not (
+            cleaned_data.get('quantity_pieces')
+            or cleaned_data.get('quantity_meters')
+            or cleaned_data.get('quantity_cubic')
+        ):
+            raise forms.ValidationError('Необходимо указать хотя бы одно количество для создания')
+
+        return cleaned_data
+
+
+class BaseConversionOutputFormSet(forms.BaseFormSet):
+    """Выходы конвертации: хотя бы один, без повторов и без исходного материала"""
+
+    def __init__(self, *args, **kwargs):
+        self.source_material_id = kwargs.pop('source_material_id', None)
+        super().__init__(*args, **kwargs)
+
+    def clean(self):
+        if any(self.errors):
+            return
+
+        outputs = self.get_outputs()
+        if not outputs:
+            raise forms.ValidationError('Добавьте хотя бы один материал, который создается')
+
+        materials = set()
+        for output in outputs:
+            material = output['material']
+
+            if self.source_material_id and str(material.pk) == str(self.source_material_id):
+                raise forms.ValidationError(
+                    f'Исходный и создаваемый материалы должны быть разными ("{material.name}")'
+                )
+
+            if material.pk in materials:
+                raise forms.ValidationError(f'Материал "{material.name}" указан несколько раз')
+            materials.add(material.pk)
+
+    def get_outputs(self):
+        """Заполненные строки (пустые строки формы пропускаются)"""
+        return [
+            form.cleaned_data for form in self.forms
+            if form.cleaned_data and form.cleaned_data.get('material')
+        ]
+
+    def build_outputs(self):
+        """Несохраненные ConversionOutput для Conversion.save_outputs"""
+        return [
+            ConversionOutput(
+                material=output['material'],
+                quantity_pieces=output.get('quantity_pieces') or 0,
+                quantity_meters=output.get('quantity_meters') or 0,
+                quantity_cubic=output.get('quantity_cubic') or 0,
+            )
+            for output in self.get_outputs()
+        ]
+
+    @staticmethod
+    def initial_for(conversion):
+        """Начальные данные формсета по сохраненным выходам (редактирование)"""
+        return [
+            {
+                'material': output.material_id,
+                'quantity_pieces': output.quantity_pieces,
+                'quantity_meters': output.quantity_meters,
+                'quantity_cubic': output.quantity_cubic,
+            }
+            for output in conversion.outputs.all()
+        ]
+
+
+ConversionOutputFormSet = formset_factory(ConversionOutputForm, formset=BaseConversionOutputFormSet, extra=4)
@@ -1,12 +1,13 @@
 # ФОРМЫ ОСТАТКИ МАТЕРИАЛОВ
 from django import forms
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
 from Forest_apps.inventory.models import MaterialBalance, StorageLocation, Receipt
 from Forest_apps.forestry.models import Material
 from Forest_apps.core.models import Warehouse, Brigade, Vehicle
-from Forest_apps.inventory.services import StorageLocationService
+from Forest_apps.inventory.services import StorageLocationService, BalanceEngine, ReferenceDataCache
 
 
 class MaterialBalanceFilterForm(forms.Form):
@@ -50,6 +51,19 @@ class MaterialBalanceFilterForm(forms.Form):
             ).order_by('name')
 
 
+class BookerBalanceFilterForm(MaterialBalanceFilterForm):
+    """Фильтр остатков для бухгалтера: дополнительно остатки на дату"""
+
+    as_of = forms.DateField(
+        required=False,
+        label='Остатки на конец дня',
+        widget=forms.DateInput(attrs={
+            'class': 'form-control auto-submit',
+            'type': 'date'
+        })
+    )
+
+
 class MaterialBalanceCreateForm(forms.ModelForm):
     """Форма создания/редактирования остатка материала (создает также поступление)"""
 
@@ -134,11 +148,19 @@ class MaterialBalanceCreateForm(forms.ModelForm):
 
         self.fields['storage_location'].queryset = user_warehouses
         self.fields['material'].queryset = Material.objects.all().order_by('material_type', 'name')
+        ReferenceDataCache.apply_choices(
+            self.fields['material'], ReferenceDataCache.material_choices(ReferenceDataCache.materials())
+        )
 
         # Источник поступления - только контрагенты
         self.fields['source_location'].queryset = StorageLocation.objects.filter(
             source_type='контрагент'
         ).order_by('source_type')
+        ReferenceDataCache.apply_choices(self.fields['source_location'], [
+            (location['id'], location['label'])
+            for location in ReferenceDataCache.storage_locations()
+            if location['source_type'] == 'контрагент'
+        ])
 
         # Если редактируем поступление, подставляем данные
         if self.receipt_instance:
@@ -153,36 +175,12 @@ class MaterialBalanceCreateForm(forms.ModelForm):
 
     def _get_user_warehouse_ids(self):
         """Получает ID складов (StorageLocation), доступных для должности пользователя"""
-        from Forest_apps.core.models import Position, Warehouse
-        from Forest_apps.inventory.models import StorageLocation
+        from Forest_apps.inventory.services import OwnedLocationResolver
 
         if not self.user or not self.user.is_authenticated:
             return []
 
-        position_name = self.position_name
-
-        if not position_name:
-            return []
-
-        # Ищем должность (регистронезависимо)
-        position = Position.objects.filter(name__iexact=position_name).first()
-
-        if not position:
-            return []
-
-        # Получаем все склады с этой должностью
-        warehouses = Warehouse.objects.filter(created_by_position=position)
-
-        # Находим соответствующие StorageLocation
-        user_warehouse_ids = []
-        for wh in warehouses:
-            loc = StorageLocation.objects.filter(source_type='склад', source_id=wh.id).first()
-            if loc:
-                user_warehouse_ids.append(loc.id)
-            else:
-                print(f"  - NOT found: {wh.name}")
-
-        return user_warehouse_ids
+        return OwnedLocationResolver.get_location_ids(self.position_name, 'склад')
 
     def clean_receipt_date(self):
         """Валидация даты поступления (только сегодня или прошедшие 7 дней, не будущая)"""
@@ -226,138 +224,52 @@ class MaterialBalanceCreateForm(forms.ModelForm):
             if not self.receipt_instance.can_edit:
                 raise ValueError('Поступление старше 5 дней, редактирование невозможно')
 
-            old_storage_location = self.receipt_instance.storage_location
-            old_material = self.receipt_instance.material
-            old_pieces = self.receipt_instance.quantity_pieces or 0
-            old_meters = self.receipt_instance.quantity_meters or 0
-            old_cubic = self.receipt_instance.quantity_cubic or 0
-
-            # Если меняется склад или материал - нужно корректно перенести остатки
-            if old_storage_location != storage_location or old_material != material:
-                # Сначала удаляем со старого склада
-                try:
-                    old_balance = MaterialBalance.objects.get(
-                        storage_location=old_storage_location,
-                        material=old_material
-                    )
-                except MaterialBalance.DoesNotExist:
-                    raise ValueError(
-                        f'Остаток материала {old_material.name} не найден на складе {old_storage_location.get_source_name()}')
-
-                # Проверяем достаточно ли материала для удаления
-                if old_pieces > 0 and old_balance.quantity_pieces < old_pieces:
-                    raise ValueError(
-                        f'Недостаточно материала на складе {old_storage_location.get_source_name()}. В наличии: {old_balance.quantity_pieces} шт, требуется удалить: {old_pieces} шт')
-                if old_meters > 0 and (old_balance.quantity_meters or 0) < old_meters:
-                    raise ValueError(
-                        f'Недостаточно материала на складе {old_storage_location.get_source_name()}. В наличии: {old_balance.quantity_meters or 0} м.п., требуется удалить: {old_meters} м.п.')
-                if old_cubic > 0 and (old_balance.quantity_cubic or 0) < old_cubic:
-                    raise ValueError(
-                        f'Недостаточно материала на складе {old_storage_location.get_source_name()}. В наличии: {old_balance.quantity_cubic or 0} м³, требуется удалить: {old_cubic} м³')
-
-                # Удаляем со старого склада
-                old_balance.quantity_pieces -= old_pieces
-                old_balance.quantity_meters = (old_balance.quantity_meters or 0) - old_meters
-                old_balance.quantity_cubic = (old_balance.quantity_cubic or 0) - old_cubic
-                old_balance.save()
-
-                # Добавляем на новый склад
-                try:
-                    new_balance = MaterialBalance.objects.get(
-                        storage_location=storage_location,
-                        material=material
-                    )
-                    new_balance.quantity_pieces += quantity_pieces
-                    new_balance.quantity_meters = (new_balance.quantity_meters or 0) + quantity_meters
-                    new_balance.quantity_cubic = (new_balance.quantity_cubic or 0) + quantity_cubic
-                    new_balance.save()
-                except MaterialBalance.DoesNotExist:
-                    new_balance = MaterialBalance.objects.create(
-                        storage_location=storage_location,
-                        material=material,
-                        quantity_pieces=quantity_pieces,
-                        quantity_meters=quantity_meters,
-                        quantity_cubic=quantity_cubic,
-                        created_by=user,
-                        created_by_position=position
-                    )
-            else:
-                # Тот же склад - просто обновляем количество
-                try:
-                    balance = MaterialBalance.objects.get(
-                        storage_location=storage_location,
-                        material=material
-                    )
-                except MaterialBalance.DoesNotExist:
-                    raise ValueError(
-                        f'Остаток материала {material.name} не найден на складе {storage_location.get_source_name()}')
-
-                diff_pieces = quantity_pieces - old_pieces
-                diff_meters = quantity_meters - old_meters
-                diff_cubic = quantity_cubic - old_cubic
-
-                # Проверяем, достаточно ли материала для уменьшения
-                if diff_pieces < 0 and balance.quantity_pieces + diff_pieces < 0:
-                    raise ValueError(
-                        f'Недостаточно материала на складе {storage_location.get_source_name()}. В наличии: {balance.quantity_pieces} шт')
-                if diff_meters < 0 and (balance.quantity_meters or 0) + diff_meters < 0:
-                    raise ValueError(
-                        f'Недостаточно материала на складе {storage_location.get_source_name()}. В наличии: {balance.quantity_meters or 0} м.п.')
-                if diff_cubic < 0 and (balance.quantity_cubic or 0) + diff_cubic < 0:
-                    raise ValueError(
-                        f'Недостаточно материала на складе {storage_location.get_source_name()}. В наличии: {balance.quantity_cubic or 0} м³')
-
-                balance.quantity_pieces += diff_pieces
-                balance.quantity_meters = (balance.quantity_meters or 0) + diff_meters
-                balance.quantity_cubic = (balance.quantity_cubic or 0) + diff_cubic
-                balance.save()
-
-            # Обновляем поступление
-            self.receipt_instance.receipt_date = self.cleaned_data['receipt_date']
-            self.receipt_instance.storage_location = storage_location
-            self.receipt_instance.material = material
-            self.receipt_instance.source_location = self.cleaned_data.get('source_location')
-            self.receipt_instance.price = self.cleaned_data.get('price')
-            self.receipt_instance.quantity_pieces = quantity_pieces
-            self.receipt_instance.quantity_meters = quantity_meters
-            self.receipt_instance.quantity_cubic = quantity_cubic
-            self.receipt_instance.save()
-
-            return balance if 'balance' in locals() else new_balance
-
-        # Создаем новое поступление
-        receipt = Receipt.objects.create(
-            receipt_date=self.cleaned_data['receipt_date'],
-            material=material,
-            storage_location=storage_location,
-            source_location=self.cleaned_data.get('source_location'),
-            quantity_pieces=quantity_pieces,
-            quantity_meters=quantity_meters,
-            quantity_cubic=quantity_cubic,
-            price=self.cleaned_data.get('price'),
-            created_by=user,
-            created_by_position=position
-        )
-
-        # Обновляем или создаем остаток
-        try:
-            balance = MaterialBalance.objects.get(
-                storage_location=storage_location,
-                material=material
-            )
-            balance.quantity_pieces += quantity_pieces
-            balance.quantity_meters = (balance.quantity_meters or 0) + quantity_meters
-            balance.quantity_cubic = (balance.quantity_cubic or 0) + quantity_cubic
-            balance.save()
-        except MaterialBalance.DoesNotExist:
-            balance = MaterialBalance.objects.create(
-                storage_location=storage_location,
+            # Откатываем старое поступление и проводим новое одной операцией
+            old_changes = self.receipt_instance.get_balance_changes()
+            old_date = self.receipt_instance.receipt_date
+
+            with transaction.atomic():
+                self.receipt_instance.receipt_date = self.cleaned_data['receipt_date']
+                self.receipt_instance.storage_location = storage_location
+                self.receipt_instance.material = material
+                self.receipt_instance.source_location = self.cleaned_data.get('source_location')
+                self.receipt_instance.price = self.cleaned_data.get('price')
+                self.receipt_instance.quantity_pieces = quantity_pieces
+                self.receipt_instance.quantity_meters = quantity_meters
+                self.receipt_instance.quantity_cubic = quantity_cubic
+
+                BalanceEngine.apply(
+                    self.receipt_instance.get_balance_changes(),
+                    created_by=user,
+                    created_by_position=position,
+                    source=self.receipt_instance,
+                    reverted=old_changes,
+                    reverted_date=old_date
+                )
+                self.receipt_instance.save()
+
+            return MaterialBalance.get_balance(storage_location, material)
+
+        # Создаем новое поступление и обновляем или создаем остаток
+        with transaction.atomic():
+            receipt = Receipt.objects.create(
+                receipt_date=self.cleaned_data['receipt_date'],
                 material=material,
+                storage_location=storage_location,
+                source_location=self.cleaned_data.get('source_location'),
                 quantity_pieces=quantity_pieces,
                 quantity_meters=quantity_meters,
                 quantity_cubic=quantity_cubic,
+                price=self.cleaned_data.get('price'),
                 created_by=user,
                 created_by_position=position
             )
 
-        return balance
\ No newline at end of file
+            BalanceEngine.apply(
+                receipt.get_balance_changes(),
+                created_by=user,
+                created_by_position=position,
+                source=receipt
+            )
+
+        return MaterialBalance.get_balance(storage_location, material)
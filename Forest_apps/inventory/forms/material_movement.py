@@ -1,15 +1,211 @@
 # ФОРМЫ ДВИЖЕНИЕ МАТЕРИАЛОВ
 from django import forms
+from django.forms import formset_factory
 from django.utils import timezone
 import datetime
-from Forest_apps.inventory.models import MaterialMovement, StorageLocation
+from Forest_apps.inventory.models import MaterialMovement, MovementDocument, StorageLocation
 from Forest_apps.forestry.models import Material
 from Forest_apps.employees.models import Employee
-from Forest_apps.core.models import Vehicle, Position
-from Forest_apps.inventory.services import StorageLocationService
+from Forest_apps.core.models import Vehicle
+from Forest_apps.inventory.services import OwnedLocationResolver, ReferenceDataCache
 
 
-class MaterialMovementCreateForm(forms.ModelForm):
+def local_to_utc(local_dt):
+    """Преобразует локальное время из формы в UTC для хранения в БД (по умолчанию - текущее время)"""
+    if not local_dt:
+        return timezone.now()
+
+    # Делаем время осознанным (aware) если оно наивное
+    if timezone.is_naive(local_dt):
+        local_tz = timezone.get_current_timezone()
+        local_dt = timezone.make_aware(local_dt, local_tz)
+
+    return local_dt.astimezone(datetime.timezone.utc)
+
+
+class MovementLocationsMixin:
+    """Общая настройка и проверка мест хранения для движений и документов движения"""
+
+    def _init_locations(self):
+        """Типы движения по должности, места хранения, водители и транспорт"""
+        # ОПРЕДЕЛЯЕМ ДОЛЖНОСТЬ ПОЛЬЗОВАТЕЛЯ
+        is_supervisor = (self.position_name and self.position_name.lower() == 'руководитель')
+
+        # ФОРМИРУЕМ СПИСОК ТИПОВ ДВИЖЕНИЯ В ЗАВИСИМОСТИ ОТ ДОЛЖНОСТИ
+        all_choices = MaterialMovement.ACCOUNTING_TYPE_CHOICES
+
+        if is_supervisor:
+            # Для руководителя - Реализация и Отправление
+            filtered_choices = [choice for choice in all_choices if choice[0] in ['Реализация', 'Отправление']]
+        else:
+            # Для всех остальных - все кроме Реализации
+            filtered_choices = [choice for choice in all_choices if choice[0] != 'Реализация']
+
+        self.fields['accounting_type'].choices = filtered_choices
+
+        if len(filtered_choices) == 1 and not self.initial.get('accounting_type') and not self.instance:
+            self.initial['accounting_type'] = filtered_choices[0][0]
+
+        # ПОЛУЧАЕМ МЕСТА ХРАНЕНИЯ (ID своих мест и списки - из кэша, без запросов)
+        self.user_location_ids = OwnedLocationResolver.get_location_ids(
+            self.position_name, list(OwnedLocationResolver.SOURCE_MODELS)
+        )
+        user_location_ids = set(self.user_location_ids)
+
+        self.reference_locations = ReferenceDataCache.storage_locations()
+        self.foreign_location_ids = [
+            loc['id'] for loc in self.reference_locations if loc['id'] not in user_location_ids
+        ]
+        self.counterparty_ids = [
+            loc['id'] for loc in self.reference_locations if loc['source_type'] == 'контрагент'
+        ]
+        self.brigade_and_vehicle_ids = [
+            loc['id'] for loc in self.reference_locations if loc['source_type'] in ('бригады', 'автомобиль')
+        ]
+
+        # Устанавливаем начальные списки мест хранения
+        self._set_location_choices('from_location', lambda loc: True)
+        self._set_location_choices('to_location', lambda loc: True)
+
+        # Сотрудники только с должностью "водитель"
+        self.fields['employee'].queryset = Employee.objects.filter(
+            position__name__iexact='водитель',
+            is_active=True
+        ).order_by('last_name', 'first_name')
+        ReferenceDataCache.apply_choices(
+            self.fields['employee'], [(driver['id'], driver['label']) for driver in ReferenceDataCache.drivers()]
+        )
+
+        self.fields['vehicle'].queryset = Vehicle.objects.all().order_by('brand', 'model')
+        ReferenceDataCache.apply_choices(self.fields['vehicle'], ReferenceDataCache.vehicles())
+
+    def _set_location_choices(self, field_name, predicate):
+        """
+        Места хранения поля: queryset для проверки значения и варианты из кэша
+
+        Args:
+            predicate: функция от строки storage_locations() - подходит ли место
+        """
+        locations = [loc for loc in self.reference_locations if predicate(loc)]
+        self.fields[field_name].queryset = StorageLocation.objects.filter(
+            id__in=[loc['id'] for loc in locations]
+        ).order_by('source_type')
+        ReferenceDataCache.apply_choices(self.fields[field_name], [(loc['id'], loc['label']) for loc in locations])
+
+    def _set_material_choices(self, material_types=None):
+        """Материалы: queryset для проверки значения и варианты из кэша (material_types - фильтр по типу)"""
+        queryset = Material.objects.all()
+        self.material_options = ReferenceDataCache.materials()
+        if material_types:
+            queryset = queryset.filter(material_type__in=material_types)
+            self.material_options = [m for m in self.material_options if m['type'] in material_types]
+
+        self.fields['material'].queryset = queryset.order_by('material_type', 'name')
+        ReferenceDataCache.apply_choices(
+            self.fields['material'], ReferenceDataCache.material_choices(self.material_options)
+        )
+
+    def _apply_filters_for_type(self, accounting_type):
+        """Применяет фильтры к полям в зависимости от типа движения"""
+        user_location_ids = set(self.user_location_ids)
+
+        def own(loc):
+            return loc['id'] in user_location_ids
+
+        if accounting_type == 'Перемещение':
+            # Перемещение: откуда и куда - только свои места
+            self._set_location_choices('from_location', own)
+            self._set_location_choices('to_location', own)
+
+        elif accounting_type == 'Отправление':
+            # Отправление: откуда - свои, куда - чужие (но не контрагенты)
+            self._set_location_choices('from_location', own)
+            self._set_location_choices(
+                'to_location', lambda loc: not own(loc) and loc['source_type'] != 'контрагент'
+            )
+
+        elif accounting_type == 'Реализация':
+            # Реализация: откуда - только склады (все, не только свои), куда - только контрагенты
+            self._set_location_choices('from_location', lambda loc: loc['source_type'] == 'склад')
+            self._set_location_choices('to_location', lambda loc: loc['source_type'] == 'контрагент')
+
+        elif accounting_type == 'Списание':
+            # Списание: откуда - только свои склады
+            self._set_location_choices('from_location', lambda loc: own(loc) and loc['source_type'] == 'склад')
+
+            # Куда - ВСЕ свои места хранения кроме контрагентов (склады, бригады, автомобили)
+            self._set_location_choices('to_location', lambda loc: own(loc) and loc['source_type'] != 'контрагент')
+
+            # Материалы - только ГСМ и запчасти
+            if 'material' in self.fields:
+                self._set_material_choices(['ГСМ', 'запчасти'])
+
+    def _clean_locations(self, accounting_type, from_location, to_location):
+        """Проверка мест хранения в зависимости от типа движения"""
+        if accounting_type == 'Перемещение':
+            if not from_location or not to_location:
+                raise forms.ValidationError('Для перемещения необходимо указать отправителя и получателя')
+
+            # Проверка, что оба места - свои
+            if from_location and from_location.id not in self.user_location_ids:
+                raise forms.ValidationError('Можно перемещать только со своих мест хранения')
+            if to_location and to_location.id not in self.user_location_ids:
+                raise forms.ValidationError('Можно перемещать только на свои места хранения')
+
+            # Проверка, что это не контрагенты
+            if from_location and from_location.source_type == 'контрагент':
+                raise forms.ValidationError('Контрагенты не могут участвовать в перемещении')
+            if to_location and to_location.source_type == 'контрагент':
+                raise forms.ValidationError('Контрагенты не могут участвовать в перемещении')
+
+        elif accounting_type == 'Отправление':
+            if not from_location or not to_location:
+                raise forms.ValidationError('Для отправления необходимо указать отправителя и получателя')
+
+            # Проверка, что отправитель - свой
+            if from_location and from_location.id not in self.user_location_ids:
+                raise forms.ValidationError('Отправлять можно только со своих мест хранения')
+
+            # Проверка, что получатель - чужой (и не контрагент)
+            if to_location and to_location.id in self.user_location_ids:
+                raise forms.ValidationError('Нельзя отправлять на свои места хранения')
+            if to_location and to_location.source_type == 'контрагент':
+                raise forms.ValidationError('Контрагенты не могут участвовать в отправлении')
+
+        elif accounting_type == 'Реализация':
+            if not from_location:
+                raise forms.ValidationError('Для реализации необходимо указать отправителя')
+            if not to_location:
+                raise forms.ValidationError('Для реализации необходимо указать получателя')
+
+            # Проверка, что отправитель - склад
+            if from_location and from_location.source_type != 'склад':
+                raise forms.ValidationError('Отправителем при реализации может быть только склад')
+
+            # Проверка, что получатель - контрагент
+            if to_location and to_location.source_type != 'контрагент':
+                raise forms.ValidationError('Получателем при реализации должен быть контрагент')
+
+        elif accounting_type == 'Списание':
+            if not from_location:
+                raise forms.ValidationError('Для списания необходимо указать отправителя')
+            if not to_location:
+                raise forms.ValidationError('Для списания необходимо указать получателя')
+
+            # Проверка, что отправитель - только склад (свой)
+            if from_location and from_location.id not in self.user_location_ids:
+                raise forms.ValidationError('Списывать можно только со своих мест хранения')
+            if from_location and from_location.source_type != 'склад':
+                raise forms.ValidationError('Списание возможно только со склада')
+
+            # Проверка, что получатель - свое место хранения (кроме контрагентов)
+            if to_location and to_location.id not in self.user_location_ids:
+                raise forms.ValidationError('Можно списывать только на свои места хранения')
+            if to_location and to_location.source_type == 'контрагент':
+                raise forms.ValidationError('Нельзя списывать на контрагентов')
+
+
+class MaterialMovementCreateForm(MovementLocationsMixin, forms.ModelForm):
     """Форма создания движения материалов"""
 
     date_time = forms.DateTimeField(
@@ -113,45 +309,8 @@ class MaterialMovementCreateForm(forms.ModelForm):
             # При создании: текущее локальное время
             self.initial['date_time'] = local_now.strftime('%Y-%m-%dT%H:%M')
 
-        # ОПРЕДЕЛЯЕМ ДОЛЖНОСТЬ ПОЛЬЗОВАТЕЛЯ
-        is_supervisor = (self.position_name and self.position_name.lower() == 'руководитель')
-
-        # ФОРМИРУЕМ СПИСОК ТИПОВ ДВИЖЕНИЯ В ЗАВИСИМОСТИ ОТ ДОЛЖНОСТИ
-        all_choices = MaterialMovement.ACCOUNTING_TYPE_CHOICES
-
-        if is_supervisor:
-            # Для руководителя - Реализация и Отправление
-            filtered_choices = [choice for choice in all_choices if choice[0] in ['Реализация', 'Отправление']]
-        else:
-            # Для всех остальных - все кроме Реализации
-            filtered_choices = [choice for choice in all_choices if choice[0] != 'Реализация']
-
-        self.fields['accounting_type'].choices = filtered_choices
-
-        if len(filtered_choices) == 1 and not self.initial.get('accounting_type') and not self.instance:
-            self.initial['accounting_type'] = filtered_choices[0][0]
-
-        # ПОЛУЧАЕМ МЕСТА ХРАНЕНИЯ ЧЕРЕЗ СЕРВИС
-        user_locations = StorageLocationService.get_user_storage_locations_by_position_name(
-            self.position_name
-        )
-        self.user_location_ids = list(user_locations.values_list('id', flat=True))
-
-        all_location_ids = list(StorageLocation.objects.all().values_list('id', flat=True))
-        self.foreign_location_ids = [loc_id for loc_id in all_location_ids if loc_id not in self.user_location_ids]
-
-        self.counterparty_ids = list(StorageLocation.objects.filter(
-            source_type='контрагент'
-        ).values_list('id', flat=True))
-
-        self.brigade_and_vehicle_ids = list(StorageLocation.objects.filter(
-            source_type__in=['бригады', 'автомобиль']
-        ).values_list('id', flat=True))
-
-        # Устанавливаем начальные queryset'ы
-        self.fields['from_location'].queryset = StorageLocation.objects.all().order_by('source_type')
-        self.fields['to_location'].queryset = StorageLocation.objects.all().order_by('source_type')
-        self.fields['material'].queryset = Material.objects.all().order_by('material_type', 'name')
+        self._init_locations()
+        self._set_material_choices()
 
         # Настройка поля материала для поиска
         self.fields['material'].widget = forms.TextInput(attrs={
@@ -161,73 +320,9 @@ class MaterialMovementCreateForm(forms.ModelForm):
             'placeholder': 'Начните вводить название материала...'
         })
 
-        # Фильтруем сотрудников только с должностью "водитель"
-        driver_position = Position.objects.filter(name__iexact='водитель').first()
-        if driver_position:
-            self.fields['employee'].queryset = Employee.objects.filter(
-                position=driver_position,
-                is_active=True
-            ).order_by('last_name', 'first_name')
-        else:
-            self.fields['employee'].queryset = Employee.objects.none()
-
-        self.fields['vehicle'].queryset = Vehicle.objects.all().order_by('brand', 'model')
-
         if self.instance and self.instance.pk:
             self._apply_filters_for_type(self.instance.accounting_type)
 
-    def _apply_filters_for_type(self, accounting_type):
-        """Применяет фильтры к полям в зависимости от типа движения"""
-
-        if accounting_type == 'Перемещение':
-            # Перемещение: откуда и куда - только свои места
-            self.fields['from_location'].queryset = StorageLocation.objects.filter(
-                id__in=self.user_location_ids
-            ).order_by('source_type')
-            self.fields['to_location'].queryset = StorageLocation.objects.filter(
-                id__in=self.user_location_ids
-            ).order_by('source_type')
-
-        elif accounting_type == 'Отправление':
-            # Отправление: откуда - свои, куда - чужие (но не контрагенты)
-            self.fields['from_location'].queryset = StorageLocation.objects.filter(
-                id__in=self.user_location_ids
-            ).order_by('source_type')
-            self.fields['to_location'].queryset = StorageLocation.objects.filter(
-                id__in=self.foreign_location_ids
-            ).exclude(
-                source_type='контрагент'
-            ).order_by('source_type')
-
-        elif accounting_type == 'Реализация':
-            # Реализация: откуда - только склады (все, не только свои)
-            self.fields['from_location'].queryset = StorageLocation.objects.filter(
-                source_type='склад'
-            ).order_by('source_type')
-            # Куда - только контрагенты
-            self.fields['to_location'].queryset = StorageLocation.objects.filter(
-                source_type='контрагент'
-            ).order_by('source_type')
-
-        elif accounting_type == 'Списание':
-            # Списание: откуда - только свои склады
-            self.fields['from_location'].queryset = StorageLocation.objects.filter(
-                id__in=self.user_location_ids,
-                source_type='склад'
-            ).order_by('source_type')
-
-            # Куда - ВСЕ свои места хранения кроме контрагентов (склады, бригады, автомобили)
-            self.fields['to_location'].queryset = StorageLocation.objects.filter(
-                id__in=self.user_location_ids
-            ).exclude(
-                source_type='контрагент'
-            ).order_by('source_type')
-
-            # Материалы - только ГСМ и запчасти
-            self.fields['material'].queryset = Material.objects.filter(
-                material_type__in=['ГСМ', 'запчасти']
-            ).order_by('material_type', 'name')
-
     def clean(self):
         """Валидация формы"""
         cleaned_data = super().clean()
@@ -286,51 +381,10 @@ class MaterialMovementCreateForm(forms.ModelForm):
                         f'Материал "{material.name}" отсутствует на складе "{from_location.get_source_name()}"'
                     )
 
-        # Валидация в зависимости от типа движения
-        if accounting_type == 'Перемещение':
-            if not from_location or not to_location:
-                raise forms.ValidationError('Для перемещения необходимо указать отправителя и получателя')
-
-            # Проверка, что оба места - свои
-            if from_location and from_location.id not in self.user_location_ids:
-                raise forms.ValidationError('Можно перемещать только со своих мест хранения')
-            if to_location and to_location.id not in self.user_location_ids:
-                raise forms.ValidationError('Можно перемещать только на свои места хранения')
-
-            # Проверка, что это не контрагенты
-            if from_location and from_location.source_type == 'контрагент':
-                raise forms.ValidationError('Контрагенты не могут участвовать в перемещении')
-            if to_location and to_location.source_type == 'контрагент':
-                raise forms.ValidationError('Контрагенты не могут участвовать в перемещении')
-
-        elif accounting_type == 'Отправление':
-            if not from_location or not to_location:
-                raise forms.ValidationError('Для отправления необходимо указать отправителя и получателя')
-
-            # Проверка, что отправитель - свой
-            if from_location and from_location.id not in self.user_location_ids:
-                raise forms.ValidationError('Отправлять можно только со своих мест хранения')
-
-            # Проверка, что получатель - чужой (и не контрагент)
-            if to_location and to_location.id in self.user_location_ids:
-                raise forms.ValidationError('Нельзя отправлять на свои места хранения')
-            if to_location and to_location.source_type == 'контрагент':
-                raise forms.ValidationError('Контрагенты не могут участвовать в отправлении')
-
-        elif accounting_type == 'Реализация':
-            if not from_location:
-                raise forms.ValidationError('Для реализации необходимо указать отправителя')
-            if not to_location:
-                raise forms.ValidationError('Для реализации необходимо указать получателя')
-
-            # Проверка, что отправитель - склад
-            if from_location and from_location.source_type != 'склад':
-                raise forms.ValidationError('Отправителем при реализации может быть только склад')
-
-            # Проверка, что получатель - контрагент
-            if to_location and to_location.source_type != 'контрагент':
-                raise forms.ValidationError('Получателем при реализации должен быть контрагент')
+        # Проверка мест хранения по типу движения
+        self._clean_locations(accounting_type, from_location, to_location)
 
+        if accounting_type == 'Реализация':
             # Проверка цены
             if not price:
                 raise forms.ValidationError('Для реализации необходимо указать цену')
@@ -338,23 +392,6 @@ class MaterialMovementCreateForm(forms.ModelForm):
                 raise forms.ValidationError('Цена должна быть положительным числом')
 
         elif accounting_type == 'Списание':
-            if not from_location:
-                raise forms.ValidationError('Для списания необходимо указать отправителя')
-            if not to_location:
-                raise forms.ValidationError('Для списания необходимо указать получателя')
-
-            # Проверка, что отправитель - только склад (свой)
-            if from_location and from_location.id not in self.user_location_ids:
-                raise forms.ValidationError('Списывать можно только со своих мест хранения')
-            if from_location and from_location.source_type != 'склад':
-                raise forms.ValidationError('Списание возможно только со склада')
-
-            # Проверка, что получатель - свое место хранения (кроме контрагентов)
-            if to_location and to_location.id not in self.user_location_ids:
-                raise forms.ValidationError('Можно списывать только на свои места хранения')
-            if to_location and to_location.source_type == 'контрагент':
-                raise forms.ValidationError('Нельзя списывать на контрагентов')
-
             # Проверка типа материала
             if material and material.material_type not in ['ГСМ', 'запчасти']:
                 raise forms.ValidationError('Списание возможно только для материалов типа ГСМ или запчасти')
@@ -366,25 +403,202 @@ class MaterialMovementCreateForm(forms.ModelForm):
         instance = super().save(commit=False)
 
         # Устанавливаем дату из формы
-        if self.cleaned_data.get('date_time'):
-            local_dt = self.cleaned_data['date_time']
+        instance.date_time = local_to_utc(self.cleaned_data.get('date_time'))
 
-            # Делаем время осознанным (aware) если оно наивное
-            if timezone.is_naive(local_dt):
-                local_tz = timezone.get_current_timezone()
-                local_dt = timezone.make_aware(local_dt, local_tz)
+        if commit:
+            instance.save()
+            self.save_m2m()
+        return instance
 
-            # Преобразуем в UTC для хранения в БД
-            instance.date_time = local_dt.astimezone(datetime.timezone.utc)
-        else:
-            instance.date_time = timezone.now()
+
+class MovementDocumentForm(MovementLocationsMixin, forms.ModelForm):
+    """Шапка многострочного документа движения"""
+
+    date_time = forms.DateTimeField(
+        label='Дата и время',
+        required=False,
+        widget=forms.DateTimeInput(attrs={
+            'class': 'form-control',
+            'type': 'datetime-local'
+        })
+    )
+
+    class Meta:
+        model = MovementDocument
+        fields = [
+            'accounting_type', 'from_location', 'to_location',
+            'employee', 'vehicle', 'wagon_number', 'date_time'
+        ]
+        widgets = {
+            'accounting_type': forms.Select(attrs={
+                'class': 'form-control',
+                'autofocus': True,
+                'id': 'id_accounting_type'
+            }),
+            'from_location': forms.Select(attrs={
+                'class': 'form-control',
+                'id': 'id_from_location'
+            }),
+            'to_location': forms.Select(attrs={
+                'class': 'form-control',
+                'id': 'id_to_location'
+            }),
+            'employee': forms.Select(attrs={
+                'class': 'form-control'
+            }),
+            'vehicle': forms.Select(attrs={
+                'class': 'form-control'
+            }),
+            'wagon_number': forms.TextInput(attrs={
+                'class': 'form-control',
+                'placeholder': 'Номер вагона',
+                'autocomplete': 'off'
+            }),
+        }
+        labels = {
+            'accounting_type': 'Тип движения',
+            'from_location': 'Откуда',
+            'to_location': 'Куда',
+            'employee': 'Водитель',
+            'vehicle': 'Транспортное средство',
+            'wagon_number': '№ вагона',
+            'date_time': 'Дата и время',
+        }
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop('user', None)
+        self.position_name = kwargs.pop('position_name', None)
+        super().__init__(*args, **kwargs)
+
+        self.initial['date_time'] = timezone.localtime(timezone.now()).strftime('%Y-%m-%dT%H:%M')
+        self._init_locations()
+
+    def clean(self):
+        """Проверка мест хранения по типу движения"""
+        cleaned_data = super().clean()
+
+        self._clean_locations(
+            cleaned_data.get('accounting_type'),
+            cleaned_data.get('from_location'),
+            cleaned_data.get('to_location')
+        )
+
+        return cleaned_data
+
+    def save(self, commit=True):
+        """Сохраняет шапку документа с преобразованием времени"""
+        instance = super().save(commit=False)
+        instance.date_time = local_to_utc(self.cleaned_data.get('date_time'))
 
         if commit:
             instance.save()
-            self.save_m2m()
         return instance
 
 
+class MovementLineForm(forms.Form):
+    """Строка документа движения: материал и количество"""
+
+    material = forms.ModelChoiceField(
+        queryset=Material.objects.all().order_by('material_type', 'name'),
+        label='Материал',
+        widget=forms.Select(attrs={'class': 'form-control line-material'})
+    )
+
+    quantity_pieces = forms.DecimalField(
+        label='Штуки',
+        required=False,
+        min_value=0,
+        max_digits=12,
+        decimal_places=3,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.001', 'min': '0'})
+    )
+
+    quantity_meters = forms.DecimalField(
+        label='Погонные метры',
+        required=False,
+        min_value=0,
+        max_digits=12,
+        decimal_places=3,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.001', 'min': '0'})
+    )
+
+    quantity_cubic = forms.DecimalField(
+        label='Кубические метры',
+        required=False,
+        min_value=0,
+        max_digits=12,
+        decimal_places=3,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.001', 'min': '0'})
+    )
+
+    price = forms.DecimalField(
+        label='Цена',
+        required=False,
+        min_value=0,
+        max_digits=12,
+        decimal_places=2,
+        widget=forms.NumberInput(attrs={'class': 'form-control line-price', 'step': '0.01', 'min': '0'})
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Список материалов из кэша: без запроса на каждую строку документа
+        ReferenceDataCache.apply_choices(
+            self.fields['material'], ReferenceDataCache.material_choices(ReferenceDataCache.materials())
+        )
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        if cleaned_data.get('material') and not (
+            cleaned_data.get('quantity_pieces')
+            or cleaned_data.get('quantity_meters')
+            or cleaned_data.get('quantity_cubic')
+        ):
+            raise forms.ValidationError('Необходимо указать хотя бы одно количество')
+
+        return cleaned_data
+
+
+class BaseMovementLineFormSet(forms.BaseFormSet):
+    """Строки документа: проверка правил типа движения для всех строк"""
+
+    def __init__(self, *args, **kwargs):
+        self.accounting_type = kwargs.pop('accounting_type', None)
+        super().__init__(*args, **kwargs)
+
+    def clean(self):
+        if any(self.errors):
+            return
+
+        lines = self.get_lines()
+        if not lines:
+            raise forms.ValidationError('Добавьте хотя бы одну строку')
+
+        for line in lines:
+            material = line['material']
+
+            if self.accounting_type == 'Реализация':
+                if not line.get('price'):
+                    raise forms.ValidationError(f'Для реализации необходимо указать цену ("{material.name}")')
+
+            elif self.accounting_type == 'Списание':
+                if material.material_type not in ['ГСМ', 'запчасти']:
+                    raise forms.ValidationError(
+                        f'Списание возможно только для материалов типа ГСМ или запчасти ("{material.name}")'
+                    )
+
+    def get_lines(self):
+        """Заполненные строки (пустые строки формы пропускаются)"""
+        return [
+            form.cleaned_data for form in self.forms
+            if form.cleaned_data and form.cleaned_data.get('material')
+        ]
+
+
+MovementLineFormSet = formset_factory(MovementLineForm, formset=BaseMovementLineFormSet, extra=5)
+
+
 class MaterialMovementFilterForm(forms.Form):
     """Форма фильтрации движений материалов"""
 
@@ -452,4 +666,4 @@ class MaterialMovementFilterForm(forms.Form):
             'class': 'form-control',
             'placeholder': 'Поиск по материалу, номеру вагона...'
         })
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,136 @@
+# Forest_apps/inventory/management/commands/balance_stress_test.py
+import random
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+
+from Forest_apps.core.models import Position, Warehouse
+from Forest_apps.forestry.models import Material
+from Forest_apps.inventory.models import MaterialBalance, StockLedgerEntry, StorageLocation
+from Forest_apps.inventory.services import BalanceEngine, StockLedger
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочная проверка BalanceEngine
+
+    Несколько потоков одновременно перемещают и списывают материал между двумя
+    тестовыми складами. После прогона проверяется, что ни один остаток не ушел
+    в минус, итоговые остатки совпадают с суммой успешных операций
+    (нет потерянных обновлений) и с журналом StockLedgerEntry.
+    Тестовые данные удаляются после проверки.
+    """
+
+    help = 'Параллельная проверка остатков: нет отрицательных остатков и потерянных обновлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Количество потоков')
+        parser.add_argument('--operations', type=int, default=200, help='Операций на поток')
+        parser.add_argument('--initial', type=int, default=500, help='Начальный остаток, шт')
+        parser.add_argument('--keep', action='store_true', help='Не удалять тестовые данные')
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+
+        position = Position.objects.create(name=f'stress-{suffix}')
+        warehouse_a = Warehouse.objects.create(name=f'stress-A-{suffix}', created_by_position=position)
+        warehouse_b = Warehouse.objects.create(name=f'stress-B-{suffix}', created_by_position=position)
+        material = Material.objects.create(material_type='древесина', name=f'stress-{suffix}')
+
+        location_a = StorageLocation.objects.get(source_type='склад', source_id=warehouse_a.id)
+        location_b = StorageLocation.objects.get(source_type='склад', source_id=warehouse_b.id)
+
+        try:
+            initial = Decimal(options['initial'])
+            BalanceEngine.apply([BalanceEngine.credit(location_a, material, initial)])
+
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                results = list(executor.map(
+                    lambda seed: self._worker(seed, options['operations'], location_a, location_b, material),
+                    range(options['workers'])
+                ))
+
+            moved_to_b = sum(result['to_b'] for result in results)
+            moved_to_a = sum(result['to_a'] for result in results)
+            written_off = sum(result['written_off'] for result in results)
+            applied = sum(result['applied'] for result in results)
+            rejected = sum(result['rejected'] for result in results)
+            errors = sum(result['errors'] for result in results)
+
+            expected_a = initial - moved_to_b + moved_to_a - written_off
+            expected_b = moved_to_b - moved_to_a
+
+            balance_a = MaterialBalance.get_balance(location_a, material).quantity_pieces
+            balance_b = MaterialBalance.get_balance(location_b, material).quantity_pieces
+            rows = MaterialBalance.objects.filter(material=material).count()
+
+            self.stdout.write(
+                f'Операций: применено {applied}, отклонено (нет остатка) {rejected}, ошибок БД {errors}'
+            )
+            self.stdout.write(f'Склад A: {balance_a} (ожидается {expected_a})')
+            self.stdout.write(f'Склад B: {balance_b} (ожидается {expected_b})')
+
+            problems = []
+            if balance_a < 0 or balance_b < 0:
+                problems.append('отрицательный остаток')
+            if balance_a != expected_a or balance_b != expected_b:
+                problems.append('потерянное обновление')
+            if rows != 2:
+                problems.append(f'дубли строк остатков ({rows})')
+            if StockLedger.drift([location_a.id, location_b.id]):
+                problems.append('расхождение с журналом')
+
+            if problems:
+                raise CommandError('Проверка не пройдена: ' + ', '.join(problems))
+
+            self.stdout.write(self.style.SUCCESS('Проверка пройдена'))
+
+        finally:
+            if not options['keep']:
+                StockLedgerEntry.objects.filter(material=material).delete()
+                MaterialBalance.objects.filter(material=material).delete()
+                warehouse_a.delete()
+                warehouse_b.delete()
+                StorageLocation.objects.filter(id__in=[location_a.id, location_b.id]).delete()
+                material.delete()
+                position.delete()
+
+    def _worker(self, seed, operations, location_a, location_b, material):
+        """Случайные перемещения A <-> B и списания с A; учитываются только успешные"""
+        rnd = random.Random(seed)
+        result = {'to_b': 0, 'to_a': 0, 'written_off': 0, 'applied': 0, 'rejected': 0, 'errors': 0}
+
+        try:
+            for _ in range(operations):
+                quantity = Decimal(rnd.randint(1, 20))
+                action = rnd.choices(('to_b', 'to_a', 'written_off'), weights=(4, 4, 1))[0]
+
+                if action == 'to_b':
+                    changes = [
+                        BalanceEngine.debit(location_a, material, quantity),
+                        BalanceEngine.credit(location_b, material, quantity),
+                    ]
+                elif action == 'to_a':
+                    changes = [
+                        BalanceEngine.debit(location_b, material, quantity),
+                        BalanceEngine.credit(location_a, material, quantity),
+                    ]
+                else:
+                    changes = [BalanceEngine.debit(location_a, material, quantity)]
+
+                try:
+                    BalanceEngine.apply(changes)
+                except ValueError:
+                    result['rejected'] += 1
+                except OperationalError:
+                    result['errors'] += 1
+                else:
+                    result[action] += quantity
+                    result['applied'] += 1
+        finally:
+            connection.close()
+
+        return result
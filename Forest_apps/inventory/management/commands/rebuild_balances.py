@@ -0,0 +1,60 @@
+# Forest_apps/inventory/management/commands/rebuild_balances.py
+from django.core.management.base import BaseCommand, CommandError
+
+from Forest_apps.forestry.models import Material
+from Forest_apps.inventory.models import StorageLocation
+from Forest_apps.inventory.services import StockLedger
+
+
+class Command(BaseCommand):
+    """
+    Пересчет остатков (MaterialBalance) по журналу StockLedgerEntry
+
+    По умолчанию остатки перезаписываются суммами журнала.
+    С --verify ничего не изменяется: выводятся расхождения по местам хранения,
+    при наличии расхождений команда завершается с ошибкой.
+    """
+
+    help = 'Пересчет остатков по журналу (--verify - только сверка)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Только сверка, без изменений')
+        parser.add_argument(
+            '--location', type=int, action='append', dest='locations',
+            help='ID места хранения (можно указать несколько раз)'
+        )
+
+    def handle(self, *args, **options):
+        location_ids = options['locations']
+
+        if not options['verify']:
+            updated, created = StockLedger.rebuild(location_ids)
+            self.stdout.write(self.style.SUCCESS(
+                f'Остатки пересчитаны по журналу: обновлено {updated}, создано {created}'
+            ))
+            return
+
+        drift = StockLedger.drift(location_ids)
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Остатки совпадают с журналом'))
+            return
+
+        locations = StorageLocation.objects.with_source_names().in_bulk(list(drift))
+        materials = Material.objects.in_bulk({
+            row['material_id'] for rows in drift.values() for row in rows
+        })
+
+        for location_id, rows in sorted(drift.items()):
+            location = locations.get(location_id)
+            name = location.get_source_name() if location else f'#{location_id}'
+            self.stdout.write(self.style.WARNING(f'{name} (ID {location_id}): расхождений {len(rows)}'))
+
+            for row in rows:
+                material = materials.get(row['material_id'])
+                balance = '—' if row['balance'] is None else row['balance']
+                self.stdout.write(
+                    f'    {material.name if material else row["material_id"]}, {row["field"]}: '
+                    f'остаток {balance}, журнал {row["ledger"]}'
+                )
+
+        raise CommandError(f'Найдены расхождения по {len(drift)} местам хранения')
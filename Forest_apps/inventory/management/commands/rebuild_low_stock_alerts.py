@@ -0,0 +1,25 @@
+# Forest_apps/inventory/management/commands/rebuild_low_stock_alerts.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Forest_apps.inventory.models import LowStockAlert
+from Forest_apps.inventory.services import LowStockMonitor
+
+
+class Command(BaseCommand):
+    """
+    Полный пересчет оповещений о низких остатках (LowStockAlert)
+
+    В обычной работе набор поддерживается инкрементально; команда нужна
+    после загрузки данных в обход BalanceEngine (фикстуры, SQL).
+    """
+
+    help = 'Полный пересчет оповещений о низких остатках по порогам материалов'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            LowStockMonitor.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Оповещения пересчитаны: остатков ниже порога {LowStockAlert.objects.count()}'
+        ))
@@ -0,0 +1,138 @@
+# Forest_apps/inventory/management/commands/reconcile_balances.py
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from Forest_apps.forestry.models import Material
+from Forest_apps.inventory.models import StorageLocation
+from Forest_apps.inventory.services import BalanceReconciler
+
+
+def _setup_worker():
+    """Инициализация процесса пула (при запуске через spawn Django еще не настроен)"""
+    django.setup()
+
+
+class Command(BaseCommand):
+    """
+    Сверка остатков (MaterialBalance) с документами
+
+    Остатки восстанавливаются по поступлениям, проведенным движениям и
+    конвертациям (см. BalanceReconciler). Места хранения делятся на части
+    по --partition штук и сверяются параллельно в пуле процессов.
+
+    Без --repair ничего не изменяется: выводятся расхождения, при наличии
+    расхождений команда завершается с ошибкой. С --repair остатки мест хранения
+    с расхождениями приводятся к документам одной транзакцией.
+    """
+
+    help = 'Сверка остатков с документами в пуле процессов (--repair - исправление)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Исправить остатки по документам')
+        parser.add_argument(
+            '--location', type=int, action='append', dest='locations',
+            help='ID места хранения (можно указать несколько раз)'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Количество процессов (1 - без пула)'
+        )
+        parser.add_argument('--partition', type=int, default=100, help='Мест хранения в одной части')
+        parser.add_argument('--report', help='Путь к JSON-файлу с расхождениями')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['partition'] < 1:
+            raise CommandError('--workers и --partition должны быть больше нуля')
+
+        location_ids = options['locations'] or list(
+            StorageLocation.objects.order_by('id').values_list('id', flat=True)
+        )
+        size = options['partition']
+        partitions = [location_ids[start:start + size] for start in range(0, len(location_ids), size)]
+        cutoff = BalanceReconciler.opening_cutoff()
+
+        drift = self._collect(partitions, cutoff, options['workers'])
+
+        if options['report']:
+            self._write_report(options['report'], drift, cutoff)
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS(
+                f'Остатки совпадают с документами (мест хранения: {len(location_ids)})'
+            ))
+            return
+
+        self._print_drift(drift)
+
+        if not options['repair']:
+            raise CommandError(f'Найдены расхождения по {len(drift)} местам хранения')
+
+        updated, created = BalanceReconciler.repair(sorted(drift), cutoff)
+        self.stdout.write(self.style.SUCCESS(
+            f'Остатки исправлены по документам: обновлено {updated}, создано {created}'
+        ))
+
+    def _collect(self, partitions, cutoff, workers):
+        """Сверка частей (в пуле процессов при workers > 1)"""
+        drift = {}
+
+        if workers == 1 or len(partitions) < 2:
+            for partition in partitions:
+                drift.update(BalanceReconciler.drift(partition, cutoff))
+            return drift
+
+        # Дочерние процессы не должны наследовать открытые соединения родителя
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=min(workers, len(partitions)), initializer=_setup_worker) as executor:
+            for result in executor.map(BalanceReconciler.drift, partitions, repeat(cutoff)):
+                drift.update(result)
+
+        return drift
+
+    def _print_drift(self, drift):
+        locations = StorageLocation.objects.with_source_names().in_bulk(list(drift))
+        materials = Material.objects.in_bulk({
+            row['material_id'] for rows in drift.values() for row in rows
+        })
+
+        for location_id, rows in sorted(drift.items()):
+            location = locations.get(location_id)
+            name = location.get_source_name() if location else f'#{location_id}'
+            self.stdout.write(self.style.WARNING(f'{name} (ID {location_id}): расхождений {len(rows)}'))
+
+            for row in rows:
+                material = materials.get(row['material_id'])
+                balance = '—' if row['balance'] is None else row['balance']
+                self.stdout.write(
+                    f'    {material.name if material else row["material_id"]}, {row["field"]}: '
+                    f'остаток {balance}, документы {row["documents"]}'
+                )
+
+    def _write_report(self, path, drift, cutoff):
+        report = {
+            'opening_cutoff': cutoff.isoformat() if cutoff else None,
+            'locations': [
+                {
+                    'storage_location_id': location_id,
+                    'rows': [
+                        {
+                            'material_id': row['material_id'],
+                            'field': row['field'],
+                            'balance': None if row['balance'] is None else str(row['balance']),
+                            'documents': str(row['documents']),
+                        }
+                        for row in rows
+                    ],
+                }
+                for location_id, rows in sorted(drift.items())
+            ],
+        }
+        with open(path, 'w', encoding='utf-8') as report_file:
+            json.dump(report, report_file, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Отчет записан в {path}')
@@ -0,0 +1,40 @@
+# Forest_apps/inventory/management/commands/take_balance_snapshot.py
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from Forest_apps.inventory.services import BalanceHistory
+
+
+class Command(BaseCommand):
+    """
+    Снимок остатков на конец дня (BalanceSnapshot)
+
+    Запускается ежедневно после полуночи (cron), по умолчанию - за вчерашний день.
+    Повторный запуск за ту же дату пересоздает снимок.
+    """
+
+    help = 'Снимок остатков на конец дня (по умолчанию - вчера)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Дата снимка в формате ГГГГ-ММ-ДД')
+        parser.add_argument('--days', type=int, default=1, help='Количество дней, заканчивая датой снимка')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                last_day = datetime.date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError('Неверный формат даты, ожидается ГГГГ-ММ-ДД')
+        else:
+            last_day = timezone.localdate() - datetime.timedelta(days=1)
+
+        # Снимки создаются по порядку: каждый следующий строится от предыдущего
+        for offset in range(options['days'] - 1, -1, -1):
+            day = last_day - datetime.timedelta(days=offset)
+            try:
+                rows = BalanceHistory.take_snapshot(day)
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f'Снимок остатков на {day:%d.%m.%Y}: строк {rows}'))
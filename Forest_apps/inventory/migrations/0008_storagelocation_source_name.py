@@ -0,0 +1,44 @@
+# Generated by Django 6.0.2 on 2026-10-18 12:54
+
+from django.db import migrations, models
+
+
+def fill_source_names(apps, schema_editor):
+    """Заполняет названия источников для существующих мест хранения"""
+    StorageLocation = apps.get_model('inventory', 'StorageLocation')
+
+    formatters = {
+        'склад': ('Warehouse', lambda obj: obj.name),
+        'автомобиль': ('Vehicle', lambda obj: f"{obj.brand} {obj.model} ({obj.license_plate})"),
+        'контрагент': ('Counterparty', lambda obj: obj.name),
+        'бригады': ('Brigade', lambda obj: obj.name),
+    }
+
+    for source_type, (model_name, formatter) in formatters.items():
+        Model = apps.get_model('core', model_name)
+        locations = list(StorageLocation.objects.filter(source_type=source_type))
+        objects = Model.objects.in_bulk({location.source_id for location in locations})
+
+        for location in locations:
+            source_object = objects.get(location.source_id)
+            if source_object is not None:
+                location.source_name = formatter(source_object)
+
+        StorageLocation.objects.bulk_update(locations, ['source_name'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_brigade_created_by_position_and_more'),
+        ('inventory', '0007_materialmovement_wagon_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storagelocation',
+            name='source_name',
+            field=models.CharField(blank=True, default='', help_text='Заполняется автоматически при сохранении склада, ТС, контрагента или бригады', max_length=255, verbose_name='Название источника'),
+        ),
+        migrations.RunPython(fill_source_names, migrations.RunPython.noop),
+    ]
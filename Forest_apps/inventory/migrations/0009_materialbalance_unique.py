@@ -0,0 +1,47 @@
+# Generated by Django 6.0.2 on 2026-10-18 12:57
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_balances(apps, schema_editor):
+    """Объединяет дублирующиеся остатки (место хранения + материал) в одну строку"""
+    MaterialBalance = apps.get_model('inventory', 'MaterialBalance')
+
+    duplicates = MaterialBalance.objects.values(
+        'storage_location_id', 'material_id'
+    ).annotate(rows=Count('id')).filter(rows__gt=1)
+
+    for duplicate in duplicates:
+        balances = list(MaterialBalance.objects.filter(
+            storage_location_id=duplicate['storage_location_id'],
+            material_id=duplicate['material_id']
+        ).order_by('id'))
+
+        main = balances[0]
+        for balance in balances[1:]:
+            main.quantity_pieces = (main.quantity_pieces or 0) + (balance.quantity_pieces or 0)
+            main.quantity_meters = (main.quantity_meters or 0) + (balance.quantity_meters or 0)
+            main.quantity_cubic = (main.quantity_cubic or 0) + (balance.quantity_cubic or 0)
+
+        main.save()
+        MaterialBalance.objects.filter(id__in=[balance.id for balance in balances[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_brigade_created_by_position_and_more'),
+        ('forestry', '0003_cuttingarea_created_by_and_more'),
+        ('inventory', '0008_storagelocation_source_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_balances, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='materialbalance',
+            constraint=models.UniqueConstraint(fields=('storage_location', 'material'), name='unique_material_balance'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_brigade_created_by_position_and_more'),
+        ('employees', '0003_employee_created_by_position_and_more'),
+        ('inventory', '0009_materialbalance_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovementDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата/время')),
+                ('accounting_type', models.CharField(choices=[('Перемещение', 'Перемещение'), ('Отправление', 'Отправление'), ('Реализация', 'Реализация'), ('Списание', 'Списание')], max_length=20, verbose_name='Тип учета')),
+                ('wagon_number', models.CharField(blank=True, default=None, max_length=50, null=True, verbose_name='№ вагона')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('is_completed', models.BooleanField(default=False, help_text='Документ проведен и остатки обновлены', verbose_name='Выполнено')),
+                ('completed_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата выполнения')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='created_movement_documents', to=settings.AUTH_USER_MODEL, verbose_name='Кто создал')),
+                ('created_by_position', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movement_documents_created', to='core.position', verbose_name='Должность создателя')),
+                ('employee', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='employees.employee', verbose_name='Сотрудник')),
+                ('from_location', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='documents_from', to='inventory.storagelocation', verbose_name='Место хранения отправления')),
+                ('to_location', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='documents_to', to='inventory.storagelocation', verbose_name='Место хранения назначения')),
+                ('vehicle', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='core.vehicle', verbose_name='Транспортное средство')),
+            ],
+            options={
+                'verbose_name': 'Документ движения (многострочный)',
+                'verbose_name_plural': 'Документы движения (многострочные)',
+                'ordering': ['-date_time'],
+            },
+        ),
+        migrations.AddField(
+            model_name='materialmovement',
+            name='document',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='inventory.movementdocument', verbose_name='Документ'),
+        ),
+        migrations.AddIndex(
+            model_name='movementdocument',
+            index=models.Index(fields=['date_time', 'accounting_type'], name='inventory_m_date_ti_a8e115_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movementdocument',
+            index=models.Index(fields=['is_completed'], name='inventory_m_is_comp_b63193_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_opening_entries(apps, schema_editor):
+    """Начальные остатки журнала: по одной записи на каждый ненулевой остаток"""
+    MaterialBalance = apps.get_model('inventory', 'MaterialBalance')
+    StockLedgerEntry = apps.get_model('inventory', 'StockLedgerEntry')
+
+    entries = [
+        StockLedgerEntry(
+            storage_location_id=balance.storage_location_id,
+            material_id=balance.material_id,
+            quantity_pieces=balance.quantity_pieces or 0,
+            quantity_meters=balance.quantity_meters or 0,
+            quantity_cubic=balance.quantity_cubic or 0,
+            source_type='Начальный остаток',
+            created_by_position_id=balance.created_by_position_id
+        )
+        for balance in MaterialBalance.objects.all()
+        if balance.quantity_pieces or balance.quantity_meters or balance.quantity_cubic
+    ]
+    StockLedgerEntry.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_brigade_created_by_position_and_more'),
+        ('forestry', '0003_cuttingarea_created_by_and_more'),
+        ('inventory', '0010_movementdocument'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity_pieces', models.DecimalField(decimal_places=3, default=0, max_digits=12, verbose_name='Изменение в штуках')),
+                ('quantity_meters', models.DecimalField(decimal_places=3, default=0, max_digits=12, verbose_name='Изменение в погонных метрах')),
+                ('quantity_cubic', models.DecimalField(decimal_places=3, default=0, max_digits=12, verbose_name='Изменение в кубических метрах')),
+                ('source_type', models.CharField(choices=[('Начальный остаток', 'Начальный остаток'), ('Поступление', 'Поступление'), ('Движение', 'Движение'), ('Документ движения', 'Документ движения'), ('Конвертация', 'Конвертация'), ('Корректировка', 'Корректировка')], default='Корректировка', max_length=30, verbose_name='Тип источника')),
+                ('source_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='ID источника')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата записи')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='created_ledger_entries', to=settings.AUTH_USER_MODEL, verbose_name='Кто создал')),
+                ('created_by_position', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries_created', to='core.position', verbose_name='Должность создателя')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='forestry.material', verbose_name='Материал')),
+                ('storage_location', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='inventory.storagelocation', verbose_name='Место хранения')),
+            ],
+            options={
+                'verbose_name': 'Запись журнала остатков',
+                'verbose_name_plural': 'Журнал остатков',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['storage_location', 'material'], name='inventory_s_storage_e87592_idx'), models.Index(fields=['source_type', 'source_id'], name='inventory_s_source__4eaadc_idx'), models.Index(fields=['created_at'], name='inventory_s_created_b52c69_idx')],
+            },
+        ),
+        migrations.RunPython(create_opening_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forestry', '0003_cuttingarea_created_by_and_more'),
+        ('inventory', '0011_stockledgerentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('snapshot_date', models.DateField(verbose_name='Дата снимка')),
+                ('cutoff', models.DateTimeField(verbose_name='Учтены записи журнала до')),
+                ('quantity_pieces', models.DecimalField(decimal_places=3, default=0, max_digits=12, verbose_name='Количество в штуках')),
+                ('quantity_meters', models.DecimalField(decimal_places=3, default=0, max_digits=12, verbose_name='Количество в погонных метрах')),
+                ('quantity_cubic', models.DecimalField(decimal_places=3, default=0, max_digits=12, verbose_name='Количество в кубических метрах')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='balance_snapshots', to='forestry.material', verbose_name='Материал')),
+                ('storage_location', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='balance_snapshots', to='inventory.storagelocation', verbose_name='Место хранения')),
+            ],
+            options={
+                'verbose_name': 'Снимок остатков',
+                'verbose_name_plural': 'Снимки остатков',
+                'ordering': ['-snapshot_date'],
+                'indexes': [models.Index(fields=['cutoff', 'storage_location'], name='inventory_b_cutoff_3ff05e_idx')],
+                'constraints': [models.UniqueConstraint(fields=('snapshot_date', 'storage_location', 'material'), name='unique_balance_snapshot')],
+            },
+        ),
+    ]
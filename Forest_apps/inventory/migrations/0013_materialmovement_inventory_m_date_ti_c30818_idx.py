@@ -0,0 +1,17 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_balancesnapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='materialmovement',
+            index=models.Index(fields=['date_time', 'id'], name='inventory_m_date_ti_c30818_idx'),
+        ),
+    ]
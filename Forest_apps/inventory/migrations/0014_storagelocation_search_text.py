@@ -0,0 +1,51 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:20
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+def fill_search_text(apps, schema_editor):
+    """Заполняет текст для поиска у существующих мест хранения"""
+    StorageLocation = apps.get_model('inventory', 'StorageLocation')
+
+    formatters = {
+        'склад': ('Warehouse', lambda obj: obj.name),
+        'автомобиль': ('Vehicle', lambda obj: f"{obj.brand} {obj.model} {obj.license_plate}"),
+        'контрагент': ('Counterparty', lambda obj: f"{obj.name} {obj.inn}"),
+        'бригады': ('Brigade', lambda obj: obj.name),
+    }
+
+    for source_type, (model_name, formatter) in formatters.items():
+        Model = apps.get_model('core', model_name)
+        locations = list(StorageLocation.objects.filter(source_type=source_type))
+        objects = Model.objects.in_bulk({location.source_id for location in locations})
+
+        for location in locations:
+            source_object = objects.get(location.source_id)
+            if source_object is not None:
+                location.search_text = formatter(source_object).lower()
+
+        StorageLocation.objects.bulk_update(locations, ['search_text'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_brigade_created_by_position_and_more'),
+        ('inventory', '0013_materialmovement_inventory_m_date_ti_c30818_idx'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='storagelocation',
+            name='search_text',
+            field=models.CharField(blank=True, default='', help_text='Название, госномер, ИНН в нижнем регистре (заполняется вместе с source_name)', max_length=255, verbose_name='Текст для поиска'),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='storagelocation',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_text'], name='storage_location_search_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
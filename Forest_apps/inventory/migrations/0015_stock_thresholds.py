@@ -0,0 +1,75 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:10
+
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_brigade_created_by_position_and_more'),
+        ('forestry', '0003_cuttingarea_created_by_and_more'),
+        ('inventory', '0014_storagelocation_search_text'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockThreshold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity_field', models.CharField(choices=[('quantity_pieces', 'Штуки'), ('quantity_meters', 'Погонные метры'), ('quantity_cubic', 'Кубические метры')], default='quantity_pieces', max_length=20, verbose_name='Единица')),
+                ('min_quantity', models.DecimalField(decimal_places=3, max_digits=12, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Минимальный остаток')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активность')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='created_stock_threshold', to=settings.AUTH_USER_MODEL, verbose_name='Кто создал')),
+                ('created_by_position', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='stock_threshold_created', to='core.position', verbose_name='Должность создателя')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_thresholds', to='forestry.material', verbose_name='Материал')),
+                ('storage_location', models.ForeignKey(blank=True, help_text='Пусто - порог для всех мест хранения', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_thresholds', to='inventory.storagelocation', verbose_name='Место хранения')),
+            ],
+            options={
+                'verbose_name': 'Порог остатка',
+                'verbose_name_plural': 'Пороги остатков',
+            },
+        ),
+        migrations.CreateModel(
+            name='LowStockAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity_field', models.CharField(choices=[('quantity_pieces', 'Штуки'), ('quantity_meters', 'Погонные метры'), ('quantity_cubic', 'Кубические метры')], max_length=20, verbose_name='Единица')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=12, verbose_name='Остаток')),
+                ('min_quantity', models.DecimalField(decimal_places=3, max_digits=12, verbose_name='Минимальный остаток')),
+                ('since', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Ниже порога с')),
+                ('balance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='low_stock_alerts', to='inventory.materialbalance', verbose_name='Остаток')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='low_stock_alerts', to='forestry.material', verbose_name='Материал')),
+                ('storage_location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='low_stock_alerts', to='inventory.storagelocation', verbose_name='Место хранения')),
+                ('threshold', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='inventory.stockthreshold', verbose_name='Порог')),
+            ],
+            options={
+                'verbose_name': 'Мало остатков',
+                'verbose_name_plural': 'Мало остатков',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stockthreshold',
+            constraint=models.UniqueConstraint(fields=('material', 'storage_location', 'quantity_field'), name='unique_stock_threshold_location'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockthreshold',
+            constraint=models.UniqueConstraint(condition=models.Q(('storage_location__isnull', True)), fields=('material', 'quantity_field'), name='unique_stock_threshold_default'),
+        ),
+        migrations.AddIndex(
+            model_name='lowstockalert',
+            index=models.Index(fields=['storage_location', 'material'], name='inventory_l_storage_b24fa7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lowstockalert',
+            index=models.Index(fields=['since'], name='inventory_l_since_86cb16_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='lowstockalert',
+            constraint=models.UniqueConstraint(fields=('balance', 'quantity_field'), name='unique_low_stock_alert'),
+        ),
+    ]
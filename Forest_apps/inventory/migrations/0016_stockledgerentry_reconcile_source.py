@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0015_stock_thresholds'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockledgerentry',
+            name='source_type',
+            field=models.CharField(choices=[('Начальный остаток', 'Начальный остаток'), ('Поступление', 'Поступление'), ('Движение', 'Движение'), ('Документ движения', 'Документ движения'), ('Конвертация', 'Конвертация'), ('Корректировка', 'Корректировка'), ('Сверка', 'Сверка с документами')], default='Корректировка', max_length=30, verbose_name='Тип источника'),
+        ),
+    ]
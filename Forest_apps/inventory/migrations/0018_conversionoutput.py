@@ -0,0 +1,111 @@
+# Generated by Django 6.0.2 on 2026-10-18 15:00
+
+import django.core.validators
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+QUANTITY_FIELDS = ('quantity_pieces', 'quantity_meters', 'quantity_cubic')
+YIELD_FIELDS = ('quantity_cubic', 'quantity_meters', 'quantity_pieces')
+
+
+def copy_targets_to_outputs(apps, schema_editor):
+    """Переносит целевой материал конвертаций в выходы (с долей выхода)"""
+    Conversion = apps.get_model('inventory', 'Conversion')
+    ConversionOutput = apps.get_model('inventory', 'ConversionOutput')
+
+    outputs = []
+    for conversion in Conversion.objects.filter(target_material__isnull=False).iterator(chunk_size=2000):
+        output = ConversionOutput(
+            conversion_id=conversion.id,
+            material_id=conversion.target_material_id,
+            **{field: getattr(conversion, f'target_{field}') for field in QUANTITY_FIELDS}
+        )
+        for field in YIELD_FIELDS:
+            source_quantity = getattr(conversion, f'source_{field}') or 0
+            output_quantity = getattr(output, field) or 0
+            if source_quantity > 0 and output_quantity > 0:
+                output.yield_ratio = (output_quantity / source_quantity).quantize(Decimal('0.0001'))
+                break
+        outputs.append(output)
+
+        if len(outputs) >= 2000:
+            ConversionOutput.objects.bulk_create(outputs)
+            outputs = []
+
+    ConversionOutput.objects.bulk_create(outputs)
+
+
+def copy_outputs_to_targets(apps, schema_editor):
+    """Обратный перенос: первый выход становится целевым материалом"""
+    Conversion = apps.get_model('inventory', 'Conversion')
+    ConversionOutput = apps.get_model('inventory', 'ConversionOutput')
+
+    conversions = []
+    seen = set()
+    for output in ConversionOutput.objects.order_by('conversion_id', 'id').iterator(chunk_size=2000):
+        if output.conversion_id in seen:
+            continue
+        seen.add(output.conversion_id)
+        conversion = Conversion(id=output.conversion_id, target_material_id=output.material_id)
+        for field in QUANTITY_FIELDS:
+            setattr(conversion, f'target_{field}', getattr(output, field))
+        conversions.append(conversion)
+
+    Conversion.objects.bulk_update(
+        conversions,
+        ['target_material'] + [f'target_{field}' for field in QUANTITY_FIELDS],
+        batch_size=2000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forestry', '0003_cuttingarea_created_by_and_more'),
+        ('inventory', '0017_storagelocation_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversionOutput',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity_pieces', models.DecimalField(blank=True, decimal_places=3, default=None, max_digits=12, null=True, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Количество в штуках')),
+                ('quantity_meters', models.DecimalField(blank=True, decimal_places=3, default=None, max_digits=12, null=True, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Количество в погонных метрах')),
+                ('quantity_cubic', models.DecimalField(blank=True, decimal_places=3, default=None, max_digits=12, null=True, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Количество в кубических метрах')),
+                ('yield_ratio', models.DecimalField(blank=True, decimal_places=4, help_text='Количество выхода к количеству исходного материала в той же единице (0.6 = 60%)', max_digits=7, null=True, verbose_name='Доля выхода')),
+                ('conversion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outputs', to='inventory.conversion', verbose_name='Конвертация')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='conversion_outputs', to='forestry.material', verbose_name='Материал')),
+            ],
+            options={
+                'verbose_name': 'Выход конвертации',
+                'verbose_name_plural': 'Выходы конвертации',
+                'ordering': ['id'],
+                'constraints': [models.UniqueConstraint(fields=('conversion', 'material'), name='unique_conversion_output_material')],
+            },
+        ),
+        migrations.AlterField(
+            model_name='conversion',
+            name='target_material',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='conversions_target', to='forestry.material', verbose_name='Целевой материал'),
+        ),
+        migrations.RunPython(copy_targets_to_outputs, copy_outputs_to_targets),
+        migrations.RemoveField(
+            model_name='conversion',
+            name='target_material',
+        ),
+        migrations.RemoveField(
+            model_name='conversion',
+            name='target_quantity_pieces',
+        ),
+        migrations.RemoveField(
+            model_name='conversion',
+            name='target_quantity_meters',
+        ),
+        migrations.RemoveField(
+            model_name='conversion',
+            name='target_quantity_cubic',
+        ),
+    ]
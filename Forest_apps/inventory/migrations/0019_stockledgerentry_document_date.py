@@ -0,0 +1,64 @@
+# Generated by Django 6.0.2 on 2026-10-18 15:40
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+# Тип источника журнала -> (модель документа, поле даты документа)
+LEDGER_DOCUMENTS = {
+    'Поступление': ('Receipt', 'receipt_date'),
+    'Движение': ('MaterialMovement', 'date_time'),
+    'Документ движения': ('MovementDocument', 'date_time'),
+    'Конвертация': ('Conversion', 'conversion_date'),
+}
+
+
+def fill_document_dates(apps, schema_editor):
+    """Дата документа для записей журнала: из документа-источника, иначе время проведения"""
+    StockLedgerEntry = apps.get_model('inventory', 'StockLedgerEntry')
+
+    for source_type, (model_name, date_field) in LEDGER_DOCUMENTS.items():
+        model = apps.get_model('inventory', model_name)
+        StockLedgerEntry.objects.filter(source_type=source_type).update(
+            document_date=Subquery(model.objects.filter(pk=OuterRef('source_id')).values(date_field)[:1])
+        )
+
+    # Начальные остатки, корректировки, сверки и записи удаленных документов
+    StockLedgerEntry.objects.filter(document_date__isnull=True).update(document_date=F('created_at'))
+
+
+def delete_snapshots(apps, schema_editor):
+    """Снимки построены по времени проведения - пересоздаются командой take_balance_snapshot"""
+    apps.get_model('inventory', 'BalanceSnapshot').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0018_conversionoutput'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockledgerentry',
+            name='document_date',
+            field=models.DateTimeField(null=True, verbose_name='Дата документа'),
+        ),
+        migrations.RunPython(fill_document_dates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='stockledgerentry',
+            name='document_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата документа'),
+        ),
+        migrations.AddIndex(
+            model_name='stockledgerentry',
+            index=models.Index(fields=['document_date'], name='inventory_s_documen_f14a2b_idx'),
+        ),
+        migrations.RunPython(delete_snapshots, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='balancesnapshot',
+            name='last_entry_id',
+            field=models.BigIntegerField(default=0, verbose_name='Учтены записи журнала по ID'),
+        ),
+    ]
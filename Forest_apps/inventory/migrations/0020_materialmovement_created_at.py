@@ -0,0 +1,24 @@
+# Generated by Django 6.0.2 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0019_stockledgerentry_document_date'),
+    ]
+
+    operations = [
+        # Сначала без auto_now_add: у существующих движений дата создания неизвестна и остается пустой
+        migrations.AddField(
+            model_name='materialmovement',
+            name='created_at',
+            field=models.DateTimeField(null=True, verbose_name='Дата создания'),
+        ),
+        migrations.AlterField(
+            model_name='materialmovement',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, null=True, verbose_name='Дата создания'),
+        ),
+    ]
@@ -1,18 +1,65 @@
 # Forest_apps/inventory/models.py
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from django.apps import apps
+from django.contrib.postgres.indexes import GinIndex
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from decimal import Decimal
 
 # Импорты из других приложений
-from Forest_apps.core.models import Warehouse, Brigade, Vehicle, Position
+from Forest_apps.core.models import Warehouse, Brigade, Vehicle
 from Forest_apps.employees.models import Employee  # если понадобится
 
 User = get_user_model()
 
 # МАТЕРИАЛЫ МЕСТА ХРАНЕНИЯ И ОСТАТКИ
+class StorageLocationQuerySet(models.QuerySet):
+    """QuerySet мест хранения с массовым получением названий источников"""
+
+    def search(self, term):
+        """
+        Поиск по названию источника (склад, ТС: марка/модель/госномер,
+        контрагент: наименование/ИНН, бригада)
+
+        Ищет подстроку в денормализованном поле search_text, по которому
+        построен триграммный GIN-индекс - один индексированный запрос.
+        Число ищется также как ID в исходной таблице.
+        """
+        term = (term or '').strip().lower()
+        if not term:
+            return self
+        condition = models.Q(search_text__contains=term)
+        if term.isdigit():
+            condition |= models.Q(source_id=int(term))
+        return self.filter(condition)
+
+    def with_source_names(self):
+        """
+        Подставляет названия источников всем местам хранения выборки.
+
+        Названия, которых нет в денормализованном поле source_name,
+        получаются одним запросом на каждый тип источника.
+        """
+        clone = self._chain()
+        clone._with_source_names = True
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._with_source_names = getattr(self, '_with_source_names', False)
+        return clone
+
+    def _fetch_all(self):
+        result_loaded = self._result_cache is not None
+        super()._fetch_all()
+        if not result_loaded and getattr(self, '_with_source_names', False):
+            StorageLocation.resolve_source_names(
+                [obj for obj in self._result_cache if isinstance(obj, StorageLocation)]
+            )
+
+
 class StorageLocation(models.Model):
     """Место хранения"""
     SOURCE_TYPE_CHOICES = [
@@ -22,12 +69,57 @@ class StorageLocation(models.Model):
         ('бригады', 'Бригада'),
     ]
 
+    # Модели-источники, форматирование их названий и текста для поиска
+    SOURCE_MODEL_MAP = {
+        'склад': {
+            'app': 'core',
+            'model': 'Warehouse',
+            'formatter': lambda obj: obj.name,
+            'search': lambda obj: obj.name
+        },
+        'автомобиль': {
+            'app': 'core',
+            'model': 'Vehicle',
+            'formatter': lambda obj: f"{obj.brand} {obj.model} ({obj.license_plate})",
+            'search': lambda obj: f"{obj.brand} {obj.model} {obj.license_plate}"
+        },
+        'контрагент': {
+            'app': 'core',
+            'model': 'Counterparty',
+            'formatter': lambda obj: obj.name,
+            'search': lambda obj: f"{obj.name} {obj.inn}"
+        },
+        'бригады': {
+            'app': 'core',
+            'model': 'Brigade',
+            'formatter': lambda obj: obj.name,
+            'search': lambda obj: obj.name
+        }
+    }
+
     source_type = models.CharField(
         'Тип хранения',
         max_length=20,
         choices=SOURCE_TYPE_CHOICES
     )
     source_id = models.IntegerField('ID в исходной таблице')
+    source_name = models.CharField(
+        'Название источника',
+        max_length=255,
+        blank=True,
+        default='',
+        help_text='Заполняется автоматически при сохранении склада, ТС, контрагента или бригады'
+    )
+    search_text = models.CharField(
+        'Текст для поиска',
+        max_length=255,
+        blank=True,
+        default='',
+        help_text='Название, госномер, ИНН в нижнем регистре (заполняется вместе с source_name)'
+    )
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True, db_index=True)
+
+    objects = StorageLocationQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Место хранения'
@@ -38,37 +130,105 @@ class StorageLocation(models.Model):
                 name='unique_storage_location'
             )
         ]
+        indexes = [
+            # Триграммный индекс для поиска подстроки (LIKE '%...%')
+            GinIndex(
+                fields=['search_text'],
+                opclasses=['gin_trgm_ops'],
+                name='storage_location_search_trgm'
+            )
+        ]
 
     def __str__(self):
         source_name = self.get_source_name()
         return f"{self.get_source_type_display()}: {source_name}"
 
+    @classmethod
+    def format_source_name(cls, source_type, source_object):
+        """Название источника для места хранения заданного типа"""
+        source_config = cls.SOURCE_MODEL_MAP.get(source_type)
+        if not source_config:
+            return str(source_object)
+        return source_config['formatter'](source_object)
+
+    @classmethod
+    def format_search_text(cls, source_type, source_object):
+        """Текст для поиска места хранения (поле search_text)"""
+        source_config = cls.SOURCE_MODEL_MAP.get(source_type)
+        if not source_config:
+            return str(source_object).lower()
+        return source_config['search'](source_object).lower()
+
+    @classmethod
+    def resolve_source_names(cls, locations):
+        """
+        Массово заполняет названия источников для списка мест хранения
+
+        Для мест хранения без сохраненного source_name выполняется
+        по одному запросу на тип источника (вместо запроса на каждую строку).
+
+        Args:
+            locations: итерируемый набор StorageLocation (None пропускаются)
+
+        Returns:
+            list переданных мест хранения
+        """
+        locations = [location for location in locations if location is not None]
+
+        missing = {}
+        for location in locations:
+            if not location.source_name and not hasattr(location, '_resolved_source_name'):
+                missing.setdefault(location.source_type, []).append(location)
+
+        for source_type, group in missing.items():
+            source_config = cls.SOURCE_MODEL_MAP.get(source_type)
+            if not source_config:
+                continue
+
+            Model = apps.get_model(
+                app_label=source_config['app'],
+                model_name=source_config['model']
+            )
+            objects = Model.objects.in_bulk({location.source_id for location in group})
+            for location in group:
+                source_object = objects.get(location.source_id)
+                if source_object is None:
+                    location._resolved_source_name = f"{source_config['model']} ID:{location.source_id} (не найден)"
+                else:
+                    location._resolved_source_name = source_config['formatter'](source_object)
+
+        return locations
+
+    @classmethod
+    def attach_source_names(cls, objects, *fields):
+        """
+        Массово заполняет названия мест хранения у связанных объектов
+
+        Пример: StorageLocation.attach_source_names(movements, 'from_location', 'to_location')
+
+        Args:
+            objects: итерируемый набор объектов (остатки, движения, конвертации)
+            fields: имена полей-ссылок на StorageLocation
+
+        Returns:
+            list объектов
+        """
+        objects = list(objects)
+        cls.resolve_source_names(
+            getattr(obj, field) for obj in objects for field in fields
+        )
+        return objects
+
     def get_source_name(self):
         """Получить название источника"""
-        model_map = {
-            'склад': {
-                'app': 'core',
-                'model': 'Warehouse',
-                'formatter': lambda obj: obj.name
-            },
-            'автомобиль': {
-                'app': 'core',
-                'model': 'Vehicle',
-                'formatter': lambda obj: f"{obj.brand} {obj.model} ({obj.license_plate})"
-            },
-            'контрагент': {
-                'app': 'core',
-                'model': 'Counterparty',
-                'formatter': lambda obj: obj.name
-            },
-            'бригады': {
-                'app': 'core',
-                'model': 'Brigade',
-                'formatter': lambda obj: obj.name
-            }
-        }
+        if self.source_name:
+            return self.source_name
 
-        source_config = model_map.get(self.source_type)
+        resolved = getattr(self, '_resolved_source_name', None)
+        if resolved is not None:
+            return resolved
+
+        source_config = self.SOURCE_MODEL_MAP.get(self.source_type)
         if not source_config:
             return f"Неизвестный тип: {self.source_type} ID:{self.source_id}"
 
@@ -78,7 +238,8 @@ class StorageLocation(models.Model):
                 model_name=source_config['model']
             )
             source_object = Model.objects.get(pk=self.source_id)
-            return source_config['formatter'](source_object)
+            self._resolved_source_name = source_config['formatter'](source_object)
+            return self._resolved_source_name
 
         except LookupError:
             return f"Ошибка: модель {source_config['app']}.{source_config['model']} не найдена"
@@ -107,8 +268,58 @@ class StorageLocation(models.Model):
         return False
 
 
+class MaterialMovementQuerySet(models.QuerySet):
+    """QuerySet движений материалов со сводной статистикой и ролью пользователя"""
+
+    def with_user_role(self, location_ids):
+        """
+        Аннотирует роль пользователя (user_role) для всех движений выборки
+
+        Роль вычисляется в SQL по местам хранения владельца
+        (см. OwnedLocationResolver), без запросов на каждую строку.
+
+        Args:
+            location_ids: ID мест хранения должности пользователя
+
+        Returns:
+            QuerySet с полем user_role: 'sender', 'receiver' или 'none'
+        """
+        location_ids = list(location_ids)
+        return self.annotate(
+            user_role=models.Case(
+                models.When(from_location_id__in=location_ids, then=models.Value('sender')),
+                models.When(to_location_id__in=location_ids, then=models.Value('receiver')),
+                default=models.Value('none'),
+                output_field=models.CharField()
+            )
+        )
+
+    def summary(self):
+        """
+        Сводная статистика выборки одним запросом (условная агрегация)
+
+        Returns:
+            dict total_count, pending_count, total_amount (только Реализация),
+            total_pieces, total_meters, total_cubic
+        """
+        summary = self.order_by().aggregate(
+            total_count=models.Count('id'),
+            pending_count=models.Count('id', filter=models.Q(is_completed=False)),
+            total_amount=models.Sum('total_amount', filter=models.Q(accounting_type='Реализация')),
+            total_pieces=models.Sum('quantity_pieces'),
+            total_meters=models.Sum('quantity_meters'),
+            total_cubic=models.Sum('quantity_cubic'),
+        )
+        return {key: value or 0 for key, value in summary.items()}
+
+
 class MaterialMovement(models.Model):
     """Документ движения материалов"""
+
+    # Тип источника и поле даты документа для записей журнала остатков (StockLedgerEntry)
+    LEDGER_SOURCE = 'Движение'
+    LEDGER_DATE_FIELD = 'date_time'
+
     ACCOUNTING_TYPE_CHOICES = [
         ('Перемещение', 'Перемещение'),
         ('Отправление', 'Отправление'),
@@ -116,6 +327,9 @@ class MaterialMovement(models.Model):
         ('Списание', 'Списание'),
     ]
 
+    # Типы, которые проводятся сразу при создании (Отправление ждет подтверждения получателем)
+    EXECUTE_ON_CREATE = ('Перемещение', 'Реализация', 'Списание')
+
     date_time = models.DateTimeField('Дата/время', default=timezone.now)
     accounting_type = models.CharField(
         'Тип учета',
@@ -237,6 +451,15 @@ class MaterialMovement(models.Model):
         null=True
     )
 
+    document = models.ForeignKey(
+        'inventory.MovementDocument',
+        on_delete=models.CASCADE,
+        verbose_name='Документ',
+        related_name='lines',
+        null=True,
+        blank=True
+    )
+
     is_completed = models.BooleanField(
         'Выполнено',
         default=False,
@@ -249,10 +472,16 @@ class MaterialMovement(models.Model):
         blank=True
     )
 
+    # Пусто у движений, созданных до появления поля (сверка берет их из журнала)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True, null=True)
+
+    objects = MaterialMovementQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Документ движения материалов'
         verbose_name_plural = 'Документы движения материалов'
         indexes = [
+            models.Index(fields=['date_time', 'id']),
             models.Index(fields=['date_time', 'accounting_type']),
             models.Index(fields=['from_location', 'to_location']),
             models.Index(fields=['is_completed']),
@@ -263,19 +492,19 @@ class MaterialMovement(models.Model):
 
     def save(self, *args, **kwargs):
         """Метод сохранения с расчетом суммы только для Реализации"""
+        self.total_amount = self.calculate_total_amount()
+        super().save(*args, **kwargs)
+
+    def calculate_total_amount(self):
+        """Сумма только для Реализации"""
         if self.accounting_type == 'Реализация' and self.price:
             if self.quantity_cubic is not None and self.quantity_cubic > 0:
-                self.total_amount = self.quantity_cubic * self.price
+                return self.quantity_cubic * self.price
             elif self.quantity_meters is not None and self.quantity_meters > 0:
-                self.total_amount = self.quantity_meters * self.price
+                return self.quantity_meters * self.price
             elif self.quantity_pieces is not None and self.quantity_pieces > 0:
-                self.total_amount = self.quantity_pieces * self.price
-            else:
-                self.total_amount = 0
-        else:
-            self.total_amount = 0
-
-        super().save(*args, **kwargs)
+                return self.quantity_pieces * self.price
+        return 0
 
     @classmethod
     def create_movement(cls, accounting_type, from_location, to_location,
@@ -295,128 +524,46 @@ class MaterialMovement(models.Model):
             author=author
         )
 
-    def execute_movement(self):
-        """Выполнение движения с проверкой остатков"""
-        from .models import MaterialBalance
+    def get_balance_changes(self):
+        """Изменения остатков, которые вносит проведенное движение"""
+        from Forest_apps.inventory.services import BalanceEngine
 
-        if self.is_completed:
-            print("ERROR: Movement already completed")
-            raise ValueError("Движение уже выполнено")
+        quantities = (self.quantity_pieces, self.quantity_meters, self.quantity_cubic)
+        changes = [BalanceEngine.debit(self.from_location, self.material, *quantities)]
+
+        # Получатель приходует материал только при перемещении и отправлении
+        if self.to_location and self.accounting_type in ('Перемещение', 'Отправление'):
+            changes.append(BalanceEngine.credit(self.to_location, self.material, *quantities))
 
-        self._check_sufficient_quantity()
+        return changes
+
+    def _mark_completed(self, error_message):
+        """Помечает движение выполненным (условным UPDATE, защита от повторного проведения)"""
+        self.completed_at = timezone.now()
+        if self.pk:
+            updated = type(self).objects.filter(pk=self.pk, is_completed=False).update(
+                is_completed=True,
+                completed_at=self.completed_at
+            )
+            if not updated:
+                raise ValueError(error_message)
+        self.is_completed = True
 
+    def validate_for_execution(self):
+        """Проверка правил типа движения перед проведением"""
         if self.accounting_type == 'Перемещение':
-            print("Processing Перемещение...")
             if not self.to_location:
                 raise ValueError("Для перемещения необходимо указать получателя")
             if self.from_location.source_type in ['контрагент'] or self.to_location.source_type in ['контрагент']:
                 raise ValueError("В перемещении не могут участвовать контрагенты")
 
-            try:
-                from_balance = MaterialBalance.objects.get(
-                    storage_location=self.from_location,
-                    material=self.material
-                )
-            except MaterialBalance.DoesNotExist:
-                print(f"ERROR: Material not found at from_location")
-                raise ValueError(f"Материал {self.material.name} отсутствует на {self.from_location.get_source_name()}")
-
-            if self.quantity_pieces and from_balance.quantity_pieces < self.quantity_pieces:
-                raise ValueError(
-                    f"Недостаточно материала в штуках: есть {from_balance.quantity_pieces}, требуется {self.quantity_pieces}"
-                )
-            if self.quantity_meters and (from_balance.quantity_meters or 0) < self.quantity_meters:
-                raise ValueError(
-                    f"Недостаточно материала в погонных метрах: есть {from_balance.quantity_meters or 0}, требуется {self.quantity_meters}"
-                )
-            if self.quantity_cubic and (from_balance.quantity_cubic or 0) < self.quantity_cubic:
-                raise ValueError(
-                    f"Недостаточно материала в кубических метрах: есть {from_balance.quantity_cubic or 0}, требуется {self.quantity_cubic}"
-                )
-
-            print("Уменьшаем количество у отправителя...")
-            if self.quantity_pieces:
-                from_balance.quantity_pieces -= self.quantity_pieces
-            if self.quantity_meters:
-                from_balance.quantity_meters = (from_balance.quantity_meters or 0) - self.quantity_meters
-            if self.quantity_cubic:
-                from_balance.quantity_cubic = (from_balance.quantity_cubic or 0) - self.quantity_cubic
-
-            from_balance.save()
-            print(f"Баланс отправителя после отправления: pieces={from_balance.quantity_pieces}")
-
-            print("Увеличиваем количество у получателя...")
-            try:
-                to_balance = MaterialBalance.objects.get(
-                    storage_location=self.to_location,
-                    material=self.material
-                )
-                print(f"Обнаружен существующий баланс: ID={to_balance.id}")
-
-                if self.quantity_pieces:
-                    to_balance.quantity_pieces += self.quantity_pieces
-                if self.quantity_meters:
-                    to_balance.quantity_meters = (to_balance.quantity_meters or 0) + self.quantity_meters
-                if self.quantity_cubic:
-                    to_balance.quantity_cubic = (to_balance.quantity_cubic or 0) + self.quantity_cubic
-
-                to_balance.save()
-                print(f"баланс получателя после обновления: pieces={to_balance.quantity_pieces}")
-
-            except MaterialBalance.DoesNotExist:
-                MaterialBalance.objects.create(
-                    storage_location=self.to_location,
-                    material=self.material,
-                    quantity_pieces=self.quantity_pieces or 0,
-                    quantity_meters=self.quantity_meters or 0,
-                    quantity_cubic=self.quantity_cubic or 0,
-                    created_by=self.created_by,
-                    created_by_position=self.created_by_position
-                )
-
-            self.is_completed = True
-            self.completed_at = timezone.now()
-
         elif self.accounting_type == 'Реализация':
             if not self.to_location or self.to_location.source_type != 'контрагент':
                 raise ValueError("Для реализации получателем должен быть контрагент")
             if not self.price:
                 raise ValueError("Для реализации необходимо указать цену")
 
-            try:
-                from_balance = MaterialBalance.objects.get(
-                    storage_location=self.from_location,
-                    material=self.material
-                )
-            except MaterialBalance.DoesNotExist:
-                raise ValueError(f"Материал {self.material.name} отсутствует на {self.from_location.get_source_name()}")
-
-            if self.quantity_pieces and from_balance.quantity_pieces < self.quantity_pieces:
-                raise ValueError(
-                    f"Недостаточно материала в штуках: есть {from_balance.quantity_pieces}, требуется {self.quantity_pieces}"
-                )
-            if self.quantity_meters and (from_balance.quantity_meters or 0) < self.quantity_meters:
-                raise ValueError(
-                    f"Недостаточно материала в погонных метрах: есть {from_balance.quantity_meters or 0}, требуется {self.quantity_meters}"
-                )
-            if self.quantity_cubic and (from_balance.quantity_cubic or 0) < self.quantity_cubic:
-                raise ValueError(
-                    f"Недостаточно материала в кубических метрах: есть {from_balance.quantity_cubic or 0}, требуется {self.quantity_cubic}"
-                )
-
-            if self.quantity_pieces:
-                from_balance.quantity_pieces -= self.quantity_pieces
-            if self.quantity_meters:
-                from_balance.quantity_meters = (from_balance.quantity_meters or 0) - self.quantity_meters
-            if self.quantity_cubic:
-                from_balance.quantity_cubic = (from_balance.quantity_cubic or 0) - self.quantity_cubic
-            from_balance.save()
-
-            self.is_completed = True
-            self.completed_at = timezone.now()
-
         elif self.accounting_type == 'Списание':
-            print("Processing Списание...")
             if not self.to_location:
                 raise ValueError("Для списания необходимо указать получателя (бригаду или ТС)")
 
@@ -429,42 +576,34 @@ class MaterialMovement(models.Model):
             if self.material.material_type not in ['ГСМ', 'запчасти']:
                 raise ValueError("Списание возможно только для материалов типа ГСМ или запчасти")
 
-            try:
-                from_balance = MaterialBalance.objects.get(
-                    storage_location=self.from_location,
-                    material=self.material
-                )
-                print(f"Найден баланс отправителя: ID={from_balance.id}, pieces={from_balance.quantity_pieces}")
+    def execute_movement(self):
+        """Выполнение движения с проверкой остатков"""
+        from Forest_apps.inventory.services import BalanceEngine
 
-            except MaterialBalance.DoesNotExist:
-                print(f"ERROR: Material not found at from_location")
-                raise ValueError(f"Материал {self.material.name} отсутствует на {self.from_location.get_source_name()}")
+        if self.document_id:
+            # Строка многострочного документа проводится вместе с документом
+            return self.document.execute()
 
-            if self.quantity_pieces and from_balance.quantity_pieces < self.quantity_pieces:
-                raise ValueError(
-                    f"Недостаточно материала в штуках: есть {from_balance.quantity_pieces}, требуется {self.quantity_pieces}"
-                )
-            if self.quantity_meters and (from_balance.quantity_meters or 0) < self.quantity_meters:
-                raise ValueError(
-                    f"Недостаточно материала в погонных метрах: есть {from_balance.quantity_meters or 0}, требуется {self.quantity_meters}"
-                )
-            if self.quantity_cubic and (from_balance.quantity_cubic or 0) < self.quantity_cubic:
-                raise ValueError(
-                    f"Недостаточно материала в кубических метрах: есть {from_balance.quantity_cubic or 0}, требуется {self.quantity_cubic}"
-                )
+        if self.is_completed:
+            raise ValueError("Движение уже выполнено")
 
-            if self.quantity_pieces:
-                from_balance.quantity_pieces -= self.quantity_pieces
-            if self.quantity_meters:
-                from_balance.quantity_meters = (from_balance.quantity_meters or 0) - self.quantity_meters
-            if self.quantity_cubic:
-                from_balance.quantity_cubic = (from_balance.quantity_cubic or 0) - self.quantity_cubic
-            from_balance.save()
+        if self.accounting_type == 'Отправление':
+            # Отправление проводится при подтверждении получателем (confirm_receipt)
+            self._check_sufficient_quantity()
+            self.save()
+            return
 
-            self.is_completed = True
-            self.completed_at = timezone.now()
+        self.validate_for_execution()
 
-        self.save()
+        with transaction.atomic():
+            self._mark_completed("Движение уже выполнено")
+            BalanceEngine.apply(
+                self.get_balance_changes(),
+                created_by=self.created_by,
+                created_by_position=self.created_by_position,
+                source=self
+            )
+            self.save()
 
     def confirm_receipt(self):
         """Подтверждение получения отправления"""
@@ -473,14 +612,35 @@ class MaterialMovement(models.Model):
         if self.is_completed:
             raise ValueError("Отправление уже подтверждено")
 
-        self._check_sufficient_quantity()
+        if self.document_id:
+            return self.document.confirm_receipt()
 
         MaterialBalance = apps.get_model('inventory', 'MaterialBalance')
-        from_balance, to_balance = MaterialBalance.process_movement(self)
 
-        self.is_completed = True
-        self.completed_at = timezone.now()
-        self.save()
+        with transaction.atomic():
+            self._mark_completed("Отправление уже подтверждено")
+            MaterialBalance.process_movement(self)
+            self.save()
+
+    def cancel_execution(self):
+        """Отмена выполнения движения с восстановлением остатков"""
+        if self.document_id:
+            return self.document.cancel_execution()
+
+        MaterialBalance = apps.get_model('inventory', 'MaterialBalance')
+
+        with transaction.atomic():
+            updated = type(self).objects.filter(pk=self.pk, is_completed=True).update(
+                is_completed=False,
+                completed_at=None
+            )
+            if not updated:
+                raise ValueError("Движение еще не выполнено")
+
+            MaterialBalance.cancel_movement(self)
+            self.is_completed = False
+            self.completed_at = None
+            self.save()
 
     def _check_sufficient_quantity(self):
         """Проверка наличия достаточного количества материалов"""
@@ -508,33 +668,18 @@ class MaterialMovement(models.Model):
             )
 
     @classmethod
-    def get_pending_shipments_for_user(cls, user):
-        """Получение ожидающих отправлений для пользователя (где пользователь - получатель)"""
-        user_locations = []
-
-        warehouses = Warehouse.objects.filter(created_by=user)
-        for wh in warehouses:
-            try:
-                location = StorageLocation.objects.get(source_type='склад', source_id=wh.id)
-                user_locations.append(location.id)
-            except StorageLocation.DoesNotExist:
-                pass
-
-        brigades = Brigade.objects.filter(created_by=user)
-        for br in brigades:
-            try:
-                location = StorageLocation.objects.get(source_type='бригады', source_id=br.id)
-                user_locations.append(location.id)
-            except StorageLocation.DoesNotExist:
-                pass
-
-        vehicles = Vehicle.objects.filter(created_by=user)
-        for vh in vehicles:
-            try:
-                location = StorageLocation.objects.get(source_type='автомобиль', source_id=vh.id)
-                user_locations.append(location.id)
-            except StorageLocation.DoesNotExist:
-                pass
+    def get_pending_shipments_for_user(cls, user, position_name=None):
+        """Получение ожидающих отправлений для пользователя (где пользователь - получатель)
+
+        Если передана должность, получатель определяется по местам хранения должности,
+        иначе - по местам хранения, созданным пользователем.
+        """
+        from Forest_apps.inventory.services import OwnedLocationResolver
+
+        if position_name:
+            user_locations = OwnedLocationResolver.get_location_ids(position_name)
+        else:
+            user_locations = OwnedLocationResolver.get_user_location_ids(user)
 
         return cls.objects.filter(
             accounting_type='Отправление',
@@ -559,6 +704,8 @@ class MaterialMovement(models.Model):
 
     def get_user_role(self, user, position_name=None):
         """Определяет роль пользователя для данного движения"""
+        from Forest_apps.inventory.services import OwnedLocationResolver
+
         if not position_name:
             if hasattr(user, 'session') and user.is_authenticated:
                 position_name = user.session.get('position_name')
@@ -566,65 +713,329 @@ class MaterialMovement(models.Model):
         if not position_name:
             return 'none'
 
-        position = Position.objects.filter(name__iexact=position_name).first()
-        if not position:
-            return 'none'
+        return self.get_role_for_locations(OwnedLocationResolver.get_location_ids(position_name))
 
-        try:
-            if self.from_location.source_type == 'склад':
-                warehouse = Warehouse.objects.filter(
-                    id=self.from_location.source_id,
-                    created_by_position=position
-                ).first()
-                if warehouse:
-                    return 'sender'
-            elif self.from_location.source_type == 'бригады':
-                brigade = Brigade.objects.filter(
-                    id=self.from_location.source_id,
-                    created_by_position=position
-                ).first()
-                if brigade:
-                    return 'sender'
-            elif self.from_location.source_type == 'автомобиль':
-                vehicle = Vehicle.objects.filter(
-                    id=self.from_location.source_id,
-                    created_by_position=position
-                ).first()
-                if vehicle:
-                    return 'sender'
-        except Exception as e:
-            print(f"Error checking from_location: {e}")
-
-        if self.to_location:
-            try:
-                if self.to_location.source_type == 'склад':
-                    warehouse = Warehouse.objects.filter(
-                        id=self.to_location.source_id,
-                        created_by_position=position
-                    ).first()
-                    if warehouse:
-                        return 'receiver'
-                elif self.to_location.source_type == 'бригады':
-                    brigade = Brigade.objects.filter(
-                        id=self.to_location.source_id,
-                        created_by_position=position
-                    ).first()
-                    if brigade:
-                        return 'receiver'
-                elif self.to_location.source_type == 'автомобиль':
-                    vehicle = Vehicle.objects.filter(
-                        id=self.to_location.source_id,
-                        created_by_position=position
-                    ).first()
-                    if vehicle:
-                        return 'receiver'
-            except Exception as e:
-                print(f"Error checking to_location: {e}")
-        else:
-            print("to_location is None")
+    def get_role_for_locations(self, location_ids):
+        """
+        Роль владельца мест хранения для данного движения (без запросов к БД)
+
+        Та же логика, что и в MaterialMovementQuerySet.with_user_role().
+
+        Args:
+            location_ids: ID мест хранения должности (OwnedLocationResolver)
+
+        Returns:
+            'sender', 'receiver' или 'none'
+        """
+        location_ids = set(location_ids)
+        if self.from_location_id in location_ids:
+            return 'sender'
+        if self.to_location_id and self.to_location_id in location_ids:
+            return 'receiver'
         return 'none'
 
 
+class MovementDocument(models.Model):
+    """Документ движения материалов с несколькими строками (шапка)
+
+    Строки документа - записи MaterialMovement с общими типом, местами хранения,
+    водителем и транспортом. Документ проводится целиком одной транзакцией.
+    """
+
+    # Тип источника и поле даты документа для записей журнала остатков (StockLedgerEntry)
+    LEDGER_SOURCE = 'Документ движения'
+    LEDGER_DATE_FIELD = 'date_time'
+
+    date_time = models.DateTimeField('Дата/время', default=timezone.now)
+    accounting_type = models.CharField(
+        'Тип учета',
+        max_length=20,
+        choices=MaterialMovement.ACCOUNTING_TYPE_CHOICES
+    )
+
+    employee = models.ForeignKey(
+        'employees.Employee',
+        on_delete=models.PROTECT,
+        verbose_name='Сотрудник',
+        null=True,
+        blank=True
+    )
+
+    vehicle = models.ForeignKey(
+        'core.Vehicle',
+        on_delete=models.PROTECT,
+        verbose_name='Транспортное средство',
+        null=True,
+        blank=True
+    )
+
+    wagon_number = models.CharField(
+        '№ вагона',
+        max_length=50,
+        null=True,
+        blank=True,
+        default=None
+    )
+
+    from_location = models.ForeignKey(
+        'inventory.StorageLocation',
+        on_delete=models.PROTECT,
+        verbose_name='Место хранения отправления',
+        related_name='documents_from'
+    )
+
+    to_location = models.ForeignKey(
+        'inventory.StorageLocation',
+        on_delete=models.PROTECT,
+        verbose_name='Место хранения назначения',
+        related_name='documents_to',
+        null=True,
+        blank=True
+    )
+
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='Кто создал',
+        related_name='created_movement_documents'
+    )
+    created_by_position = models.ForeignKey(
+        'core.Position',
+        on_delete=models.PROTECT,
+        verbose_name='Должность создателя',
+        related_name='movement_documents_created',
+        null=True
+    )
+
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+
+    is_completed = models.BooleanField(
+        'Выполнено',
+        default=False,
+        help_text='Документ проведен и остатки обновлены'
+    )
+
+    completed_at = models.DateTimeField(
+        'Дата выполнения',
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        verbose_name = 'Документ движения (многострочный)'
+        verbose_name_plural = 'Документы движения (многострочные)'
+        ordering = ['-date_time']
+        indexes = [
+            models.Index(fields=['date_time', 'accounting_type']),
+            models.Index(fields=['is_completed']),
+        ]
+
+    def __str__(self):
+        return f"{self.accounting_type} (документ №{self.id}) от {self.date_time.date()}"
+
+    @classmethod
+    def check_balances(cls, from_location, lines):
+        """
+        Проверка остатков для всех строк одним запросом
+
+        Args:
+            from_location: место хранения отправления
+            lines: список словарей с material и quantity_pieces/meters/cubic
+
+        Returns:
+            list сообщений об ошибках (пустой, если остатков достаточно)
+        """
+        MaterialBalance = apps.get_model('inventory', 'MaterialBalance')
+
+        # Суммируем строки с одинаковым материалом
+        required = {}
+        for line in lines:
+            totals = required.setdefault(line['material'].pk, {
+                'material': line['material'],
+                'quantity_pieces': 0,
+                'quantity_meters': 0,
+                'quantity_cubic': 0,
+            })
+            for field in ('quantity_pieces', 'quantity_meters', 'quantity_cubic'):
+                totals[field] += line.get(field) or 0
+
+        balances = {
+            balance.material_id: balance
+            for balance in MaterialBalance.objects.filter(
+                storage_location=from_location,
+                material_id__in=list(required)
+            )
+        }
+
+        units = {'quantity_pieces': 'шт', 'quantity_meters': 'м.п.', 'quantity_cubic': 'м³'}
+        errors = []
+        for material_id, totals in required.items():
+            material = totals['material']
+            balance = balances.get(material_id)
+            if balance is None:
+                errors.append(f'Материал "{material.name}" отсутствует на "{from_location.get_source_name()}"')
+                continue
+
+            for field, unit in units.items():
+                available = getattr(balance, field) or 0
+                if totals[field] and available < totals[field]:
+                    errors.append(
+                        f'Недостаточно материала "{material.name}": '
+                        f'в наличии {available} {unit}, требуется {totals[field]} {unit}'
+                    )
+
+        return errors
+
+    @classmethod
+    def create_with_lines(cls, document, lines):
+        """
+        Сохранение документа и всех строк (bulk_create)
+
+        Args:
+            document: несохраненная шапка документа
+            lines: список словарей с material, quantity_pieces/meters/cubic и price
+        """
+        with transaction.atomic():
+            document.save()
+
+            movements = []
+            for line in lines:
+                movement = MaterialMovement(
+                    document=document,
+                    date_time=document.date_time,
+                    accounting_type=document.accounting_type,
+                    employee=document.employee,
+                    vehicle=document.vehicle,
+                    wagon_number=document.wagon_number,
+                    from_location=document.from_location,
+                    to_location=document.to_location,
+                    material=line['material'],
+                    quantity_pieces=line.get('quantity_pieces'),
+                    quantity_meters=line.get('quantity_meters'),
+                    quantity_cubic=line.get('quantity_cubic'),
+                    price=line.get('price'),
+                    created_by=document.created_by,
+                    created_by_position=document.created_by_position
+                )
+                # bulk_create не вызывает save(), поэтому сумму считаем здесь
+                movement.total_amount = movement.calculate_total_amount()
+                movements.append(movement)
+
+            MaterialMovement.objects.bulk_create(movements)
+
+        return document
+
+    def get_lines(self):
+        return self.lines.select_related('material', 'from_location', 'to_location').order_by('id')
+
+    def get_balance_changes(self, lines=None):
+        """Изменения остатков всех строк документа"""
+        changes = []
+        for line in lines if lines is not None else self.get_lines():
+            changes.extend(line.get_balance_changes())
+        return changes
+
+    def _set_completed(self, completed, error_message):
+        """Условная смена статуса документа и всех его строк"""
+        completed_at = timezone.now() if completed else None
+        updated = type(self).objects.filter(pk=self.pk, is_completed=not completed).update(
+            is_completed=completed,
+            completed_at=completed_at
+        )
+        if not updated:
+            raise ValueError(error_message)
+
+        self.lines.update(is_completed=completed, completed_at=completed_at)
+        self.is_completed = completed
+        self.completed_at = completed_at
+
+    def execute(self):
+        """Проведение документа (Перемещение, Реализация, Списание) одной транзакцией"""
+        from Forest_apps.inventory.services import BalanceEngine
+
+        if self.accounting_type == 'Отправление':
+            raise ValueError("Отправление проводится при подтверждении получателем")
+
+        lines = list(self.get_lines())
+        if not lines:
+            raise ValueError("В документе нет строк")
+
+        for line in lines:
+            line.validate_for_execution()
+
+        with transaction.atomic():
+            self._set_completed(True, "Документ уже проведен")
+            BalanceEngine.apply(
+                self.get_balance_changes(lines),
+                created_by=self.created_by,
+                created_by_position=self.created_by_position,
+                source=self
+            )
+
+    def confirm_receipt(self):
+        """Подтверждение получения всех строк отправления"""
+        from Forest_apps.inventory.services import BalanceEngine
+
+        if self.accounting_type != 'Отправление':
+            raise ValueError("Подтверждение возможно только для отправлений")
+
+        with transaction.atomic():
+            self._set_completed(True, "Отправление уже подтверждено")
+            BalanceEngine.apply(
+                self.get_balance_changes(),
+                created_by=self.created_by,
+                created_by_position=self.created_by_position,
+                source=self
+            )
+
+    def cancel_execution(self):
+        """Отмена проведения документа с восстановлением остатков"""
+        from Forest_apps.inventory.services import BalanceEngine
+
+        with transaction.atomic():
+            self._set_completed(False, "Документ еще не проведен")
+            BalanceEngine.apply(
+                BalanceEngine.reverse(self.get_balance_changes()),
+                created_by_position=self.created_by_position,
+                source=self
+            )
+
+    @property
+    def total_amount(self):
+        return sum((line.total_amount or 0) for line in self.lines.all())
+
+
+class MaterialBalanceQuerySet(models.QuerySet):
+    """QuerySet остатков со сводом по материалам и типам мест хранения"""
+
+    def pivot_rows(self, by_position=False):
+        """
+        Свод выборки одним запросом: GROUP BY материал, тип места хранения
+        (и должность создателя остатка, если by_position)
+
+        Returns:
+            QuerySet словарей material_id, material_name, material_type, source_type,
+            [position_id, position_name,] pieces, meters, cubic, count
+        """
+        group_by = {
+            'material_name': models.F('material__name'),
+            'material_type': models.F('material__material_type'),
+            'source_type': models.F('storage_location__source_type'),
+        }
+        if by_position:
+            group_by['position_id'] = models.F('created_by_position_id')
+            group_by['position_name'] = models.F('created_by_position__name')
+
+        return self.order_by().values('material_id', **group_by).annotate(
+            pieces=models.Sum('quantity_pieces'),
+            meters=models.Sum('quantity_meters'),
+            cubic=models.Sum('quantity_cubic'),
+            count=models.Count('id')
+        ).order_by('material_type', 'material_name')
+
+
 class MaterialBalance(models.Model):
     """Остатки материалов (без цены)"""
     storage_location = models.ForeignKey(
@@ -682,12 +1093,20 @@ class MaterialBalance(models.Model):
         null=True
     )
 
+    objects = MaterialBalanceQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Остаток материала'
         verbose_name_plural = 'Остатки материалов'
-        indexes = [
-            models.Index(fields=['storage_location', 'material']),
-            models.Index(fields=['material', 'storage_location']),
+        constraints = [
+            models.UniqueConstraint(
+                fields=['storage_location', 'material'],
+                name='unique_material_balance'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['storage_location', 'material']),
+            models.Index(fields=['material', 'storage_location']),
             models.Index(fields=['last_updated']),
         ]
 
@@ -697,110 +1116,34 @@ class MaterialBalance(models.Model):
     @classmethod
     def process_movement(cls, movement):
         """Обработка движения материалов"""
-        try:
-            from_balance = cls.objects.get(
-                storage_location=movement.from_location,
-                material=movement.material
-            )
-        except cls.DoesNotExist:
-            raise ValueError(f"Материал {movement.material} не найден в месте хранения {movement.from_location}")
+        from Forest_apps.inventory.services import BalanceEngine
 
-        if movement.quantity_pieces and from_balance.quantity_pieces < movement.quantity_pieces:
-            raise ValueError(
-                f"Недостаточно материала в штуках: есть {from_balance.quantity_pieces}, требуется {movement.quantity_pieces}"
-            )
-        if movement.quantity_meters and (from_balance.quantity_meters or 0) < movement.quantity_meters:
-            raise ValueError(
-                f"Недостаточно материала в погонных метрах: есть {from_balance.quantity_meters or 0}, требуется {movement.quantity_meters}"
-            )
-        if movement.quantity_cubic and (from_balance.quantity_cubic or 0) < movement.quantity_cubic:
-            raise ValueError(
-                f"Недостаточно материала в кубических метрах: есть {from_balance.quantity_cubic or 0}, требуется {movement.quantity_cubic}"
-            )
-
-        if movement.quantity_pieces:
-            from_balance.quantity_pieces -= movement.quantity_pieces
-        if movement.quantity_meters:
-            from_balance.quantity_meters = (from_balance.quantity_meters or 0) - movement.quantity_meters
-        if movement.quantity_cubic:
-            from_balance.quantity_cubic = (from_balance.quantity_cubic or 0) - movement.quantity_cubic
-
-        from_balance.save()
+        BalanceEngine.apply(
+            movement.get_balance_changes(),
+            created_by=movement.created_by,
+            created_by_position=movement.created_by_position,
+            source=movement
+        )
 
+        from_balance = cls.get_balance(movement.from_location, movement.material)
         to_balance = None
-        if movement.to_location and movement.accounting_type != 'Списание':
-            to_balance, created = cls._add_to_balance(
-                storage_location=movement.to_location,
-                material=movement.material,
-                quantity_pieces=movement.quantity_pieces,
-                quantity_meters=movement.quantity_meters,
-                quantity_cubic=movement.quantity_cubic,
-                created_by_position=movement.created_by_position
-            )
+        if movement.to_location and movement.accounting_type in ('Перемещение', 'Отправление'):
+            to_balance = cls.get_balance(movement.to_location, movement.material)
 
         return from_balance, to_balance
 
     @classmethod
     def cancel_movement(cls, movement):
-        from_balance, _ = cls._add_to_balance(
-            storage_location=movement.from_location,
-            material=movement.material,
-            quantity_pieces=movement.quantity_pieces,
-            quantity_meters=movement.quantity_meters,
-            quantity_cubic=movement.quantity_cubic
-        )
+        """Отмена движения: возврат материала отправителю и списание у получателя"""
+        from Forest_apps.inventory.services import BalanceEngine
 
-        if movement.to_location and movement.accounting_type != 'Списание':
-            try:
-                to_balance = cls.objects.get(
-                    storage_location=movement.to_location,
-                    material=movement.material
-                )
-
-                if movement.quantity_pieces:
-                    to_balance.quantity_pieces -= movement.quantity_pieces
-                if movement.quantity_meters is not None:
-                    to_balance.quantity_meters = (to_balance.quantity_meters or 0) - (movement.quantity_meters or 0)
-                if movement.quantity_cubic is not None:
-                    to_balance.quantity_cubic = (to_balance.quantity_cubic or 0) - (movement.quantity_cubic or 0)
-
-                to_balance.save()
-            except cls.DoesNotExist:
-                pass
-
-        return from_balance
-
-    @classmethod
-    def _add_to_balance(cls, storage_location, material, quantity_pieces=0,
-                        quantity_meters=None, quantity_cubic=None, created_by_position=None):
-        try:
-            balance = cls.objects.get(
-                storage_location=storage_location,
-                material=material
-            )
-            created = False
-
-            if quantity_pieces:
-                balance.quantity_pieces += quantity_pieces
-            if quantity_meters is not None:
-                balance.quantity_meters = (balance.quantity_meters or 0) + (quantity_meters or 0)
-            if quantity_cubic is not None:
-                balance.quantity_cubic = (balance.quantity_cubic or 0) + (quantity_cubic or 0)
-
-            balance.save()
-
-        except cls.DoesNotExist:
-            balance = cls.objects.create(
-                storage_location=storage_location,
-                material=material,
-                quantity_pieces=quantity_pieces or 0,
-                quantity_meters=quantity_meters or 0,
-                quantity_cubic=quantity_cubic or 0,
-                created_by_position=created_by_position
-            )
-            created = True
+        BalanceEngine.apply(
+            BalanceEngine.reverse(movement.get_balance_changes()),
+            created_by_position=movement.created_by_position,
+            source=movement
+        )
 
-        return balance, created
+        return cls.get_balance(movement.from_location, movement.material)
 
     @classmethod
     def get_balance(cls, storage_location, material):
@@ -844,13 +1187,20 @@ class MaterialBalance(models.Model):
         }
 
     @classmethod
-    def get_balances_with_low_stock(cls, min_quantity=10, material_type=None):
-        queryset = cls.objects.filter(quantity_pieces__lt=min_quantity)
+    def get_balances_with_low_stock(cls, material_type=None, storage_location_ids=None):
+        """
+        Остатки ниже порога (по набору LowStockAlert, без пересчета всех остатков)
+
+        Пороги задаются по материалу и, при необходимости, месту хранения (StockThreshold).
+        """
+        queryset = cls.objects.filter(low_stock_alerts__isnull=False).distinct()
 
         if material_type:
             queryset = queryset.filter(material__material_type=material_type)
+        if storage_location_ids is not None:
+            queryset = queryset.filter(storage_location_id__in=storage_location_ids)
 
-        return queryset.select_related('material', 'storage_location').order_by('quantity_pieces')
+        return queryset.select_related('material', 'storage_location').order_by('material__name')
 
     def has_sufficient_quantity(self, quantity_pieces=0, quantity_meters=0, quantity_cubic=0):
         if quantity_pieces and self.quantity_pieces < quantity_pieces:
@@ -874,67 +1224,346 @@ class MaterialBalance(models.Model):
         return ", ".join(parts) if parts else "0"
 
 
-class Conversion(models.Model):
-    """Документ конвертации древесины (списание одного материала и создание другого)"""
+class StockThreshold(models.Model):
+    """
+    Минимальный остаток материала (порог для оповещения "мало остатков")
 
-    conversion_date = models.DateTimeField(
-        'Дата конвертации',
-        default=timezone.now
-    )
+    Порог задается в любой единице учета материала. Без места хранения порог
+    действует на всех местах хранения; порог для конкретного места хранения
+    заменяет общий порог по той же единице.
+    """
+    QUANTITY_FIELD_CHOICES = [
+        ('quantity_pieces', 'Штуки'),
+        ('quantity_meters', 'Погонные метры'),
+        ('quantity_cubic', 'Кубические метры'),
+    ]
 
+    material = models.ForeignKey(
+        'forestry.Material',
+        on_delete=models.CASCADE,
+        verbose_name='Материал',
+        related_name='stock_thresholds'
+    )
     storage_location = models.ForeignKey(
         'inventory.StorageLocation',
+        on_delete=models.CASCADE,
+        verbose_name='Место хранения',
+        related_name='stock_thresholds',
+        null=True,
+        blank=True,
+        help_text='Пусто - порог для всех мест хранения'
+    )
+    quantity_field = models.CharField(
+        'Единица',
+        max_length=20,
+        choices=QUANTITY_FIELD_CHOICES,
+        default='quantity_pieces'
+    )
+    min_quantity = models.DecimalField(
+        'Минимальный остаток',
+        max_digits=12,
+        decimal_places=3,
+        validators=[MinValueValidator(0)]
+    )
+    is_active = models.BooleanField('Активность', default=True)
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='Кто создал',
+        related_name='created_stock_threshold'
+    )
+    created_by_position = models.ForeignKey(
+        'core.Position',
         on_delete=models.PROTECT,
+        verbose_name='Должность создателя',
+        related_name='stock_threshold_created',
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        verbose_name = 'Порог остатка'
+        verbose_name_plural = 'Пороги остатков'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['material', 'storage_location', 'quantity_field'],
+                name='unique_stock_threshold_location'
+            ),
+            models.UniqueConstraint(
+                fields=['material', 'quantity_field'],
+                condition=models.Q(storage_location__isnull=True),
+                name='unique_stock_threshold_default'
+            ),
+        ]
+
+    def __str__(self):
+        place = self.storage_location.get_source_name() if self.storage_location_id else 'все места'
+        return f"{self.material}: < {self.min_quantity} ({self.get_quantity_field_display()}, {place})"
+
+
+class LowStockAlert(models.Model):
+    """
+    Остаток ниже порога (текущее состояние, а не история)
+
+    Набор поддерживается инкрементально: после каждого изменения остатков
+    пересчитываются только затронутые строки (см. LowStockMonitor).
+    Строка удаляется, как только остаток снова не ниже порога.
+    """
+    balance = models.ForeignKey(
+        'inventory.MaterialBalance',
+        on_delete=models.CASCADE,
+        verbose_name='Остаток',
+        related_name='low_stock_alerts'
+    )
+    threshold = models.ForeignKey(
+        'inventory.StockThreshold',
+        on_delete=models.CASCADE,
+        verbose_name='Порог',
+        related_name='alerts'
+    )
+    storage_location = models.ForeignKey(
+        'inventory.StorageLocation',
+        on_delete=models.CASCADE,
         verbose_name='Место хранения',
-        limit_choices_to={'source_type': 'склад'}
+        related_name='low_stock_alerts'
+    )
+    material = models.ForeignKey(
+        'forestry.Material',
+        on_delete=models.CASCADE,
+        verbose_name='Материал',
+        related_name='low_stock_alerts'
     )
+    quantity_field = models.CharField(
+        'Единица',
+        max_length=20,
+        choices=StockThreshold.QUANTITY_FIELD_CHOICES
+    )
+    quantity = models.DecimalField('Остаток', max_digits=12, decimal_places=3)
+    min_quantity = models.DecimalField('Минимальный остаток', max_digits=12, decimal_places=3)
+    since = models.DateTimeField('Ниже порога с', default=timezone.now)
 
-    source_material = models.ForeignKey(
+    class Meta:
+        verbose_name = 'Мало остатков'
+        verbose_name_plural = 'Мало остатков'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['balance', 'quantity_field'],
+                name='unique_low_stock_alert'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['storage_location', 'material']),
+            models.Index(fields=['since']),
+        ]
+
+    def __str__(self):
+        return f"{self.material}: {self.quantity} < {self.min_quantity} ({self.get_quantity_field_display()})"
+
+    @property
+    def shortage(self):
+        """Сколько не хватает до порога"""
+        return self.min_quantity - self.quantity
+
+
+class StockLedgerEntry(models.Model):
+    """
+    Журнал изменений остатков (только добавление записей)
+
+    Каждое изменение остатка пишется сюда со знаком (+ поступление, - списание)
+    в той же транзакции, что и UPDATE MaterialBalance (см. BalanceEngine).
+    MaterialBalance - проекция журнала и может быть пересчитана командой
+    rebuild_balances.
+
+    created_at - время проведения, document_date - дата документа-источника
+    (для записей без документа совпадает со временем проведения). Остатки
+    на дату (BalanceHistory) считаются по дате документа.
+    """
+
+    SOURCE_TYPE_CHOICES = [
+        ('Начальный остаток', 'Начальный остаток'),
+        ('Поступление', 'Поступление'),
+        ('Движение', 'Движение'),
+        ('Документ движения', 'Документ движения'),
+        ('Конвертация', 'Конвертация'),
+        ('Корректировка', 'Корректировка'),
+        ('Сверка', 'Сверка с документами'),
+    ]
+
+    storage_location = models.ForeignKey(
+        'inventory.StorageLocation',
+        on_delete=models.PROTECT,
+        verbose_name='Место хранения',
+        related_name='ledger_entries'
+    )
+    material = models.ForeignKey(
         'forestry.Material',
         on_delete=models.PROTECT,
-        verbose_name='Исходный материал',
-        related_name='conversions_source'
+        verbose_name='Материал',
+        related_name='ledger_entries'
     )
-
-    source_quantity_pieces = models.DecimalField(
-        'Количество в штуках (списание)',
+    quantity_pieces = models.DecimalField(
+        'Изменение в штуках',
         max_digits=12,
         decimal_places=3,
-        validators=[MinValueValidator(0)],
-        null=True,
-        blank=True,
-        default=None
+        default=0
     )
-
-    source_quantity_meters = models.DecimalField(
-        'Количество в погонных метрах (списание)',
+    quantity_meters = models.DecimalField(
+        'Изменение в погонных метрах',
         max_digits=12,
         decimal_places=3,
-        validators=[MinValueValidator(0)],
+        default=0
+    )
+    quantity_cubic = models.DecimalField(
+        'Изменение в кубических метрах',
+        max_digits=12,
+        decimal_places=3,
+        default=0
+    )
+    source_type = models.CharField(
+        'Тип источника',
+        max_length=30,
+        choices=SOURCE_TYPE_CHOICES,
+        default='Корректировка'
+    )
+    source_id = models.PositiveIntegerField(
+        'ID источника',
+        null=True,
+        blank=True
+    )
+    document_date = models.DateTimeField('Дата документа', default=timezone.now)
+    created_at = models.DateTimeField('Дата записи', auto_now_add=True)
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
         null=True,
         blank=True,
-        default=None
+        verbose_name='Кто создал',
+        related_name='created_ledger_entries'
+    )
+    created_by_position = models.ForeignKey(
+        'core.Position',
+        on_delete=models.PROTECT,
+        verbose_name='Должность создателя',
+        related_name='ledger_entries_created',
+        null=True,
+        blank=True
     )
 
-    source_quantity_cubic = models.DecimalField(
-        'Количество в кубических метрах (списание)',
+    class Meta:
+        verbose_name = 'Запись журнала остатков'
+        verbose_name_plural = 'Журнал остатков'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['storage_location', 'material']),
+            models.Index(fields=['source_type', 'source_id']),
+            models.Index(fields=['created_at']),
+            models.Index(fields=['document_date']),
+        ]
+
+    def __str__(self):
+        return f"{self.source_type} №{self.source_id}: {self.material} ({self.storage_location})"
+
+
+class BalanceSnapshot(models.Model):
+    """
+    Остаток материала на конец дня (снимок)
+
+    Снимок - сумма журнала StockLedgerEntry по записям с датой документа до
+    cutoff (начало следующего дня) и с ID не больше last_entry_id. Используется
+    для быстрого получения остатков на произвольный момент: ближайший снимок +
+    записи журнала с датой документа после него + записи, проведенные задним
+    числом после снимка (ID больше last_entry_id).
+    """
+
+    snapshot_date = models.DateField('Дата снимка')
+    cutoff = models.DateTimeField('Учтены записи журнала до')
+    last_entry_id = models.BigIntegerField('Учтены записи журнала по ID', default=0)
+    storage_location = models.ForeignKey(
+        'inventory.StorageLocation',
+        on_delete=models.PROTECT,
+        verbose_name='Место хранения',
+        related_name='balance_snapshots'
+    )
+    material = models.ForeignKey(
+        'forestry.Material',
+        on_delete=models.PROTECT,
+        verbose_name='Материал',
+        related_name='balance_snapshots'
+    )
+    quantity_pieces = models.DecimalField(
+        'Количество в штуках',
         max_digits=12,
         decimal_places=3,
-        validators=[MinValueValidator(0)],
-        null=True,
-        blank=True,
-        default=None
+        default=0
+    )
+    quantity_meters = models.DecimalField(
+        'Количество в погонных метрах',
+        max_digits=12,
+        decimal_places=3,
+        default=0
+    )
+    quantity_cubic = models.DecimalField(
+        'Количество в кубических метрах',
+        max_digits=12,
+        decimal_places=3,
+        default=0
+    )
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Снимок остатков'
+        verbose_name_plural = 'Снимки остатков'
+        ordering = ['-snapshot_date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['snapshot_date', 'storage_location', 'material'],
+                name='unique_balance_snapshot'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['cutoff', 'storage_location']),
+        ]
+
+    def __str__(self):
+        return f"{self.snapshot_date}: {self.material} ({self.storage_location})"
+
+
+class Conversion(models.Model):
+    """
+    Документ конвертации древесины: списание одного исходного материала
+    и создание одного или нескольких материалов (выходы, ConversionOutput)
+
+    Например, распиловка бревен дает доски, брус, горбыль и опилки -
+    один документ с четырьмя выходами проводится одной операцией BalanceEngine.
+    """
+
+    # Тип источника и поле даты документа для записей журнала остатков (StockLedgerEntry)
+    LEDGER_SOURCE = 'Конвертация'
+    LEDGER_DATE_FIELD = 'conversion_date'
+
+    conversion_date = models.DateTimeField(
+        'Дата конвертации',
+        default=timezone.now
     )
 
-    target_material = models.ForeignKey(
+    storage_location = models.ForeignKey(
+        'inventory.StorageLocation',
+        on_delete=models.PROTECT,
+        verbose_name='Место хранения',
+        limit_choices_to={'source_type': 'склад'}
+    )
+
+    source_material = models.ForeignKey(
         'forestry.Material',
         on_delete=models.PROTECT,
-        verbose_name='Целевой материал',
-        related_name='conversions_target'
+        verbose_name='Исходный материал',
+        related_name='conversions_source'
     )
 
-    target_quantity_pieces = models.DecimalField(
-        'Количество в штуках (создание)',
+    source_quantity_pieces = models.DecimalField(
+        'Количество в штуках (списание)',
         max_digits=12,
         decimal_places=3,
         validators=[MinValueValidator(0)],
@@ -943,8 +1572,8 @@ class Conversion(models.Model):
         default=None
     )
 
-    target_quantity_meters = models.DecimalField(
-        'Количество в погонных метрах (создание)',
+    source_quantity_meters = models.DecimalField(
+        'Количество в погонных метрах (списание)',
         max_digits=12,
         decimal_places=3,
         validators=[MinValueValidator(0)],
@@ -953,8 +1582,8 @@ class Conversion(models.Model):
         default=None
     )
 
-    target_quantity_cubic = models.DecimalField(
-        'Количество в кубических метрах (создание)',
+    source_quantity_cubic = models.DecimalField(
+        'Количество в кубических метрах (списание)',
         max_digits=12,
         decimal_places=3,
         validators=[MinValueValidator(0)],
@@ -1015,85 +1644,101 @@ class Conversion(models.Model):
         if not self.source_quantity_pieces and not self.source_quantity_meters and not self.source_quantity_cubic:
             raise ValidationError('Необходимо указать хотя бы одно количество для списания')
 
-        if not self.target_quantity_pieces and not self.target_quantity_meters and not self.target_quantity_cubic:
-            raise ValidationError('Необходимо указать хотя бы одно количество для создания')
-
         if self.source_material and self.source_material.material_type != 'древесина':
             raise ValidationError('Исходный материал должен быть типа "древесина"')
 
-        if self.target_material and self.target_material.material_type != 'древесина':
-            raise ValidationError('Целевой материал должен быть типа "древесина"')
-
-        if self.source_material == self.target_material:
-            raise ValidationError('Исходный и целевой материалы должны быть разными')
-
-    def execute_conversion(self):
-        """Выполнение конвертации (списание исходного и создание целевого материала)"""
-        from .models import MaterialBalance
-
-        if self.is_completed:
-            raise ValueError("Конвертация уже выполнена")
-
-        try:
-            source_balance = MaterialBalance.objects.get(
-                storage_location=self.storage_location,
-                material=self.source_material
+    def calculate_yield(self, output):
+        """
+        Доля выхода материала от исходного (0.6 = 60%)
+
+        Считается по первой общей единице: кубометры, погонные метры, штуки.
+        None, если общей единицы нет.
+        """
+        for field in ConversionOutput.YIELD_FIELDS:
+            source_quantity = getattr(self, f'source_{field}') or 0
+            output_quantity = getattr(output, field) or 0
+            if source_quantity > 0 and output_quantity > 0:
+                return (Decimal(output_quantity) / Decimal(source_quantity)).quantize(ConversionOutput.YIELD_PRECISION)
+        return None
+
+    def save_outputs(self, outputs):
+        """
+        Записывает выходы конвертации (прежние удаляются) с долями выхода
+
+        Args:
+            outputs: несохраненные ConversionOutput (conversion заполняется здесь)
+
+        Returns:
+            list сохраненных выходов
+        """
+        for output in outputs:
+            output.conversion = self
+            output.yield_ratio = self.calculate_yield(output)
+
+        self.outputs.all().delete()
+        return ConversionOutput.objects.bulk_create(outputs)
+
+    def get_balance_changes(self, outputs=None):
+        """
+        Изменения остатков, которые вносит проведенная конвертация
+
+        Args:
+            outputs: выходы (по умолчанию - сохраненные, с учетом prefetch_related)
+        """
+        from Forest_apps.inventory.services import BalanceEngine
+
+        if outputs is None:
+            outputs = self.outputs.all()
+
+        return [
+            BalanceEngine.debit(
+                self.storage_location, self.source_material,
+                self.source_quantity_pieces, self.source_quantity_meters, self.source_quantity_cubic
+            ),
+        ] + [
+            BalanceEngine.credit(
+                self.storage_location, output.material,
+                output.quantity_pieces, output.quantity_meters, output.quantity_cubic
             )
-        except MaterialBalance.DoesNotExist:
-            raise ValueError(
-                f"Материал {self.source_material.name} отсутствует на складе {self.storage_location.get_source_name()}")
+            for output in outputs
+        ]
 
-        if self.source_quantity_pieces and source_balance.quantity_pieces < self.source_quantity_pieces:
-            raise ValueError(
-                f"Недостаточно исходного материала в штуках: есть {source_balance.quantity_pieces}, требуется {self.source_quantity_pieces}"
-            )
-        if self.source_quantity_meters and (source_balance.quantity_meters or 0) < self.source_quantity_meters:
-            raise ValueError(
-                f"Недостаточно исходного материала в погонных метрах: есть {source_balance.quantity_meters or 0}, требуется {self.source_quantity_meters}"
-            )
-        if self.source_quantity_cubic and (source_balance.quantity_cubic or 0) < self.source_quantity_cubic:
-            raise ValueError(
-                f"Недостаточно исходного материала в кубических метрах: есть {source_balance.quantity_cubic or 0}, требуется {self.source_quantity_cubic}"
-            )
+    def validate_for_execution(self, outputs=None):
+        """Проверка остатка исходного материала перед проведением (без записи)"""
+        from Forest_apps.inventory.services import BalanceEngine
 
-        if self.source_quantity_pieces:
-            source_balance.quantity_pieces -= self.source_quantity_pieces
-        if self.source_quantity_meters:
-            source_balance.quantity_meters = (source_balance.quantity_meters or 0) - self.source_quantity_meters
-        if self.source_quantity_cubic:
-            source_balance.quantity_cubic = (source_balance.quantity_cubic or 0) - self.source_quantity_cubic
+        BalanceEngine.check(self.get_balance_changes(outputs))
 
-        source_balance.save()
+    def execute_conversion(self, outputs=None):
+        """
+        Выполнение конвертации (списание исходного и создание всех выходов одной операцией)
 
-        try:
-            target_balance = MaterialBalance.objects.get(
-                storage_location=self.storage_location,
-                material=self.target_material
-            )
+        Args:
+            outputs: выходы, если они уже в памяти (иначе читаются из БД)
+        """
+        from Forest_apps.inventory.services import BalanceEngine
 
-            if self.target_quantity_pieces:
-                target_balance.quantity_pieces += self.target_quantity_pieces
-            if self.target_quantity_meters:
-                target_balance.quantity_meters = (target_balance.quantity_meters or 0) + self.target_quantity_meters
-            if self.target_quantity_cubic:
-                target_balance.quantity_cubic = (target_balance.quantity_cubic or 0) + self.target_quantity_cubic
+        if self.is_completed:
+            raise ValueError("Конвертация уже выполнена")
 
-            target_balance.save()
+        with transaction.atomic():
+            self.completed_at = timezone.now()
+            if self.pk:
+                updated = type(self).objects.filter(pk=self.pk, is_completed=False).update(
+                    is_completed=True,
+                    completed_at=self.completed_at
+                )
+                if not updated:
+                    raise ValueError("Конвертация уже выполнена")
+            self.is_completed = True
 
-        except MaterialBalance.DoesNotExist:
-            MaterialBalance.objects.create(
-                storage_location=self.storage_location,
-                material=self.target_material,
-                quantity_pieces=self.target_quantity_pieces or 0,
-                quantity_meters=self.target_quantity_meters or 0,
-                quantity_cubic=self.target_quantity_cubic or 0,
+            BalanceEngine.apply(
+                self.get_balance_changes(outputs),
                 created_by=self.created_by,
-                created_by_position=self.created_by_position
+                created_by_position=self.created_by_position,
+                source=self
             )
-
-        self.is_completed = True
-        self.completed_at = timezone.now()
-        self.save()
+            self.save()
 
         return True
 
@@ -1110,21 +1755,110 @@ class Conversion(models.Model):
         return ", ".join(parts) if parts else "0"
 
     @property
-    def target_quantity_display(self):
-        """Возвращает строковое представление количества целевого материала"""
+    def total_yield_percent(self):
+        """Суммарный выход в процентах (по выходам с долей; использует prefetch_related('outputs'))"""
+        ratios = [output.yield_ratio for output in self.outputs.all() if output.yield_ratio is not None]
+        return (sum(ratios) * 100).quantize(Decimal('0.1')) if ratios else None
+
+
+class ConversionOutput(models.Model):
+    """Выход конвертации: созданный материал, количество и доля выхода от исходного"""
+
+    # Единицы для доли выхода в порядке приоритета
+    YIELD_FIELDS = ('quantity_cubic', 'quantity_meters', 'quantity_pieces')
+    YIELD_PRECISION = Decimal('0.0001')
+
+    conversion = models.ForeignKey(
+        Conversion,
+        on_delete=models.CASCADE,
+        verbose_name='Конвертация',
+        related_name='outputs'
+    )
+
+    material = models.ForeignKey(
+        'forestry.Material',
+        on_delete=models.PROTECT,
+        verbose_name='Материал',
+        related_name='conversion_outputs'
+    )
+
+    quantity_pieces = models.DecimalField(
+        'Количество в штуках',
+        max_digits=12,
+        decimal_places=3,
+        validators=[MinValueValidator(0)],
+        null=True,
+        blank=True,
+        default=None
+    )
+
+    quantity_meters = models.DecimalField(
+        'Количество в погонных метрах',
+        max_digits=12,
+        decimal_places=3,
+        validators=[MinValueValidator(0)],
+        null=True,
+        blank=True,
+        default=None
+    )
+
+    quantity_cubic = models.DecimalField(
+        'Количество в кубических метрах',
+        max_digits=12,
+        decimal_places=3,
+        validators=[MinValueValidator(0)],
+        null=True,
+        blank=True,
+        default=None
+    )
+
+    yield_ratio = models.DecimalField(
+        'Доля выхода',
+        max_digits=7,
+        decimal_places=4,
+        null=True,
+        blank=True,
+        help_text='Количество выхода к количеству исходного материала в той же единице (0.6 = 60%)'
+    )
+
+    class Meta:
+        verbose_name = 'Выход конвертации'
+        verbose_name_plural = 'Выходы конвертации'
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['conversion', 'material'], name='unique_conversion_output_material'),
+        ]
+
+    def __str__(self):
+        return f"{self.material} ({self.quantity_display})"
+
+    @property
+    def quantity_display(self):
+        """Возвращает строковое представление количества"""
         parts = []
-        if self.target_quantity_pieces and self.target_quantity_pieces > 0:
-            parts.append(f"{self.target_quantity_pieces} шт")
-        if self.target_quantity_meters and self.target_quantity_meters > 0:
-            parts.append(f"{self.target_quantity_meters} м.п.")
-        if self.target_quantity_cubic and self.target_quantity_cubic > 0:
-            parts.append(f"{self.target_quantity_cubic} м³")
+        if self.quantity_pieces and self.quantity_pieces > 0:
+            parts.append(f"{self.quantity_pieces} шт")
+        if self.quantity_meters and self.quantity_meters > 0:
+            parts.append(f"{self.quantity_meters} м.п.")
+        if self.quantity_cubic and self.quantity_cubic > 0:
+            parts.append(f"{self.quantity_cubic} м³")
         return ", ".join(parts) if parts else "0"
 
+    @property
+    def yield_percent(self):
+        """Доля выхода в процентах"""
+        if self.yield_ratio is None:
+            return None
+        return (self.yield_ratio * 100).quantize(Decimal('0.1'))
+
 
 class Receipt(models.Model):
     """Документ поступления материалов"""
 
+    # Тип источника и поле даты документа для записей журнала остатков (StockLedgerEntry)
+    LEDGER_SOURCE = 'Поступление'
+    LEDGER_DATE_FIELD = 'receipt_date'
+
     receipt_date = models.DateTimeField(
         'Дата поступления',
         default=timezone.now
@@ -1265,6 +1999,17 @@ class Receipt(models.Model):
 
         super().save(*args, **kwargs)
 
+    def get_balance_changes(self):
+        """Изменения остатков, которые вносит поступление"""
+        from Forest_apps.inventory.services import BalanceEngine
+
+        return [
+            BalanceEngine.credit(
+                self.storage_location, self.material,
+                self.quantity_pieces, self.quantity_meters, self.quantity_cubic
+            )
+        ]
+
     @property
     def can_edit(self):
         """Проверка, можно ли редактировать поступление (5 дней)"""
@@ -1281,4 +2026,4 @@ class Receipt(models.Model):
             parts.append(f"{self.quantity_meters} м.п.")
         if self.quantity_cubic and self.quantity_cubic > 0:
             parts.append(f"{self.quantity_cubic} м³")
-        return ", ".join(parts) if parts else "0"
\ No newline at end of file
+        return ", ".join(parts) if parts else "0"
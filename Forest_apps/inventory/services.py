@@ -1,6 +1,500 @@
 # Forest_apps/inventory/services.py
-from Forest_apps.inventory.models import StorageLocation
+import base64
+import datetime
+import hashlib
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import DecimalField, F, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from Forest_apps.inventory.models import (
+    StorageLocation, MaterialBalance, StockLedgerEntry, BalanceSnapshot, StockThreshold, LowStockAlert,
+    MaterialMovement, MovementDocument, Conversion, ConversionOutput, Receipt
+)
 from Forest_apps.core.models import Warehouse, Brigade, Vehicle, Counterparty, Position
+from Forest_apps.core.services import CacheVersions
+
+
+class OwnedLocationResolver:
+    """
+    Резолвер мест хранения, принадлежащих должности (или пользователю).
+
+    Все места хранения владельца получаются одним запросом к StorageLocation
+    с подзапросами к Warehouse/Brigade/Vehicle/Counterparty. Результат
+    кэшируется (django cache) под ключом с версией из CacheVersions - она общая
+    для всех воркеров: сохранение/удаление справочников core увеличивает ее
+    после фиксации транзакции (см. signals.py), и прежние данные не читает
+    ни один процесс. Внутри одного запроса результат дополнительно
+    запоминается на объекте request.
+    """
+
+    CACHE_PREFIX = 'owned_locations'
+    VERSION_NAME = 'owned_locations'
+    CACHE_TIMEOUT = 60 * 10
+
+    # Типы мест хранения, которыми может владеть должность
+    SOURCE_MODELS = {
+        'склад': Warehouse,
+        'бригады': Brigade,
+        'автомобиль': Vehicle,
+        'контрагент': Counterparty,
+    }
+
+    # Места хранения, по которым определяются "свои" движения (без контрагентов)
+    OWN_SOURCE_TYPES = ('склад', 'бригады', 'автомобиль')
+
+    @classmethod
+    def get_version(cls):
+        """Версия кэша владельцев (меняется при изменении справочников)"""
+        return CacheVersions.get(cls.VERSION_NAME)
+
+    @classmethod
+    def invalidate(cls):
+        """Сбрасывает кэш владельцев во всех процессах (после фиксации изменений справочников)"""
+        CacheVersions.bump(cls.VERSION_NAME)
+
+    @classmethod
+    def _key(cls, *parts):
+        return ':'.join([cls.CACHE_PREFIX, str(cls.get_version())] + [str(p) for p in parts])
+
+    @classmethod
+    def get_position_id(cls, position):
+        """
+        Возвращает ID должности
+
+        Args:
+            position: Position, ID должности или название должности (из сессии)
+
+        Returns:
+            int или None, если должность не найдена
+        """
+        if not position:
+            return None
+        if isinstance(position, Position):
+            return position.id
+        if isinstance(position, int):
+            return position
+
+        name = str(position).strip()
+        key = cls._key('position', hashlib.md5(name.lower().encode('utf-8')).hexdigest())
+        position_id = cache.get(key)
+        if position_id is None:
+            position_id = Position.objects.filter(
+                name__iexact=name
+            ).values_list('id', flat=True).first() or 0
+            cache.set(key, position_id, cls.CACHE_TIMEOUT)
+
+        return position_id or None
+
+    @classmethod
+    def _load(cls, owner_key, owner_filter):
+        """Один запрос: {source_type: [location_id, ...]} для владельца"""
+        key = cls._key(owner_key)
+        locations = cache.get(key)
+        if locations is not None:
+            return locations
+
+        condition = Q()
+        for source_type, model in cls.SOURCE_MODELS.items():
+            condition |= Q(
+                source_type=source_type,
+                source_id__in=model.objects.filter(**owner_filter).values('id')
+            )
+
+        locations = {source_type: [] for source_type in cls.SOURCE_MODELS}
+        rows = StorageLocation.objects.filter(condition).order_by('id').values_list('id', 'source_type')
+        for location_id, source_type in rows:
+            locations[source_type].append(location_id)
+
+        cache.set(key, locations, cls.CACHE_TIMEOUT)
+        return locations
+
+    @staticmethod
+    def select(locations, source_types):
+        """ID мест хранения нужных типов из {source_type: [location_id, ...]}"""
+        if source_types is None:
+            source_types = OwnedLocationResolver.OWN_SOURCE_TYPES
+        elif isinstance(source_types, str):
+            source_types = (source_types,)
+
+        location_ids = []
+        for source_type in source_types:
+            location_ids.extend(locations.get(source_type, []))
+        return location_ids
+
+    @classmethod
+    def get_location_ids(cls, position, source_types=None):
+        """
+        Получает ID мест хранения, созданных должностью
+
+        Args:
+            position: Position, ID или название должности
+            source_types: тип или список типов мест хранения
+                          (по умолчанию склады, бригады и транспорт)
+
+        Returns:
+            list ID StorageLocation
+        """
+        position_id = cls.get_position_id(position)
+        if not position_id:
+            return []
+
+        locations = cls._load(f'position:{position_id}', {'created_by_position_id': position_id})
+        return cls.select(locations, source_types)
+
+    @classmethod
+    def get_user_location_ids(cls, user, source_types=None):
+        """Получает ID мест хранения, созданных пользователем"""
+        if not user or not user.is_authenticated:
+            return []
+
+        locations = cls._load(f'user:{user.pk}', {'created_by_id': user.pk})
+        return cls.select(locations, source_types)
+
+    @classmethod
+    def get_locations(cls, position):
+        """
+        Все места хранения должности по типам
+
+        Returns:
+            dict {source_type: [location_id, ...]} (пустой, если должность не найдена)
+        """
+        position_id = cls.get_position_id(position)
+        if not position_id:
+            return {}
+        return cls._load(f'position:{position_id}', {'created_by_position_id': position_id})
+
+    @classmethod
+    def for_request(cls, request, source_types=None):
+        """
+        ID мест хранения должности из сессии
+
+        Берутся из request.role (RoleMiddleware), без него - запоминаются
+        на объекте request на время запроса.
+
+        Args:
+            request: HttpRequest (должность берется из session['position_name'])
+            source_types: тип или список типов мест хранения
+
+        Returns:
+            list ID StorageLocation
+        """
+        role = getattr(request, 'role', None)
+        if role is not None:
+            return role.location_ids(source_types)
+
+        position_name = request.session.get('position_name')
+        memo = getattr(request, '_owned_locations', None)
+        if memo is None:
+            memo = request._owned_locations = {}
+
+        if position_name not in memo:
+            memo[position_name] = cls.get_locations(position_name)
+
+        return cls.select(memo[position_name], source_types)
+
+
+class ReferenceDataCache:
+    """
+    Кэш справочных данных: должности, материалы, типы операций, лесничества,
+    склады/транспорт/бригады/контрагенты, места хранения и водители
+
+    Версии хранятся в БД (CacheVersions) и общие для всех воркеров и серверов.
+    Общая версия (VERSION_NAME) - время последнего изменения справочников
+    в миллисекундах: она служит для ETag и Last-Modified ответов API
+    (см. views/material_movement.py) и для ключей get_or_build.
+
+    Кроме нее у каждой таблицы справочника своя версия (table_versions).
+    Сохранение/удаление строки увеличивает версию своей таблицы после
+    фиксации транзакции (bump, signals.py). Данные хранятся в django cache
+    под ключом из версий таблиц, из которых они собраны, и дополнительно
+    в памяти процесса (_local, не дольше LOCAL_TIMEOUT): пока версии
+    не изменились, воркер отдает данные без запросов к БД и без распаковки.
+    Версии читаются одним запросом на HTTP-запрос.
+    """
+
+    CACHE_PREFIX = 'reference_data'
+    VERSION_NAME = 'reference_data'
+    TABLE_VERSION_PREFIX = 'reference_data:table'
+    CACHE_TIMEOUT = 60 * 60
+    LOCAL_TIMEOUT = 60 * 5
+
+    # Данные, собранные процессом: {имя: (версии таблиц, данные, срок годности по time.monotonic)}
+    _local = {}
+
+    @classmethod
+    def get_version(cls):
+        return CacheVersions.get(cls.VERSION_NAME)
+
+    @classmethod
+    def invalidate(cls):
+        """Сбрасывает кэш справочных данных во всех процессах (после фиксации изменений справочников)"""
+        CacheVersions.bump(cls.VERSION_NAME)
+
+    @classmethod
+    def last_modified(cls):
+        """Время последнего изменения справочников (для заголовка Last-Modified)"""
+        return datetime.datetime.fromtimestamp(cls.get_version() / 1000, tz=datetime.timezone.utc)
+
+    @classmethod
+    def etag(cls, *parts):
+        """ETag данных: версия справочников + параметры запроса"""
+        digest = hashlib.md5(':'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:12]
+        return f'{cls.get_version()}-{digest}'
+
+    @classmethod
+    def get_or_build(cls, builder, *parts):
+        """
+        Возвращает данные из кэша или строит их и кладет в кэш
+
+        Args:
+            builder: функция без аргументов, возвращающая данные для JSON
+            parts: части ключа (параметры запроса)
+        """
+        digest = hashlib.md5(':'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+        key = f'{cls.CACHE_PREFIX}:{cls.get_version()}:{digest}'
+        data = cache.get(key)
+        if data is None:
+            data = builder()
+            cache.set(key, data, cls.CACHE_TIMEOUT)
+        return data
+
+    # ---------- Версии таблиц ----------
+
+    @staticmethod
+    def reference_models():
+        """Таблицы справочников, изменения которых увеличивают их версию"""
+        from Forest_apps.employees.models import Employee
+        from Forest_apps.forestry.models import Material, Forestry
+        from Forest_apps.operations.models import OperationType
+
+        return (
+            Position, Material, OperationType, Forestry,
+            Warehouse, Vehicle, Brigade, Counterparty, StorageLocation, Employee,
+        )
+
+    @classmethod
+    def _table_key(cls, model):
+        return f'{cls.TABLE_VERSION_PREFIX}:{model._meta.label_lower}'
+
+    @classmethod
+    def table_versions(cls, models):
+        """Версии таблиц (CacheVersions)"""
+        keys = [cls._table_key(model) for model in models]
+        versions = CacheVersions.get_many(keys)
+        return tuple(versions[key] for key in keys)
+
+    @classmethod
+    def bump(cls, model):
+        """Увеличивает версию таблицы: данные из нее пересобираются во всех процессах"""
+        CacheVersions.bump(cls._table_key(model))
+
+    @classmethod
+    def invalidate_tables(cls):
+        """Сбрасывает данные всех таблиц (после массовых изменений без сигналов)"""
+        CacheVersions.bump(cls.VERSION_NAME, *(cls._table_key(model) for model in cls.reference_models()))
+
+    @classmethod
+    def cached(cls, name, models, builder):
+        """
+        Данные, собранные из таблиц models, с учетом их версий
+
+        Порядок поиска: память процесса, django cache, builder().
+
+        Args:
+            name: имя набора данных
+            models: модели, из которых собираются данные
+            builder: функция без аргументов, возвращающая данные
+        """
+        versions = cls.table_versions(models)
+        now = time.monotonic()
+
+        local = cls._local.get(name)
+        if local is not None and local[0] == versions and local[2] > now:
+            return local[1]
+
+        key = f'{cls.CACHE_PREFIX}:{name}:' + '.'.join(str(version) for version in versions)
+        data = cache.get(key)
+        if data is None:
+            data = builder()
+            cache.set(key, data, cls.CACHE_TIMEOUT)
+
+        cls._local[name] = (versions, data, now + cls.LOCAL_TIMEOUT)
+        return data
+
+    @classmethod
+    def rows(cls, model):
+        """Все строки таблицы: кортежи значений полей в порядке _meta.concrete_fields"""
+        attnames = [field.attname for field in model._meta.concrete_fields]
+        return cls.cached(
+            f'rows:{model._meta.label_lower}', (model,),
+            lambda: list(model.objects.order_by('pk').values_list(*attnames))
+        )
+
+    @classmethod
+    def objects(cls, model):
+        """Все строки таблицы как новые объекты модели (можно изменять и сохранять)"""
+        attnames = [field.attname for field in model._meta.concrete_fields]
+        return [model.from_db('default', attnames, row) for row in cls.rows(model)]
+
+    @classmethod
+    def get_position(cls, name):
+        """
+        Должность по названию без учета регистра (замена Position.objects.get(name__iexact=...))
+
+        Raises:
+            Position.DoesNotExist: должность не найдена
+            Position.MultipleObjectsReturned: найдено несколько должностей
+        """
+        name = (name or '').lower()
+        name_index = [field.attname for field in Position._meta.concrete_fields].index('name')
+        found = [row for row in cls.rows(Position) if name and row[name_index].lower() == name]
+
+        if not found:
+            raise Position.DoesNotExist('Position matching query does not exist.')
+        if len(found) > 1:
+            raise Position.MultipleObjectsReturned(f'get() returned more than one Position -- it returned {len(found)}!')
+
+        attnames = [field.attname for field in Position._meta.concrete_fields]
+        return Position.from_db('default', attnames, found[0])
+
+    # ---------- Варианты выпадающих списков ----------
+
+    @staticmethod
+    def apply_choices(field, options):
+        """
+        Варианты ModelChoiceField из кэша вместо запроса при выводе формы
+
+        Queryset поля остается: по нему проверяется отправленное значение.
+
+        Args:
+            field: ModelChoiceField
+            options: [(id, подпись), ...]
+        """
+        choices = list(options)
+        if field.empty_label is not None:
+            choices.insert(0, ('', field.empty_label))
+        field.choices = choices
+
+    @classmethod
+    def storage_locations(cls):
+        """Места хранения: [{'id', 'source_type', 'label'}] по типу и ID"""
+        # Подписи берутся из источников, если название не сохранено в месте хранения
+        models = (StorageLocation,) + tuple(OwnedLocationResolver.SOURCE_MODELS.values())
+
+        def build():
+            locations = StorageLocation.objects.order_by('source_type', 'id').with_source_names()
+            return [
+                {'id': location.id, 'source_type': location.source_type, 'label': str(location)}
+                for location in locations
+            ]
+
+        return cls.cached('storage_locations', models, build)
+
+    @classmethod
+    def vehicles(cls):
+        """Транспорт: [(id, подпись)] по марке и модели"""
+        return cls.cached('vehicles', (Vehicle,), lambda: [
+            (vehicle.id, str(vehicle)) for vehicle in Vehicle.objects.order_by('brand', 'model')
+        ])
+
+    @classmethod
+    def drivers(cls):
+        """Активные сотрудники с должностью "водитель": [{'id', 'last_name', 'first_name', 'label'}]"""
+        from Forest_apps.employees.models import Employee
+
+        return cls.cached('drivers', (Employee, Position), lambda: [
+            {
+                'id': employee.id,
+                'last_name': employee.last_name,
+                'first_name': employee.first_name,
+                'label': str(employee),
+            }
+            for employee in Employee.objects.filter(
+                position__name__iexact='водитель', is_active=True
+            ).order_by('last_name', 'first_name')
+        ])
+
+    @classmethod
+    def operation_types(cls):
+        """Активные типы операций: [(id, подпись)]"""
+        from Forest_apps.operations.models import OperationType
+
+        return cls.cached('operation_types', (OperationType,), lambda: [
+            (operation_type.id, str(operation_type))
+            for operation_type in OperationType.objects.filter(is_active=True).order_by('name')
+        ])
+
+    @staticmethod
+    def material_choices(materials):
+        """[(id, подпись)] для списка материалов из materials()"""
+        return [(m['id'], f"{m['type_display']} - {m['name']}") for m in materials]
+
+    @classmethod
+    def materials(cls):
+        """Список материалов для выпадающих списков"""
+        from Forest_apps.forestry.models import Material
+
+        def build():
+            materials = Material.objects.order_by('material_type', 'name')
+            return [
+                {
+                    'id': m.id,
+                    'name': m.name,
+                    'type': m.material_type,
+                    'type_display': m.get_material_type_display()
+                }
+                for m in materials
+            ]
+
+        return cls.cached('materials', (Material,), build)
+
+    @classmethod
+    def locations_by_type(cls, movement_type, position_name):
+        """
+        Места хранения "откуда"/"куда" для типа движения и должности
+
+        Returns:
+            dict {'from_locations': [...], 'to_locations': [...]}
+        """
+        position_id = OwnedLocationResolver.get_position_id(position_name)
+
+        def build():
+            user_location_ids = OwnedLocationResolver.get_location_ids(position_id) if position_id else []
+
+            from_locations = StorageLocation.objects.none()
+            to_locations = StorageLocation.objects.none()
+
+            if movement_type == 'Перемещение':
+                from_locations = StorageLocation.objects.filter(id__in=user_location_ids)
+                to_locations = StorageLocation.objects.filter(id__in=user_location_ids)
+
+            elif movement_type == 'Отправление':
+                from_locations = StorageLocation.objects.filter(id__in=user_location_ids)
+                to_locations = StorageLocation.objects.exclude(id__in=user_location_ids).exclude(source_type='контрагент')
+
+            elif movement_type == 'Реализация':
+                from_locations = StorageLocation.objects.filter(source_type='склад')
+                to_locations = StorageLocation.objects.filter(source_type='контрагент')
+
+            elif movement_type == 'Списание':
+                from_locations = StorageLocation.objects.filter(id__in=user_location_ids, source_type='склад')
+                to_locations = StorageLocation.objects.filter(id__in=user_location_ids).exclude(source_type='контрагент')
+
+            from_locations = from_locations.order_by('source_type', 'id').with_source_names()
+            to_locations = to_locations.order_by('source_type', 'id').with_source_names()
+
+            return {
+                'from_locations': [{'id': loc.id, 'name': loc.get_source_name()} for loc in from_locations],
+                'to_locations': [{'id': loc.id, 'name': loc.get_source_name()} for loc in to_locations]
+            }
+
+        return cls.get_or_build(build, 'locations', movement_type, position_id)
 
 
 class StorageLocationService:
@@ -17,22 +511,8 @@ class StorageLocationService:
         Returns:
             QuerySet StorageLocation (только склады)
         """
-        if not position_name:
-            return StorageLocation.objects.none()
-
-        position = Position.objects.filter(name__iexact=position_name).first()
-        if not position:
-            return StorageLocation.objects.none()
-
-        warehouses = Warehouse.objects.filter(created_by_position=position)
-
-        location_ids = []
-        for wh in warehouses:
-            loc = StorageLocation.objects.filter(source_type='склад', source_id=wh.id).first()
-            if loc:
-                location_ids.append(loc.id)
-
-        return StorageLocation.objects.filter(id__in=location_ids).order_by('source_type')
+        location_ids = OwnedLocationResolver.get_location_ids(position_name, 'склад')
+        return StorageLocation.objects.filter(id__in=location_ids).order_by('source_type').with_source_names()
 
     @staticmethod
     def get_user_vehicles_by_position_name(position_name):
@@ -45,22 +525,8 @@ class StorageLocationService:
         Returns:
             QuerySet StorageLocation (только транспорт)
         """
-        if not position_name:
-            return StorageLocation.objects.none()
-
-        position = Position.objects.filter(name__iexact=position_name).first()
-        if not position:
-            return StorageLocation.objects.none()
-
-        vehicles = Vehicle.objects.filter(created_by_position=position)
-
-        location_ids = []
-        for vh in vehicles:
-            loc = StorageLocation.objects.filter(source_type='автомобиль', source_id=vh.id).first()
-            if loc:
-                location_ids.append(loc.id)
-
-        return StorageLocation.objects.filter(id__in=location_ids).order_by('source_type')
+        location_ids = OwnedLocationResolver.get_location_ids(position_name, 'автомобиль')
+        return StorageLocation.objects.filter(id__in=location_ids).order_by('source_type').with_source_names()
 
     @staticmethod
     def get_user_brigades_by_position_name(position_name):
@@ -73,22 +539,8 @@ class StorageLocationService:
         Returns:
             QuerySet StorageLocation (только бригады)
         """
-        if not position_name:
-            return StorageLocation.objects.none()
-
-        position = Position.objects.filter(name__iexact=position_name).first()
-        if not position:
-            return StorageLocation.objects.none()
-
-        brigades = Brigade.objects.filter(created_by_position=position)
-
-        location_ids = []
-        for br in brigades:
-            loc = StorageLocation.objects.filter(source_type='бригады', source_id=br.id).first()
-            if loc:
-                location_ids.append(loc.id)
-
-        return StorageLocation.objects.filter(id__in=location_ids).order_by('source_type')
+        location_ids = OwnedLocationResolver.get_location_ids(position_name, 'бригады')
+        return StorageLocation.objects.filter(id__in=location_ids).order_by('source_type').with_source_names()
 
     @staticmethod
     def get_user_counterparties_by_position_name(position_name):
@@ -101,22 +553,8 @@ class StorageLocationService:
         Returns:
             QuerySet StorageLocation (только контрагенты)
         """
-        if not position_name:
-            return StorageLocation.objects.none()
-
-        position = Position.objects.filter(name__iexact=position_name).first()
-        if not position:
-            return StorageLocation.objects.none()
-
-        counterparties = Counterparty.objects.filter(created_by_position=position)
-
-        location_ids = []
-        for cp in counterparties:
-            loc = StorageLocation.objects.filter(source_type='контрагент', source_id=cp.id).first()
-            if loc:
-                location_ids.append(loc.id)
-
-        return StorageLocation.objects.filter(id__in=location_ids).order_by('source_type')
+        location_ids = OwnedLocationResolver.get_location_ids(position_name, 'контрагент')
+        return StorageLocation.objects.filter(id__in=location_ids).order_by('source_type').with_source_names()
 
     @staticmethod
     def get_user_storage_locations_by_position_name(position_name, source_type=None):
@@ -130,46 +568,1135 @@ class StorageLocationService:
         Returns:
             QuerySet StorageLocation
         """
-        if not position_name:
-            return StorageLocation.objects.none()
+        source_types = source_type or list(OwnedLocationResolver.SOURCE_MODELS)
+        location_ids = OwnedLocationResolver.get_location_ids(position_name, source_types)
 
-        position = Position.objects.filter(name__iexact=position_name).first()
-        if not position:
-            return StorageLocation.objects.none()
+        return StorageLocation.objects.filter(id__in=location_ids).order_by('source_type').with_source_names()
 
-        location_ids = []
 
-        # Склады
-        warehouses = Warehouse.objects.filter(created_by_position=position)
-        for wh in warehouses:
-            loc = StorageLocation.objects.filter(source_type='склад', source_id=wh.id).first()
-            if loc:
-                location_ids.append(loc.id)
-
-        # Бригады
-        brigades = Brigade.objects.filter(created_by_position=position)
-        for br in brigades:
-            loc = StorageLocation.objects.filter(source_type='бригады', source_id=br.id).first()
-            if loc:
-                location_ids.append(loc.id)
-
-        # Транспорт
-        vehicles = Vehicle.objects.filter(created_by_position=position)
-        for vh in vehicles:
-            loc = StorageLocation.objects.filter(source_type='автомобиль', source_id=vh.id).first()
-            if loc:
-                location_ids.append(loc.id)
-
-        # Контрагенты
-        counterparties = Counterparty.objects.filter(created_by_position=position)
-        for cp in counterparties:
-            loc = StorageLocation.objects.filter(source_type='контрагент', source_id=cp.id).first()
-            if loc:
-                location_ids.append(loc.id)
-
-        queryset = StorageLocation.objects.filter(id__in=location_ids)
-
-        if source_type:
-            queryset = queryset.filter(source_type=source_type)
-
-        return queryset.order_by('source_type')
\ No newline at end of file
+# Изменение остатка: положительные количества - поступление, отрицательные - списание
+BalanceChange = namedtuple(
+    'BalanceChange',
+    ['storage_location', 'material', 'quantity_pieces', 'quantity_meters', 'quantity_cubic']
+)
+
+
+class BalanceEngine:
+    """
+    Единая точка изменения остатков материалов (MaterialBalance)
+
+    Все изменения одной операции применяются в transaction.atomic:
+    - списание - условный UPDATE qty = qty - x WHERE qty >= x, поэтому
+      параллельные операции не могут увести остаток в минус или потерять обновление;
+    - поступление - UPDATE qty = qty + x, а если строки нет -
+      INSERT ... ON CONFLICT DO NOTHING (уникальность место хранения + материал)
+      и повторный UPDATE.
+    Строки остатков обновляются в порядке (storage_location_id, material_id),
+    поэтому операции над несколькими остатками не блокируют друг друга взаимно.
+    В той же транзакции изменения пишутся в журнал StockLedgerEntry
+    (один INSERT на операцию).
+    """
+
+    QUANTITY_FIELDS = ('quantity_pieces', 'quantity_meters', 'quantity_cubic')
+
+    UNIT_LABELS = {
+        'quantity_pieces': 'в штуках',
+        'quantity_meters': 'в погонных метрах',
+        'quantity_cubic': 'в кубических метрах',
+    }
+
+    @staticmethod
+    def credit(storage_location, material, quantity_pieces=None, quantity_meters=None, quantity_cubic=None):
+        """Поступление материала на место хранения"""
+        return BalanceChange(
+            storage_location, material,
+            quantity_pieces or 0, quantity_meters or 0, quantity_cubic or 0
+        )
+
+    @staticmethod
+    def debit(storage_location, material, quantity_pieces=None, quantity_meters=None, quantity_cubic=None):
+        """Списание материала с места хранения"""
+        return BalanceChange(
+            storage_location, material,
+            -(quantity_pieces or 0), -(quantity_meters or 0), -(quantity_cubic or 0)
+        )
+
+    @staticmethod
+    def reverse(changes):
+        """Обратные изменения (для отмены и редактирования документов)"""
+        return [
+            BalanceChange(
+                change.storage_location, change.material,
+                -change.quantity_pieces, -change.quantity_meters, -change.quantity_cubic
+            )
+            for change in changes
+        ]
+
+    @classmethod
+    def apply(cls, changes, created_by=None, created_by_position=None, source=None, reverted=None, reverted_date=None):
+        """
+        Атомарно применяет изменения остатков и записывает их в журнал
+
+        Изменения одного остатка суммируются, поэтому откат старого документа
+        и проведение нового проверяются по итоговой разнице.
+
+        Args:
+            changes: список BalanceChange
+            created_by, created_by_position: автор новых строк остатков и записей журнала
+            source: документ-источник (модель с атрибутами LEDGER_SOURCE и LEDGER_DATE_FIELD);
+                без него записи журнала получают тип "Корректировка" и дату проведения
+            reverted: изменения проведенного варианта документа при его исправлении -
+                откатываются той же операцией
+            reverted_date: дата документа до исправления; если она изменилась, откат
+                пишется в журнал отдельными записями на прежнюю дату
+
+        Raises:
+            ValueError: материала нет или недостаточно (ни одно изменение не применяется)
+        """
+        changes = list(changes)
+        reversal = cls.reverse(reverted or [])
+        merged = cls._merge(changes + reversal)
+        date_field = getattr(source, 'LEDGER_DATE_FIELD', None)
+        document_date = (getattr(source, date_field) if date_field else None) or timezone.now()
+
+        # Записи журнала: откат - на прежнюю дату документа, проведение - на текущую
+        if reversal and reverted_date is not None and reverted_date != document_date:
+            postings = [(cls._merge(reversal), reverted_date), (cls._merge(changes), document_date)]
+        else:
+            postings = [(merged, document_date)]
+
+        entries = []
+        for posting, date in postings:
+            for key in sorted(posting):
+                storage_location, material, deltas = posting[key]
+                deltas = {field: delta for field, delta in deltas.items() if delta}
+                if deltas:
+                    entries.append(StockLedgerEntry(
+                        storage_location=storage_location,
+                        material=material,
+                        source_type=getattr(source, 'LEDGER_SOURCE', 'Корректировка'),
+                        source_id=getattr(source, 'pk', None),
+                        document_date=date,
+                        created_by=created_by,
+                        created_by_position=created_by_position,
+                        **deltas
+                    ))
+
+        with transaction.atomic():
+            missing = []
+            for key in sorted(merged):
+                storage_location, material, deltas = merged[key]
+                deltas = {field: delta for field, delta in deltas.items() if delta}
+                if not deltas:
+                    continue
+
+                if cls._update(storage_location, material, deltas):
+                    continue
+
+                if any(delta < 0 for delta in deltas.values()):
+                    raise cls._insufficient_error(storage_location, material, deltas)
+
+                missing.append((storage_location, material, deltas))
+
+            if missing:
+                # Строк нет - создаем нулевые одним INSERT (параллельная вставка не приведет к дублю)
+                MaterialBalance.objects.bulk_create([
+                    MaterialBalance(
+                        storage_location=storage_location,
+                        material=material,
+                        quantity_pieces=0,
+                        quantity_meters=0,
+                        quantity_cubic=0,
+                        created_by=created_by,
+                        created_by_position=created_by_position
+                    )
+                    for storage_location, material, deltas in missing
+                ], ignore_conflicts=True)
+
+                for storage_location, material, deltas in missing:
+                    cls._update(storage_location, material, deltas)
+
+            if entries:
+                StockLedgerEntry.objects.bulk_create(entries)
+
+            # Оповещения "мало остатков" - только по затронутым строкам
+            LowStockMonitor.evaluate(key for key, (_, _, deltas) in merged.items() if any(deltas.values()))
+
+    @classmethod
+    def check(cls, changes):
+        """
+        Проверка остатков для списаний без изменения (до записи документа)
+
+        Окончательная проверка - условный UPDATE в apply: между check и apply
+        остаток может списать параллельная операция.
+
+        Raises:
+            ValueError: материала нет или недостаточно
+        """
+        for storage_location, material, deltas in cls._merge(changes).values():
+            debits = {field: delta for field, delta in deltas.items() if delta < 0}
+            if debits:
+                error = cls._shortage_error(storage_location, material, debits)
+                if error is not None:
+                    raise error
+
+    @classmethod
+    def _merge(cls, changes):
+        """Суммирование изменений по остатку: {(место, материал): [место, материал, {поле: дельта}]}"""
+        merged = {}
+        for change in changes:
+            key = (change.storage_location.pk, change.material.pk)
+            if key not in merged:
+                merged[key] = [change.storage_location, change.material, dict.fromkeys(cls.QUANTITY_FIELDS, 0)]
+            deltas = merged[key][2]
+            for field in cls.QUANTITY_FIELDS:
+                deltas[field] += getattr(change, field) or 0
+        return merged
+
+    @classmethod
+    def _update(cls, storage_location, material, deltas):
+        """Условный UPDATE остатка; возвращает количество обновленных строк"""
+        conditions = {
+            f'{field}__gte': -delta for field, delta in deltas.items() if delta < 0
+        }
+        updates = {
+            field: Coalesce(
+                F(field), Value(Decimal('0')),
+                output_field=DecimalField(max_digits=12, decimal_places=3)
+            ) + delta
+            for field, delta in deltas.items()
+        }
+        return MaterialBalance.objects.filter(
+            storage_location=storage_location,
+            material=material,
+            **conditions
+        ).update(last_updated=timezone.now(), **updates)
+
+    @classmethod
+    def _shortage_error(cls, storage_location, material, deltas):
+        """Ошибка нехватки по текущему остатку или None, если остатка хватает"""
+        balance = MaterialBalance.objects.filter(
+            storage_location=storage_location,
+            material=material
+        ).first()
+
+        if balance is None:
+            return ValueError(f"Материал {material.name} отсутствует на {storage_location.get_source_name()}")
+
+        for field, delta in deltas.items():
+            available = getattr(balance, field) or 0
+            if delta < 0 and available < -delta:
+                return ValueError(
+                    f"Недостаточно материала {material.name} {cls.UNIT_LABELS[field]} "
+                    f"на {storage_location.get_source_name()}: есть {available}, требуется {-delta}"
+                )
+
+        return None
+
+    @classmethod
+    def _insufficient_error(cls, storage_location, material, deltas):
+        error = cls._shortage_error(storage_location, material, deltas)
+        if error is not None:
+            return error
+
+        return ValueError(
+            f"Остаток материала {material.name} на {storage_location.get_source_name()} изменился, повторите операцию"
+        )
+
+
+class LowStockMonitor:
+    """
+    Набор остатков ниже порога (LowStockAlert)
+
+    Набор не пересчитывается целиком: после изменения остатков проверяются
+    только затронутые строки (место хранения + материал) - BalanceEngine и
+    StockLedger вызывают evaluate в своей транзакции. При изменении порогов
+    материала проверяются остатки этого материала (см. signals.py).
+
+    Порог для места хранения заменяет общий порог материала по той же единице.
+    """
+
+    QUANTITY_FIELDS = BalanceEngine.QUANTITY_FIELDS
+    CHUNK_SIZE = 1000
+
+    # Должности, которые видят оповещения по всем местам хранения
+    ALL_LOCATIONS_POSITIONS = ('руководитель', 'бухгалтер')
+
+    @classmethod
+    def evaluate(cls, keys):
+        """
+        Пересчет оповещений по остаткам
+
+        Args:
+            keys: пары (storage_location_id, material_id) измененных остатков
+        """
+        keys = sorted(set(keys))
+
+        for start in range(0, len(keys), cls.CHUNK_SIZE):
+            condition = Q()
+            for location_id, material_id in keys[start:start + cls.CHUNK_SIZE]:
+                condition |= Q(storage_location_id=location_id, material_id=material_id)
+
+            cls._evaluate_balances(list(MaterialBalance.objects.filter(condition)))
+
+    @classmethod
+    def evaluate_materials(cls, material_ids):
+        """Пересчет оповещений по всем остаткам материалов (после изменения порогов)"""
+        cls._evaluate_queryset(MaterialBalance.objects.filter(material_id__in=list(material_ids)))
+
+    @classmethod
+    def rebuild(cls):
+        """Полный пересчет набора (для команд обслуживания)"""
+        cls._evaluate_queryset(MaterialBalance.objects.filter(
+            material_id__in=StockThreshold.objects.filter(is_active=True).values('material_id')
+        ))
+        # Оповещения по материалам без действующих порогов
+        LowStockAlert.objects.exclude(threshold__is_active=True).delete()
+
+    @classmethod
+    def _evaluate_queryset(cls, balances):
+        chunk = []
+        for balance in balances.order_by('id').iterator(chunk_size=cls.CHUNK_SIZE):
+            chunk.append(balance)
+            if len(chunk) == cls.CHUNK_SIZE:
+                cls._evaluate_balances(chunk)
+                chunk = []
+        if chunk:
+            cls._evaluate_balances(chunk)
+
+    @classmethod
+    def _evaluate_balances(cls, balances):
+        if not balances:
+            return
+
+        thresholds = {}
+        for threshold in StockThreshold.objects.filter(
+            material_id__in={balance.material_id for balance in balances},
+            is_active=True
+        ):
+            thresholds[(threshold.material_id, threshold.storage_location_id, threshold.quantity_field)] = threshold
+
+        # Какие оповещения должны быть: {(id остатка, единица): (остаток, порог, количество)}
+        expected = {}
+        for balance in balances:
+            for field in cls.QUANTITY_FIELDS:
+                threshold = (
+                    thresholds.get((balance.material_id, balance.storage_location_id, field)) or
+                    thresholds.get((balance.material_id, None, field))
+                )
+                quantity = getattr(balance, field) or Decimal('0')
+                if threshold is not None and quantity < threshold.min_quantity:
+                    expected[(balance.id, field)] = (balance, threshold, quantity)
+
+        existing = {
+            (alert.balance_id, alert.quantity_field): alert
+            for alert in LowStockAlert.objects.filter(balance_id__in=[balance.id for balance in balances])
+        }
+
+        stale = [alert.id for key, alert in existing.items() if key not in expected]
+        changed = []
+        created = []
+        for key, (balance, threshold, quantity) in expected.items():
+            alert = existing.get(key)
+            if alert is None:
+                created.append(LowStockAlert(
+                    balance=balance,
+                    threshold=threshold,
+                    storage_location_id=balance.storage_location_id,
+                    material_id=balance.material_id,
+                    quantity_field=key[1],
+                    quantity=quantity,
+                    min_quantity=threshold.min_quantity
+                ))
+            elif (alert.quantity, alert.min_quantity, alert.threshold_id) != (quantity, threshold.min_quantity, threshold.id):
+                alert.quantity = quantity
+                alert.min_quantity = threshold.min_quantity
+                alert.threshold = threshold
+                changed.append(alert)
+
+        if stale:
+            LowStockAlert.objects.filter(id__in=stale).delete()
+        if changed:
+            LowStockAlert.objects.bulk_update(changed, ['quantity', 'min_quantity', 'threshold'])
+        if created:
+            LowStockAlert.objects.bulk_create(created, ignore_conflicts=True)
+
+    @classmethod
+    def location_ids_for_request(cls, request):
+        """
+        Места хранения, оповещения по которым видит пользователь
+
+        Returns:
+            None для руководителя и бухгалтера (все места), иначе ID мест хранения должности
+        """
+        role = getattr(request, 'role', None)
+        if role is not None:
+            return None if role.sees_all_locations else role.location_ids()
+
+        position_name = (request.session.get('position_name') or '').lower()
+        if position_name in cls.ALL_LOCATIONS_POSITIONS:
+            return None
+        return OwnedLocationResolver.for_request(request)
+
+    @staticmethod
+    def alerts(location_ids=None):
+        """
+        Текущие оповещения (при location_ids - только по этим местам хранения)
+
+        Returns:
+            QuerySet LowStockAlert, самые "глубокие" нехватки первыми
+        """
+        alerts = LowStockAlert.objects.select_related('material', 'storage_location')
+        if location_ids is not None:
+            alerts = alerts.filter(storage_location_id__in=list(location_ids))
+        return alerts.order_by(F('quantity') - F('min_quantity'), 'id')
+
+
+class StockLedger:
+    """
+    Пересчет и сверка остатков (MaterialBalance) по журналу StockLedgerEntry
+
+    Остаток - сумма всех записей журнала по месту хранения и материалу,
+    считается одним GROUP BY запросом.
+    """
+
+    QUANTITY_FIELDS = BalanceEngine.QUANTITY_FIELDS
+
+    @classmethod
+    def totals(cls, storage_location_ids=None):
+        """Суммы журнала: {(storage_location_id, material_id): {поле: сумма}}"""
+        entries = StockLedgerEntry.objects.all()
+        if storage_location_ids:
+            entries = entries.filter(storage_location_id__in=storage_location_ids)
+
+        rows = entries.values('storage_location_id', 'material_id').annotate(
+            **{f'total_{field}': Sum(field) for field in cls.QUANTITY_FIELDS}
+        ).order_by()
+
+        return {
+            (row['storage_location_id'], row['material_id']): {
+                field: row[f'total_{field}'] or Decimal('0') for field in cls.QUANTITY_FIELDS
+            }
+            for row in rows
+        }
+
+    @classmethod
+    def _balances(cls, storage_location_ids=None):
+        balances = MaterialBalance.objects.all()
+        if storage_location_ids:
+            balances = balances.filter(storage_location_id__in=storage_location_ids)
+        return balances
+
+    @classmethod
+    def drift(cls, storage_location_ids=None):
+        """
+        Расхождения остатков с журналом
+
+        Returns:
+            dict {storage_location_id: [{'material_id', 'field', 'balance', 'ledger'}, ...]}
+        """
+        return cls.compare(cls._balances(storage_location_ids), cls.totals(storage_location_ids), 'ledger')
+
+    @classmethod
+    def compare(cls, balances, expected, label):
+        """
+        Сравнение строк остатков с ожидаемыми количествами
+
+        Args:
+            balances: QuerySet MaterialBalance
+            expected: {(storage_location_id, material_id): {поле: количество}}
+            label: ключ ожидаемого значения в строках расхождений
+
+        Returns:
+            dict {storage_location_id: [{'material_id', 'field', 'balance', label}, ...]}
+        """
+        zero = dict.fromkeys(cls.QUANTITY_FIELDS, Decimal('0'))
+
+        drift = {}
+        seen = set()
+        for balance in balances.only(
+            'storage_location_id', 'material_id', *cls.QUANTITY_FIELDS
+        ).iterator(chunk_size=2000):
+            key = (balance.storage_location_id, balance.material_id)
+            seen.add(key)
+            quantities = expected.get(key, zero)
+            for field in cls.QUANTITY_FIELDS:
+                value = getattr(balance, field) or Decimal('0')
+                if value != quantities[field]:
+                    drift.setdefault(key[0], []).append({
+                        'material_id': key[1], 'field': field, 'balance': value, label: quantities[field],
+                    })
+
+        # Ожидаемые количества без строки остатка
+        for key, quantities in expected.items():
+            if key in seen:
+                continue
+            for field in cls.QUANTITY_FIELDS:
+                if quantities[field]:
+                    drift.setdefault(key[0], []).append({
+                        'material_id': key[1], 'field': field, 'balance': None, label: quantities[field],
+                    })
+
+        return drift
+
+    @classmethod
+    def rebuild(cls, storage_location_ids=None):
+        """
+        Пересчитывает MaterialBalance по журналу
+
+        Строки остатков блокируются (SELECT ... FOR UPDATE) на время пересчета.
+
+        Returns:
+            tuple (обновлено строк, создано строк)
+        """
+        with transaction.atomic():
+            balances = {
+                (balance.storage_location_id, balance.material_id): balance
+                for balance in cls._balances(storage_location_ids).select_for_update()
+            }
+            totals = cls.totals(storage_location_ids)
+            zero = dict.fromkeys(cls.QUANTITY_FIELDS, Decimal('0'))
+
+            changed = []
+            for key, balance in balances.items():
+                ledger = totals.get(key, zero)
+                if any((getattr(balance, field) or 0) != ledger[field] for field in cls.QUANTITY_FIELDS):
+                    for field in cls.QUANTITY_FIELDS:
+                        setattr(balance, field, ledger[field])
+                    changed.append(balance)
+
+            created = [
+                MaterialBalance(storage_location_id=key[0], material_id=key[1], **ledger)
+                for key, ledger in totals.items()
+                if key not in balances and any(ledger.values())
+            ]
+
+            MaterialBalance.objects.bulk_update(changed, list(cls.QUANTITY_FIELDS), batch_size=500)
+            MaterialBalance.objects.bulk_create(created, batch_size=500)
+
+            LowStockMonitor.evaluate(
+                (balance.storage_location_id, balance.material_id) for balance in changed + created
+            )
+
+        return len(changed), len(created)
+
+
+class BalanceReconciler:
+    """
+    Сверка остатков (MaterialBalance) с документами
+
+    Остаток места хранения восстанавливается заново по документам:
+    поступления (Receipt), проведенные движения (MaterialMovement, в том числе
+    строки документов движения) и выполненные конвертации (Conversion с выходами ConversionOutput).
+    Документы до появления журнала уже вошли в его начальные остатки, поэтому
+    учитываются записи "Начальный остаток", документы, созданные после них,
+    и записи журнала более ранних документов после начальных остатков
+    (их исправления, отмены и удаления). Движения без даты создания (созданные
+    до появления поля) считаются ранними. Ручные корректировки остатков
+    документов не имеют и берутся из журнала.
+
+    Каждый запрос ограничен набором мест хранения, строки читаются потоком
+    (.iterator()), поэтому места хранения можно сверять частями в разных процессах
+    (см. команду reconcile_balances).
+    """
+
+    QUANTITY_FIELDS = BalanceEngine.QUANTITY_FIELDS
+    CHUNK_SIZE = 2000
+
+    # Записи журнала, которые не порождаются документами
+    LEDGER_SOURCES = ('Начальный остаток', 'Корректировка')
+    REPAIR_SOURCE = 'Сверка'
+
+    # Получатель приходует материал только при этих типах движения (см. MaterialMovement.get_balance_changes)
+    CREDIT_TO_TYPES = ('Перемещение', 'Отправление')
+
+    @staticmethod
+    def opening_cutoff():
+        """Время начальных остатков журнала (None - журнал ведется с первого документа)"""
+        return StockLedgerEntry.objects.filter(
+            source_type='Начальный остаток'
+        ).aggregate(cutoff=Max('created_at'))['cutoff']
+
+    @classmethod
+    def replay(cls, storage_location_ids, cutoff=None):
+        """
+        Остатки мест хранения по документам
+
+        Args:
+            storage_location_ids: ID мест хранения
+            cutoff: время начальных остатков журнала (см. opening_cutoff)
+
+        Returns:
+            dict {(storage_location_id, material_id): {поле: количество}}
+        """
+        storage_location_ids = list(storage_location_ids)
+        totals = {}
+
+        def add(location_id, material_id, quantities, sign):
+            row = totals.setdefault(
+                (location_id, material_id), dict.fromkeys(cls.QUANTITY_FIELDS, Decimal('0'))
+            )
+            for field, quantity in zip(cls.QUANTITY_FIELDS, quantities):
+                if quantity:
+                    row[field] += sign * quantity
+
+        def stream(queryset, *fields):
+            return queryset.values_list(*fields).order_by().iterator(chunk_size=cls.CHUNK_SIZE)
+
+        for location_id, material_id, *quantities in stream(
+            StockLedgerEntry.objects.filter(
+                storage_location_id__in=storage_location_ids, source_type__in=cls.LEDGER_SOURCES
+            ),
+            'storage_location_id', 'material_id', *cls.QUANTITY_FIELDS
+        ):
+            add(location_id, material_id, quantities, 1)
+
+        receipts = Receipt.objects.all()
+        movements = MaterialMovement.objects.filter(is_completed=True)
+        conversions = Conversion.objects.filter(is_completed=True)
+
+        if cutoff is not None:
+            # Документы, созданные после начальных остатков, - по документам
+            # (строки документа движения - по дате создания документа)
+            new_movement = Q(document__isnull=True, created_at__gt=cutoff) | Q(document__created_at__gt=cutoff)
+            new_documents = {
+                Receipt.LEDGER_SOURCE: Receipt.objects.filter(created_at__gt=cutoff),
+                MaterialMovement.LEDGER_SOURCE: MaterialMovement.objects.filter(new_movement),
+                MovementDocument.LEDGER_SOURCE: MovementDocument.objects.filter(created_at__gt=cutoff),
+                Conversion.LEDGER_SOURCE: Conversion.objects.filter(created_at__gt=cutoff),
+            }
+            receipts = receipts.filter(created_at__gt=cutoff)
+            movements = movements.filter(new_movement)
+            conversions = conversions.filter(created_at__gt=cutoff)
+
+            # Более ранние документы уже в начальных остатках - их последующие изменения по журналу
+            later_entries = StockLedgerEntry.objects.filter(
+                storage_location_id__in=storage_location_ids, created_at__gt=cutoff
+            )
+            for source_type, documents in new_documents.items():
+                for location_id, material_id, *quantities in stream(
+                    later_entries.filter(source_type=source_type).exclude(source_id__in=documents.values('pk')),
+                    'storage_location_id', 'material_id', *cls.QUANTITY_FIELDS
+                ):
+                    add(location_id, material_id, quantities, 1)
+
+        for location_id, material_id, *quantities in stream(
+            receipts.filter(storage_location_id__in=storage_location_ids),
+            'storage_location_id', 'material_id', *cls.QUANTITY_FIELDS
+        ):
+            add(location_id, material_id, quantities, 1)
+
+        for location_id, material_id, *quantities in stream(
+            movements.filter(from_location_id__in=storage_location_ids),
+            'from_location_id', 'material_id', *cls.QUANTITY_FIELDS
+        ):
+            add(location_id, material_id, quantities, -1)
+
+        for location_id, material_id, *quantities in stream(
+            movements.filter(to_location_id__in=storage_location_ids, accounting_type__in=cls.CREDIT_TO_TYPES),
+            'to_location_id', 'material_id', *cls.QUANTITY_FIELDS
+        ):
+            add(location_id, material_id, quantities, 1)
+
+        for location_id, material_id, *quantities in stream(
+            conversions.filter(storage_location_id__in=storage_location_ids),
+            'storage_location_id', 'source_material_id', *(f'source_{field}' for field in cls.QUANTITY_FIELDS)
+        ):
+            add(location_id, material_id, quantities, -1)
+
+        for location_id, material_id, *quantities in stream(
+            ConversionOutput.objects.filter(
+                conversion__in=conversions.filter(storage_location_id__in=storage_location_ids)
+            ),
+            'conversion__storage_location_id', 'material_id', *cls.QUANTITY_FIELDS
+        ):
+            add(location_id, material_id, quantities, 1)
+
+        return totals
+
+    @classmethod
+    def drift(cls, storage_location_ids, cutoff=None):
+        """
+        Расхождения остатков мест хранения с документами
+
+        Returns:
+            dict {storage_location_id: [{'material_id', 'field', 'balance', 'documents'}, ...]}
+        """
+        storage_location_ids = list(storage_location_ids)
+        return StockLedger.compare(
+            MaterialBalance.objects.filter(storage_location_id__in=storage_location_ids),
+            cls.replay(storage_location_ids, cutoff),
+            'documents'
+        )
+
+    @classmethod
+    def repair(cls, storage_location_ids, cutoff=None, created_by=None, created_by_position=None):
+        """
+        Приводит остатки мест хранения к документам одной транзакцией
+
+        Строки остатков блокируются, количества пересчитываются заново под блокировкой.
+        Разница документов с журналом пишется в журнал записями "Сверка", поэтому
+        журнал остается согласованным с остатками (rebuild_balances --verify).
+
+        Returns:
+            tuple (обновлено строк, создано строк)
+        """
+        storage_location_ids = list(storage_location_ids)
+
+        with transaction.atomic():
+            balances = {
+                (balance.storage_location_id, balance.material_id): balance
+                for balance in MaterialBalance.objects.filter(
+                    storage_location_id__in=storage_location_ids
+                ).order_by('storage_location_id', 'material_id').select_for_update()
+            }
+            expected = cls.replay(storage_location_ids, cutoff)
+            ledger = StockLedger.totals(storage_location_ids)
+            zero = dict.fromkeys(cls.QUANTITY_FIELDS, Decimal('0'))
+
+            changed, created, entries = [], [], []
+            for key in sorted(set(balances) | set(expected) | set(ledger)):
+                quantities = expected.get(key, zero)
+
+                deltas = {
+                    field: quantities[field] - ledger.get(key, zero)[field] for field in cls.QUANTITY_FIELDS
+                }
+                if any(deltas.values()):
+                    entries.append(StockLedgerEntry(
+                        storage_location_id=key[0],
+                        material_id=key[1],
+                        source_type=cls.REPAIR_SOURCE,
+                        created_by=created_by,
+                        created_by_position=created_by_position,
+                        **deltas
+                    ))
+
+                balance = balances.get(key)
+                if balance is None:
+                    if not any(quantities.values()):
+                        continue
+                    balance = MaterialBalance(storage_location_id=key[0], material_id=key[1])
+                    created.append(balance)
+                elif all((getattr(balance, field) or 0) == quantities[field] for field in cls.QUANTITY_FIELDS):
+                    continue
+                else:
+                    changed.append(balance)
+
+                for field in cls.QUANTITY_FIELDS:
+                    setattr(balance, field, quantities[field])
+
+            MaterialBalance.objects.bulk_update(changed, list(cls.QUANTITY_FIELDS), batch_size=500)
+            MaterialBalance.objects.bulk_create(created, batch_size=500)
+            StockLedgerEntry.objects.bulk_create(entries, batch_size=500)
+
+            LowStockMonitor.evaluate(
+                (balance.storage_location_id, balance.material_id) for balance in changed + created
+            )
+
+        return len(changed), len(created)
+
+
+class BalanceHistory:
+    """
+    Остатки материалов на произвольный момент времени
+
+    Остаток на момент = ближайший предыдущий снимок BalanceSnapshot + записи
+    журнала StockLedgerEntry с датой документа после него + записи, проведенные
+    задним числом уже после снимка. Снимок и записи журнала суммируются одним
+    SQL-запросом (UNION ALL + GROUP BY).
+
+    Изменения относятся к дате документа (document_date), а не ко времени
+    проведения. История ведется с начальных остатков журнала (history_start):
+    документы до них в журнал не попали, поэтому более ранние моменты недоступны.
+    """
+
+    QUANTITY_FIELDS = BalanceEngine.QUANTITY_FIELDS
+
+    @staticmethod
+    def cutoff_for(day):
+        """Граница дня: начало следующего дня в текущем часовом поясе"""
+        return timezone.make_aware(
+            datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min)
+        )
+
+    @staticmethod
+    def history_start():
+        """Начало истории остатков (None - журнал ведется с первого документа)"""
+        return BalanceReconciler.opening_cutoff()
+
+    @classmethod
+    def check_moment(cls, moment):
+        """
+        Проверяет, что остатки на момент moment можно восстановить по журналу
+
+        Raises:
+            ValueError: момент раньше начальных остатков журнала
+        """
+        start = cls.history_start()
+        if start is not None and moment < start:
+            raise ValueError(
+                f'Остатки на дату доступны с {timezone.localtime(start):%d.%m.%Y %H:%M} '
+                f'(начальные остатки журнала)'
+            )
+
+    @classmethod
+    def as_of(cls, moment, storage_location_ids=None, material_ids=None, last_entry_id=None):
+        """
+        Остатки на момент moment по дате документа
+
+        Args:
+            last_entry_id: учитывать только записи журнала с ID не больше этого (для снимков)
+
+        Returns:
+            dict {(storage_location_id, material_id): {поле: количество}}
+
+        Raises:
+            ValueError: момент раньше начальных остатков журнала
+        """
+        cls.check_moment(moment)
+
+        snapshot = BalanceSnapshot.objects.filter(cutoff__lte=moment).order_by('-cutoff').values_list(
+            'cutoff', 'last_entry_id'
+        ).first()
+
+        filters = ''
+        filter_params = []
+        if storage_location_ids is not None:
+            filters += ' AND storage_location_id IN ({})'.format(', '.join(['%s'] * len(storage_location_ids) or ['NULL']))
+            filter_params += list(storage_location_ids)
+        if material_ids is not None:
+            filters += ' AND material_id IN ({})'.format(', '.join(['%s'] * len(material_ids) or ['NULL']))
+            filter_params += list(material_ids)
+
+        ledger_filters = filters
+        ledger_params = filter_params
+        if last_entry_id is not None:
+            ledger_filters += ' AND id <= %s'
+            ledger_params = [*filter_params, last_entry_id]
+
+        columns = 'storage_location_id, material_id, quantity_pieces, quantity_meters, quantity_cubic'
+        ledger_table = StockLedgerEntry._meta.db_table
+        moment = connection.ops.adapt_datetimefield_value(moment)
+
+        if snapshot is not None:
+            snapshot_cutoff = connection.ops.adapt_datetimefield_value(snapshot[0])
+            # Снимок + документы после него + проведенные задним числом после снимка
+            sql = (
+                f'SELECT {columns} FROM {BalanceSnapshot._meta.db_table} WHERE cutoff = %s{filters} '
+                f'UNION ALL '
+                f'SELECT {columns} FROM {ledger_table} '
+                f'WHERE document_date >= %s AND document_date <= %s{ledger_filters} '
+                f'UNION ALL '
+                f'SELECT {columns} FROM {ledger_table} WHERE document_date < %s AND id > %s{ledger_filters}'
+            )
+            params = [
+                snapshot_cutoff, *filter_params,
+                snapshot_cutoff, moment, *ledger_params,
+                snapshot_cutoff, snapshot[1], *ledger_params,
+            ]
+        else:
+            sql = f'SELECT {columns} FROM {ledger_table} WHERE document_date <= %s{ledger_filters}'
+            params = [moment, *ledger_params]
+
+        sql = (
+            f'SELECT storage_location_id, material_id, '
+            f'SUM(quantity_pieces), SUM(quantity_meters), SUM(quantity_cubic) '
+            f'FROM ({sql}) AS balance_rows GROUP BY storage_location_id, material_id'
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        return {
+            (location_id, material_id): {
+                field: Decimal(str(value or 0)).quantize(Decimal('0.001'))
+                for field, value in zip(cls.QUANTITY_FIELDS, quantities)
+            }
+            for location_id, material_id, *quantities in rows
+        }
+
+    @classmethod
+    def apply_to(cls, balances, moment):
+        """
+        Подменяет количества у строк MaterialBalance значениями на момент moment
+
+        Returns:
+            list строк остатков с историческими количествами
+        """
+        balances = list(balances)
+        history = cls.as_of(
+            moment,
+            storage_location_ids={balance.storage_location_id for balance in balances},
+            material_ids={balance.material_id for balance in balances}
+        )
+        zero = dict.fromkeys(cls.QUANTITY_FIELDS, Decimal('0'))
+
+        for balance in balances:
+            for field, value in history.get((balance.storage_location_id, balance.material_id), zero).items():
+                setattr(balance, field, value)
+
+        return balances
+
+    @classmethod
+    def take_snapshot(cls, day):
+        """
+        Снимок остатков на конец дня day (повторный запуск пересоздает снимок)
+
+        Снимок фиксирует последнюю учтенную запись журнала: документы за этот день,
+        проведенные позже, as_of добавит к снимку по ID записи.
+
+        Returns:
+            int количество строк снимка
+
+        Raises:
+            ValueError: день раньше начальных остатков журнала
+        """
+        cutoff = cls.cutoff_for(day)
+        last_entry_id = StockLedgerEntry.objects.aggregate(last=Max('id'))['last'] or 0
+        # Записи журнала ровно на границе относятся к следующему дню
+        balances = cls.as_of(cutoff - datetime.timedelta(microseconds=1), last_entry_id=last_entry_id)
+
+        with transaction.atomic():
+            BalanceSnapshot.objects.filter(snapshot_date=day).delete()
+            BalanceSnapshot.objects.bulk_create([
+                BalanceSnapshot(
+                    snapshot_date=day,
+                    cutoff=cutoff,
+                    last_entry_id=last_entry_id,
+                    storage_location_id=location_id,
+                    material_id=material_id,
+                    **quantities
+                )
+                for (location_id, material_id), quantities in balances.items()
+                if any(quantities.values())
+            ], batch_size=500)
+
+        return BalanceSnapshot.objects.filter(snapshot_date=day).count()
+
+
+class BalancePivot:
+    """
+    Свод остатков: материал × тип места хранения (и, по желанию, × должность создателя)
+
+    Строится по одному сгруппированному запросу (MaterialBalanceQuerySet.pivot_rows)
+    или, для остатков на дату, по уже пересчитанному списку строк.
+
+    rows - строки свода по материалам (и должностям): material_id, material_name,
+        material_type, [position_id, position_name,] cells {тип: итоги},
+        columns (те же итоги списком в порядке SOURCE_TYPES), total
+    totals_by_type - итоги по типам мест хранения
+    totals - общие итоги
+    Итоги - словари pieces, meters, cubic, count (число строк остатков).
+    """
+
+    SOURCE_TYPES = [source_type for source_type, _ in StorageLocation.SOURCE_TYPE_CHOICES]
+    FIELDS = ('pieces', 'meters', 'cubic')
+
+    def __init__(self, grouped_rows, by_position=False):
+        self.by_position = by_position
+        self.source_types = StorageLocation.SOURCE_TYPE_CHOICES
+        self.totals_by_type = {source_type: self._empty() for source_type in self.SOURCE_TYPES}
+        self.totals = self._empty()
+
+        rows = {}
+        for grouped in grouped_rows:
+            key = (grouped['material_id'], grouped.get('position_id'))
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = {
+                    'material_id': grouped['material_id'],
+                    'material_name': grouped['material_name'],
+                    'material_type': grouped['material_type'],
+                    'cells': {source_type: self._empty() for source_type in self.SOURCE_TYPES},
+                    'total': self._empty(),
+                }
+                if by_position:
+                    row['position_id'] = grouped.get('position_id')
+                    row['position_name'] = grouped.get('position_name')
+
+            cell = row['cells'].setdefault(grouped['source_type'], self._empty())
+            type_totals = self.totals_by_type.setdefault(grouped['source_type'], self._empty())
+            for target in (cell, row['total'], type_totals, self.totals):
+                for field in self.FIELDS:
+                    target[field] += grouped[field] or 0
+                target['count'] += grouped['count']
+
+        self.rows = sorted(
+            rows.values(),
+            key=lambda row: (row['material_type'], row['material_name'], row.get('position_name') or '')
+        )
+
+        # Ячейки в порядке типов мест хранения - для вывода таблицей в шаблоне
+        for row in self.rows:
+            row['columns'] = [row['cells'][source_type] for source_type in self.SOURCE_TYPES]
+        self.type_columns = [self.totals_by_type[source_type] for source_type in self.SOURCE_TYPES]
+
+    @classmethod
+    def _empty(cls):
+        return {'pieces': Decimal('0'), 'meters': Decimal('0'), 'cubic': Decimal('0'), 'count': 0}
+
+    @classmethod
+    def for_queryset(cls, balances, by_position=False):
+        """Свод по выборке MaterialBalance (один запрос GROUP BY)"""
+        return cls(balances.pivot_rows(by_position), by_position)
+
+    @classmethod
+    def for_balances(cls, balances, by_position=False):
+        """Свод по уже загруженным строкам остатков (например, пересчитанным на дату)"""
+        return cls(
+            (
+                {
+                    'material_id': balance.material_id,
+                    'material_name': balance.material.name,
+                    'material_type': balance.material.material_type,
+                    'source_type': balance.storage_location.source_type,
+                    'position_id': balance.created_by_position_id,
+                    'position_name': balance.created_by_position.name if balance.created_by_position else None,
+                    'pieces': balance.quantity_pieces,
+                    'meters': balance.quantity_meters,
+                    'cubic': balance.quantity_cubic,
+                    'count': 1,
+                }
+                for balance in balances
+            ),
+            by_position
+        )
+
+    def as_dict(self):
+        """Свод для JSON-ответа (количества строками, как в остальных API)"""
+        def totals(values):
+            return {field: str(values[field]) for field in self.FIELDS} | {'count': values['count']}
+
+        return {
+            'source_types': [{'value': value, 'label': label} for value, label in self.source_types],
+            'rows': [
+                {
+                    key: value for key, value in row.items() if key not in ('cells', 'columns', 'total')
+                } | {
+                    'cells': {source_type: totals(cell) for source_type, cell in row['cells'].items()},
+                    'total': totals(row['total']),
+                }
+                for row in self.rows
+            ],
+            'totals_by_type': {source_type: totals(values) for source_type, values in self.totals_by_type.items()},
+            'totals': totals(self.totals),
+        }
+
+
+class KeysetPage:
+    """Страница keyset-пагинации"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class KeysetPaginator:
+    """
+    Keyset-пагинация по (поле даты, id) в порядке убывания
+
+    Вместо OFFSET страница выбирается условием
+    (дата, id) < (дата курсора, id курсора), поэтому стоимость страницы
+    не зависит от ее номера, а новые записи не сдвигают открытые страницы.
+    Курсор - base64 от "ISO-дата|id" крайней записи страницы.
+    """
+
+    PAGE_SIZE = 50
+
+    def __init__(self, field='date_time', page_size=None):
+        self.field = field
+        self.page_size = page_size or self.PAGE_SIZE
+
+    @staticmethod
+    def encode_cursor(value, pk):
+        raw = f'{value.isoformat()}|{pk}'.encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Возвращает (datetime, id) или None для неверного курсора"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+            value, pk = raw.rsplit('|', 1)
+            return datetime.datetime.fromisoformat(value), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    def _cursor_for(self, item):
+        return self.encode_cursor(getattr(item, self.field), item.pk)
+
+    def paginate(self, queryset, cursor=None, direction='next'):
+        """
+        Страница выборки queryset
+
+        Args:
+            cursor: next_cursor/prev_cursor соседней страницы (None - первая страница)
+            direction: 'next' - записи после курсора (старше), 'prev' - перед курсором (новее)
+        """
+        position = self.decode_cursor(cursor) if cursor else None
+        field = self.field
+
+        if position is None:
+            rows = list(queryset.order_by(f'-{field}', '-pk')[:self.page_size + 1])
+            items = rows[:self.page_size]
+            return KeysetPage(
+                items,
+                next_cursor=self._cursor_for(items[-1]) if len(rows) > self.page_size else None
+            )
+
+        value, pk = position
+        if direction == 'prev':
+            rows = list(queryset.filter(
+                Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk})
+            ).order_by(field, 'pk')[:self.page_size + 1])
+            if len(rows) <= self.page_size:
+                # Дошли до начала - показываем полную первую страницу
+                return self.paginate(queryset)
+            items = list(reversed(rows[:self.page_size]))
+            return KeysetPage(
+                items,
+                next_cursor=self._cursor_for(items[-1]),
+                prev_cursor=self._cursor_for(items[0])
+            )
+
+        rows = list(queryset.filter(
+            Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk})
+        ).order_by(f'-{field}', '-pk')[:self.page_size + 1])
+        items = rows[:self.page_size]
+        return KeysetPage(
+            items,
+            next_cursor=self._cursor_for(items[-1]) if len(rows) > self.page_size else None,
+            prev_cursor=self._cursor_for(items[0]) if items else None
+        )
+
+    def for_request(self, request, queryset):
+        """Страница по параметрам запроса ?cursor=...&direction=next|prev"""
+        return self.paginate(
+            queryset,
+            cursor=request.GET.get('cursor'),
+            direction=request.GET.get('direction', 'next')
+        )
+
+    @staticmethod
+    def querystring(request):
+        """GET-параметры запроса без параметров пагинации (для ссылок на страницы)"""
+        params = request.GET.copy()
+        params.pop('cursor', None)
+        params.pop('direction', None)
+        return params.urlencode()
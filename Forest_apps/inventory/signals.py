@@ -0,0 +1,63 @@
+# Forest_apps/inventory/signals.py
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from Forest_apps.core.models import Position, Warehouse, Vehicle, Counterparty, Brigade
+from Forest_apps.forestry.models import Material
+from Forest_apps.inventory.models import StorageLocation, MaterialBalance, StockThreshold
+from Forest_apps.inventory.services import OwnedLocationResolver, ReferenceDataCache, LowStockMonitor
+
+
+@receiver(post_save, sender=Position)
+@receiver(post_delete, sender=Position)
+@receiver(post_save, sender=Warehouse)
+@receiver(post_delete, sender=Warehouse)
+@receiver(post_save, sender=Vehicle)
+@receiver(post_delete, sender=Vehicle)
+@receiver(post_save, sender=Counterparty)
+@receiver(post_delete, sender=Counterparty)
+@receiver(post_save, sender=Brigade)
+@receiver(post_delete, sender=Brigade)
+@receiver(post_save, sender=StorageLocation)
+@receiver(post_delete, sender=StorageLocation)
+def invalidate_owned_locations(sender, **kwargs):
+    """Сбрасывает кэш мест хранения должностей после фиксации изменения справочников"""
+    transaction.on_commit(OwnedLocationResolver.invalidate)
+    transaction.on_commit(ReferenceDataCache.invalidate)
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_delete, sender=Material)
+def invalidate_reference_data(sender, **kwargs):
+    """Сбрасывает кэш списка материалов для форм после фиксации изменения"""
+    transaction.on_commit(ReferenceDataCache.invalidate)
+
+
+def bump_reference_table(sender, **kwargs):
+    """Увеличивает версию таблицы справочника после фиксации транзакции"""
+    transaction.on_commit(lambda: ReferenceDataCache.bump(sender))
+
+
+for reference_model in ReferenceDataCache.reference_models():
+    post_save.connect(
+        bump_reference_table, sender=reference_model,
+        dispatch_uid=f'reference_table_save:{reference_model._meta.label_lower}'
+    )
+    post_delete.connect(
+        bump_reference_table, sender=reference_model,
+        dispatch_uid=f'reference_table_delete:{reference_model._meta.label_lower}'
+    )
+
+
+@receiver(post_save, sender=StockThreshold)
+@receiver(post_delete, sender=StockThreshold)
+def reevaluate_low_stock(sender, instance, **kwargs):
+    """Пересчитывает оповещения "мало остатков" по материалу после изменения порога"""
+    LowStockMonitor.evaluate_materials([instance.material_id])
+
+
+@receiver(post_save, sender=MaterialBalance)
+def evaluate_balance_low_stock(sender, instance, **kwargs):
+    """Проверяет порог после сохранения остатка в обход BalanceEngine (например, в админке)"""
+    LowStockMonitor.evaluate([(instance.storage_location_id, instance.material_id)])
@@ -0,0 +1,298 @@
+# Forest_apps/inventory/sync.py
+import datetime
+import gzip
+import io
+import json
+import zlib
+
+from django.db import transaction
+from django.utils import timezone
+
+from Forest_apps.core.models import IdempotencyKey
+from Forest_apps.core.services import IdempotentSubmission, DuplicateSubmission
+from Forest_apps.employees.forms.workTimeRecord import WorkTimeRecordCreateForm
+from Forest_apps.employees.models import Employee
+from Forest_apps.forestry.models import Material
+from Forest_apps.inventory.forms.material_movement import MaterialMovementCreateForm
+from Forest_apps.inventory.models import MaterialMovement, StorageLocation
+from Forest_apps.inventory.services import OwnedLocationResolver
+from Forest_apps.operations.forms.operation_record import OperationRecordCreateForm
+from Forest_apps.operations.models import OperationType
+
+
+class SyncItemError(ValueError):
+    """Документ пакета не прошел проверку формы (errors - ошибки по полям)"""
+
+    def __init__(self, errors):
+        super().__init__('Ошибки в документе')
+        self.errors = errors
+
+
+class DeviceSync:
+    """
+    Пакетная синхронизация полевых устройств (ввод без связи)
+
+    Устройство копит движения, табель и операции и отправляет их одним пакетом
+    (JSON, можно сжать gzip - заголовок Content-Encoding):
+
+        {"items": [{"id": "<ключ устройства>", "type": "movement", "data": {...}}, ...]}
+
+    data - поля той же формы, что и при вводе на сайте. Пакет проводится одной
+    транзакцией по порядку (следующий документ видит остатки после предыдущего),
+    каждый документ - в своей точке сохранения: ошибка одного документа не
+    откатывает остальные. id документа записывается как IdempotencyKey вместе
+    с документом, поэтому повторная отправка пакета после обрыва связи
+    не создает дублей - такие документы возвращаются со статусом duplicate.
+
+    Справочники для работы без связи устройство получает через delta: изменения
+    после версии (token) прошлой синхронизации.
+    """
+
+    MAX_ITEMS = 500
+    MAX_BODY_SIZE = 5 * 1024 * 1024  # после распаковки
+
+    # Запас при выборке изменений справочников: строка, сохраненная до выдачи
+    # версии, но зафиксированная после выборки, попадет в следующую дельту
+    DELTA_OVERLAP = datetime.timedelta(minutes=5)
+
+    ITEM_TYPES = ('movement', 'worktime', 'operation')
+
+    REFERENCE_MODELS = {
+        'materials': Material,
+        'locations': StorageLocation,
+        'employees': Employee,
+        'operation_types': OperationType,
+    }
+
+    # ---------- Прием пакета ----------
+
+    @classmethod
+    def parse(cls, request):
+        """
+        Документы пакета из тела запроса
+
+        Raises:
+            ValueError: тело не читается, не JSON или пакет слишком большой
+        """
+        body = request.body
+        encoding = request.headers.get('Content-Encoding', '').strip().lower()
+
+        if encoding in ('gzip', 'deflate'):
+            body = cls._decompress(body, encoding)
+        elif encoding not in ('', 'identity'):
+            raise ValueError(f'Неподдерживаемое сжатие: {encoding}')
+
+        try:
+            payload = json.loads(body)
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            raise ValueError('Тело запроса должно быть JSON')
+
+        items = payload.get('items') if isinstance(payload, dict) else None
+        if not isinstance(items, list):
+            raise ValueError('Ожидается {"items": [...]}')
+        if len(items) > cls.MAX_ITEMS:
+            raise ValueError(f'В пакете больше {cls.MAX_ITEMS} документов')
+
+        return items
+
+    @classmethod
+    def _decompress(cls, body, encoding):
+        """Распаковка с ограничением размера (защита от "zip-бомбы")"""
+        try:
+            if encoding == 'gzip':
+                with gzip.GzipFile(fileobj=io.BytesIO(body)) as stream:
+                    data = stream.read(cls.MAX_BODY_SIZE + 1)
+            else:
+                data = zlib.decompressobj().decompress(body, cls.MAX_BODY_SIZE + 1)
+        except (OSError, EOFError, zlib.error):
+            raise ValueError('Не удалось распаковать тело запроса')
+
+        if len(data) > cls.MAX_BODY_SIZE:
+            raise ValueError('Пакет слишком большой')
+        return data
+
+    @classmethod
+    def apply(cls, user, position, items):
+        """
+        Проведение документов пакета
+
+        Returns:
+            list: по документу {'id', 'type', 'status': created|duplicate|error, 'object_id' | 'errors'}
+        """
+        client_ids = [item.get('id') for item in items if isinstance(item, dict) and item.get('id')]
+        # Уже принятые документы - одним запросом по уникальному индексу
+        known = dict(IdempotencyKey.objects.filter(
+            user=user, key__in=[str(client_id) for client_id in client_ids]
+        ).values_list('key', 'object_id'))
+
+        results = []
+        with transaction.atomic():
+            for item in items:
+                results.append(cls._apply_item(user, position, item, known))
+        return results
+
+    @classmethod
+    def _apply_item(cls, user, position, item, known):
+        if not isinstance(item, dict):
+            return {'id': None, 'type': None, 'status': 'error', 'errors': {'__all__': ['Документ должен быть объектом']}}
+
+        client_id = str(item.get('id') or '')
+        item_type = item.get('type')
+        result = {'id': client_id or None, 'type': item_type}
+
+        if not IdempotentSubmission.KEY_PATTERN.match(client_id):
+            return dict(result, status='error', errors={'id': ['Нужен id документа: 8-64 символа A-Z, 0-9, _ или -']})
+        if item_type not in cls.ITEM_TYPES:
+            return dict(result, status='error', errors={'type': [f'Тип документа: {", ".join(cls.ITEM_TYPES)}']})
+        if not isinstance(item.get('data'), dict):
+            return dict(result, status='error', errors={'data': ['Нужны поля документа']})
+
+        if client_id in known:
+            return dict(result, status='duplicate', object_id=known[client_id])
+
+        post = getattr(cls, f'_post_{item_type}')
+        try:
+            with transaction.atomic():
+                record = IdempotentSubmission.claim(user, client_id, f'sync:{item_type}')
+                obj = post(user, position, item['data'])
+                record.object_id = obj.pk
+                record.save(update_fields=['object_id'])
+        except DuplicateSubmission:
+            # Тот же пакет пришел параллельно - документ уже проведен
+            object_id = IdempotencyKey.objects.filter(user=user, key=client_id).values_list('object_id', flat=True).first()
+            return dict(result, status='duplicate', object_id=object_id)
+        except SyncItemError as e:
+            return dict(result, status='error', errors=e.errors)
+        except ValueError as e:
+            return dict(result, status='error', errors={'__all__': [str(e)]})
+        except Exception as e:
+            return dict(result, status='error', errors={'__all__': [f'Ошибка при проведении: {e}']})
+
+        known[client_id] = obj.pk
+        return dict(result, status='created', object_id=obj.pk)
+
+    @staticmethod
+    def _form_errors(form):
+        return {field: [str(message) for message in messages] for field, messages in form.errors.items()}
+
+    @classmethod
+    def _post_movement(cls, user, position, data):
+        """Движение: форма сайта, проводка сразу для EXECUTE_ON_CREATE"""
+        form = MaterialMovementCreateForm(data, user=user, position_name=position.name)
+        if not form.is_valid():
+            raise SyncItemError(cls._form_errors(form))
+
+        movement = form.save(commit=False)
+        movement.created_by = user
+        movement.created_by_position = position
+
+        executes = movement.accounting_type in MaterialMovement.EXECUTE_ON_CREATE
+        if executes:
+            movement.validate_for_execution()
+
+        movement.save()
+        if executes:
+            movement.execute_movement()
+        return movement
+
+    @classmethod
+    def _post_worktime(cls, user, position, data):
+        """Запись табеля"""
+        form = WorkTimeRecordCreateForm(data, user=user, user_position=position.name)
+        if not form.is_valid():
+            raise SyncItemError(cls._form_errors(form))
+
+        record = form.save(commit=False)
+        record.created_by = user
+        record.created_by_position = position
+        record.save()
+        return record
+
+    @classmethod
+    def _post_operation(cls, user, position, data):
+        """Запись операции"""
+        form = OperationRecordCreateForm(data, user=user, position_name=position.name)
+        if not form.is_valid():
+            raise SyncItemError(cls._form_errors(form))
+
+        record = form.save(commit=False)
+        record.created_by = user
+        record.created_by_position = position
+        record.save()
+        return record
+
+    # ---------- Справочники ----------
+
+    @staticmethod
+    def version_token(moment):
+        """Версия справочников - время выдачи в миллисекундах (как в ReferenceDataCache)"""
+        return str(int(moment.timestamp() * 1000))
+
+    @staticmethod
+    def parse_version_token(token):
+        """
+        Время из версии справочников
+
+        Raises:
+            ValueError: неверная версия
+        """
+        try:
+            milliseconds = int(token)
+        except (TypeError, ValueError):
+            raise ValueError('Неверная версия справочников')
+        if milliseconds < 0:
+            raise ValueError('Неверная версия справочников')
+        return datetime.datetime.fromtimestamp(milliseconds / 1000, tz=datetime.timezone.utc)
+
+    @classmethod
+    def delta(cls, since, position_id):
+        """
+        Справочники, измененные после версии since (None - полная выгрузка)
+
+        Для каждого справочника: changed - новые и измененные строки,
+        ids (только в дельте) - все существующие ID, по ним устройство удаляет
+        строки, удаленные на сервере.
+        """
+        issued_at = timezone.now()
+        changed_after = since - cls.DELTA_OVERLAP if since else None
+        own_location_ids = set(OwnedLocationResolver.get_location_ids(position_id)) if position_id else set()
+
+        def changed(queryset):
+            if changed_after is not None:
+                queryset = queryset.filter(updated_at__gte=changed_after)
+            return queryset.order_by('id')
+
+        locations = [
+            {
+                'id': location_id,
+                'source_type': source_type,
+                'name': source_name,
+                'own': location_id in own_location_ids,
+            }
+            for location_id, source_type, source_name in changed(StorageLocation.objects).values_list(
+                'id', 'source_type', 'source_name'
+            )
+        ]
+
+        data = {
+            'version': cls.version_token(issued_at),
+            'full': since is None,
+            'materials': {
+                'changed': list(changed(Material.objects).values('id', 'name', 'material_type', 'is_active')),
+            },
+            'locations': {'changed': locations},
+            'employees': {
+                'changed': list(changed(Employee.objects).values(
+                    'id', 'last_name', 'first_name', 'middle_name', 'position_id', 'warehouse_id', 'is_active'
+                )),
+            },
+            'operation_types': {
+                'changed': list(changed(OperationType.objects).values('id', 'name', 'is_active')),
+            },
+        }
+
+        if since is not None:
+            for name, model in cls.REFERENCE_MODELS.items():
+                data[name]['ids'] = list(model.objects.order_by('id').values_list('id', flat=True))
+
+        return data
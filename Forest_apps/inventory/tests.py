@@ -1,3 +1,325 @@
-from django.test import TestCase
+import datetime
+import threading
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+
+from Forest_apps.core.models import IdempotencyKey, Position, Warehouse
+from Forest_apps.core.services import IdempotentSubmission
+from Forest_apps.forestry.models import Material
+from Forest_apps.inventory.models import MaterialBalance, MaterialMovement, Receipt, StockLedgerEntry, StorageLocation
+from Forest_apps.inventory.services import BalanceEngine, BalanceHistory, BalanceReconciler, StockLedger
+
+
+def create_location(name):
+    """Склад с местом хранения (место хранения создается сигналом)"""
+    position = Position.objects.create(name=f'position-{name}')
+    warehouse = Warehouse.objects.create(name=name, created_by_position=position)
+    return StorageLocation.objects.get(source_type='склад', source_id=warehouse.id)
+
+
+class BalanceEngineConcurrencyTests(TransactionTestCase):
+    """Параллельные списания одного остатка (условный UPDATE без блокировок)"""
+
+    @skipUnlessDBFeature('test_db_allows_multiple_connections')
+    def test_parallel_debits_do_not_overdraw(self):
+        location = create_location('concurrency')
+        material = Material.objects.create(material_type='древесина', name='concurrency')
+        BalanceEngine.apply([BalanceEngine.credit(location, material, quantity_pieces=Decimal('10'))])
+
+        barrier = threading.Barrier(2)
+        results = []
+
+        def debit():
+            try:
+                barrier.wait()
+                BalanceEngine.apply([BalanceEngine.debit(location, material, quantity_pieces=Decimal('10'))])
+            except ValueError:
+                results.append('rejected')
+            else:
+                results.append('applied')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=debit) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), ['applied', 'rejected'])
+        balance = MaterialBalance.get_balance(location, material)
+        self.assertEqual(balance.quantity_pieces, Decimal('0'))
+        self.assertEqual(StockLedger.drift([location.id]), {})
+
+
+class StockLedgerTests(TestCase):
+    """Журнал остатков: записи на каждое изменение, сверка и пересчет"""
+
+    def setUp(self):
+        self.location = create_location('ledger')
+        self.material = Material.objects.create(material_type='древесина', name='ledger')
+
+    def test_apply_writes_ledger_entries(self):
+        BalanceEngine.apply([BalanceEngine.credit(self.location, self.material, quantity_cubic=Decimal('5'))])
+        BalanceEngine.apply([BalanceEngine.debit(self.location, self.material, quantity_cubic=Decimal('2'))])
+
+        entries = StockLedgerEntry.objects.filter(storage_location=self.location, material=self.material)
+        self.assertEqual(
+            list(entries.values_list('quantity_cubic', flat=True)),
+            [Decimal('5'), Decimal('-2')]
+        )
+        self.assertEqual(StockLedger.drift([self.location.id]), {})
+
+    def test_insufficient_debit_changes_nothing(self):
+        BalanceEngine.apply([BalanceEngine.credit(self.location, self.material, quantity_cubic=Decimal('1'))])
+
+        with self.assertRaises(ValueError):
+            BalanceEngine.apply([BalanceEngine.debit(self.location, self.material, quantity_cubic=Decimal('2'))])
+
+        self.assertEqual(MaterialBalance.get_balance(self.location, self.material).quantity_cubic, Decimal('1'))
+        self.assertEqual(StockLedgerEntry.objects.filter(material=self.material).count(), 1)
+
+    def test_rebuild_restores_balance_from_ledger(self):
+        BalanceEngine.apply([BalanceEngine.credit(self.location, self.material, quantity_cubic=Decimal('5'))])
+        MaterialBalance.objects.filter(material=self.material).update(quantity_cubic=Decimal('7'))
+        self.assertIn(self.location.id, StockLedger.drift([self.location.id]))
+
+        StockLedger.rebuild([self.location.id])
+
+        self.assertEqual(StockLedger.drift([self.location.id]), {})
+        self.assertEqual(MaterialBalance.get_balance(self.location, self.material).quantity_cubic, Decimal('5'))
+
+
+class BalanceHistoryTests(TestCase):
+    """Остатки на дату: по дате документа, со снимками, документами задним числом и исправлениями"""
+
+    def setUp(self):
+        self.location = create_location('history')
+        self.material = Material.objects.create(material_type='древесина', name='history')
+        self.today = timezone.localdate()
+
+    def days_ago(self, days):
+        return timezone.now() - datetime.timedelta(days=days)
+
+    def receive(self, quantity, days_ago):
+        receipt = Receipt.objects.create(
+            receipt_date=self.days_ago(days_ago),
+            storage_location=self.location,
+            material=self.material,
+            quantity_cubic=Decimal(quantity)
+        )
+        BalanceEngine.apply(receipt.get_balance_changes(), source=receipt)
+        return receipt
+
+    def edit(self, receipt, quantity, receipt_date):
+        """Исправление проведенного поступления (как MaterialBalanceCreateForm.save)"""
+        old_changes = receipt.get_balance_changes()
+        old_date = receipt.receipt_date
+
+        receipt.receipt_date = receipt_date
+        receipt.quantity_cubic = Decimal(quantity)
+        BalanceEngine.apply(
+            receipt.get_balance_changes(), source=receipt, reverted=old_changes, reverted_date=old_date
+        )
+        receipt.save()
+
+    def end_of_day(self, days_ago):
+        moment = BalanceHistory.cutoff_for(self.today - datetime.timedelta(days=days_ago))
+        quantities = BalanceHistory.as_of(moment - datetime.timedelta(microseconds=1))
+        return quantities.get((self.location.id, self.material.id), {}).get('quantity_cubic', Decimal('0'))
+
+    def test_backdated_document_counts_on_document_date(self):
+        self.receive('5', days_ago=3)
+        self.receive('2', days_ago=1)
+
+        self.assertEqual(self.end_of_day(4), Decimal('0'))
+        self.assertEqual(self.end_of_day(3), Decimal('5'))
+        self.assertEqual(self.end_of_day(1), Decimal('7'))
+
+    def test_snapshot_and_documents_posted_after_it(self):
+        self.receive('5', days_ago=3)
+        BalanceHistory.take_snapshot(self.today - datetime.timedelta(days=1))
+
+        # Документ задним числом после снимка: попадает и в остаток на дату документа, и после снимка
+        self.receive('2', days_ago=2)
+
+        self.assertEqual(self.end_of_day(3), Decimal('5'))
+        self.assertEqual(self.end_of_day(2), Decimal('7'))
+        self.assertEqual(self.end_of_day(1), Decimal('7'))
+        self.assertEqual(self.end_of_day(0), Decimal('7'))
+
+        BalanceHistory.take_snapshot(self.today - datetime.timedelta(days=1))
+        self.assertEqual(self.end_of_day(0), Decimal('7'))
+
+    def test_date_edit_moves_document_to_new_date(self):
+        receipt = self.receive('5', days_ago=3)
+        BalanceHistory.take_snapshot(self.today - datetime.timedelta(days=2))
+
+        self.edit(receipt, '5', self.days_ago(1))
+
+        self.assertEqual(self.end_of_day(3), Decimal('0'))
+        self.assertEqual(self.end_of_day(2), Decimal('0'))
+        self.assertEqual(self.end_of_day(1), Decimal('5'))
+        self.assertEqual(MaterialBalance.get_balance(self.location, self.material).quantity_cubic, Decimal('5'))
+        self.assertEqual(StockLedger.drift([self.location.id]), {})
+
+    def test_date_and_quantity_edit(self):
+        receipt = self.receive('5', days_ago=3)
+
+        self.edit(receipt, '8', self.days_ago(1))
+
+        self.assertEqual(self.end_of_day(3), Decimal('0'))
+        self.assertEqual(self.end_of_day(2), Decimal('0'))
+        self.assertEqual(self.end_of_day(1), Decimal('8'))
+
+    def test_quantity_edit_keeps_document_date(self):
+        receipt = self.receive('5', days_ago=3)
+
+        self.edit(receipt, '3', receipt.receipt_date)
+
+        self.assertEqual(self.end_of_day(3), Decimal('3'))
+        # Откат и проведение на одну дату - одна запись с разницей
+        self.assertEqual(
+            list(StockLedgerEntry.objects.filter(source_id=receipt.pk).values_list('quantity_cubic', flat=True)),
+            [Decimal('5'), Decimal('-2')]
+        )
+
+    def test_moment_before_opening_is_rejected(self):
+        StockLedgerEntry.objects.create(
+            storage_location=self.location, material=self.material, source_type='Начальный остаток'
+        )
+
+        with self.assertRaises(ValueError):
+            BalanceHistory.as_of(timezone.now() - datetime.timedelta(days=1))
+
+
+class BalanceReconcilerTests(TestCase):
+    """Сверка с документами: документы до начальных остатков журнала и их последующие изменения"""
+
+    def setUp(self):
+        self.warehouse = create_location('reconcile-a')
+        self.brigade = create_location('reconcile-b')
+        self.material = Material.objects.create(material_type='древесина', name='reconcile')
+
+        # Документы до появления журнала: остатки без записей журнала
+        self.receipt = Receipt.objects.create(
+            receipt_date=timezone.now(),
+            storage_location=self.warehouse,
+            material=self.material,
+            quantity_cubic=Decimal('10')
+        )
+        self.movement = MaterialMovement.objects.create(
+            accounting_type='Перемещение',
+            from_location=self.warehouse,
+            to_location=self.brigade,
+            material=self.material,
+            quantity_cubic=Decimal('4'),
+            is_completed=True,
+            completed_at=timezone.now()
+        )
+        for location, quantity in ((self.warehouse, '6'), (self.brigade, '4')):
+            MaterialBalance.objects.create(
+                storage_location=location, material=self.material, quantity_cubic=Decimal(quantity)
+            )
+
+        # Начальные остатки журнала (как миграция 0011)
+        for location, quantity in ((self.warehouse, '6'), (self.brigade, '4')):
+            StockLedgerEntry.objects.create(
+                storage_location=location,
+                material=self.material,
+                source_type='Начальный остаток',
+                quantity_cubic=Decimal(quantity)
+            )
+        self.cutoff = BalanceReconciler.opening_cutoff()
+        self.location_ids = [self.warehouse.id, self.brigade.id]
+
+    def test_opening_matches_documents(self):
+        self.assertEqual(BalanceReconciler.drift(self.location_ids, self.cutoff), {})
+
+    def test_early_movement_cancelled_after_opening(self):
+        self.movement.cancel_execution()
+
+        self.assertEqual(BalanceReconciler.drift(self.location_ids, self.cutoff), {})
+        self.assertEqual(MaterialBalance.get_balance(self.warehouse, self.material).quantity_cubic, Decimal('10'))
+
+    def test_early_receipt_edited_after_opening(self):
+        old_changes = self.receipt.get_balance_changes()
+        self.receipt.quantity_cubic = Decimal('7')
+        BalanceEngine.apply(
+            self.receipt.get_balance_changes(),
+            source=self.receipt,
+            reverted=old_changes,
+            reverted_date=self.receipt.receipt_date
+        )
+        self.receipt.save()
+
+        self.assertEqual(BalanceReconciler.drift(self.location_ids, self.cutoff), {})
+
+    def test_new_document_checked_against_balance(self):
+        receipt = Receipt.objects.create(
+            receipt_date=timezone.now(),
+            storage_location=self.warehouse,
+            material=self.material,
+            quantity_cubic=Decimal('2')
+        )
+        BalanceEngine.apply(receipt.get_balance_changes(), source=receipt)
+        MaterialBalance.objects.filter(storage_location=self.warehouse).update(quantity_cubic=Decimal('5'))
+
+        drift = BalanceReconciler.drift(self.location_ids, self.cutoff)
+        self.assertEqual(drift[self.warehouse.id][0]['documents'], Decimal('8'))
+
+        BalanceReconciler.repair(self.location_ids, self.cutoff)
+        self.assertEqual(BalanceReconciler.drift(self.location_ids, self.cutoff), {})
+        self.assertEqual(MaterialBalance.get_balance(self.warehouse, self.material).quantity_cubic, Decimal('8'))
+
+
+class IdempotentSubmissionTests(TestCase):
+    """Повторная отправка формы с тем же ключом не создает документ второй раз"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('idempotency')
+        self.location = create_location('idempotency')
+        self.material = Material.objects.create(material_type='древесина', name='idempotency')
+
+    def post(self, key):
+        request = RequestFactory().post('/', {IdempotentSubmission.FIELD_NAME: key})
+        request.user = self.user
+        request.session = {}
+        request._messages = FallbackStorage(request)
+        return request
+
+    def receive(self):
+        BalanceEngine.apply([BalanceEngine.credit(self.location, self.material, quantity_pieces=Decimal('1'))])
+        return self.material, '/done/', 'Поступление создано'
+
+    def test_repeated_submission_is_replayed(self):
+        key = 'a1b2c3d4e5f6'
+
+        first = IdempotentSubmission.run(self.post(key), 'receipt', self.receive)
+        second = IdempotentSubmission.replay(self.post(key)) or IdempotentSubmission.run(
+            self.post(key), 'receipt', self.receive
+        )
+
+        self.assertEqual(first.url, '/done/')
+        self.assertEqual(second.url, '/done/')
+        self.assertEqual(MaterialBalance.get_balance(self.location, self.material).quantity_pieces, Decimal('1'))
+        self.assertEqual(IdempotencyKey.objects.filter(user=self.user, key=key).count(), 1)
+
+    def test_failed_submission_releases_key(self):
+        key = 'f6e5d4c3b2a1'
+
+        def fail():
+            raise ValueError('Недостаточно материала')
+
+        with self.assertRaises(ValueError):
+            IdempotentSubmission.run(self.post(key), 'receipt', fail)
+        self.assertFalse(IdempotencyKey.objects.filter(key=key).exists())
+
+        response = IdempotentSubmission.run(self.post(key), 'receipt', self.receive)
+        self.assertEqual(response.url, '/done/')
+        self.assertEqual(MaterialBalance.get_balance(self.location, self.material).quantity_pieces, Decimal('1'))
@@ -2,7 +2,9 @@ from django.urls import path
 from Forest_apps.inventory.views import storage_location
 from Forest_apps.inventory.views import material_balance
 from Forest_apps.inventory.views import material_movement
+from Forest_apps.inventory.views import movement_document
 from Forest_apps.inventory.views import conversion
+from Forest_apps.inventory.views import sync
 
 app_name = 'inventory'
 
@@ -18,9 +20,11 @@ urlpatterns = [
     path('balances/', material_balance.material_balance_list_view, name='material_balance_list'),
     path('balances/create/', material_balance.material_balance_create_view, name='material_balance_create'),
     path('balances/<int:balance_id>/', material_balance.material_balance_detail_view, name='material_balance_detail'),
+    path('balances/low-stock/', material_balance.low_stock_list_view, name='low_stock_list'),
 
     # Поступления материалов
     path('receipts/', material_balance.receipt_list_view, name='receipt_list'),
+    path('receipts/export/', material_balance.receipt_export_view, name='receipt_export'),
     path('receipts/<int:receipt_id>/', material_balance.receipt_detail_view, name='receipt_detail'),
     path('receipts/<int:receipt_id>/edit/', material_balance.receipt_edit_view, name='receipt_edit'),
     path('receipts/<int:receipt_id>/delete/', material_balance.receipt_delete_view, name='receipt_delete'),
@@ -31,6 +35,7 @@ urlpatterns = [
     # path('movements/all/<int:movement_id>/edit/', material_movement.all_material_movements_edit_view, name='all_material_movements_edit'),
     # path('movements/all/<int:movement_id>/delete/', material_movement.all_material_movements_delete_view, name='all_material_movements_delete'),
     path('movements/create/', material_movement.material_movement_create_view, name='material_movement_create'),
+    path('movements/export/', material_movement.material_movement_export_view, name='material_movement_export'),
     path('movements/<int:movement_id>/', material_movement.material_movement_detail_view,
          name='material_movement_detail'),
     path('movements/<int:movement_id>/edit/', material_movement.material_movement_edit_view,
@@ -46,9 +51,23 @@ urlpatterns = [
     path('movements/pending-shipments/', material_movement.material_movement_pending_shipments_view,
          name='material_movement_pending_shipments'),
 
+    # Многострочные документы движения
+    path('movements/documents/create/', movement_document.movement_document_create_view,
+         name='movement_document_create'),
+    path('movements/documents/<int:document_id>/', movement_document.movement_document_detail_view,
+         name='movement_document_detail'),
+    path('movements/documents/<int:document_id>/confirm/', movement_document.movement_document_confirm_view,
+         name='movement_document_confirm'),
+    path('movements/documents/<int:document_id>/delete/', movement_document.movement_document_delete_view,
+         name='movement_document_delete'),
+
     # API
     path('api/locations-by-type/', material_movement.get_locations_by_type, name='api_locations_by_type'),
     path('api/materials/', material_movement.get_materials, name='api_materials'),
+    path('api/balances-as-of/', material_balance.balances_as_of_api, name='api_balances_as_of'),
+    path('api/low-stock/', material_balance.low_stock_api, name='api_low_stock'),
+    path('api/sync/', sync.sync_batch_api, name='api_sync_batch'),
+    path('api/sync/reference/', sync.sync_reference_api, name='api_sync_reference'),
 
     # Конвертация древесины
     path('conversions/', conversion.conversion_list_view, name='conversion_list'),
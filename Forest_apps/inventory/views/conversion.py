@@ -1,13 +1,16 @@
 # ПРЕДСТАВЛЕНИЯ КОНВЕРТАЦИИ
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Prefetch, Sum
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.utils import timezone
 from datetime import timedelta
-from Forest_apps.inventory.models import Conversion, MaterialBalance, StorageLocation
+from Forest_apps.inventory.models import Conversion, ConversionOutput, StorageLocation
 from Forest_apps.core.models import Position
-from Forest_apps.inventory.forms.conversion import ConversionCreateForm
+from Forest_apps.core.services import IdempotentSubmission
+from Forest_apps.inventory.forms.conversion import ConversionCreateForm, ConversionOutputFormSet
+from Forest_apps.inventory.services import OwnedLocationResolver, BalanceEngine, ReferenceDataCache
 
 
 @login_required
@@ -16,7 +19,7 @@ def conversion_list_view(request):
 
     # Получаем должность текущего пользователя из сессии
     user_position_name = request.session.get('position_name')
-    is_manager = (user_position_name and user_position_name.lower() == 'руководитель')
+    is_manager = request.role.is_manager
 
     # Вычисляем дату 5 дней назад для проверки возраста
     now_minus_5_days = timezone.now() - timedelta(days=5)
@@ -28,36 +31,19 @@ def conversion_list_view(request):
     if is_manager:
         # Руководитель видит ВСЕ конвертации
         conversions = Conversion.objects.select_related(
-            'storage_location', 'source_material', 'target_material', 'created_by_position'
+            'storage_location', 'source_material', 'created_by_position'
         ).order_by('-conversion_date')
         # Для руководителя - все склады
-        user_warehouses = StorageLocation.objects.filter(source_type='склад').order_by('source_type')
+        user_warehouses = StorageLocation.objects.filter(source_type='склад').order_by('source_type').with_source_names()
     else:
-        # Находим склады, созданные должностью мастера
-        from Forest_apps.core.models import Warehouse
-
-        user_position_id = None
-        try:
-            position = Position.objects.get(name__iexact=user_position_name)
-            user_position_id = position.id
-        except Position.DoesNotExist:
-            user_position_id = -1
-
         # Получаем ID складов, принадлежащих должности
-        user_warehouse_ids = []
-        warehouses = Warehouse.objects.filter(created_by_position_id=user_position_id)
-        for wh in warehouses:
-            try:
-                location = StorageLocation.objects.get(source_type='склад', source_id=wh.id)
-                user_warehouse_ids.append(location.id)
-            except StorageLocation.DoesNotExist:
-                pass
+        user_warehouse_ids = OwnedLocationResolver.for_request(request, 'склад')
 
         # Фильтруем конвертации по складам пользователя
         conversions = Conversion.objects.filter(
             storage_location_id__in=user_warehouse_ids
         ).select_related(
-            'storage_location', 'source_material', 'target_material', 'created_by_position'
+            'storage_location', 'source_material', 'created_by_position'
         ).order_by('-conversion_date')
 
         user_warehouses = StorageLocation.objects.filter(id__in=user_warehouse_ids).order_by('source_type')
@@ -76,7 +62,8 @@ def conversion_list_view(request):
         conversions = conversions.filter(source_material_id=source_material_id)
 
     if target_material_id:
-        conversions = conversions.filter(target_material_id=target_material_id)
+        # Конвертации, в выходах которых есть материал (материал в выходах не повторяется)
+        conversions = conversions.filter(outputs__material_id=target_material_id)
 
     if date_from:
         conversions = conversions.filter(conversion_date__date__gte=date_from)
@@ -85,12 +72,24 @@ def conversion_list_view(request):
         conversions = conversions.filter(conversion_date__date__lte=date_to)
 
     # ===== СТАТИСТИКА =====
-    total_source_pieces = conversions.aggregate(total=Sum('source_quantity_pieces'))['total'] or 0
-    total_source_meters = conversions.aggregate(total=Sum('source_quantity_meters'))['total'] or 0
-    total_source_cubic = conversions.aggregate(total=Sum('source_quantity_cubic'))['total'] or 0
-    total_target_pieces = conversions.aggregate(total=Sum('target_quantity_pieces'))['total'] or 0
-    total_target_meters = conversions.aggregate(total=Sum('target_quantity_meters'))['total'] or 0
-    total_target_cubic = conversions.aggregate(total=Sum('target_quantity_cubic'))['total'] or 0
+    # Один запрос по исходному материалу и один по выходам
+    source_totals = conversions.aggregate(
+        pieces=Sum('source_quantity_pieces'),
+        meters=Sum('source_quantity_meters'),
+        cubic=Sum('source_quantity_cubic'),
+    )
+    target_totals = ConversionOutput.objects.filter(
+        conversion__in=conversions.values('id')
+    ).aggregate(
+        pieces=Sum('quantity_pieces'),
+        meters=Sum('quantity_meters'),
+        cubic=Sum('quantity_cubic'),
+    )
+
+    # Выходы с материалами и долями выхода - одним запросом на всю страницу
+    conversions = conversions.prefetch_related(
+        Prefetch('outputs', queryset=ConversionOutput.objects.select_related('material'))
+    )
 
     context = {
         'title': 'Конвертация древесины',
@@ -101,12 +100,12 @@ def conversion_list_view(request):
         'materials': materials,
         'is_manager': is_manager,
         'now_minus_5_days': now_minus_5_days,
-        'total_source_pieces': total_source_pieces,
-        'total_source_meters': total_source_meters,
-        'total_source_cubic': total_source_cubic,
-        'total_target_pieces': total_target_pieces,
-        'total_target_meters': total_target_meters,
-        'total_target_cubic': total_target_cubic,
+        'total_source_pieces': source_totals['pieces'] or 0,
+        'total_source_meters': source_totals['meters'] or 0,
+        'total_source_cubic': source_totals['cubic'] or 0,
+        'total_target_pieces': target_totals['pieces'] or 0,
+        'total_target_meters': target_totals['meters'] or 0,
+        'total_target_cubic': target_totals['cubic'] or 0,
     }
 
     return render(request, 'Conversion/conversion_list.html', context)
@@ -120,15 +119,23 @@ def conversion_create_view(request):
     position_name = request.session.get('position_name')
 
     if request.method == 'POST':
+        # Повторная отправка (нажали еще раз после таймаута) - результат первой
+        replayed = IdempotentSubmission.replay(request)
+        if replayed:
+            return replayed
+
         form = ConversionCreateForm(request.POST, user=request.user, position_name=position_name)
-        if form.is_valid():
+        formset = ConversionOutputFormSet(request.POST, source_material_id=request.POST.get('source_material'))
+        if form.is_valid() and formset.is_valid():
+            outputs = formset.build_outputs()
+
             # Сохраняем конвертацию
             conversion = form.save(commit=False)
             conversion.created_by = request.user
 
             # Добавляем должность создателя
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 conversion.created_by_position = position
             except Position.DoesNotExist:
                 position, _ = Position.objects.get_or_create(
@@ -137,26 +144,27 @@ def conversion_create_view(request):
                 )
                 conversion.created_by_position = position
 
-            # Сохраняем (дата уже установлена в форме)
-            conversion.save()
-
-            try:
-                # Выполняем конвертацию
-                conversion.execute_conversion()
-                messages.success(
-                    request,
+            def submit():
+                # Сохранение документа, выходов и проводка - одна транзакция:
+                # при ошибке конвертация не остается
+                conversion.save()
+                conversion.execute_conversion(conversion.save_outputs(outputs))
+                return conversion, 'inventory:conversion_list', (
                     f'✅ Конвертация №{conversion.id} успешно выполнена! '
-                    f'{conversion.source_material.name} → {conversion.target_material.name}'
+                    f'{conversion.source_material.name} → '
+                    f'{", ".join(output.material.name for output in outputs)}'
                 )
+
+            try:
+                # Остаток исходного материала проверяется до записи
+                conversion.validate_for_execution(outputs)
+                return IdempotentSubmission.run(request, 'inventory:conversion_create', submit)
             except ValueError as e:
-                # Если ошибка, удаляем созданную конвертацию
-                conversion.delete()
                 messages.error(request, str(e))
                 return redirect('inventory:conversion_create')
-
-            return redirect('inventory:conversion_list')
     else:
         form = ConversionCreateForm(user=request.user, position_name=position_name)
+        formset = ConversionOutputFormSet()
 
         # Проверяем, есть ли у пользователя склады
         if form.fields['storage_location'].queryset.count() == 0:
@@ -168,7 +176,9 @@ def conversion_create_view(request):
     context = {
         'title': 'Создание конвертации',
         'form': form,
+        'formset': formset,
         'employee_name': request.session.get('employee_name'),
+        'idempotency_key': IdempotentSubmission.form_key(request),
     }
 
     return render(request, 'Conversion/conversion_create.html', context)
@@ -180,8 +190,10 @@ def conversion_detail_view(request, conversion_id):
 
     conversion = get_object_or_404(
         Conversion.objects.select_related(
-            'storage_location', 'source_material', 'target_material',
+            'storage_location', 'source_material',
             'created_by', 'created_by_position'
+        ).prefetch_related(
+            Prefetch('outputs', queryset=ConversionOutput.objects.select_related('material'))
         ),
         id=conversion_id
     )
@@ -199,33 +211,24 @@ def conversion_detail_view(request, conversion_id):
 def conversion_edit_view(request, conversion_id):
     """Редактирование конвертации: откат старой + применение новой"""
 
-    conversion = get_object_or_404(Conversion, id=conversion_id)
+    conversion = get_object_or_404(
+        Conversion.objects.prefetch_related(
+            Prefetch('outputs', queryset=ConversionOutput.objects.select_related('material'))
+        ),
+        id=conversion_id
+    )
     position_name = request.session.get('position_name')
-    is_manager = (position_name and position_name.lower() == 'руководитель')
+    is_manager = request.role.is_manager
 
     # Проверка прав (оставляем как есть)
     if not is_manager:
-        from Forest_apps.core.models import Warehouse
-        from Forest_apps.inventory.models import StorageLocation
-
-        user_position_id = None
-        try:
-            position = Position.objects.get(name__iexact=position_name)
-            user_position_id = position.id
-        except Position.DoesNotExist:
+        if not OwnedLocationResolver.get_position_id(position_name):
             messages.error(request, 'Ошибка определения должности')
             return redirect('inventory:conversion_list')
 
-        user_warehouse_ids = []
-        warehouses = Warehouse.objects.filter(created_by_position_id=user_position_id)
-        for wh in warehouses:
-            try:
-                location = StorageLocation.objects.get(source_type='склад', source_id=wh.id)
-                user_warehouse_ids.append(location.id)
-            except StorageLocation.DoesNotExist:
-                pass
+        user_warehouse_ids = OwnedLocationResolver.for_request(request, 'склад')
 
-        if conversion.storage_location.id not in user_warehouse_ids:
+        if conversion.storage_location_id not in user_warehouse_ids:
             messages.error(request, 'Вы можете редактировать только свои конвертации')
             return redirect('inventory:conversion_list')
 
@@ -235,249 +238,61 @@ def conversion_edit_view(request, conversion_id):
             return redirect('inventory:conversion_list')
 
     if request.method == 'POST':
-        # ===== 1. СОХРАНЯЕМ СТАРЫЕ ДАННЫЕ ДО ИЗМЕНЕНИЯ ФОРМЫ =====
-        storage_location = conversion.storage_location
-
-        old_source = conversion.source_material
-        old_source_pieces = conversion.source_quantity_pieces or 0
-        old_source_meters = conversion.source_quantity_meters or 0
-        old_source_cubic = conversion.source_quantity_cubic or 0
-
-        old_target = conversion.target_material
-        old_target_pieces = conversion.target_quantity_pieces or 0
-        old_target_meters = conversion.target_quantity_meters or 0
-        old_target_cubic = conversion.target_quantity_cubic or 0
-
-        print("\n" + "=" * 80)
-        print(f"РЕДАКТИРОВАНИЕ КОНВЕРТАЦИИ #{conversion.id}")
-        print("=" * 80)
-
-        print("\n📊 ПЕРВОНАЧАЛЬНЫЕ ОСТАТКИ В БАЗЕ ДАННЫХ:")
-        print("-" * 50)
-
-        # Получаем остатки ДО начала любых изменений
-        try:
-            old_source_balance = MaterialBalance.objects.get(
-                storage_location=storage_location,
-                material=old_source
-            )
-            old_source_qty = old_source_balance.quantity_pieces
-            print(f"{old_source.name}: {old_source_qty} шт")
-        except MaterialBalance.DoesNotExist:
-            old_source_balance = None
-            old_source_qty = 0
-            print(f"{old_source.name}: 0 шт")
-
-        try:
-            old_target_balance = MaterialBalance.objects.get(
-                storage_location=storage_location,
-                material=old_target
-            )
-            old_target_qty = old_target_balance.quantity_pieces
-            print(f"{old_target.name}: {old_target_qty} шт")
-        except MaterialBalance.DoesNotExist:
-            old_target_balance = None
-            old_target_qty = 0
-            print(f"{old_target.name}: 0 шт")
+        # Изменения остатков старой конвертации (до изменения экземпляра формой)
+        old_changes = conversion.get_balance_changes()
+        old_date = conversion.conversion_date
 
-        print(f"\n📋 СТАРАЯ КОНВЕРТАЦИЯ (из базы данных):")
-        print(f"   -{old_source_pieces} {old_source.name} → +{old_target_pieces} {old_target.name}")
-
-        # ===== 2. ТЕПЕРЬ СОЗДАЁМ ФОРМУ И ПОЛУЧАЕМ НОВЫЕ ДАННЫЕ =====
         form = ConversionCreateForm(request.POST, instance=conversion, user=request.user, position_name=position_name)
+        formset = ConversionOutputFormSet(request.POST, source_material_id=request.POST.get('source_material'))
 
-        if form.is_valid():
+        if form.is_valid() and formset.is_valid():
+            outputs = formset.build_outputs()
             try:
-                # ===== 3. НОВАЯ КОНВЕРТАЦИЯ ИЗ ФОРМЫ =====
-                new_source = form.cleaned_data.get('source_material')
-                new_source_pieces = form.cleaned_data.get('source_quantity_pieces') or 0
-                new_source_meters = form.cleaned_data.get('source_quantity_meters') or 0
-                new_source_cubic = form.cleaned_data.get('source_quantity_cubic') or 0
-
-                new_target = form.cleaned_data.get('target_material')
-                new_target_pieces = form.cleaned_data.get('target_quantity_pieces') or 0
-                new_target_meters = form.cleaned_data.get('target_quantity_meters') or 0
-                new_target_cubic = form.cleaned_data.get('target_quantity_cubic') or 0
-
-                print(f"\n📋 НОВАЯ КОНВЕРТАЦИЯ (из формы):")
-                print(f"   -{new_source_pieces} {new_source.name} → +{new_target_pieces} {new_target.name}")
-
-                # ===== 4. ОТКАТ СТАРОЙ КОНВЕРТАЦИИ =====
-                print("\n" + "=" * 80)
-                print("ШАГ 1: ОТКАТ СТАРОЙ КОНВЕРТАЦИИ")
-                print("=" * 80)
-
-                # Возвращаем исходный материал
-                print(f"\n1️⃣ Возвращаем списанный исходный материал: +{old_source_pieces} {old_source.name}")
-                if old_source_balance:
-                    before = old_source_balance.quantity_pieces
-                    old_source_balance.quantity_pieces += old_source_pieces
-                    old_source_balance.quantity_meters = (old_source_balance.quantity_meters or 0) + old_source_meters
-                    old_source_balance.quantity_cubic = (old_source_balance.quantity_cubic or 0) + old_source_cubic
-                    old_source_balance.save()
-                    print(
-                        f"   {old_source.name}: {before} → {old_source_balance.quantity_pieces} шт (+{old_source_pieces})")
-                else:
-                    old_source_balance = MaterialBalance.objects.create(
-                        storage_location=storage_location,
-                        material=old_source,
-                        quantity_pieces=old_source_pieces,
-                        quantity_meters=old_source_meters,
-                        quantity_cubic=old_source_cubic
-                    )
-                    print(f"   Создан новый баланс: {old_source.name}: {old_source_pieces} шт")
-
-                # Удаляем целевой материал
-                print(f"\n2️⃣ Удаляем созданный целевой материал: -{old_target_pieces} {old_target.name}")
-                if old_target_balance:
-                    if old_target_balance.quantity_pieces < old_target_pieces:
-                        raise ValueError(
-                            f'Невозможно откатить конвертацию: "{old_target.name}" недостаточно на складе. В наличии: {old_target_balance.quantity_pieces}, требуется удалить: {old_target_pieces}')
-
-                    before = old_target_balance.quantity_pieces
-                    old_target_balance.quantity_pieces -= old_target_pieces
-                    old_target_balance.quantity_meters = (old_target_balance.quantity_meters or 0) - old_target_meters
-                    old_target_balance.quantity_cubic = (old_target_balance.quantity_cubic or 0) - old_target_cubic
-                    old_target_balance.save()
-                    print(
-                        f"   {old_target.name}: {before} → {old_target_balance.quantity_pieces} шт (-{old_target_pieces})")
-                else:
-                    if old_target_pieces > 0:
-                        raise ValueError(f'Невозможно откатить конвертацию: "{old_target.name}" отсутствует на складе')
-                    print(f"   Целевой материал отсутствовал, пропускаем")
-
-                # Показываем остатки после отката
-                print("\n📊 ОСТАТКИ ПОСЛЕ ОТКАТА:")
-                after_source = MaterialBalance.objects.filter(
-                    storage_location=storage_location,
-                    material=old_source
-                ).first()
-                after_target = MaterialBalance.objects.filter(
-                    storage_location=storage_location,
-                    material=old_target
-                ).first()
-                print(f"{old_source.name}: {after_source.quantity_pieces if after_source else 0} шт")
-                print(f"{old_target.name}: {after_target.quantity_pieces if after_target else 0} шт")
-
-                # ===== 5. ПРИМЕНЕНИЕ НОВОЙ КОНВЕРТАЦИИ =====
-                print("\n" + "=" * 80)
-                print("ШАГ 2: ПРИМЕНЕНИЕ НОВОЙ КОНВЕРТАЦИИ")
-                print("=" * 80)
-                print(
-                    f"Новая конвертация: -{new_source_pieces} {new_source.name} → +{new_target_pieces} {new_target.name}")
-
-                # Получаем актуальные балансы для новых материалов
-                try:
-                    new_source_balance = MaterialBalance.objects.get(
-                        storage_location=storage_location,
-                        material=new_source
-                    )
-                except MaterialBalance.DoesNotExist:
-                    new_source_balance = None
-
-                # Списываем исходный материал
-                print(f"\n1️⃣ Списываем исходный материал: -{new_source_pieces} {new_source.name}")
-                if new_source_balance:
-                    if new_source_balance.quantity_pieces < new_source_pieces:
-                        raise ValueError(
-                            f'Недостаточно "{new_source.name}" на складе. В наличии: {new_source_balance.quantity_pieces}, требуется: {new_source_pieces}')
-
-                    before = new_source_balance.quantity_pieces
-                    new_source_balance.quantity_pieces -= new_source_pieces
-                    new_source_balance.quantity_meters = (new_source_balance.quantity_meters or 0) - new_source_meters
-                    new_source_balance.quantity_cubic = (new_source_balance.quantity_cubic or 0) - new_source_cubic
-                    new_source_balance.save()
-                    print(
-                        f"   {new_source.name}: {before} → {new_source_balance.quantity_pieces} шт (-{new_source_pieces})")
-                else:
-                    if new_source_pieces > 0:
-                        raise ValueError(f'Материал "{new_source.name}" отсутствует на складе')
-                    print(f"   Исходный материал отсутствует, пропускаем")
-
-                # Создаём целевой материал
-                print(f"\n2️⃣ Создаём целевой материал: +{new_target_pieces} {new_target.name}")
-                try:
-                    new_target_balance = MaterialBalance.objects.get(
-                        storage_location=storage_location,
-                        material=new_target
-                    )
-                    before = new_target_balance.quantity_pieces
-                    new_target_balance.quantity_pieces += new_target_pieces
-                    new_target_balance.quantity_meters = (new_target_balance.quantity_meters or 0) + new_target_meters
-                    new_target_balance.quantity_cubic = (new_target_balance.quantity_cubic or 0) + new_target_cubic
-                    new_target_balance.save()
-                    print(
-                        f"   {new_target.name}: {before} → {new_target_balance.quantity_pieces} шт (+{new_target_pieces})")
-                except MaterialBalance.DoesNotExist:
-                    MaterialBalance.objects.create(
-                        storage_location=storage_location,
-                        material=new_target,
-                        quantity_pieces=new_target_pieces,
-                        quantity_meters=new_target_meters,
-                        quantity_cubic=new_target_cubic,
-                        created_by=request.user,
-                        created_by_position=conversion.created_by_position
-                    )
-                    print(f"   Создан новый баланс: {new_target.name}: {new_target_pieces} шт")
-
-                # ===== 6. ФИНАЛЬНЫЕ ОСТАТКИ =====
-                print("\n" + "=" * 80)
-                print("📊 ОСТАТКИ ПОСЛЕ РЕДАКТИРОВАНИЯ:")
-                print("-" * 50)
-
-                final_source = MaterialBalance.objects.filter(
-                    storage_location=storage_location,
-                    material=new_source
-                ).first()
-                final_target = MaterialBalance.objects.filter(
-                    storage_location=storage_location,
-                    material=new_target
-                ).first()
-
-                print(f"{new_source.name}: {final_source.quantity_pieces if final_source else 0} шт")
-                print(f"{new_target.name}: {final_target.quantity_pieces if final_target else 0} шт")
-
-                # ===== 7. ОБНОВЛЯЕМ ЗАПИСЬ КОНВЕРТАЦИИ =====
-                conversion.source_material = new_source
-                conversion.source_quantity_pieces = new_source_pieces
-                conversion.source_quantity_meters = new_source_meters
-                conversion.source_quantity_cubic = new_source_cubic
-                conversion.target_material = new_target
-                conversion.target_quantity_pieces = new_target_pieces
-                conversion.target_quantity_meters = new_target_meters
-                conversion.target_quantity_cubic = new_target_cubic
+                conversion.source_material = form.cleaned_data.get('source_material')
+                conversion.source_quantity_pieces = form.cleaned_data.get('source_quantity_pieces') or 0
+                conversion.source_quantity_meters = form.cleaned_data.get('source_quantity_meters') or 0
+                conversion.source_quantity_cubic = form.cleaned_data.get('source_quantity_cubic') or 0
                 conversion.conversion_date = form.cleaned_data.get('conversion_date', timezone.now())
-                conversion.save()
 
-                print("\n" + "=" * 80)
-                print(f"✅ КОНВЕРТАЦИЯ #{conversion.id} УСПЕШНО ОБНОВЛЕНА")
-                print("=" * 80 + "\n")
+                # Откат старой и применение новой конвертации одной операцией
+                with transaction.atomic():
+                    BalanceEngine.apply(
+                        conversion.get_balance_changes(outputs),
+                        created_by=request.user,
+                        created_by_position=conversion.created_by_position,
+                        source=conversion,
+                        reverted=old_changes,
+                        reverted_date=old_date
+                    )
+                    conversion.save()
+                    conversion.save_outputs(outputs)
 
                 messages.success(request, f'✅ Конвертация №{conversion.id} успешно обновлена!')
                 return redirect('inventory:conversion_list')
 
             except ValueError as e:
-                print(f"\n❌ ОШИБКА: {str(e)}")
                 messages.error(request, str(e))
                 return redirect('inventory:conversion_edit', conversion_id=conversion.id)
             except Exception as e:
-                print(f"\n❌ ОШИБКА: {str(e)}")
                 messages.error(request, f'Ошибка: {str(e)}')
                 return redirect('inventory:conversion_edit', conversion_id=conversion.id)
         else:
             context = {
                 'title': f'Редактирование конвертации №{conversion.id}',
                 'form': form,
+                'formset': formset,
                 'conversion': conversion,
                 'employee_name': request.session.get('employee_name'),
             }
             return render(request, 'Conversion/conversion_create.html', context)
     else:
         form = ConversionCreateForm(instance=conversion, user=request.user, position_name=position_name)
+        formset = ConversionOutputFormSet(initial=ConversionOutputFormSet.initial_for(conversion))
 
     context = {
         'title': f'Редактирование конвертации №{conversion.id}',
         'form': form,
+        'formset': formset,
         'conversion': conversion,
         'employee_name': request.session.get('employee_name'),
     }
@@ -491,31 +306,17 @@ def conversion_delete_view(request, conversion_id):
 
     conversion = get_object_or_404(Conversion, id=conversion_id)
     position_name = request.session.get('position_name')
-    is_manager = (position_name and position_name.lower() == 'руководитель')
+    is_manager = request.role.is_manager
 
     # Проверка прав
     if not is_manager:
-        from Forest_apps.core.models import Warehouse
-        from Forest_apps.inventory.models import StorageLocation
-
-        user_position_id = None
-        try:
-            position = Position.objects.get(name__iexact=position_name)
-            user_position_id = position.id
-        except Position.DoesNotExist:
+        if not OwnedLocationResolver.get_position_id(position_name):
             messages.error(request, 'Ошибка определения должности')
             return redirect('inventory:conversion_list')
 
-        user_warehouse_ids = []
-        warehouses = Warehouse.objects.filter(created_by_position_id=user_position_id)
-        for wh in warehouses:
-            try:
-                location = StorageLocation.objects.get(source_type='склад', source_id=wh.id)
-                user_warehouse_ids.append(location.id)
-            except StorageLocation.DoesNotExist:
-                pass
+        user_warehouse_ids = OwnedLocationResolver.for_request(request, 'склад')
 
-        if conversion.storage_location.id not in user_warehouse_ids:
+        if conversion.storage_location_id not in user_warehouse_ids:
             messages.error(request, 'Вы можете удалять только свои конвертации')
             return redirect('inventory:conversion_list')
 
@@ -526,42 +327,18 @@ def conversion_delete_view(request, conversion_id):
             return redirect('inventory:conversion_list')
 
     try:
-        from Forest_apps.inventory.models import MaterialBalance
+        # Возвращаем исходный материал и убираем созданный одной транзакцией
+        with transaction.atomic():
+            BalanceEngine.apply(
+                BalanceEngine.reverse(conversion.get_balance_changes()),
+                created_by=request.user,
+                created_by_position=conversion.created_by_position,
+                source=conversion
+            )
 
-        storage_location = conversion.storage_location
+            conversion_id_for_message = conversion.id
+            conversion.delete()
 
-        # Возвращаем исходный материал
-        try:
-            source_balance = MaterialBalance.objects.get(
-                storage_location=storage_location,
-                material=conversion.source_material
-            )
-            source_balance.quantity_pieces += conversion.source_quantity_pieces or 0
-            source_balance.quantity_meters = (source_balance.quantity_meters or 0) + (
-                        conversion.source_quantity_meters or 0)
-            source_balance.quantity_cubic = (source_balance.quantity_cubic or 0) + (
-                        conversion.source_quantity_cubic or 0)
-            source_balance.save()
-        except MaterialBalance.DoesNotExist:
-            pass
-
-        # Убираем созданный материал
-        try:
-            target_balance = MaterialBalance.objects.get(
-                storage_location=storage_location,
-                material=conversion.target_material
-            )
-            target_balance.quantity_pieces -= conversion.target_quantity_pieces or 0
-            target_balance.quantity_meters = (target_balance.quantity_meters or 0) - (
-                        conversion.target_quantity_meters or 0)
-            target_balance.quantity_cubic = (target_balance.quantity_cubic or 0) - (
-                        conversion.target_quantity_cubic or 0)
-            target_balance.save()
-        except MaterialBalance.DoesNotExist:
-            pass
-
-        conversion_id_for_message = conversion.id
-        conversion.delete()
         messages.success(request, f'✅ Конвертация №{conversion_id_for_message} успешно удалена!')
 
     except Exception as e:
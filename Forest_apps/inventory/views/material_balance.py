@@ -2,19 +2,28 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
+from django.db import transaction
 from django.db.models import Q, Sum
-# from django.utils import timezone
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.core.paginator import Paginator
 # from decimal import Decimal
-# from datetime import timedelta
+from datetime import timedelta
 
 from Forest_apps.inventory.models import MaterialBalance, StorageLocation, Receipt
-# from Forest_apps.forestry.models import Material
+from Forest_apps.forestry.models import Material
 from Forest_apps.core.models import Position, Warehouse #, Brigade, Vehicle
+from Forest_apps.core.services import IdempotentSubmission
 from Forest_apps.inventory.forms.material_balance import (
     MaterialBalanceCreateForm,
     MaterialBalanceFilterForm
 )
-from Forest_apps.inventory.services import StorageLocationService
+from Forest_apps.inventory.services import (
+    StorageLocationService, BalanceEngine, BalanceHistory, OwnedLocationResolver, LowStockMonitor,
+    ReferenceDataCache
+)
+from Forest_apps.inventory.exports import RECEIPT_COLUMNS, export_response, iter_chunks
 
 
 @login_required
@@ -73,7 +82,7 @@ def material_balance_list_view(request):
     # Получаем ID исходных объектов для проверки прав в шаблоне
     user_position_id = None
     try:
-        position = Position.objects.get(name__iexact=user_position_name)
+        position = ReferenceDataCache.get_position(user_position_name)
         user_position_id = position.id
     except Position.DoesNotExist:
         user_position_id = -1
@@ -112,6 +121,11 @@ def material_balance_create_view(request):
     position_name = request.session.get('position_name')
 
     if request.method == 'POST':
+        # Повторная отправка (нажали еще раз после таймаута) - результат первой
+        replayed = IdempotentSubmission.replay(request)
+        if replayed:
+            return replayed
+
         form = MaterialBalanceCreateForm(request.POST, user=request.user, position_name=position_name)
         if form.is_valid():
             try:
@@ -119,24 +133,23 @@ def material_balance_create_view(request):
                 position = None
                 if position_name:
                     try:
-                        position = Position.objects.get(name__iexact=position_name)
+                        position = ReferenceDataCache.get_position(position_name)
                     except Position.DoesNotExist:
                         position, _ = Position.objects.get_or_create(
                             name=position_name,
                             defaults={'is_active': True}
                         )
 
-                # Сохраняем форму, передавая должность и пользователя
-                balance = form.save(commit=False, position=position, user=request.user)
+                def submit():
+                    # Сохраняем форму, передавая должность и пользователя
+                    balance = form.save(commit=False, position=position, user=request.user)
+                    return balance, 'inventory:material_balance_list', (
+                        f'✅ Поступление материала "{form.cleaned_data["material"].name}" '
+                        f'на склад "{form.cleaned_data["storage_location"].get_source_name()}" '
+                        f'успешно создано!'
+                    )
 
-                messages.success(
-                    request,
-                    f'✅ Поступление материала "{form.cleaned_data["material"].name}" '
-                    f'на склад "{form.cleaned_data["storage_location"].get_source_name()}" '
-                    f'успешно создано!'
-                )
-
-                return redirect('inventory:material_balance_list')
+                return IdempotentSubmission.run(request, 'inventory:material_balance_create', submit)
 
             except ValueError as e:
                 messages.error(request, str(e))
@@ -146,6 +159,7 @@ def material_balance_create_view(request):
                 'title': 'Добавление остатка',
                 'form': form,
                 'employee_name': request.session.get('employee_name'),
+                'idempotency_key': IdempotentSubmission.form_key(request),
             }
             return render(request, 'MaterialBalance/material_balance_create.html', context)
     else:
@@ -160,6 +174,7 @@ def material_balance_create_view(request):
         'title': 'Добавление остатка',
         'form': form,
         'employee_name': request.session.get('employee_name'),
+        'idempotency_key': IdempotentSubmission.form_key(request),
     }
 
     return render(request, 'MaterialBalance/material_balance_create.html', context)
@@ -183,12 +198,11 @@ def material_balance_detail_view(request, balance_id):
     return render(request, 'MaterialBalance/material_balance_detail.html', context)
 
 
-@login_required
-def receipt_list_view(request):
-    """Список поступлений материалов с фильтрацией"""
+def _filter_receipts(request):
+    """Поступления должности с фильтрами списка (общие для списка и выгрузки)"""
 
     user_position_name = request.session.get('position_name')
-    is_manager = (user_position_name and user_position_name.lower() == 'руководитель')
+    is_manager = request.role.is_manager
 
     if is_manager:
         # Руководитель видит ВСЕ поступления
@@ -197,7 +211,7 @@ def receipt_list_view(request):
         ).order_by('-receipt_date')
 
         # Для фильтра складов показываем все склады
-        user_warehouses = StorageLocation.objects.filter(source_type='склад').order_by('source_type')
+        user_warehouses = StorageLocation.objects.filter(source_type='склад').order_by('source_type').with_source_names()
     else:
         # Мастер - только свои поступления
         user_warehouses = StorageLocationService.get_user_warehouses_by_position_name(user_position_name)
@@ -209,9 +223,6 @@ def receipt_list_view(request):
             'storage_location', 'material', 'source_location', 'created_by_position'
         ).order_by('-receipt_date')
 
-    # Получаем все контрагенты для фильтра
-    counterparties = StorageLocation.objects.filter(source_type='контрагент').order_by('source_id')
-
     # Фильтрация
     storage_location_id = request.GET.get('storage_location')
     source_location_id = request.GET.get('source_location')
@@ -234,6 +245,21 @@ def receipt_list_view(request):
     if date_to:
         receipts = receipts.filter(receipt_date__date__lte=date_to)
 
+    return receipts, user_warehouses
+
+
+@login_required
+def receipt_list_view(request):
+    """Список поступлений материалов с фильтрацией"""
+
+    user_position_name = request.session.get('position_name')
+    is_manager = request.role.is_manager
+
+    receipts, user_warehouses = _filter_receipts(request)
+
+    # Получаем все контрагенты для фильтра
+    counterparties = StorageLocation.objects.filter(source_type='контрагент').order_by('source_id').with_source_names()
+
     # Статистика
     total_count = receipts.count()
     total_pieces = receipts.aggregate(total=Sum('quantity_pieces'))['total'] or 0
@@ -259,6 +285,20 @@ def receipt_list_view(request):
     return render(request, 'MaterialBalance/receipt_list.html', context)
 
 
+@login_required
+def receipt_export_view(request):
+    """Выгрузка поступлений (CSV/XLSX) с фильтрами списка"""
+
+    receipts, user_warehouses = _filter_receipts(request)
+
+    return export_response(
+        iter_chunks(receipts.order_by('-receipt_date', '-id'), location_fields=('storage_location', 'source_location')),
+        RECEIPT_COLUMNS,
+        'receipts',
+        request.GET.get('format')
+    )
+
+
 @login_required
 def receipt_edit_view(request, receipt_id):
     """Редактирование поступления"""
@@ -270,7 +310,7 @@ def receipt_edit_view(request, receipt_id):
 
     # Получаем должность пользователя
     position_name = request.session.get('position_name')
-    is_manager = (position_name and position_name.lower() == 'руководитель')
+    is_manager = request.role.is_manager
 
     if is_manager:
         # Руководитель может редактировать ЛЮБЫЕ поступления
@@ -305,7 +345,7 @@ def receipt_edit_view(request, receipt_id):
                 position = None
                 if position_name:
                     try:
-                        position = Position.objects.get(name__iexact=position_name)
+                        position = ReferenceDataCache.get_position(position_name)
                     except Position.DoesNotExist:
                         position, _ = Position.objects.get_or_create(
                             name=position_name,
@@ -354,7 +394,7 @@ def receipt_delete_view(request, receipt_id):
 
     # Получаем должность пользователя
     position_name = request.session.get('position_name')
-    is_manager = (position_name and position_name.lower() == 'руководитель')
+    is_manager = request.role.is_manager
 
     if is_manager:
         # Руководитель может удалять ЛЮБЫЕ поступления
@@ -377,46 +417,20 @@ def receipt_delete_view(request, receipt_id):
             return redirect('inventory:receipt_list')
 
     try:
-        # Получаем баланс
-        balance = MaterialBalance.objects.get(
-            storage_location=receipt.storage_location,
-            material=receipt.material
-        )
-
-        # Проверяем, достаточно ли остатков для удаления
-        pieces_to_remove = receipt.quantity_pieces or 0
-        meters_to_remove = receipt.quantity_meters or 0
-        cubic_to_remove = receipt.quantity_cubic or 0
-
-        if pieces_to_remove > 0 and balance.quantity_pieces < pieces_to_remove:
-            raise ValueError(
-                f'Недостаточно материала на складе. В наличии: {balance.quantity_pieces} шт, '
-                f'требуется удалить: {pieces_to_remove} шт'
-            )
-        if meters_to_remove > 0 and (balance.quantity_meters or 0) < meters_to_remove:
-            raise ValueError(
-                f'Недостаточно материала на складе. В наличии: {balance.quantity_meters or 0} м.п., '
-                f'требуется удалить: {meters_to_remove} м.п.'
+        receipt_id_for_message = receipt.id
+
+        # Списываем поступивший материал и удаляем поступление одной транзакцией
+        with transaction.atomic():
+            BalanceEngine.apply(
+                BalanceEngine.reverse(receipt.get_balance_changes()),
+                created_by=request.user,
+                created_by_position=receipt.created_by_position,
+                source=receipt
             )
-        if cubic_to_remove > 0 and (balance.quantity_cubic or 0) < cubic_to_remove:
-            raise ValueError(
-                f'Недостаточно материала на складе. В наличии: {balance.quantity_cubic or 0} м³, '
-                f'требуется удалить: {cubic_to_remove} м³'
-            )
-
-        # Уменьшаем баланс
-        balance.quantity_pieces -= pieces_to_remove
-        balance.quantity_meters = (balance.quantity_meters or 0) - meters_to_remove
-        balance.quantity_cubic = (balance.quantity_cubic or 0) - cubic_to_remove
-        balance.save()
+            receipt.delete()
 
-        # Удаляем поступление
-        receipt.delete()
+        messages.success(request, f'✅ Поступление №{receipt_id_for_message} успешно удалено!')
 
-        messages.success(request, f'✅ Поступление №{receipt.id} успешно удалено!')
-
-    except MaterialBalance.DoesNotExist:
-        messages.error(request, f'Остаток материала не найден на складе')
     except ValueError as e:
         messages.error(request, str(e))
     except Exception as e:
@@ -443,4 +457,139 @@ def receipt_detail_view(request, receipt_id):
         'receipt': receipt,
     }
 
-    return render(request, 'MaterialBalance/receipt_detail.html', context)
\ No newline at end of file
+    return render(request, 'MaterialBalance/receipt_detail.html', context)
+
+
+def parse_as_of(value):
+    """
+    Момент времени для остатков "на дату"
+
+    Дата (ГГГГ-ММ-ДД) - конец этого дня, дата и время - указанный момент.
+    Возвращает None, если значение не распознано.
+    """
+    if not value:
+        return None
+
+    day = parse_date(value)
+    if day is not None:
+        return BalanceHistory.cutoff_for(day) - timedelta(microseconds=1)
+
+    moment = parse_datetime(value)
+    if moment is not None:
+        return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+    return None
+
+
+@login_required
+def balances_as_of_api(request):
+    """
+    API остатков на момент времени: ?at=ГГГГ-ММ-ДД[THH:MM]&location=ID&material=ID
+
+    Бухгалтер и руководитель видят все места хранения, остальные - только свои.
+    Изменения относятся к дате документа; момент раньше начальных остатков
+    журнала - ошибка 400.
+    """
+    try:
+        moment = parse_as_of(request.GET.get('at'))
+    except ValueError:
+        moment = None
+    if moment is None:
+        return JsonResponse({'error': 'Укажите дату: at=ГГГГ-ММ-ДД или ГГГГ-ММ-ДДTЧЧ:ММ'}, status=400)
+
+    try:
+        location_ids = [int(value) for value in request.GET.getlist('location')] or None
+        material_ids = [int(value) for value in request.GET.getlist('material')] or None
+    except ValueError:
+        return JsonResponse({'error': 'Неверный ID места хранения или материала'}, status=400)
+
+    if not request.role.sees_all_locations and not request.session.get('is_switched', False):
+        own_location_ids = set(OwnedLocationResolver.for_request(request))
+        location_ids = [loc_id for loc_id in (location_ids or own_location_ids) if loc_id in own_location_ids]
+
+    try:
+        balances = BalanceHistory.as_of(moment, storage_location_ids=location_ids, material_ids=material_ids)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    locations = StorageLocation.objects.with_source_names().in_bulk({key[0] for key in balances})
+    data = [
+        {
+            'storage_location_id': location_id,
+            'storage_location': locations[location_id].get_source_name() if location_id in locations else None,
+            'material_id': material_id,
+            'quantity_pieces': str(quantities['quantity_pieces']),
+            'quantity_meters': str(quantities['quantity_meters']),
+            'quantity_cubic': str(quantities['quantity_cubic']),
+        }
+        for (location_id, material_id), quantities in sorted(balances.items())
+        if any(quantities.values())
+    ]
+
+    return JsonResponse({'at': moment.isoformat(), 'balances': data})
+
+
+LOW_STOCK_PAGE_SIZE = 50
+
+
+@login_required
+def low_stock_list_view(request):
+    """Остатки ниже порогов (по местам хранения должности; руководителю и бухгалтеру - все)"""
+
+    location_ids = LowStockMonitor.location_ids_for_request(request)
+    alerts = LowStockMonitor.alerts(location_ids)
+
+    material_type = request.GET.get('material_type')
+    if material_type:
+        alerts = alerts.filter(material__material_type=material_type)
+
+    page = Paginator(alerts, LOW_STOCK_PAGE_SIZE).get_page(request.GET.get('page'))
+    StorageLocation.resolve_source_names([alert.storage_location for alert in page])
+
+    query = request.GET.copy()
+    query.pop('page', None)
+
+    context = {
+        'title': 'Мало остатков',
+        'employee_name': request.session.get('employee_name'),
+        'position_name': request.session.get('position_name'),
+        'alerts': page,
+        'page': page,
+        'page_querystring': query.urlencode(),
+        'total_count': page.paginator.count,
+        'material_types': Material.MATERIAL_TYPE_CHOICES,
+        'selected_material_type': material_type,
+    }
+
+    return render(request, 'MaterialBalance/low_stock_list.html', context)
+
+
+@login_required
+def low_stock_api(request):
+    """API: количество и список остатков ниже порогов (для панелей должностей)"""
+
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+    except ValueError:
+        return JsonResponse({'error': 'Неверный limit'}, status=400)
+
+    alerts = LowStockMonitor.alerts(LowStockMonitor.location_ids_for_request(request))
+    top = list(alerts[:limit])
+    StorageLocation.resolve_source_names([alert.storage_location for alert in top])
+
+    return JsonResponse({
+        'count': alerts.count(),
+        'alerts': [
+            {
+                'storage_location_id': alert.storage_location_id,
+                'storage_location': alert.storage_location.get_source_name(),
+                'material_id': alert.material_id,
+                'material': alert.material.name,
+                'quantity_field': alert.quantity_field,
+                'quantity': str(alert.quantity),
+                'min_quantity': str(alert.min_quantity),
+                'since': alert.since.isoformat(),
+            }
+            for alert in top
+        ],
+    })
@@ -2,69 +2,35 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.db.models import Q, Sum
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from django.http import JsonResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
 from datetime import timedelta
 
-from Forest_apps.forestry.models import Material
-from Forest_apps.inventory.models import MaterialMovement, StorageLocation, MaterialBalance
-from Forest_apps.core.models import Position, Warehouse, Brigade, Vehicle
-from Forest_apps.employees.models import Employee
+from Forest_apps.inventory.models import MaterialMovement, MaterialBalance
+from Forest_apps.core.models import Position
+from Forest_apps.core.services import IdempotentSubmission
+from Forest_apps.inventory.services import (
+    OwnedLocationResolver,
+    BalanceEngine,
+    KeysetPaginator,
+    ReferenceDataCache
+)
+from Forest_apps.inventory.exports import MOVEMENT_COLUMNS, export_response, iter_chunks
 from Forest_apps.inventory.forms.material_movement import (
     MaterialMovementCreateForm,
     MaterialMovementFilterForm
 )
 
 
-@login_required
-def material_movement_list_view(request):
-    """Список движений материалов (для должности пользователя как отправителя или получателя)"""
+def _filter_movements(request):
+    """Движения должности с фильтрами списка (общие для списка и выгрузки)"""
 
-    # Получаем должность текущего пользователя из сессии
-    user_position_name = request.session.get('position_name')
-
-    user_position_id = None
-
-    # Проверяем, является ли пользователь руководителем
-    is_manager = (user_position_name and user_position_name.lower() == 'руководитель')
-
-    # Находим ID должности по названию
-    try:
-        position = Position.objects.get(name__iexact=user_position_name)
-        user_position_id = position.id
-    except Position.DoesNotExist:
-        user_position_id = -1
-
-    # Получаем ID мест хранения, принадлежащих этой должности
-    user_location_ids = []
-
-    # Склады, созданные должностью
-    warehouses = Warehouse.objects.filter(created_by_position_id=user_position_id)
-    for wh in warehouses:
-        try:
-            location = StorageLocation.objects.get(source_type='склад', source_id=wh.id)
-            user_location_ids.append(location.id)
-        except StorageLocation.DoesNotExist:
-            pass
-
-    # Бригады, созданные должностью
-    brigades = Brigade.objects.filter(created_by_position_id=user_position_id)
-    for br in brigades:
-        try:
-            location = StorageLocation.objects.get(source_type='бригады', source_id=br.id)
-            user_location_ids.append(location.id)
-        except StorageLocation.DoesNotExist:
-            pass
-
-    # Транспорт, созданный должностью
-    vehicles = Vehicle.objects.filter(created_by_position_id=user_position_id)
-    for vh in vehicles:
-        try:
-            location = StorageLocation.objects.get(source_type='автомобиль', source_id=vh.id)
-            user_location_ids.append(location.id)
-        except StorageLocation.DoesNotExist:
-            pass
+    is_manager = request.role.is_manager
+    user_location_ids = OwnedLocationResolver.for_request(request)
 
     # Базовый запрос
     if is_manager:
@@ -85,13 +51,6 @@ def material_movement_list_view(request):
             'created_by', 'created_by_position'
         ).order_by('-date_time')
 
-    # Получаем список всех водителей для фильтра
-    driver_position = Position.objects.filter(name__iexact='водитель').first()
-    if driver_position:
-        drivers = Employee.objects.filter(position=driver_position, is_active=True).order_by('last_name', 'first_name')
-    else:
-        drivers = Employee.objects.none()
-
     # Фильтрация
     filter_form = MaterialMovementFilterForm(request.GET or None)
 
@@ -141,27 +100,40 @@ def material_movement_list_view(request):
     if employee_id:
         movements = movements.filter(employee_id=employee_id)
 
-    # Добавляем роль для каждого движения (передаем position_name)
-    for movement in movements:
-        movement.user_role = movement.get_user_role(request.user, user_position_name)
+    return movements, filter_form
+
+
+@login_required
+def material_movement_list_view(request):
+    """Список движений материалов (для должности пользователя как отправителя или получателя)"""
+
+    # Получаем должность текущего пользователя из сессии
+    user_position_name = request.session.get('position_name')
+
+    # Проверяем, является ли пользователь руководителем
+    is_manager = request.role.is_manager
+
+    # Получаем ID мест хранения, принадлежащих этой должности (склады, бригады, транспорт)
+    user_location_ids = OwnedLocationResolver.for_request(request)
+
+    movements, filter_form = _filter_movements(request)
+
+    # Получаем список всех водителей для фильтра
+    drivers = ReferenceDataCache.drivers()
+
+    # Сводная статистика по всей выборке - один запрос
+    summary = movements.summary()
+
+    # Текущая страница (keyset-пагинация по дате и id), роль пользователя - аннотацией в SQL
+    page = KeysetPaginator().for_request(request, movements.with_user_role(user_location_ids))
 
     # Получаем ID мест хранения текущего пользователя для проверки прав на подтверждение
     user_locations = user_location_ids
 
     # Подсчет ожидающих отправлений для текущего пользователя
-    pending_shipments_count = MaterialMovement.get_pending_shipments_for_user(request.user).count()
-
-    # Подсчет статистики
-    total_count = movements.count()
-    total_amount = movements.filter(accounting_type='Реализация').aggregate(
-        total=Sum('total_amount')
-    )['total'] or 0
-    pending_count = movements.filter(is_completed=False).count()
-
-    # Новая статистика по количествам
-    total_pieces = movements.aggregate(total=Sum('quantity_pieces'))['total'] or 0
-    total_meters = movements.aggregate(total=Sum('quantity_meters'))['total'] or 0
-    total_cubic = movements.aggregate(total=Sum('quantity_cubic'))['total'] or 0
+    pending_shipments_count = MaterialMovement.get_pending_shipments_for_user(
+        request.user, position_name=user_position_name
+    ).count()
 
     # Вычисляем дату 5 дней назад для проверки возраста
     now_minus_5_days = timezone.now() - timedelta(days=5)
@@ -170,14 +142,11 @@ def material_movement_list_view(request):
         'title': 'Движение материалов',
         'employee_name': request.session.get('employee_name'),
         'position_name': user_position_name,
-        'movements': movements,
+        'movements': page,
+        'page': page,
+        'page_querystring': KeysetPaginator.querystring(request),
         'filter_form': filter_form,
-        'total_count': total_count,
-        'total_amount': total_amount,
-        'pending_count': pending_count,
-        'total_pieces': total_pieces,
-        'total_meters': total_meters,
-        'total_cubic': total_cubic,
+        **summary,
         'pending_shipments_count': pending_shipments_count,
         'user_locations': user_locations,
         'is_manager': is_manager,
@@ -189,15 +158,34 @@ def material_movement_list_view(request):
     return render(request, 'MaterialMovement/material_movement_list.html', context)
 
 
+@login_required
+def material_movement_export_view(request):
+    """Выгрузка движений (CSV/XLSX) с фильтрами списка"""
+
+    movements, filter_form = _filter_movements(request)
+
+    return export_response(
+        iter_chunks(movements.order_by('-date_time', '-id'), location_fields=('from_location', 'to_location')),
+        MOVEMENT_COLUMNS,
+        'movements',
+        request.GET.get('format')
+    )
+
+
 @login_required
 def material_movement_create_view(request):
     """Создание нового движения материалов"""
 
     # Получаем должность из сессии
     position_name = request.session.get('position_name')
-    is_manager = (position_name and position_name.lower() == 'руководитель')
+    is_manager = request.role.is_manager
 
     if request.method == 'POST':
+        # Повторная отправка (нажали еще раз после таймаута) - результат первой
+        replayed = IdempotentSubmission.replay(request)
+        if replayed:
+            return replayed
+
         form = MaterialMovementCreateForm(request.POST, user=request.user, position_name=position_name)
 
         if form.is_valid():
@@ -207,7 +195,7 @@ def material_movement_create_view(request):
 
             # Добавляем должность создателя
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 movement.created_by_position = position
             except Position.DoesNotExist:
                 position, _ = Position.objects.get_or_create(
@@ -216,32 +204,32 @@ def material_movement_create_view(request):
                 )
                 movement.created_by_position = position
 
-            # Сохраняем движение (дата уже установлена в форме)
-            movement.save()
+            # Для Перемещения, Реализации и Списания движение сразу выполняется
+            executes = movement.accounting_type in MaterialMovement.EXECUTE_ON_CREATE
 
-            # Для Перемещения, Реализации и Списания сразу выполняем движение
-            if movement.accounting_type in ['Перемещение', 'Реализация', 'Списание']:
-                try:
-                    movement.execute_movement()
-                    messages.success(
-                        request,
-                        f'Движение №{movement.id} успешно создано и выполнено!'
+            def submit():
+                # Сохранение и проводка - одна транзакция: при ошибке движение не остается
+                movement.save()
+                if not executes:
+                    return movement, 'inventory:material_movement_list', (
+                        f'Отправление №{movement.id} успешно создано и ожидает подтверждения!'
                     )
-                except ValueError as e:
-                    movement.delete()
-                    messages.error(request, str(e))
-                    return redirect('inventory:material_movement_create')
-                except Exception as e:
-                    movement.delete()
-                    messages.error(request, f'Ошибка при выполнении движения: {str(e)}')
-                    return redirect('inventory:material_movement_create')
-            else:
-                messages.success(
-                    request,
-                    f'Отправление №{movement.id} успешно создано и ожидает подтверждения!'
+                movement.execute_movement()
+                return movement, 'inventory:material_movement_list', (
+                    f'Движение №{movement.id} успешно создано и выполнено!'
                 )
 
-            return redirect('inventory:material_movement_list')
+            try:
+                # Правила типа движения проверяются до записи
+                if executes:
+                    movement.validate_for_execution()
+                return IdempotentSubmission.run(request, 'inventory:material_movement_create', submit)
+            except ValueError as e:
+                messages.error(request, str(e))
+                return redirect('inventory:material_movement_create')
+            except Exception as e:
+                messages.error(request, f'Ошибка при выполнении движения: {str(e)}')
+                return redirect('inventory:material_movement_create')
         else:
             print(f"Ошибки формы: {form.errors}")
 
@@ -253,6 +241,7 @@ def material_movement_create_view(request):
         'form': form,
         'employee_name': request.session.get('employee_name'),
         'is_manager': is_manager,
+        'idempotency_key': IdempotentSubmission.form_key(request),
     }
 
     return render(request, 'MaterialMovement/material_movement_create.html', context)
@@ -271,11 +260,10 @@ def material_movement_detail_view(request, movement_id):
     )
 
     # Определяем роль текущего пользователя
-    user_role = movement.get_user_role(request.user)
+    user_role = movement.get_role_for_locations(OwnedLocationResolver.for_request(request))
 
     # Проверяем, является ли пользователь руководителем
-    position_name = request.session.get('position_name')
-    is_manager = (position_name and position_name.lower() == 'руководитель')
+    is_manager = request.role.is_manager
 
     context = {
         'title': f'Движение №{movement.id}',
@@ -294,19 +282,23 @@ def material_movement_edit_view(request, movement_id):
 
     # Получаем должность текущего пользователя из сессии
     position_name = request.session.get('position_name')
-    is_manager = (position_name and position_name.lower() == 'руководитель')
+    is_manager = request.role.is_manager
 
     try:
         if is_manager:
             movement = get_object_or_404(MaterialMovement, id=movement_id)
 
+            if movement.document_id:
+                messages.error(request, 'Строка многострочного документа изменяется только через документ')
+                return redirect('inventory:movement_document_detail', document_id=movement.document_id)
+
             if movement.accounting_type == 'Отправление' and movement.is_completed:
                 messages.error(request, 'Нельзя редактировать выполненное отправление')
                 return redirect('inventory:material_movement_detail', movement_id=movement.id)
 
         else:
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 movement = get_object_or_404(
                     MaterialMovement,
                     id=movement_id,
@@ -316,12 +308,16 @@ def material_movement_edit_view(request, movement_id):
                 messages.error(request, 'Ошибка определения должности')
                 return redirect('inventory:material_movement_list')
 
+            if movement.document_id:
+                messages.error(request, 'Строка многострочного документа изменяется только через документ')
+                return redirect('inventory:movement_document_detail', document_id=movement.document_id)
+
             if movement.accounting_type == 'Отправление' and movement.is_completed:
                 messages.error(request, 'Нельзя редактировать выполненное отправление')
                 return redirect('inventory:material_movement_detail', movement_id=movement.id)
 
             if movement.accounting_type == 'Отправление':
-                user_role = movement.get_user_role(request.user, position_name)
+                user_role = movement.get_role_for_locations(OwnedLocationResolver.for_request(request))
                 if user_role != 'sender':
                     messages.error(request, 'Только отправитель может редактировать это отправление')
                     return redirect('inventory:material_movement_detail', movement_id=movement.id)
@@ -339,14 +335,10 @@ def material_movement_edit_view(request, movement_id):
                 return redirect('inventory:material_movement_list')
 
         if request.method == 'POST':
-            # Получаем старые данные ДО изменения
-            old_from_location = movement.from_location
-            old_to_location = movement.to_location
-            old_material = movement.material
-            old_quantity_pieces = movement.quantity_pieces or 0
-            old_quantity_meters = movement.quantity_meters or 0
-            old_quantity_cubic = movement.quantity_cubic or 0
+            # Изменения остатков проведенного движения (до изменения экземпляра формой)
             old_is_completed = movement.is_completed
+            old_changes = movement.get_balance_changes() if old_is_completed else []
+            old_date = movement.date_time
 
             # Создаем форму с skip_balance_check=True для редактирования
             form = MaterialMovementCreateForm(
@@ -358,101 +350,26 @@ def material_movement_edit_view(request, movement_id):
             )
 
             if form.is_valid():
-                # Получаем новые данные из формы
-                new_from_location = form.cleaned_data.get('from_location')
-                new_to_location = form.cleaned_data.get('to_location')
-                new_material = form.cleaned_data.get('material')
-                new_quantity_pieces = form.cleaned_data.get('quantity_pieces') or 0
-                new_quantity_meters = form.cleaned_data.get('quantity_meters') or 0
-                new_quantity_cubic = form.cleaned_data.get('quantity_cubic') or 0
-
-                from Forest_apps.inventory.models import MaterialBalance
-
-                # ===== ЕСЛИ ДВИЖЕНИЕ УЖЕ ВЫПОЛНЕНО, ДЕЛАЕМ ОТКАТ =====
-                if old_is_completed:
-                    # 1. ВОЗВРАЩАЕМ МАТЕРИАЛ НА СКЛАД (ОТКАТ)
-                    try:
-                        from_balance = MaterialBalance.objects.get(
-                            storage_location=old_from_location,
-                            material=old_material
-                        )
-                        from_balance.quantity_pieces += old_quantity_pieces
-                        from_balance.quantity_meters = (from_balance.quantity_meters or 0) + old_quantity_meters
-                        from_balance.quantity_cubic = (from_balance.quantity_cubic or 0) + old_quantity_cubic
-                        from_balance.save()
-                    except MaterialBalance.DoesNotExist:
-                        messages.error(request, f'Ошибка отката: баланс не найден')
-                        return redirect('inventory:material_movement_edit', movement_id=movement.id)
-
-                    # 2. ЕСЛИ БЫЛА РЕАЛИЗАЦИЯ - УДАЛЯЕМ ЗАПИСЬ У КОНТРАГЕНТА
-                    if movement.accounting_type == 'Реализация' and old_to_location:
-                        try:
-                            to_balance = MaterialBalance.objects.get(
-                                storage_location=old_to_location,
-                                material=old_material
-                            )
-                            to_balance.quantity_pieces -= old_quantity_pieces
-                            to_balance.quantity_meters = (to_balance.quantity_meters or 0) - old_quantity_meters
-                            to_balance.quantity_cubic = (to_balance.quantity_cubic or 0) - old_quantity_cubic
-                            to_balance.save()
-                        except MaterialBalance.DoesNotExist:
-                            pass  # Если нет — пропускаем
-
-                # ===== ПРИМЕНЯЕМ НОВЫЕ ДАННЫЕ =====
-                if old_is_completed:
-                    # 3. ПРОВЕРЯЕМ И СПИСЫВАЕМ МАТЕРИАЛ СО СКЛАДА
-                    try:
-                        new_from_balance = MaterialBalance.objects.get(
-                            storage_location=new_from_location,
-                            material=new_material
-                        )
-
-                        # Проверка достаточности
-                        if new_quantity_pieces > 0 and new_from_balance.quantity_pieces < new_quantity_pieces:
-                            raise ValueError(f'Недостаточно материала "{new_material.name}" на складе')
-                        if new_quantity_meters > 0 and (new_from_balance.quantity_meters or 0) < new_quantity_meters:
-                            raise ValueError(f'Недостаточно материала "{new_material.name}" на складе')
-                        if new_quantity_cubic > 0 and (new_from_balance.quantity_cubic or 0) < new_quantity_cubic:
-                            raise ValueError(f'Недостаточно материала "{new_material.name}" на складе')
-
-                        new_from_balance.quantity_pieces -= new_quantity_pieces
-                        new_from_balance.quantity_meters = (new_from_balance.quantity_meters or 0) - new_quantity_meters
-                        new_from_balance.quantity_cubic = (new_from_balance.quantity_cubic or 0) - new_quantity_cubic
-                        new_from_balance.save()
-                    except MaterialBalance.DoesNotExist:
-                        messages.error(request, f'Материал "{new_material.name}" отсутствует на складе')
-                        return redirect('inventory:material_movement_edit', movement_id=movement.id)
-                    except ValueError as e:
-                        messages.error(request, str(e))
-                        return redirect('inventory:material_movement_edit', movement_id=movement.id)
-
-                    # 4. ЕСЛИ РЕАЛИЗАЦИЯ - СОЗДАЕМ ЗАПИСЬ У КОНТРАГЕНТА
-                    if movement.accounting_type == 'Реализация' and new_to_location:
-                        try:
-                            new_to_balance = MaterialBalance.objects.get(
-                                storage_location=new_to_location,
-                                material=new_material
-                            )
-                            new_to_balance.quantity_pieces += new_quantity_pieces
-                            new_to_balance.quantity_meters = (new_to_balance.quantity_meters or 0) + new_quantity_meters
-                            new_to_balance.quantity_cubic = (new_to_balance.quantity_cubic or 0) + new_quantity_cubic
-                            new_to_balance.save()
-                        except MaterialBalance.DoesNotExist:
-                            MaterialBalance.objects.create(
-                                storage_location=new_to_location,
-                                material=new_material,
-                                quantity_pieces=new_quantity_pieces,
-                                quantity_meters=new_quantity_meters,
-                                quantity_cubic=new_quantity_cubic,
+                updated_movement = form.save(commit=False)
+
+                try:
+                    with transaction.atomic():
+                        # Если движение уже выполнено - откат старого и проведение нового одной операцией
+                        if old_is_completed:
+                            updated_movement.is_completed = True
+                            BalanceEngine.apply(
+                                updated_movement.get_balance_changes(),
                                 created_by=request.user,
-                                created_by_position=movement.created_by_position
+                                created_by_position=movement.created_by_position,
+                                source=movement,
+                                reverted=old_changes,
+                                reverted_date=old_date
                             )
 
-                # Сохраняем обновленное движение
-                updated_movement = form.save(commit=False)
-                if old_is_completed:
-                    updated_movement.is_completed = True
-                updated_movement.save()
+                        updated_movement.save()
+                except ValueError as e:
+                    messages.error(request, str(e))
+                    return redirect('inventory:material_movement_edit', movement_id=movement.id)
 
                 messages.success(request, f'Движение №{updated_movement.id} успешно обновлено!')
                 return redirect('inventory:material_movement_detail', movement_id=updated_movement.id)
@@ -486,7 +403,7 @@ def material_movement_delete_view(request, movement_id):
 
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
-    is_manager = (position_name and position_name.lower() == 'руководитель')
+    is_manager = request.role.is_manager
 
     try:
         if is_manager:
@@ -500,7 +417,7 @@ def material_movement_delete_view(request, movement_id):
         else:
             # Обычные пользователи - только свои движения
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 movement = get_object_or_404(
                     MaterialMovement,
                     id=movement_id,
@@ -519,7 +436,7 @@ def material_movement_delete_view(request, movement_id):
 
             # 2. Для Отправлений: только отправитель может удалять
             if movement.accounting_type == 'Отправление':
-                user_role = movement.get_user_role(request.user, position_name)
+                user_role = movement.get_role_for_locations(OwnedLocationResolver.for_request(request))
                 if user_role != 'sender':
                     messages.error(request, 'Только отправитель может удалять это отправление')
                     return redirect('inventory:material_movement_list')
@@ -538,15 +455,21 @@ def material_movement_delete_view(request, movement_id):
                 messages.error(request, 'Доступ запрещен')
                 return redirect('inventory:material_movement_list')
 
+        # Строки документа удаляются вместе с документом
+        if movement.document_id:
+            messages.error(request, 'Строка многострочного документа удаляется только вместе с документом')
+            return redirect('inventory:movement_document_detail', document_id=movement.document_id)
+
         # Сохраняем ID ДО удаления
         movement_id_for_message = movement.id
 
         # Для руководителя: если движение выполнено (не отправление), восстанавливаем остатки
-        if is_manager and movement.is_completed and movement.accounting_type != 'Отправление':
-            MaterialBalance.cancel_movement(movement)
-            messages.info(request, f'Остатки материалов восстановлены для движения №{movement_id_for_message}')
+        with transaction.atomic():
+            if is_manager and movement.is_completed and movement.accounting_type != 'Отправление':
+                MaterialBalance.cancel_movement(movement)
+                messages.info(request, f'Остатки материалов восстановлены для движения №{movement_id_for_message}')
 
-        movement.delete()
+            movement.delete()
         messages.success(request, f'✅ Движение №{movement_id_for_message} успешно удалено!')
 
     except Exception as e:
@@ -562,7 +485,7 @@ def material_movement_execute_view(request, movement_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('inventory:material_movement_list')
@@ -597,7 +520,7 @@ def material_movement_cancel_view(request, movement_id):
     # Получаем должность текущего пользователя
     position_name = request.session.get('position_name')
     try:
-        position = Position.objects.get(name__iexact=position_name)
+        position = ReferenceDataCache.get_position(position_name)
     except Position.DoesNotExist:
         messages.error(request, 'Ошибка определения должности')
         return redirect('inventory:material_movement_list')
@@ -612,10 +535,7 @@ def material_movement_cancel_view(request, movement_id):
         if not movement.is_completed:
             messages.error(request, 'Движение еще не выполнено')
         else:
-            MaterialBalance.cancel_movement(movement)
-            movement.is_completed = False
-            movement.completed_at = None
-            movement.save()
+            movement.cancel_execution()
             messages.success(
                 request,
                 f'Выполнение движения №{movement.id} отменено!'
@@ -643,11 +563,8 @@ def material_movement_confirm_shipment_view(request, movement_id):
             messages.error(request, 'Отправление уже подтверждено')
             return redirect('inventory:material_movement_list')
 
-        # Получаем должность пользователя
-        position_name = request.session.get('position_name')
-
-        # Проверяем, что пользователь - получатель (передаем position_name)
-        user_role = movement.get_user_role(request.user, position_name)
+        # Проверяем, что пользователь - получатель (по местам хранения должности)
+        user_role = movement.get_role_for_locations(OwnedLocationResolver.for_request(request))
         if user_role != 'receiver':
             messages.error(request, 'Только получатель может подтвердить это отправление')
             return redirect('inventory:material_movement_list')
@@ -668,12 +585,27 @@ def material_movement_confirm_shipment_view(request, movement_id):
 def material_movement_pending_shipments_view(request):
     """Список ожидающих отправлений для текущего пользователя"""
 
-    movements = MaterialMovement.get_pending_shipments_for_user(request.user)
-
-    # Добавляем роль для каждого движения (для отображения кнопок)
     position_name = request.session.get('position_name')
-    for movement in movements:
-        movement.user_role = movement.get_user_role(request.user, position_name)
+    # Роль пользователя (для отображения кнопок) - аннотацией в SQL
+    pending = MaterialMovement.get_pending_shipments_for_user(
+        request.user, position_name=position_name
+    ).with_user_role(OwnedLocationResolver.for_request(request))
+
+    # Строки одного документа показываем одной записью (подтверждается весь документ)
+    movements = []
+    documents = {}
+    for movement in pending:
+        if movement.document_id:
+            first_line = documents.get(movement.document_id)
+            if first_line:
+                first_line.document_lines_count += 1
+                first_line.document_materials.append(movement.material.name)
+                continue
+            movement.document_lines_count = 1
+            movement.document_materials = [movement.material.name]
+            documents[movement.document_id] = movement
+
+        movements.append(movement)
 
     context = {
         'title': 'Ожидающие отправления',
@@ -685,104 +617,44 @@ def material_movement_pending_shipments_view(request):
     return render(request, 'MaterialMovement/material_movement_pending.html', context)
 
 
-@login_required
-def get_locations_by_type(request):
-    """API для получения списка мест хранения в зависимости от типа движения"""
-    movement_type = request.GET.get('type')
-    position_name = request.session.get('position_name')
-
-    if not movement_type:
-        return JsonResponse({'from_locations': [], 'to_locations': []})
-
-    user_location_ids = _get_user_location_ids_by_position(position_name)
-    all_location_ids = list(StorageLocation.objects.all().values_list('id', flat=True))
-    foreign_location_ids = [loc_id for loc_id in all_location_ids if loc_id not in user_location_ids]
-
-    from_locations = StorageLocation.objects.none()
-    to_locations = StorageLocation.objects.none()
-
-    if movement_type == 'Перемещение':
-        from_locations = StorageLocation.objects.filter(id__in=user_location_ids)
-        to_locations = StorageLocation.objects.filter(id__in=user_location_ids)
-
-    elif movement_type == 'Отправление':
-        from_locations = StorageLocation.objects.filter(id__in=user_location_ids)
-        to_locations = StorageLocation.objects.exclude(id__in=user_location_ids).exclude(source_type='контрагент')
-
-    elif movement_type == 'Реализация':
-        from_locations = StorageLocation.objects.filter(source_type='склад')
-        to_locations = StorageLocation.objects.filter(source_type='контрагент')
-
-    elif movement_type == 'Списание':
-        from_locations = StorageLocation.objects.filter(id__in=user_location_ids, source_type='склад')
-        to_locations = StorageLocation.objects.filter(id__in=user_location_ids).exclude(source_type='контрагент')
-
-    from_locations = from_locations.distinct().order_by('source_type')
-    to_locations = to_locations.distinct().order_by('source_type')
-
-    data = {
-        'from_locations': [{'id': loc.id, 'name': loc.get_source_name()} for loc in from_locations],
-        'to_locations': [{'id': loc.id, 'name': loc.get_source_name()} for loc in to_locations]
-    }
+def _locations_etag(request):
+    return ReferenceDataCache.etag(
+        'locations', request.GET.get('type'),
+        OwnedLocationResolver.get_position_id(request.session.get('position_name'))
+    )
 
-    return JsonResponse(data)
 
+def _materials_etag(request):
+    return ReferenceDataCache.etag('materials')
 
-def _get_user_location_ids_by_position(position_name):
-    """Получает ID мест хранения по должности (created_by_position)"""
-    from Forest_apps.inventory.models import StorageLocation
-    from Forest_apps.core.models import Warehouse, Brigade, Vehicle, Position
 
-    if not position_name:
-        return []
+def _reference_data_last_modified(request):
+    return ReferenceDataCache.last_modified()
 
-    position = Position.objects.filter(name__iexact=position_name).first()
-    if not position:
-        return []
 
-    user_location_ids = []
+def _reference_json(data, **kwargs):
+    """JSON справочных данных: браузер кэширует ответ и перепроверяет его по ETag"""
+    response = JsonResponse(data, **kwargs)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
 
-    # Склады, созданные должностью
-    warehouses = Warehouse.objects.filter(created_by_position=position)
-    for wh in warehouses:
-        try:
-            location = StorageLocation.objects.get(source_type='склад', source_id=wh.id)
-            user_location_ids.append(location.id)
-        except StorageLocation.DoesNotExist:
-            pass
 
-    # Бригады, созданные должностью
-    brigades = Brigade.objects.filter(created_by_position=position)
-    for br in brigades:
-        try:
-            location = StorageLocation.objects.get(source_type='бригады', source_id=br.id)
-            user_location_ids.append(location.id)
-        except StorageLocation.DoesNotExist:
-            pass
+@login_required
+@condition(etag_func=_locations_etag, last_modified_func=_reference_data_last_modified)
+def get_locations_by_type(request):
+    """API для получения списка мест хранения в зависимости от типа движения"""
+    movement_type = request.GET.get('type')
 
-    # Транспорт, созданный должностью
-    vehicles = Vehicle.objects.filter(created_by_position=position)
-    for vh in vehicles:
-        try:
-            location = StorageLocation.objects.get(source_type='автомобиль', source_id=vh.id)
-            user_location_ids.append(location.id)
-        except StorageLocation.DoesNotExist:
-            pass
+    if not movement_type:
+        return JsonResponse({'from_locations': [], 'to_locations': []})
 
-    return user_location_ids
+    data = ReferenceDataCache.locations_by_type(movement_type, request.session.get('position_name'))
+    return _reference_json(data)
 
 
 @login_required
+@condition(etag_func=_materials_etag, last_modified_func=_reference_data_last_modified)
 def get_materials(request):
     """API для получения списка материалов"""
-    materials = Material.objects.all().order_by('material_type', 'name')
-    data = [
-        {
-            'id': m.id,
-            'name': m.name,
-            'type': m.material_type,
-            'type_display': m.get_material_type_display()
-        }
-        for m in materials
-    ]
-    return JsonResponse(data, safe=False)
\ No newline at end of file
+    return _reference_json(ReferenceDataCache.materials(), safe=False)
\ No newline at end of file
@@ -0,0 +1,208 @@
+# ПРЕДСТАВЛЕНИЯ МНОГОСТРОЧНЫХ ДОКУМЕНТОВ ДВИЖЕНИЯ
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib import messages
+from django.db import transaction
+from django.utils import timezone
+
+from Forest_apps.inventory.models import MovementDocument
+from Forest_apps.core.models import Position
+from Forest_apps.inventory.services import BalanceEngine, OwnedLocationResolver, ReferenceDataCache
+from Forest_apps.inventory.forms.material_movement import (
+    MovementDocumentForm,
+    MovementLineFormSet
+)
+
+
+@login_required
+def movement_document_create_view(request):
+    """Создание документа движения с несколькими строками материалов"""
+
+    # Получаем должность из сессии
+    position_name = request.session.get('position_name')
+    is_manager = request.role.is_manager
+
+    if request.method == 'POST':
+        form = MovementDocumentForm(request.POST, user=request.user, position_name=position_name)
+        formset = MovementLineFormSet(request.POST, accounting_type=request.POST.get('accounting_type'))
+
+        if form.is_valid() and formset.is_valid():
+            lines = formset.get_lines()
+            from_location = form.cleaned_data['from_location']
+
+            # Проверка остатков всех строк одним запросом
+            errors = MovementDocument.check_balances(from_location, lines)
+            for error in errors:
+                form.add_error(None, error)
+
+            if not errors:
+                document = form.save(commit=False)
+                document.created_by = request.user
+
+                # Добавляем должность создателя
+                try:
+                    document.created_by_position = ReferenceDataCache.get_position(position_name)
+                except Position.DoesNotExist:
+                    document.created_by_position, _ = Position.objects.get_or_create(
+                        name=position_name,
+                        defaults={'is_active': True}
+                    )
+
+                try:
+                    # Документ, строки и проводка - одна транзакция
+                    with transaction.atomic():
+                        document = MovementDocument.create_with_lines(document, lines)
+
+                        # Для Перемещения, Реализации и Списания сразу проводим документ
+                        if document.accounting_type != 'Отправление':
+                            document.execute()
+                except ValueError as e:
+                    form.add_error(None, str(e))
+                else:
+                    if document.accounting_type == 'Отправление':
+                        messages.success(
+                            request,
+                            f'Отправление (документ №{document.id}, строк: {len(lines)}) '
+                            f'успешно создано и ожидает подтверждения!'
+                        )
+                    else:
+                        messages.success(
+                            request,
+                            f'Документ №{document.id} (строк: {len(lines)}) успешно создан и выполнен!'
+                        )
+                    return redirect('inventory:movement_document_detail', document_id=document.id)
+
+    else:
+        form = MovementDocumentForm(user=request.user, position_name=position_name)
+        formset = MovementLineFormSet()
+
+    context = {
+        'title': 'Создание документа движения',
+        'form': form,
+        'formset': formset,
+        'employee_name': request.session.get('employee_name'),
+        'is_manager': is_manager,
+    }
+
+    return render(request, 'MaterialMovement/movement_document_create.html', context)
+
+
+@login_required
+def movement_document_detail_view(request, document_id):
+    """Детальный просмотр документа движения со всеми строками"""
+
+    document = get_object_or_404(
+        MovementDocument.objects.select_related(
+            'from_location', 'to_location', 'employee', 'vehicle',
+            'created_by', 'created_by_position'
+        ),
+        id=document_id
+    )
+    lines = list(document.get_lines())
+
+    is_manager = request.role.is_manager
+
+    # Строки документа имеют общие места хранения - роль определяем по первой строке
+    user_role = lines[0].get_role_for_locations(OwnedLocationResolver.for_request(request)) if lines else None
+
+    context = {
+        'title': f'Документ движения №{document.id}',
+        'employee_name': request.session.get('employee_name'),
+        'document': document,
+        'lines': lines,
+        'total_amount': sum((line.total_amount or 0) for line in lines),
+        'user_role': user_role,
+        'is_manager': is_manager,
+    }
+
+    return render(request, 'MaterialMovement/movement_document_detail.html', context)
+
+
+@login_required
+def movement_document_confirm_view(request, document_id):
+    """Подтверждение получения всех строк отправления (только для получателя)"""
+
+    try:
+        document = get_object_or_404(MovementDocument, id=document_id)
+
+        if document.accounting_type != 'Отправление':
+            messages.error(request, 'Подтверждение возможно только для отправлений')
+            return redirect('inventory:movement_document_detail', document_id=document.id)
+
+        if document.is_completed:
+            messages.error(request, 'Отправление уже подтверждено')
+            return redirect('inventory:movement_document_detail', document_id=document.id)
+
+        # Проверяем, что пользователь - получатель
+        line = document.lines.first()
+        if not line or line.get_role_for_locations(OwnedLocationResolver.for_request(request)) != 'receiver':
+            messages.error(request, 'Только получатель может подтвердить это отправление')
+            return redirect('inventory:movement_document_detail', document_id=document.id)
+
+        document.confirm_receipt()
+        messages.success(request, f'Отправление (документ №{document.id}) успешно подтверждено!')
+
+    except ValueError as e:
+        messages.error(request, str(e))
+    except Exception as e:
+        messages.error(request, f'Ошибка при подтверждении: {str(e)}')
+
+    return redirect('inventory:material_movement_list')
+
+
+@login_required
+def movement_document_delete_view(request, document_id):
+    """Удаление документа движения со всеми строками"""
+
+    position_name = request.session.get('position_name')
+    is_manager = request.role.is_manager
+
+    try:
+        if is_manager:
+            document = get_object_or_404(MovementDocument, id=document_id)
+        else:
+            try:
+                position = ReferenceDataCache.get_position(position_name)
+            except Position.DoesNotExist:
+                messages.error(request, 'Ошибка определения должности')
+                return redirect('inventory:material_movement_list')
+
+            document = get_object_or_404(MovementDocument, id=document_id, created_by_position=position)
+
+            if document.accounting_type == 'Реализация':
+                messages.error(request, 'Доступ запрещен')
+                return redirect('inventory:material_movement_list')
+
+            # Для Перемещения и Списания: проверка 5 дней от создания
+            if document.is_completed and (timezone.now() - document.date_time).days >= 5:
+                messages.error(request,
+                               f'Документ старше 5 дней (создан {document.date_time.date()}), удаление невозможно')
+                return redirect('inventory:movement_document_detail', document_id=document.id)
+
+        # Выполненное отправление удалить нельзя (это договор между сторонами)
+        if document.accounting_type == 'Отправление' and document.is_completed:
+            messages.error(request, 'Нельзя удалить выполненное отправление')
+            return redirect('inventory:movement_document_detail', document_id=document.id)
+
+        document_id_for_message = document.id
+
+        # Откат остатков и удаление документа со строками - одна транзакция
+        with transaction.atomic():
+            if document.is_completed:
+                BalanceEngine.apply(
+                    BalanceEngine.reverse(document.get_balance_changes()),
+                    created_by=request.user,
+                    created_by_position=document.created_by_position,
+                    source=document
+                )
+                messages.info(request, f'Остатки материалов восстановлены для документа №{document_id_for_message}')
+
+            document.delete()
+        messages.success(request, f'✅ Документ №{document_id_for_message} успешно удален!')
+
+    except ValueError as e:
+        messages.error(request, str(e))
+    except Exception as e:
+        messages.error(request, str(e))
+
+    return redirect('inventory:material_movement_list')
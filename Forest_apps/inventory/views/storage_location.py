@@ -1,84 +1,85 @@
 # ПРЕДСТАВЛЕНИЯ МЕСТ ХРАНЕНИЯ
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.db.models import Count
 from django.shortcuts import render, get_object_or_404
 from Forest_apps.inventory.models import StorageLocation, MaterialBalance
 from Forest_apps.inventory.forms.storage_location import StorageLocationTypeForm, StorageLocationSearchForm
-from Forest_apps.inventory.services import StorageLocationService
+from Forest_apps.inventory.services import StorageLocationService, ReferenceDataCache
 from Forest_apps.core.models import Position
 
 
-@login_required
-def storage_location_list_view(request):
-    """Просмотр ВСЕХ мест хранения (административная функция)"""
+# Размер страницы списка мест хранения
+LOCATIONS_PAGE_SIZE = 50
 
-    # Получаем все записи
-    locations = StorageLocation.objects.all().order_by('source_type', 'id')
 
-    # Инициализируем формы
+def _search_locations(request, locations):
+    """
+    Фильтр по типу, поиск и постраничный вывод мест хранения
+
+    Поиск выполняется в БД по индексированному полю search_text,
+    статистика по типам - одним запросом с группировкой.
+
+    Returns:
+        dict для контекста шаблона: locations, page, page_querystring, stats, формы
+    """
     type_form = StorageLocationTypeForm(request.GET or None)
     search_form = StorageLocationSearchForm(request.GET or None)
 
-    source_type = None
-    search = None
-
-    if type_form.is_valid():
-        source_type = type_form.cleaned_data.get('source_type')
-
-    if search_form.is_valid():
-        search = search_form.cleaned_data.get('search')
-
-    if source_type:
-        locations = locations.filter(source_type=source_type)
-
-    all_locations = list(locations)
-
-    if search:
-        filtered_locations = []
-        for location in all_locations:
-            try:
-                source_name = location.get_source_name().lower()
-                if search.lower() in source_name:
-                    filtered_locations.append(location)
-            except:
-                if str(location.source_id) == search:
-                    filtered_locations.append(location)
-        locations_to_show = filtered_locations
-    else:
-        locations_to_show = all_locations
-
-    locations_with_names = []
-    for location in locations_to_show:
-        try:
-            source_name = location.get_source_name()
-        except:
-            source_name = "Ошибка получения названия"
-
-        locations_with_names.append({
+    if type_form.is_valid() and type_form.cleaned_data.get('source_type'):
+        locations = locations.filter(source_type=type_form.cleaned_data['source_type'])
+
+    if search_form.is_valid() and search_form.cleaned_data.get('search'):
+        locations = locations.search(search_form.cleaned_data['search'])
+
+    by_type = dict.fromkeys(['склад', 'автомобиль', 'контрагент', 'бригады'], 0)
+    for row in locations.order_by().values('source_type').annotate(count=Count('id')):
+        by_type[row['source_type']] = row['count']
+
+    paginator = Paginator(locations.order_by('source_type', 'id').with_source_names(), LOCATIONS_PAGE_SIZE)
+    page = paginator.get_page(request.GET.get('page'))
+
+    locations_with_names = [
+        {
             'id': location.id,
             'source_type': location.get_source_type_display(),
             'source_type_raw': location.source_type,
             'source_id': location.source_id,
-            'source_name': source_name,
+            'source_name': location.get_source_name(),
             'obj': location
-        })
-
-    stats = {
-        'total': len(locations_to_show),
-        'by_type': {
-            'склад': sum(1 for l in locations_to_show if l.source_type == 'склад'),
-            'автомобиль': sum(1 for l in locations_to_show if l.source_type == 'автомобиль'),
-            'контрагент': sum(1 for l in locations_to_show if l.source_type == 'контрагент'),
-            'бригады': sum(1 for l in locations_to_show if l.source_type == 'бригады'),
         }
+        for location in page
+    ]
+
+    querystring = request.GET.copy()
+    querystring.pop('page', None)
+
+    return {
+        'locations': locations_with_names,
+        'page': page,
+        'page_querystring': querystring.urlencode(),
+        'type_form': type_form,
+        'search_form': search_form,
+        'stats': {
+            'total': paginator.count,
+            'by_type': by_type,
+        },
     }
 
+
+@login_required
+def storage_location_list_view(request):
+    """Просмотр ВСЕХ мест хранения (административная функция)"""
+
+    # Получаем все записи
+    locations = StorageLocation.objects.all()
+
+    list_data = _search_locations(request, locations)
+
     context = {
         'title': 'Все места хранения',
         'employee_name': request.session.get('employee_name'),
-        'locations': locations_with_names,
-        'type_form': type_form,
-        'search_form': search_form,
-        'stats': stats,
+        **list_data,
     }
 
     return render(request, 'StorageLocation/storage_location_list.html', context)
@@ -99,79 +100,18 @@ def my_storage_location_list_view(request):
     # Получаем ID должности для отображения в заголовке
     user_position_id = None
     try:
-        position = Position.objects.get(name__iexact=user_position_name)
+        position = ReferenceDataCache.get_position(user_position_name)
         user_position_id = position.id
     except Position.DoesNotExist:
         user_position_id = -1
 
-    # Инициализируем формы
-    type_form = StorageLocationTypeForm(request.GET or None)
-    search_form = StorageLocationSearchForm(request.GET or None)
-
-    source_type = None
-    search = None
-
-    if type_form.is_valid():
-        source_type = type_form.cleaned_data.get('source_type')
-
-    if search_form.is_valid():
-        search = search_form.cleaned_data.get('search')
-
-    # Фильтруем по типу
-    if source_type:
-        user_locations = user_locations.filter(source_type=source_type)
-
-    all_locations = list(user_locations)
-
-    # Поиск по названию
-    if search:
-        filtered_locations = []
-        for location in all_locations:
-            try:
-                source_name = location.get_source_name().lower()
-                if search.lower() in source_name:
-                    filtered_locations.append(location)
-            except:
-                if str(location.source_id) == search:
-                    filtered_locations.append(location)
-        locations_to_show = filtered_locations
-    else:
-        locations_to_show = all_locations
-
-    locations_with_names = []
-    for location in locations_to_show:
-        try:
-            source_name = location.get_source_name()
-        except:
-            source_name = "Ошибка получения названия"
-
-        locations_with_names.append({
-            'id': location.id,
-            'source_type': location.get_source_type_display(),
-            'source_type_raw': location.source_type,
-            'source_id': location.source_id,
-            'source_name': source_name,
-            'obj': location
-        })
-
-    stats = {
-        'total': len(locations_to_show),
-        'by_type': {
-            'склад': sum(1 for l in locations_to_show if l.source_type == 'склад'),
-            'автомобиль': sum(1 for l in locations_to_show if l.source_type == 'автомобиль'),
-            'контрагент': sum(1 for l in locations_to_show if l.source_type == 'контрагент'),
-            'бригады': sum(1 for l in locations_to_show if l.source_type == 'бригады'),
-        }
-    }
+    list_data = _search_locations(request, user_locations)
 
     context = {
         'title': 'Мои места хранения',
         'employee_name': request.session.get('employee_name'),
         'position_name': user_position_name,
-        'locations': locations_with_names,
-        'type_form': type_form,
-        'search_form': search_form,
-        'stats': stats,
+        **list_data,
     }
 
     return render(request, 'StorageLocation/my_storage_location_list.html', context)
@@ -0,0 +1,63 @@
+# ПРЕДСТАВЛЕНИЯ СИНХРОНИЗАЦИИ ПОЛЕВЫХ УСТРОЙСТВ
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET, require_POST
+
+from Forest_apps.core.models import Position
+from Forest_apps.inventory.sync import DeviceSync
+
+
+@login_required
+@require_POST
+def sync_batch_api(request):
+    """
+    API пакетной отправки документов, накопленных без связи (см. DeviceSync)
+
+    Ответ: результат по каждому документу и версия справочников на момент приема
+    (version) - с ней устройство запрашивает изменения справочников (sync_reference_api?since=).
+    """
+    position_id = request.role.position_id
+    position = Position.objects.filter(id=position_id).first() if position_id else None
+    if position is None:
+        return JsonResponse({'error': 'Ошибка определения должности'}, status=403)
+
+    try:
+        items = DeviceSync.parse(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Версия - до приема: изменения справочников во время приема попадут в следующую дельту
+    accepted_at = timezone.now()
+    results = DeviceSync.apply(request.user, position, items)
+
+    return JsonResponse({
+        'results': results,
+        'created': sum(1 for result in results if result['status'] == 'created'),
+        'duplicates': sum(1 for result in results if result['status'] == 'duplicate'),
+        'errors': sum(1 for result in results if result['status'] == 'error'),
+        'version': DeviceSync.version_token(accepted_at),
+    })
+
+
+@login_required
+@require_GET
+@gzip_page
+def sync_reference_api(request):
+    """
+    API справочников для работы без связи: ?since=<version> - только изменения
+
+    Без since - полная выгрузка. Версию из ответа устройство передает
+    при следующей синхронизации.
+    """
+    since = request.GET.get('since')
+    if since:
+        try:
+            since = DeviceSync.parse_version_token(since)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    else:
+        since = None
+
+    return JsonResponse(DeviceSync.delta(since, request.role.position_id))
@@ -5,7 +5,7 @@ import datetime
 from Forest_apps.operations.models import OperationRecord
 from Forest_apps.core.models import Warehouse
 from Forest_apps.forestry.models import Material
-from Forest_apps.inventory.services import StorageLocationService
+from Forest_apps.inventory.services import StorageLocationService, ReferenceDataCache
 
 
 class OperationRecordCreateForm(forms.ModelForm):
@@ -80,6 +80,7 @@ class OperationRecordCreateForm(forms.ModelForm):
         self.fields['operation_type'].queryset = OperationType.objects.filter(
             is_active=True
         ).order_by('name')
+        ReferenceDataCache.apply_choices(self.fields['operation_type'], ReferenceDataCache.operation_types())
 
         # Получаем склады пользователя через сервис
         user_warehouses = StorageLocationService.get_user_warehouses_by_position_name(
@@ -95,6 +96,9 @@ class OperationRecordCreateForm(forms.ModelForm):
 
         # Все материалы, сортировка по типу и названию
         self.fields['material'].queryset = Material.objects.all().order_by('material_type', 'name')
+        ReferenceDataCache.apply_choices(
+            self.fields['material'], ReferenceDataCache.material_choices(ReferenceDataCache.materials())
+        )
 
         # Делаем поля площади и объема необязательными
         self.fields['square_meters'].required = False
@@ -213,6 +217,7 @@ class OperationRecordFilterForm(forms.Form):
         self.fields['operation_type'].queryset = OperationType.objects.filter(
             is_active=True
         ).order_by('name')
+        ReferenceDataCache.apply_choices(self.fields['operation_type'], ReferenceDataCache.operation_types())
 
         # Для фильтра складов показываем только склады пользователя через сервис
         if position_name:
@@ -226,4 +231,7 @@ class OperationRecordFilterForm(forms.Form):
         else:
             self.fields['warehouse'].queryset = Warehouse.objects.none()
 
-        self.fields['material'].queryset = Material.objects.all().order_by('material_type', 'name')
\ No newline at end of file
+        self.fields['material'].queryset = Material.objects.all().order_by('material_type', 'name')
+        ReferenceDataCache.apply_choices(
+            self.fields['material'], ReferenceDataCache.material_choices(ReferenceDataCache.materials())
+        )
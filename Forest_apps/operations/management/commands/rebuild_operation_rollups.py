@@ -0,0 +1,31 @@
+# Forest_apps/operations/management/commands/rebuild_operation_rollups.py
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Forest_apps.operations.models import OperationDailyRollup
+
+
+class Command(BaseCommand):
+    """
+    Пересчет дневной сводки операций (OperationDailyRollup) по записям
+
+    Сводка обновляется автоматически при сохранении/удалении записей;
+    команда нужна после массовых изменений в обход моделей (update/delete по QuerySet).
+    """
+
+    help = 'Пересчет дневной сводки операций (за период или целиком)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', help='Начало периода в формате ГГГГ-ММ-ДД')
+        parser.add_argument('--date-to', help='Конец периода в формате ГГГГ-ММ-ДД')
+
+    def handle(self, *args, **options):
+        try:
+            date_from = datetime.date.fromisoformat(options['date_from']) if options['date_from'] else None
+            date_to = datetime.date.fromisoformat(options['date_to']) if options['date_to'] else None
+        except ValueError:
+            raise CommandError('Неверный формат даты, ожидается ГГГГ-ММ-ДД')
+
+        rows = OperationDailyRollup.rebuild(date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(f'Сводка операций пересчитана: строк {rows}'))
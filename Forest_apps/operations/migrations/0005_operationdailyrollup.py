@@ -0,0 +1,68 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_rollups(apps, schema_editor):
+    """Строит дневную сводку по существующим записям операций"""
+    OperationRecord = apps.get_model('operations', 'OperationRecord')
+    OperationDailyRollup = apps.get_model('operations', 'OperationDailyRollup')
+
+    rows = OperationRecord.objects.annotate(day=TruncDate('date_time')).values(
+        'day', 'warehouse_id', 'operation_type_id', 'material_id'
+    ).annotate(
+        total_quantity=Sum('quantity'),
+        total_square=Sum('square_meters'),
+        total_cubic=Sum('cubic_meters'),
+        total_count=Count('id')
+    ).order_by()
+
+    OperationDailyRollup.objects.bulk_create([
+        OperationDailyRollup(
+            day=row['day'],
+            warehouse_id=row['warehouse_id'],
+            operation_type_id=row['operation_type_id'],
+            material_id=row['material_id'],
+            quantity=row['total_quantity'] or 0,
+            square_meters=row['total_square'] or 0,
+            cubic_meters=row['total_cubic'] or 0,
+            records_count=row['total_count'],
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_brigade_created_by_position_and_more'),
+        ('forestry', '0003_cuttingarea_created_by_and_more'),
+        ('operations', '0004_alter_operationrecord_date_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperationDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('quantity', models.DecimalField(decimal_places=3, default=0, max_digits=15, verbose_name='Количество (шт)')),
+                ('square_meters', models.DecimalField(decimal_places=3, default=0, max_digits=15, verbose_name='Площадь (м²)')),
+                ('cubic_meters', models.DecimalField(decimal_places=3, default=0, max_digits=15, verbose_name='Объем (м³)')),
+                ('records_count', models.IntegerField(default=0, verbose_name='Количество записей')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='operation_rollups', to='forestry.material', verbose_name='Материал')),
+                ('operation_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='operations.operationtype', verbose_name='Операция')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='operation_rollups', to='core.warehouse', verbose_name='Склад')),
+            ],
+            options={
+                'verbose_name': 'Дневная сводка операций',
+                'verbose_name_plural': 'Дневные сводки операций',
+                'indexes': [models.Index(fields=['warehouse', 'day'], name='operations__warehou_1fd0bd_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'warehouse', 'operation_type', 'material'), name='unique_operation_daily_rollup')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0005_operationdailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operationtype',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения'),
+        ),
+    ]
@@ -1,5 +1,5 @@
 # Forest_apps/operations/models.py
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
 from django.utils import timezone
@@ -12,6 +12,7 @@ class OperationType(models.Model):
     """Тип операции (технический процесс)"""
     name = models.CharField('Название', max_length=100)
     is_active = models.BooleanField('Активность', default=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True, db_index=True)
     created_by = models.ForeignKey(
         User,
         on_delete=models.SET_NULL,
@@ -134,6 +135,28 @@ class OperationRecord(models.Model):
     def __str__(self):
         return f"{self.operation_type} - {self.date_time.date()}"
 
+    def save(self, *args, **kwargs):
+        """Сохранение записи с обновлением дневной сводки"""
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = OperationRecord.objects.select_for_update().filter(pk=self.pk).first()
+
+            super().save(*args, **kwargs)
+
+            if previous:
+                OperationDailyRollup.apply(previous, sign=-1)
+            OperationDailyRollup.apply(self, sign=1)
+
+    def delete(self, *args, **kwargs):
+        """Удаление записи с обновлением дневной сводки"""
+        with transaction.atomic():
+            previous = OperationRecord.objects.select_for_update().filter(pk=self.pk).first()
+            result = super().delete(*args, **kwargs)
+            if previous:
+                OperationDailyRollup.apply(previous, sign=-1)
+        return result
+
     @classmethod
     def create_operation_record(cls, operation_type, warehouse, material,
                                 quantity, square_meters=None, cubic_meters=None, date_time=None):
@@ -251,4 +274,142 @@ class OperationRecord(models.Model):
             total_square_meters=Sum('square_meters'),
             total_cubic_meters=Sum('cubic_meters'),
             operation_count=Count('id')
-        ).order_by('operation_type__name', 'material__name')
\ No newline at end of file
+        ).order_by('operation_type__name', 'material__name')
+
+
+class OperationDailyRollup(models.Model):
+    """
+    Дневная сводка операций: (день, склад, тип операции, материал)
+
+    Обновляется при каждом сохранении/удалении OperationRecord,
+    поэтому статистика списка операций и API графиков читается
+    из сводки, а не агрегируется по всем записям.
+    Полный пересчет - команда rebuild_operation_rollups.
+    """
+    day = models.DateField('День')
+    warehouse = models.ForeignKey(
+        'core.Warehouse',
+        on_delete=models.CASCADE,
+        verbose_name='Склад',
+        related_name='operation_rollups'
+    )
+    operation_type = models.ForeignKey(
+        'operations.OperationType',
+        on_delete=models.CASCADE,
+        verbose_name='Операция',
+        related_name='daily_rollups'
+    )
+    material = models.ForeignKey(
+        'forestry.Material',
+        on_delete=models.CASCADE,
+        verbose_name='Материал',
+        related_name='operation_rollups'
+    )
+    quantity = models.DecimalField('Количество (шт)', max_digits=15, decimal_places=3, default=0)
+    square_meters = models.DecimalField('Площадь (м²)', max_digits=15, decimal_places=3, default=0)
+    cubic_meters = models.DecimalField('Объем (м³)', max_digits=15, decimal_places=3, default=0)
+    records_count = models.IntegerField('Количество записей', default=0)
+
+    class Meta:
+        verbose_name = 'Дневная сводка операций'
+        verbose_name_plural = 'Дневные сводки операций'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'warehouse', 'operation_type', 'material'],
+                name='unique_operation_daily_rollup'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['warehouse', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.day}: {self.operation_type_id} / {self.material_id} ({self.records_count})"
+
+    @staticmethod
+    def day_for(date_time):
+        """День записи в часовом поясе проекта (как в фильтрах date_time__date)"""
+        return timezone.localdate(date_time) if timezone.is_aware(date_time) else date_time.date()
+
+    @classmethod
+    def apply(cls, record, sign=1):
+        """
+        Добавляет (sign=1) или вычитает (sign=-1) запись из сводки
+
+        Изменение выполняется одним условным UPDATE с F-выражениями;
+        если строки сводки еще нет, она создается.
+        """
+        key = {
+            'day': cls.day_for(record.date_time),
+            'warehouse_id': record.warehouse_id,
+            'operation_type_id': record.operation_type_id,
+            'material_id': record.material_id,
+        }
+        deltas = {
+            'quantity': sign * (record.quantity or 0),
+            'square_meters': sign * (record.square_meters or 0),
+            'cubic_meters': sign * (record.cubic_meters or 0),
+            'records_count': sign,
+        }
+
+        with transaction.atomic():
+            updated = cls.objects.filter(**key).update(
+                **{field: models.F(field) + delta for field, delta in deltas.items()}
+            )
+            if not updated:
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(**key, **deltas)
+                except IntegrityError:
+                    # Строку создал параллельный запрос - применяем изменение к ней
+                    cls.objects.filter(**key).update(
+                        **{field: models.F(field) + delta for field, delta in deltas.items()}
+                    )
+
+            # Пустые строки сводки не храним
+            cls.objects.filter(**key, records_count__lte=0).delete()
+
+    @classmethod
+    def rebuild(cls, start_date=None, end_date=None):
+        """
+        Полный пересчет сводки по записям операций (за период или целиком)
+
+        Returns:
+            int количество строк сводки
+        """
+        from django.db.models import Count, Sum
+        from django.db.models.functions import Coalesce, TruncDate
+
+        records = OperationRecord.objects.annotate(day=TruncDate('date_time'))
+        rollups = cls.objects.all()
+        if start_date:
+            records = records.filter(day__gte=start_date)
+            rollups = rollups.filter(day__gte=start_date)
+        if end_date:
+            records = records.filter(day__lte=end_date)
+            rollups = rollups.filter(day__lte=end_date)
+
+        rows = records.values('day', 'warehouse_id', 'operation_type_id', 'material_id').annotate(
+            total_quantity=Coalesce(Sum('quantity'), 0, output_field=models.DecimalField()),
+            total_square=Coalesce(Sum('square_meters'), 0, output_field=models.DecimalField()),
+            total_cubic=Coalesce(Sum('cubic_meters'), 0, output_field=models.DecimalField()),
+            total_count=Count('id')
+        ).order_by()
+
+        with transaction.atomic():
+            rollups.delete()
+            created = cls.objects.bulk_create([
+                cls(
+                    day=row['day'],
+                    warehouse_id=row['warehouse_id'],
+                    operation_type_id=row['operation_type_id'],
+                    material_id=row['material_id'],
+                    quantity=row['total_quantity'],
+                    square_meters=row['total_square'],
+                    cubic_meters=row['total_cubic'],
+                    records_count=row['total_count'],
+                )
+                for row in rows
+            ], batch_size=1000)
+
+        return len(created)
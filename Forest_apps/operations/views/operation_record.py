@@ -1,16 +1,16 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.db.models import Q, Sum
+from django.db.models import Q, Sum, Count
 from django.utils import timezone
-from Forest_apps.operations.models import OperationRecord, OperationType
+from Forest_apps.operations.models import OperationRecord, OperationDailyRollup
 from Forest_apps.core.models import Position, Warehouse
 from Forest_apps.forestry.models import Material
 from Forest_apps.operations.forms.operation_record import (
     OperationRecordCreateForm,
     OperationRecordFilterForm
 )
-from Forest_apps.inventory.services import StorageLocationService
+from Forest_apps.inventory.services import StorageLocationService, ReferenceDataCache
 
 
 @login_required
@@ -33,6 +33,10 @@ def operation_record_list_view(request):
         'operation_type', 'warehouse', 'material', 'created_by_position'
     ).order_by('-date_time')
 
+    # Статистика считается по дневной сводке с теми же фильтрами
+    rollups = OperationDailyRollup.objects.filter(warehouse_id__in=user_warehouse_ids)
+    has_measurements = None
+
     # Фильтрация
     filter_form = OperationRecordFilterForm(request.GET or None, position_name=user_position_name)
 
@@ -47,24 +51,31 @@ def operation_record_list_view(request):
 
         if operation_type:
             records = records.filter(operation_type=operation_type)
+            rollups = rollups.filter(operation_type=operation_type)
 
         if warehouse:
             records = records.filter(warehouse=warehouse)
+            rollups = rollups.filter(warehouse=warehouse)
 
         if material:
             records = records.filter(material=material)
+            rollups = rollups.filter(material=material)
 
         if date_from:
             records = records.filter(date_time__date__gte=date_from)
+            rollups = rollups.filter(day__gte=date_from)
 
         if date_to:
             records = records.filter(date_time__date__lte=date_to)
+            rollups = rollups.filter(day__lte=date_to)
 
         if search:
-            records = records.filter(
+            search_condition = (
                 Q(material__name__icontains=search) |
                 Q(operation_type__name__icontains=search)
             )
+            records = records.filter(search_condition)
+            rollups = rollups.filter(search_condition)
 
         if has_measurements == 'with_square':
             records = records.filter(square_meters__isnull=False, square_meters__gt=0)
@@ -76,29 +87,44 @@ def operation_record_list_view(request):
                 cubic_meters__isnull=False, cubic_meters__gt=0
             )
 
-    # Статистика
-    total_count = records.count()
-    total_quantity = records.aggregate(total=Sum('quantity'))['total'] or 0
-    total_square_meters = records.aggregate(total=Sum('square_meters'))['total'] or 0
-    total_cubic_meters = records.aggregate(total=Sum('cubic_meters'))['total'] or 0
-
-    # Статистика по типам операций
-    stats_by_type = []
-    for op_type in OperationType.objects.filter(is_active=True):
-        type_records = records.filter(operation_type=op_type)
-        type_count = type_records.count()
-        type_quantity = type_records.aggregate(total=Sum('quantity'))['total'] or 0
-        type_square = type_records.aggregate(total=Sum('square_meters'))['total'] or 0
-        type_cubic = type_records.aggregate(total=Sum('cubic_meters'))['total'] or 0
-
-        if type_count > 0:
-            stats_by_type.append({
-                'name': op_type.name,
-                'count': type_count,
-                'quantity': type_quantity,
-                'square_meters': type_square,
-                'cubic_meters': type_cubic,
-            })
+    if has_measurements:
+        # Фильтр по отдельным измерениям записи в сводке не выразить - считаем по записям
+        stats_source = records.order_by()
+        count_field = Count('id')
+    else:
+        stats_source = rollups
+        count_field = Sum('records_count')
+
+    # Статистика - итоги и разбивка по типам операций (по одному запросу)
+    totals = stats_source.aggregate(
+        count=count_field,
+        quantity=Sum('quantity'),
+        square_meters=Sum('square_meters'),
+        cubic_meters=Sum('cubic_meters')
+    )
+    total_count = totals['count'] or 0
+    total_quantity = totals['quantity'] or 0
+    total_square_meters = totals['square_meters'] or 0
+    total_cubic_meters = totals['cubic_meters'] or 0
+
+    stats_by_type = [
+        {
+            'name': row['operation_type__name'],
+            'count': row['count'],
+            'quantity': row['quantity'] or 0,
+            'square_meters': row['square_meters'] or 0,
+            'cubic_meters': row['cubic_meters'] or 0,
+        }
+        for row in stats_source.filter(operation_type__is_active=True).values(
+            'operation_type_id', 'operation_type__name'
+        ).annotate(
+            count=count_field,
+            quantity=Sum('quantity'),
+            square_meters=Sum('square_meters'),
+            cubic_meters=Sum('cubic_meters')
+        ).order_by('operation_type_id')
+        if row['count']
+    ]
 
     context = {
         'title': 'Учет операций',
@@ -129,7 +155,7 @@ def operation_record_create_view(request):
             record.created_by = request.user
 
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 record.created_by_position = position
             except Position.DoesNotExist:
                 position, _ = Position.objects.get_or_create(
@@ -257,7 +283,6 @@ def operation_record_detail_view(request, record_id):
 def get_operation_stats(request):
     """API для получения статистики по операциям (для графиков)"""
     from django.http import JsonResponse
-    from django.db.models import Count, Sum
     from datetime import timedelta
 
     position_name = request.session.get('position_name')
@@ -267,35 +292,34 @@ def get_operation_stats(request):
     user_warehouse_ids = [loc.source_id for loc in user_warehouses if loc.source_id]
 
     # Статистика за последние 30 дней
-    end_date = timezone.now().date()
+    end_date = timezone.localdate()
     start_date = end_date - timedelta(days=30)
 
-    records = OperationRecord.objects.filter(
+    # Данные из дневной сводки: O(дней x типов), а не O(записей)
+    rollups = OperationDailyRollup.objects.filter(
         warehouse_id__in=user_warehouse_ids,
-        date_time__date__gte=start_date,
-        date_time__date__lte=end_date
+        day__gte=start_date,
+        day__lte=end_date
     )
 
     # По дням
-    daily_stats = records.extra(
-        select={'day': "date(date_time)"}
-    ).values('day').annotate(
-        count=Count('id'),
+    daily_stats = rollups.values('day').annotate(
+        count=Sum('records_count'),
         total=Sum('quantity')
     ).order_by('day')
 
     # По типам операций
-    type_stats = records.values(
+    type_stats = rollups.values(
         'operation_type__name'
     ).annotate(
-        count=Count('id'),
+        count=Sum('records_count'),
         total=Sum('quantity')
     ).order_by('-total')
 
     # По материалам
-    material_stats = records.values(
+    material_stats = rollups.values(
         'material__name',
-        'material__unit'
+        'material__material_type'
     ).annotate(
         total=Sum('quantity')
     ).order_by('-total')[:10]
@@ -4,6 +4,7 @@ from django.contrib import messages
 from django.db.models import Q
 from Forest_apps.operations.models import OperationType
 from Forest_apps.core.models import Position
+from Forest_apps.inventory.services import ReferenceDataCache
 from Forest_apps.operations.forms.operation_type import (
     OperationTypeCreateForm,
     OperationTypeFilterForm
@@ -72,7 +73,7 @@ def operation_type_create_view(request):
             # Добавляем должность создателя
             position_name = request.session.get('position_name')
             try:
-                position = Position.objects.get(name__iexact=position_name)
+                position = ReferenceDataCache.get_position(position_name)
                 operation_type.created_by_position = position
             except Position.DoesNotExist:
                 # Если должность не найдена, создаем
@@ -31,15 +31,20 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'Forest_apps.admin_central.middleware.QueryProfilerMiddleware',  # работает только при QUERY_PROFILING
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'Forest_apps.authorization.middleware.RoleMiddleware',  # request.role - контекст должности из сессии
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Профилирование SQL по запросам (admin_central: /admin_central/queries/)
+QUERY_PROFILING = os.getenv('QUERY_PROFILING') == '1'
+
 ROOT_URLCONF = 'Forest_project.urls'
 
 TEMPLATES = [
@@ -71,6 +76,19 @@ DATABASES = {
     }
 }
 
+# Кэш. По умолчанию - в памяти процесса: у каждого воркера gunicorn свой кэш.
+# Версии кэшируемых данных хранятся в БД (core.CacheVersion), поэтому изменение,
+# сделанное одним воркером, видят все. Общий сервис кэша нужен только для того,
+# чтобы воркеры не собирали одни и те же данные каждый сам, например:
+#   CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache
+#   CACHE_LOCATION=127.0.0.1:11211
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
 # Static files только для Django (CSS, JavaScript, Images)
 STATIC_URL = '/static/'
 